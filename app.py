@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 import os
 import subprocess
 from datetime import datetime, timedelta
@@ -7,11 +7,90 @@ import logging
 import threading
 from typing import Dict, Any
 import socket
+import stat
 import re
 import json
 import sys
+import hashlib
+import bisect
+import itertools
+import mimetypes
+import shlex
+import shutil
+import tempfile
+import errno
+import glob
 from functools import wraps
+from contextlib import contextmanager
 from bootstrap import wait_for_redis, log_tcp_port
+from filtergraph import build_shorts_filter
+from ass_renderer import compile_ass, build_ass_filter, AssCompileError
+from font_registry import FontRegistry
+from ffmpeg_runner import FFmpegResult, run_ffmpeg
+from parallel_encode import (
+    SEGMENT_END_EPSILON,
+    build_concat_list,
+    plan_segments,
+    segment_threads,
+    shift_text_items,
+)
+from storyboard import (
+    DEFAULT_STORYBOARD_PARAMS,
+    STORYBOARD_VERSION,
+    build_storyboard_command,
+    build_storyboard_vtt,
+    storyboard_layout,
+)
+from quality_search import (
+    DEFAULT_TARGETS,
+    QUALITY_METRICS,
+    SAMPLE_SIZE,
+    choose_crf,
+    next_crf,
+    parse_quality_score,
+    plan_samples,
+)
+from media_concat import (
+    build_concat_filter,
+    build_concat_script,
+    signature_mismatch,
+    stream_signature,
+    trimmed_input_args,
+    VIDEO_SIGNATURE_FIELDS,
+    AUDIO_SIGNATURE_FIELDS,
+)
+from audio_peaks import (
+    DEFAULT_PIXELS_PER_SECOND,
+    MAX_PIXELS_PER_SECOND,
+    PEAKS_FORMATS,
+    PeaksCollector,
+    build_levels,
+    build_peaks_output_args,
+    samples_per_pixel_for,
+    slice_levels,
+    write_peaks,
+)
+from probe_cache import ProbeCache, source_fingerprint
+from result_cache import ResultCache, result_cache_key, file_sha256
+from scratch_space import ScratchSpace, SpillWriter
+from plan_estimates import CostModel, estimate_output, parse_bitrate
+from audio_passthrough import COPY_SEEK_MARGIN, align_to_packets, passthrough_mismatch
+from size_target import (
+    MAX_SECOND_PASS_ATTEMPTS,
+    audio_bitrate_for_size,
+    lower_audio_bitrate,
+    retry_video_bitrate,
+    video_bitrate_for_size,
+)
+from media_analysis import (
+    DEFAULT_ANALYSIS_PARAMS,
+    DEFAULT_LOUDNORM_TARGET,
+    build_analysis_command,
+    build_timeline,
+    build_loudnorm_measure_filter,
+    build_loudnorm_apply_filter,
+    parse_loudnorm_json,
+)
 from api_commons import (
     # Error codes - Authentication
     ERROR_MISSING_AUTH_TOKEN,
@@ -278,6 +357,40 @@ def format_ttl_human(hours: int) -> str:
 TASKS_DIR = "/app/tasks"
 os.makedirs(TASKS_DIR, exist_ok=True)
 
+# Долговременные кеши вне TASKS_DIR (кроме result cache - ему нужен том задач, см. ниже)
+CACHE_DIR = "/app/cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Probe cache: результаты анализа/измерений по отпечатку содержимого источника
+PROBE_CACHE_DIR = os.path.join(CACHE_DIR, "probe")
+PROBE_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600  # Записи без обращений дольше 30 дней удаляются
+PROBE_CACHE_PRUNE_INTERVAL_SECONDS = 3600
+PROBE_CACHE = ProbeCache(PROBE_CACHE_DIR)
+_probe_cache_last_prune = 0.0
+
+# Result cache: готовые результаты операций (источник + тип + параметры + версия ffmpeg).
+# Лежит на томе задач: объекты - жёсткие ссылки на выходные файлы, между файловыми
+# системами ссылок нет. Служебные каталоги в TASKS_DIR начинаются с точки (см. is_task_dir_name)
+RESULT_CACHE_DIR = os.path.join(TASKS_DIR, ".cache", "results")
+RESULT_CACHE_MAX_BYTES = 20 * 1024 * 1024 * 1024  # 20 GB, сверх лимита - LRU-вытеснение сразу после put
+RESULT_CACHE = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+
+
+def is_task_dir_name(name: str) -> bool:
+    """Каталоги задач в TASKS_DIR; скрытые (.cache) - служебные и не считаются задачами"""
+    return not name.startswith('.')
+
+# Scratch: короткоживущие файлы задач (input_*, temp_*, .part) на tmpfs в пределах бюджета,
+# при нехватке - в папке задачи. Включается, только если SCRATCH_RAM_DIR смонтирован как tmpfs
+SCRATCH_RAM_DIR = "/app/scratch"
+SCRATCH_RAM_BUDGET_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB на процесс (жёсткий предел - размер tmpfs)
+SCRATCH_TEMP_SIZE_FACTOR = 1.5  # Оценка промежуточного выхода относительно размера источника
+SCRATCH_ORPHAN_MAX_AGE_SECONDS = 6 * 3600
+SCRATCH = ScratchSpace(SCRATCH_RAM_DIR, SCRATCH_RAM_BUDGET_BYTES)
+
+# Dry run (POST /plan): оценка CPU по операциям уточняется по rusage выполненных задач
+COST_MODEL = CostModel()
+
 # ============================================
 # TASK RECOVERY CONFIGURATION
 # ============================================
@@ -369,7 +482,10 @@ def build_structured_metadata(
     total_size: int | None = None,
     total_size_mb: float | None = None,
     ttl_seconds: int | None = None,
-    ttl_human: str | None = None
+    ttl_human: str | None = None,
+    resource_usage: list | None = None,
+    scratch_usage: dict | None = None,
+    operation_details: list | None = None
 ) -> dict:
     """
     Builds metadata object with structured, predictable field ordering.
@@ -426,6 +542,15 @@ def build_structured_metadata(
         output_data["ttl_seconds"] = ttl_seconds
     if ttl_human is not None:
         output_data["ttl_human"] = ttl_human
+    if resource_usage:
+        # rusage ffmpeg по операциям: max_rss_mb, user_time, sys_time, wall_time
+        output_data["resource_usage"] = resource_usage
+    if scratch_usage:
+        # RAM scratch задачи: пик резерва на tmpfs и число файлов, ушедших на диск
+        output_data["scratch_usage"] = scratch_usage
+    if operation_details:
+        # Решения, принятые операциями по содержимому (например CRF для target_quality)
+        output_data["operation_details"] = operation_details
     if output_data:  # Only add if not empty
         result["output"] = output_data
 
@@ -715,13 +840,17 @@ def validate_client_meta(client_meta):
 # INPUT DOWNLOAD + VALIDATION
 # ============================================
 
-def download_media_with_validation(url: str, dest_path: str, timeout: int = 300) -> tuple[bool, str]:
+def download_media_with_validation(url: str, dest_path: str, timeout: int = 300,
+                                   spill_path: str | None = None) -> tuple[bool, str]:
     """Скачивает контент по URL в dest_path с базовой валидацией медиа.
 
     Отсеивает очевидно не‑медийные ответы (HTML, JSON и т.п.),
     проверяет заголовки и сигнатуру первых байт. Записывает во временный .part
     с последующим атомарным переименованием в итоговый файл.
 
+    spill_path - для dest_path в RAM scratch: куда перенести файл, если бюджет
+    исчерпается (итоговый файл окажется по одному из двух путей).
+
     Возвращает (ok, message). В случае ok=False файл не создаётся.
     """
     import requests
@@ -748,7 +877,10 @@ def download_media_with_validation(url: str, dest_path: str, timeout: int = 300)
             if file_size < 50 * 1024:  # < 50KB
                 return False, f"Local file too small ({file_size} bytes). Likely not media."
             
-            # Copy file with validation
+            # Copy file with validation (в RAM scratch - только если размер помещается в бюджет)
+            if spill_path and not SCRATCH.reserve(dest_path + '.part', file_size):
+                SCRATCH.record_spill(dest_path)
+                dest_path = spill_path
             tmp_path = dest_path + '.part'
             try:
                 shutil.copy2(local_path, tmp_path)
@@ -788,6 +920,7 @@ def download_media_with_validation(url: str, dest_path: str, timeout: int = 300)
             
             # Move to final location
             os.replace(tmp_path, dest_path)
+            SCRATCH.move(tmp_path, dest_path)
             os.chmod(dest_path, 0o644)
             return True, f"Copied {file_size} bytes from local file"
         
@@ -824,7 +957,8 @@ def download_media_with_validation(url: str, dest_path: str, timeout: int = 300)
             total = 0
 
             tmp_path = dest_path + '.part'
-            with open(tmp_path, 'wb') as f:
+            part_file = SpillWriter(SCRATCH, tmp_path, spill_path + '.part') if spill_path else open(tmp_path, 'wb')
+            with part_file as f:
                 for chunk in r.iter_content(chunk_size=64 * 1024):
                     if not chunk:
                         continue
@@ -832,6 +966,9 @@ def download_media_with_validation(url: str, dest_path: str, timeout: int = 300)
                         first_chunk = chunk[:4096]
                     f.write(chunk)
                     total += len(chunk)
+            if spill_path and part_file.spilled:
+                # Бюджет RAM исчерпан во время скачивания - файл уже на диске
+                tmp_path, dest_path = part_file.path, spill_path
 
             # Если заголовок заявлял маленький размер или реально скачали слишком мало
             if clength and clength < min_reasonable:
@@ -874,21 +1011,83 @@ def download_media_with_validation(url: str, dest_path: str, timeout: int = 300)
 
             # Перемещаем во final
             os.replace(tmp_path, dest_path)
+            SCRATCH.move(tmp_path, dest_path)
             os.chmod(dest_path, 0o644)
             return True, f"Downloaded {total} bytes"
 
     except Exception as e:
         # Уберём .part если остался
-        try:
-            if os.path.exists(dest_path + '.part'):
-                os.remove(dest_path + '.part')
-        except Exception:
-            pass
+        for part_path in [dest_path + '.part'] + ([spill_path + '.part'] if spill_path else []):
+            try:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            except Exception:
+                pass
+            SCRATCH.discard(part_path)
         return False, f"Download error: {e}"
 
+# ============================================
+# SCRATCH SPACE (TMPFS FOR TASK INTERMEDIATES)
+# ============================================
+
+def download_task_input(task_id: str, video_url: str) -> tuple[bool, str, str]:
+    """
+    Скачивает источник задачи: в RAM scratch, пока хватает бюджета, иначе в папку задачи.
+
+    Returns:
+        (ok, message, input_path)
+    """
+    name = f"input_{uuid.uuid4()}.mp4"
+    disk_path = os.path.join(get_task_dir(task_id), name)
+    if not SCRATCH.enabled:
+        ok, msg = download_media_with_validation(video_url, disk_path)
+        return ok, msg, disk_path
+    ram_path = SCRATCH.ram_path(task_id, name)
+    os.makedirs(os.path.dirname(ram_path), exist_ok=True)
+    ok, msg = download_media_with_validation(video_url, ram_path, spill_path=disk_path)
+    input_path = ram_path if os.path.exists(ram_path) else disk_path
+    logger.debug(f"[{task_id[:8]}] Input stored {'in RAM scratch' if input_path == ram_path else 'on disk'}: {input_path}")
+    return ok, msg, input_path
+
+
+def scratch_temp_path(task_id: str, op_index: int, source_path: str) -> str:
+    """
+    Путь промежуточного выхода операции: RAM scratch, если оценка размера помещается в бюджет.
+    Источник-FIFO размера не имеет (getsize = 0) - выход сразу на диске, без резерва и spill.
+    """
+    name = f"temp_{op_index}_{uuid.uuid4()}.mp4"
+    try:
+        if source_path in STREAM_INPUTS or stat.S_ISFIFO(os.stat(source_path).st_mode):
+            return os.path.join(get_task_dir(task_id), name)
+        expected = int(os.path.getsize(source_path) * SCRATCH_TEMP_SIZE_FACTOR)
+    except OSError:
+        expected = 0
+    return SCRATCH.allocate(task_id, name, get_task_dir(task_id), expected)
+
+
+def remove_task_file(path: str):
+    """Удаляет временный файл задачи и снимает его резерв в scratch"""
+    if os.path.exists(path):
+        os.remove(path)
+    SCRATCH.discard(path)
+
+
+def release_task_scratch(task_id: str) -> dict:
+    """
+    Освобождает RAM scratch задачи (по завершении, ошибке или перед повтором).
+    Возвращает использование scratch задачей до освобождения (для metadata).
+    """
+    usage = SCRATCH.usage(task_id)
+    freed = SCRATCH.release_task(task_id)
+    if freed:
+        logger.debug(f"[{task_id[:8]}] Scratch released: {freed / 1024 / 1024:.1f} MB")
+    return usage
+
+
 # Очистка старых файлов (старше 2 часов)
 def cleanup_old_files():
     """Удаляет задачи старше 2 часов (expired) и orphaned задачи без metadata.json"""
+    global _probe_cache_last_prune
     import time
     import shutil
 
@@ -902,7 +1101,7 @@ def cleanup_old_files():
 
         for task_id in os.listdir(TASKS_DIR):
             task_path = os.path.join(TASKS_DIR, task_id)
-            if not os.path.isdir(task_path):
+            if not is_task_dir_name(task_id) or not os.path.isdir(task_path):
                 continue
 
             metadata_path = os.path.join(task_path, 'metadata.json')
@@ -959,6 +1158,18 @@ def cleanup_old_files():
             total_size_mb = total_size_freed / 1024 / 1024
             logger.info(f"Cleanup summary: {cleaned_count} expired, {orphaned_count} orphaned, {total_size_mb:.1f} MB freed")
 
+        # Probe cache чистится реже - обход всего кеша не нужен на каждый запрос
+        if time.time() - _probe_cache_last_prune > PROBE_CACHE_PRUNE_INTERVAL_SECONDS:
+            _probe_cache_last_prune = time.time()
+            pruned = PROBE_CACHE.prune(PROBE_CACHE_MAX_AGE_SECONDS)
+            if pruned:
+                logger.info(f"Probe cache: removed {pruned} stale entr{'y' if pruned == 1 else 'ies'}")
+
+        # Scratch задач, которые прервались вместе с процессом (tmpfs не очищается при рестарте воркера)
+        orphaned_scratch = SCRATCH.prune_orphans(SCRATCH_ORPHAN_MAX_AGE_SECONDS)
+        if orphaned_scratch:
+            logger.info(f"Scratch: removed {orphaned_scratch} orphaned task director{'y' if orphaned_scratch == 1 else 'ies'}")
+
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
 
@@ -1140,772 +1351,3869 @@ def send_webhook(webhook_url: str, payload: dict, webhook_headers: dict | None =
 
 
 # ============================================
-# VIDEO OPERATIONS REGISTRY
+# FFPROBE HELPERS
 # ============================================
 
-class VideoOperation:
-    """Базовый класс для операций с видео"""
-    def __init__(self, name: str, required_params: list, optional_params: dict = None):
-        self.name = name
-        self.required_params = required_params
-        self.optional_params = optional_params or {}
+# Входы-FIFO (pipe handoff): ffprobe не может прочитать поток, не забрав данные у ffmpeg,
+# поэтому свойства потока берёт из описания операции-источника (duration, size, stream_types)
+STREAM_INPUTS: Dict[str, dict] = {}
+
+# Входы dry run (/plan): файлы, которых ещё нет (источник до скачивания, промежуточные
+# выходы) - свойства из ffprobe источника по URL и оценок предыдущих шагов
+PLANNED_INPUTS: Dict[str, dict] = {}
+
+
+def virtual_input_info(input_path: str) -> dict | None:
+    """Описание входа без файла на диске (FIFO или вход dry run); None - обычный файл"""
+    return STREAM_INPUTS.get(input_path) or PLANNED_INPUTS.get(input_path)
+
+
+def probe_video_size(input_path: str) -> tuple[int, int] | None:
+    """Возвращает (width, height) первого видеопотока или None если не удалось определить"""
+    info = virtual_input_info(input_path)
+    if info is not None:
+        return info.get('size')
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height',
+        '-of', 'json',
+        input_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.debug(f"ffprobe failed for {input_path}: {result.stderr[:200]}")
+            return None
+        streams = json.loads(result.stdout or '{}').get('streams') or []
+        if not streams:
+            return None
+        width = int(streams[0].get('width') or 0)
+        height = int(streams[0].get('height') or 0)
+        if width <= 0 or height <= 0:
+            return None
+        return width, height
+    except Exception as e:
+        logger.debug(f"ffprobe error for {input_path}: {e}")
+        return None
 
-    def validate(self, params: dict) -> tuple[bool, str]:
-        """Валидация параметров операции"""
-        for param in self.required_params:
-            if param not in params:
-                return False, f"Missing required parameter: {param}"
-        return True, ""
-    
-    def validate_input_file(self, input_path: str) -> tuple[bool, str]:
-        """Валидация входного файла перед FFmpeg операцией"""
-        if not os.path.exists(input_path):
-            return False, f"Input file not found: {input_path}"
-        
-        file_size = os.path.getsize(input_path)
-        if file_size == 0:
-            return False, f"Input file is empty: {input_path}"
-        
-        if file_size < 1024:  # < 1KB
-            return False, f"Input file too small ({file_size} bytes): {input_path}"
-        
-        return True, ""
 
-    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str]:
-        """
-        Выполнение операции (переопределяется в подклассах)
+def probe_media_duration(input_path: str) -> float | None:
+    """Возвращает длительность контейнера в секундах или None если не удалось определить"""
+    info = virtual_input_info(input_path)
+    if info is not None:
+        return info.get('duration')
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        input_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.debug(f"ffprobe failed for {input_path}: {result.stderr[:200]}")
+            return None
+        duration = float(result.stdout.strip())
+        return duration if duration > 0 else None
+    except Exception as e:
+        logger.debug(f"ffprobe error for {input_path}: {e}")
+        return None
 
-        Args:
-            input_path: Путь к входному видео
-            output_path: Путь к выходному видео
-            params: Параметры операции
-            additional_inputs: Дополнительные входные данные (аудио, изображения и т.д.)
-        """
-        raise NotImplementedError()
 
+def probe_stream_types(input_path: str) -> set:
+    """Типы потоков источника ({'video', 'audio', ...}); пустое множество если ffprobe не смог"""
+    info = virtual_input_info(input_path)
+    if info is not None:
+        return set(info.get('stream_types') or ())
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'stream=codec_type',
+        '-of', 'json',
+        input_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.debug(f"ffprobe failed for {input_path}: {result.stderr[:200]}")
+            return set()
+        streams = json.loads(result.stdout or '{}').get('streams') or []
+        return {s.get('codec_type') for s in streams if s.get('codec_type')}
+    except Exception as e:
+        logger.debug(f"ffprobe error for {input_path}: {e}")
+        return set()
 
-class CutVideoOperation(VideoOperation):
-    """Операция нарезки видео"""
-    def __init__(self):
-        super().__init__(
-            name="cut_video",
-            required_params=["start_time", "end_time"],
-            optional_params={}
-        )
 
-    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str]:
-        """Нарезка видео"""
-        logger.debug(f"📥 Starting CutVideoOperation execute: input_path={input_path}, output_path={output_path}")
-        logger.debug(f"📋 Input params: {json.dumps(params, indent=2, default=str)}")
-        
-        # Валидация входного файла
-        valid, msg = self.validate_input_file(input_path)
-        if not valid:
-            logger.error(f"❌ Input validation failed: {msg}")
-            return False, msg
-        
-        start_time = params['start_time']
-        end_time = params['end_time']
-        logger.debug(f"⏱️  Cut parameters: start_time={start_time}s, end_time={end_time}s, duration={(end_time - start_time)}s")
+def probe_stream_signature(input_path: str) -> dict | None:
+    """Параметры кодеков для склейки без перекодирования (media_concat.stream_signature); None если ffprobe не смог"""
+    if virtual_input_info(input_path) is not None:
+        return None
+    fields = ['codec_type', *dict.fromkeys(VIDEO_SIGNATURE_FIELDS + AUDIO_SIGNATURE_FIELDS)]
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', f"stream={','.join(fields)}",
+        '-of', 'json',
+        input_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.debug(f"ffprobe failed for {input_path}: {result.stderr[:200]}")
+            return None
+        return stream_signature(json.loads(result.stdout or '{}').get('streams') or [])
+    except Exception as e:
+        logger.debug(f"ffprobe error for {input_path}: {e}")
+        return None
 
-        cmd = [
-            'ffmpeg',
-            '-ss', str(start_time),
-            '-i', input_path,
-            '-to', str(end_time),
-            '-c', 'copy',
-            '-y',
-            output_path
-        ]
-        
-        logger.debug(f"📹 ════════════════════════════════════════════════════════════")
-        logger.debug(f"📹 FFmpeg COMMAND for video cut:")
-        logger.debug(f"📹 {' '.join(cmd)}")
 
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        logger.debug(f"📊 FFmpeg return code: {result.returncode}")
-        if result.stdout:
-            logger.debug(f"📋 FFmpeg stdout: {result.stdout[:500]}")
-        if result.stderr:
-            logger.debug(f"⚠️  FFmpeg stderr: {result.stderr[:500]}")
-        
+def probe_audio_stream(input_path: str) -> dict | None:
+    """Параметры первого аудиопотока {'codec_name', 'sample_rate', 'channels', 'bit_rate'}; None если нет или ffprobe не смог"""
+    if virtual_input_info(input_path) is not None:
+        return None
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels,bit_rate',
+        '-of', 'json',
+        input_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
         if result.returncode != 0:
-            logger.error(f"❌ FFmpeg error: {result.stderr}")
-            return False, f"FFmpeg error: {result.stderr}"
+            logger.debug(f"ffprobe failed for {input_path}: {result.stderr[:200]}")
+            return None
+        streams = json.loads(result.stdout or '{}').get('streams') or []
+        return streams[0] if streams else None
+    except Exception as e:
+        logger.debug(f"ffprobe error for {input_path}: {e}")
+        return None
 
-        logger.info(f"✅ Video cut completed: {start_time}s to {end_time}s -> {output_path}")
-        return True, "Video cut completed"
 
+def probe_keyframes(input_path: str) -> list | None:
+    """
+    Времена ключевых кадров первого видеопотока (секунды от начала файла, как у -ss).
+    Читаются только заголовки пакетов (без декодирования); результат кешируется
+    в PROBE_CACHE по отпечатку источника.
+    """
+    try:
+        fingerprint = source_fingerprint(input_path)
+    except OSError as e:
+        logger.debug(f"Cannot fingerprint {input_path}: {e}")
+        return None
+    keyframes = PROBE_CACHE.get(fingerprint, 'keyframes')
+    if keyframes is not None:
+        return keyframes
+
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags:format=start_time',
+        '-of', 'json',
+        input_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        if result.returncode != 0:
+            logger.debug(f"ffprobe failed for {input_path}: {result.stderr[:200]}")
+            return None
+        data = json.loads(result.stdout or '{}')
+        start_offset = float((data.get('format') or {}).get('start_time') or 0.0)
+        keyframes = sorted(
+            round(float(packet['pts_time']) - start_offset, 6)
+            for packet in data.get('packets') or []
+            if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')
+        )
+    except Exception as e:
+        logger.debug(f"ffprobe error for {input_path}: {e}")
+        return None
+    PROBE_CACHE.put(fingerprint, 'keyframes', keyframes)
+    return keyframes
 
-class MakeShortOperation(VideoOperation):
-    """Операция конвертации в Shorts формат"""
-    def __init__(self):
-        super().__init__(
-            name="make_short",
-            required_params=[],
-            optional_params={
-                'start_time': None,
-                'end_time': None,
-                'crop_mode': 'center',
-                'letterbox_config': {},
-                'text_items': [],  # Новая универсальная система текста
-                'generate_thumbnail': True,  # Автоматическая генерация превью
-                'thumbnail_timestamp': 0.5   # Время для извлечения превью (секунды)
+
+def parse_time_value(value) -> float | None:
+    """Секунды из числа или строки '90', '01:30', '00:01:30.5'; None если не распознано"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        parts = [float(p) for p in str(value).strip().split(':')]
+    except ValueError:
+        return None
+    if not parts or len(parts) > 3:
+        return None
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def expected_output_duration(input_path: str, start_time=None, end_time=None) -> float | None:
+    """Ожидаемая длительность выхода операции с учётом start_time/end_time (для прогресса и ETA)"""
+    start = parse_time_value(start_time) or 0.0
+    end = parse_time_value(end_time)
+    if end is not None:
+        return end - start if end > start else None
+    total = probe_media_duration(input_path)
+    if total is None:
+        return None
+    return total - start if total > start else None
+
+
+# ============================================
+# FFMPEG RUNNER (LIVE PROGRESS, BOUNDED LOGS)
+# ============================================
+
+PROGRESS_UPDATE_INTERVAL = 2.0  # Не чаще одной записи прогресса в task record за интервал (секунды)
+
+# Лимиты ресурсов ffmpeg по приоритетным полосам (HARDCODED for public version)
+# - interactive: sync-запросы (клиент ждёт ответа)
+# - background: async-задачи
+# - recovery: перезапуск прерванных задач - самый низкий приоритет CPU и диска
+# ionice_class: 1 - realtime, 2 - best-effort (level 0..7), 3 - idle
+# cpu_time_factor: мягкий RLIMIT_CPU = длительность медиа × ядра × factor
+# cpu_time_fallback: RLIMIT_CPU без известной длительности = fallback × ядра (CPU-секунд на ядро)
+# cpu_affinity: None - все CPU, либо список номеров CPU (например [2, 3])
+# max_rss_mb: лимит резидентной памяти процесса ffmpeg (сторож читает VmRSS и убивает процесс).
+# Лимита адресного пространства (RLIMIT_AS) нет: ffmpeg резервирует его под потоки
+# и аппаратные кодеки намного больше реального RSS, и RLIMIT_AS даёт ложные ENOMEM
+FFMPEG_RESOURCE_LANES = {
+    'interactive': {
+        'nice': 0, 'ionice_class': 2, 'ionice_level': 4,
+        'cpu_time_factor': 10, 'cpu_time_fallback': 1800,
+        'max_rss_mb': 6144, 'cpu_affinity': None
+    },
+    'background': {
+        'nice': 10, 'ionice_class': 2, 'ionice_level': 7,
+        'cpu_time_factor': 20, 'cpu_time_fallback': 3600,
+        'max_rss_mb': 6144, 'cpu_affinity': None
+    },
+    'recovery': {
+        'nice': 19, 'ionice_class': 3, 'ionice_level': None,
+        'cpu_time_factor': 20, 'cpu_time_fallback': 3600,
+        'max_rss_mb': 4096, 'cpu_affinity': None
+    },
+}
+DEFAULT_RESOURCE_LANE = 'background'
+
+# Контекст текущей операции pipeline (операции выполняются в потоке задачи)
+_task_context = threading.local()
+
+
+def set_task_context(task_id: str, op_type: str, op_index: int, total_ops: int,
+                     lane: str = DEFAULT_RESOURCE_LANE):
+    """Привязывает текущий поток к операции задачи - ffmpeg-вызовы будут обновлять её прогресс"""
+    _task_context.task_id = task_id
+    _task_context.op_type = op_type
+    _task_context.op_index = op_index
+    _task_context.total_ops = total_ops
+    _task_context.lane = lane if lane in FFMPEG_RESOURCE_LANES else DEFAULT_RESOURCE_LANE
+    _task_context.ffmpeg_failure = None
+    _task_context.call_counter = itertools.count(1)
+    _task_context.rusage = []
+    _task_context.details = {}
+    _task_context.plan_commands = None
+
+
+def clear_task_context():
+    """Отвязывает текущий поток от задачи"""
+    _task_context.task_id = None
+    _task_context.plan_commands = None
+
+
+def start_plan_recording():
+    """Dry run (/plan): ffmpeg-вызовы текущего потока (и его рабочих потоков) записываются вместо запуска"""
+    _task_context.plan_commands = []
+
+
+def stop_plan_recording() -> list:
+    """Завершает dry run; возвращает записанные вызовы [{'cmd', 'duration'}, ...]"""
+    commands = getattr(_task_context, 'plan_commands', None) or []
+    _task_context.plan_commands = None
+    return commands
+
+
+def is_plan_recording() -> bool:
+    return getattr(_task_context, 'plan_commands', None) is not None
+
+
+# Поля контекста, которые разделяются с рабочими потоками операции
+# (rusage и call_counter - общие объекты: ресурсы суммируются, имена логов не пересекаются)
+_SHARED_TASK_CONTEXT_FIELDS = ('task_id', 'op_type', 'op_index', 'total_ops', 'lane', 'call_counter', 'rusage',
+                               'plan_commands')
+
+
+def task_context_snapshot() -> dict | None:
+    """Контекст текущей операции для передачи в рабочие потоки (None - поток не привязан к задаче)"""
+    if not getattr(_task_context, 'task_id', None) and not is_plan_recording():
+        return None
+    return {name: getattr(_task_context, name, None) for name in _SHARED_TASK_CONTEXT_FIELDS}
+
+
+def bind_task_context(snapshot: dict | None):
+    """Привязывает рабочий поток к операции родительского потока (см. task_context_snapshot)"""
+    if not snapshot:
+        return
+    for name, value in snapshot.items():
+        setattr(_task_context, name, value)
+    _task_context.ffmpeg_failure = None
+
+
+def record_ffmpeg_failure(result):
+    """Запоминает ошибку ffmpeg для metadata текущей операции (summary и имя полного лога)"""
+    if not getattr(_task_context, 'task_id', None):
+        return
+    _task_context.ffmpeg_failure = {
+        'summary': result.error_summary,
+        'log_file': os.path.basename(result.log_path) if result.log_path else None
+    }
+
+
+def pop_ffmpeg_failure() -> dict | None:
+    """Возвращает (и сбрасывает) последнюю ошибку ffmpeg текущей операции: summary и log_file"""
+    failure = getattr(_task_context, 'ffmpeg_failure', None)
+    _task_context.ffmpeg_failure = None
+    return failure
+
+
+def pop_operation_rusage() -> dict | None:
+    """
+    Сводка ресурсов всех ffmpeg-процессов текущей операции (и сброс накопленного):
+    max_rss_mb - максимум по процессам, user/sys/wall_time - суммы.
+    """
+    samples = getattr(_task_context, 'rusage', None) or []
+    _task_context.rusage = []
+    if not samples:
+        return None
+    return {
+        'operation': getattr(_task_context, 'op_type', None),
+        'lane': getattr(_task_context, 'lane', None),
+        'ffmpeg_calls': len(samples),
+        'max_rss_mb': max(r['max_rss_mb'] for r in samples),
+        'user_time': round(sum(r['user_time'] for r in samples), 2),
+        'sys_time': round(sum(r['sys_time'] for r in samples), 2),
+        'wall_time': round(sum(r['wall_time'] for r in samples), 2)
+    }
+
+
+def record_operation_details(**details):
+    """Добавляет к metadata текущей операции сведения о выбранных параметрах (operation_details)"""
+    current = getattr(_task_context, 'details', None)
+    if current is None:
+        current = _task_context.details = {}
+    current.update(details)
+
+
+def pop_operation_details() -> dict | None:
+    """Сведения текущей операции для operation_details в metadata (и сброс)"""
+    details = getattr(_task_context, 'details', None)
+    _task_context.details = {}
+    if not details:
+        return None
+    return {
+        'operation': getattr(_task_context, 'op_type', None),
+        'index': getattr(_task_context, 'op_index', None),
+        **details
+    }
+
+
+def build_operation_error_details(task_id: str, op_type: str, message: str, ffmpeg_failure: dict | None) -> dict:
+    """
+    error_code и error_details для metadata упавшей операции (формат create_task_error).
+    Вместо полного stderr - краткое описание и ссылка на полный лог ffmpeg.
+    """
+    task_error = create_task_error(
+        task_id=task_id,
+        error_message=message,
+        error_code=ERROR_FFMPEG_ERROR if ffmpeg_failure else ERROR_OPERATION_FAILED,
+        operation=op_type,
+        raw_error=ffmpeg_failure.get('summary') if ffmpeg_failure else None
+    )
+    if ffmpeg_failure and ffmpeg_failure.get('log_file'):
+        task_error['error_details']['log_path'] = f"/download/{task_id}/{ffmpeg_failure['log_file']}"
+    return {
+        'error_code': task_error['error_code'],
+        'error_details': task_error['error_details']
+    }
+
+
+def _make_progress_reporter(task_id: str, op_type: str, op_index: int, total_ops: int):
+    """
+    Callback для run_ffmpeg: переводит прогресс ffmpeg в общий прогресс задачи
+    (полоса операции 20..90%) и пишет его в task record не чаще PROGRESS_UPDATE_INTERVAL.
+    """
+    last_write = [0.0]
+
+    def report(snapshot: dict):
+        now = time.monotonic()
+        if not snapshot.get('done') and now - last_write[0] < PROGRESS_UPDATE_INTERVAL:
+            return
+        last_write[0] = now
+
+        fraction = snapshot.get('fraction') or 0.0
+        updates = {
+            'current_operation': op_type,
+            'encode': {
+                'operation': op_type,
+                'operation_index': op_index + 1,
+                'operations_total': total_ops,
+                'operation_progress': round(fraction * 100, 1) if snapshot.get('fraction') is not None else None,
+                'out_time': snapshot.get('out_time'),
+                'fps': snapshot.get('fps'),
+                'speed': snapshot.get('speed'),
+                'eta_seconds': snapshot.get('eta_seconds'),
+                'updated_at': datetime.now().isoformat()
             }
+        }
+        if snapshot.get('fraction') is not None:
+            updates['progress'] = 20 + int(((op_index + fraction) / total_ops) * 70)
+        try:
+            update_task(task_id, updates)
+        except Exception as e:
+            logger.debug(f"[{task_id[:8]}] Progress update failed: {e}")
+
+    return report
+
+
+def run_ffmpeg_for_task(cmd: list, duration: float | None = None, track_progress: bool = True,
+                        on_progress=None):
+    """
+    Запускает ffmpeg из операции. Если поток привязан к задаче (set_task_context):
+    - прогресс кодирования (fps, speed, ETA) пишется в task record в реальном времени
+      (track_progress=False - для коротких вспомогательных вызовов: превью, чанки;
+      on_progress - свой обработчик снимков вместо записи в task record)
+    - полный stderr сохраняется в ffmpeg_<операция>_<N>.log в папке задачи, но только при ошибке
+    - к процессу применяются лимиты полосы задачи (FFMPEG_RESOURCE_LANES), rusage накапливается
+    В памяти держится лишь хвост stderr (STDERR_TAIL_LINES строк).
+    Без привязки к задаче используется полоса DEFAULT_RESOURCE_LANE.
+    В режиме dry run (start_plan_recording) ffmpeg не запускается: команда записывается
+    в план, возвращается успешный результат без вывода.
+
+    Возвращает FFmpegResult, совместимый с subprocess.run(..., capture_output=True, text=True),
+    плюс error_summary для сообщений об ошибке.
+    """
+    plan_commands = getattr(_task_context, 'plan_commands', None)
+    if plan_commands is not None:
+        # Dry run: команда попадает в план вместо запуска
+        plan_commands.append({'cmd': list(cmd), 'duration': duration})
+        return FFmpegResult(list(cmd), 0)
+
+    task_id = getattr(_task_context, 'task_id', None)
+    log_path = None
+    lane = DEFAULT_RESOURCE_LANE
+    if task_id:
+        lane = _task_context.lane
+        if track_progress and on_progress is None:
+            on_progress = _make_progress_reporter(
+                task_id,
+                _task_context.op_type,
+                _task_context.op_index,
+                _task_context.total_ops
+            )
+        call_number = next(_task_context.call_counter)
+        log_path = os.path.join(
+            get_task_dir(task_id),
+            f"ffmpeg_{_task_context.op_index}_{_task_context.op_type}_{call_number}.log"
         )
 
-    def _get_available_fonts_list(self) -> list:
-        """Получает список всех доступных шрифтов из /app/fonts/
-        
-        Примечание: .ttc (TrueType Collection) файлы исключены, так как FFmpeg
-        не может работать с многошрифтовыми архивами. Поддерживаются только:
-        - .ttf (TrueType Font)
-        - .otf (OpenType Font)
-        """
-        fonts = []
-        
-        app_fonts_dir = "/app/fonts"
-        if os.path.exists(app_fonts_dir):
-            for filename in sorted(os.listdir(app_fonts_dir)):
-                # Исключаем .ttc файлы - FFmpeg не может их обрабатывать
-                if filename.lower().endswith(('.ttf', '.otf')):
-                    font_path = os.path.join(app_fonts_dir, filename)
-                    fonts.append({"name": filename, "file": font_path})
-        
-        return fonts
+    result = run_ffmpeg(cmd, duration=duration, on_progress=on_progress, log_path=log_path,
+                        limits=FFMPEG_RESOURCE_LANES[lane])
 
-    def _resolve_font_path(self, fontfile) -> str:
-        """
-        Резолвение шрифта из /app/fonts/:
-        1. Ищет по имени файла в /app/fonts/ (основной случай)
-        2. Если не найдено - использует fallback (DejaVu Sans система)
-        
-        Args:
-            fontfile: Имя файла шрифта (например: "Arial.ttf") или только имя (например: "Arial")
-        
-        Returns:
-            Полный путь к файлу шрифта
-        """
-        FALLBACK_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-        
-        if not fontfile:
-            return FALLBACK_FONT
-        
-        # Проверяем, что это строка
-        if not isinstance(fontfile, str):
-            fontfile = str(fontfile)
+    if task_id and result.rusage:
+        _task_context.rusage.append(result.rusage)
+        if result.returncode == 0 and duration:
+            # Коэффициенты CPU/секунда медиа для оценок /plan
+            COST_MODEL.observe(_task_context.op_type, result.rusage['user_time'] + result.rusage['sys_time'], duration)
+
+    if result.returncode != 0 and task_id:
+        record_ffmpeg_failure(result)
+        logger.debug(f"[{task_id[:8]}] ffmpeg stderr: {result.stderr_lines_total} line(s), full log: {result.log_path}")
+    return result
+
+
+# ============================================
+# MP4 OUTPUT MODES (FASTSTART / FRAGMENTED)
+# ============================================
+
+# faststart  - moov в начале файла: ffmpeg переписывает весь файл в конце кодирования
+# fragmented - fMP4 (empty_moov + фрагменты по ключевым кадрам): без финального прохода,
+#              файл можно отдавать клиенту пока он пишется
+MP4_OUTPUT_MODES = ('faststart', 'fragmented')
+
+# Маркер "файл ещё пишется" рядом с выходом (виден всем gunicorn worker'ам)
+GROWING_FILE_SUFFIX = '.writing'
+# Маркер "кодирование не удалось": появляется до снятия .writing, файл недописан
+GROWING_FILE_FAILED_SUFFIX = '.failed'
+GROWING_FILE_CHUNK_SIZE = 1024 * 1024
+GROWING_FILE_POLL_SECONDS = 0.5
+GROWING_FILE_IDLE_TIMEOUT = 60  # Файл не растёт дольше - считаем запись прерванной
+# Предел отдачи растущего файла одним запросом: поток держит sync-worker gunicorn (их 2),
+# а --timeout 600 убивает worker'а посреди ответа. Остаток клиент докачивает Range-запросом
+# после завершения задачи (готовый файл отдаётся send_file с поддержкой Range)
+GROWING_FILE_MAX_STREAM_SECONDS = 480
+
+
+class GrowingFileError(OSError):
+    """Отдача растущего файла прервана - ответ обрывается без завершающего chunk"""
+
+
+def validate_output_mode(params: dict) -> tuple[bool, str]:
+    """Проверка параметра output_mode операции"""
+    mode = params.get('output_mode', 'faststart')
+    if mode not in MP4_OUTPUT_MODES:
+        return False, f"Invalid output_mode: {mode}. Available: {list(MP4_OUTPUT_MODES)}"
+    return True, ""
+
+
+def mp4_movflags_args(output_mode: str | None) -> list:
+    """Аргументы -movflags для режима вывода MP4 (None - без флагов)"""
+    if output_mode == 'fragmented':
+        return ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+    if output_mode == 'faststart':
+        return ['-movflags', '+faststart']
+    return []
+
+
+@contextmanager
+def growing_output(output_path: str, enabled: bool = True):
+    """
+    Помечает файл как растущий на время кодирования: /download отдаёт его потоком,
+    дочитывая новые фрагменты до снятия маркера. Для финального файла задачи
+    (не temp_*) путь публикуется в task record как streaming_output.
+
+    Отдаёт dict состояния: код возврата ffmpeg записывается в state['returncode'].
+    При исключении или ненулевом (незаписанном) коде до снятия маркера создаётся
+    маркер .failed - поток /download обрывается, а не выдаёт недописанный файл за полный.
+    """
+    state = {'returncode': None}
+    if not enabled:
+        yield state
+        return
+
+    marker = output_path + GROWING_FILE_SUFFIX
+    failed_marker = output_path + GROWING_FILE_FAILED_SUFFIX
+    task_id = getattr(_task_context, 'task_id', None)
+    filename = os.path.basename(output_path)
+    publish = bool(task_id) and not filename.startswith('temp_')
+    try:
+        if os.path.exists(failed_marker):
+            os.remove(failed_marker)
+        open(marker, 'w').close()
+    except OSError as e:
+        logger.debug(f"Cannot create growing-file marker {marker}: {e}")
+        yield state
+        return
+
+    if publish:
+        update_task(task_id, {'streaming_output': {
+            'filename': filename,
+            'download_path': f"/download/{task_id}/{filename}"
+        }})
+    succeeded = False
+    try:
+        yield state
+        succeeded = state['returncode'] == 0
+    finally:
+        try:
+            if not succeeded:
+                open(failed_marker, 'w').close()
+            os.remove(marker)
+        except OSError:
+            pass
+        if publish:
+            update_task(task_id, {'streaming_output': None})
+
+
+def _stream_growing_file(path: str, marker: str):
+    """
+    Генератор: отдаёт файл кусками, пока маркер существует - ждёт новые данные.
+    Неполная отдача (предел GROWING_FILE_MAX_STREAM_SECONDS, остановка роста, неудачное
+    кодирование) - GrowingFileError: соединение обрывается без завершающего chunk,
+    и клиент не примет недописанный файл за целый.
+    """
+    started = time.monotonic()
+    idle_since = started
+    with open(path, 'rb') as f:
+        while True:
+            if time.monotonic() - started > GROWING_FILE_MAX_STREAM_SECONDS:
+                logger.info(f"Growing file stream reached {GROWING_FILE_MAX_STREAM_SECONDS}s limit, "
+                            f"aborting at byte {f.tell()}: {path}")
+                raise GrowingFileError(f"Stream limit reached at byte {f.tell()}: {path}")
+            chunk = f.read(GROWING_FILE_CHUNK_SIZE)
+            if chunk:
+                idle_since = time.monotonic()
+                yield chunk
+                continue
+            if not os.path.exists(marker):
+                if os.path.exists(path + GROWING_FILE_FAILED_SUFFIX):
+                    logger.warning(f"Growing file encode failed, aborting stream at byte {f.tell()}: {path}")
+                    raise GrowingFileError(f"Encode failed: {path}")
+                # Запись завершена - дочитываем остаток
+                while True:
+                    chunk = f.read(GROWING_FILE_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+            if time.monotonic() - idle_since > GROWING_FILE_IDLE_TIMEOUT:
+                logger.warning(f"Growing file stalled, aborting stream at byte {f.tell()}: {path}")
+                raise GrowingFileError(f"Stalled at byte {f.tell()}: {path}")
+            time.sleep(GROWING_FILE_POLL_SECONDS)
+
+
+# ============================================
+# SEEK PLANNING (KEYFRAME INPUT SEEK + ACCURATE OUTPUT SEEK)
+# ============================================
+
+def format_seconds(seconds: float) -> str:
+    """Секунды для -ss/-t: до микросекунд, без лишних нулей (5 -> '5', 2.5 -> '2.5')"""
+    return f"{seconds:.6f}".rstrip('0').rstrip('.')
+
+
+def keyframe_at_or_before(keyframes: list, seconds: float) -> float:
+    """Ближайший ключевой кадр не позже seconds (0.0, если таких нет)"""
+    index = bisect.bisect_right(keyframes, seconds + 0.0005)
+    return keyframes[index - 1] if index else 0.0
+
+
+def build_trim_args(start_time=None, end_time=None) -> tuple[list, list]:
+    """
+    Аргументы обрезки (до -i, после -i) - одинаковые для кодирования и для
+    измерительного прохода, чтобы измерялся ровно тот же отрезок.
+
+    Таймкоды ('00:01:30', 90) приводятся к секундам; конец всегда задаётся
+    длительностью -t (-to после -ss до -i отсчитывался бы от точки перемотки).
+    """
+    start = parse_time_value(start_time)
+    end = parse_time_value(end_time)
+    before_input = ['-ss', format_seconds(start)] if start else []
+    after_input = ['-t', format_seconds(end - (start or 0.0))] if end is not None else []
+    return before_input, after_input
+
+
+# Двухэтапная перемотка (вход - на ключевой кадр, остаток - -ss выхода). HARDCODED for public version:
+# выключена - -ss до -i при перекодировании сам перематывает на предыдущий ключевой кадр и
+# отбрасывает лишние кадры до фильтров, а -ss выхода пропускает их через весь filtergraph.
+# Включать только там, где benchmarks/bench_seek.py показывает выигрыш
+SEEK_TWO_STAGE_ENABLED = False
+
+# Выражения drawtext, зависящие от времени кадра (t, %{pts}): при двухэтапной перемотке
+# t отсчитывается от ключевого кадра, а сдвинуть выражение нельзя
+_TEXT_TIME_EXPRESSION_RE = re.compile(r'(?<![\w.])t(?!\w)')
+_TEXT_EXPRESSION_KEYS = ('x', 'y', 'fontsize')
+
+
+def cached_keyframes(input_path: str) -> list | None:
+    """Индекс ключевых кадров из PROBE_CACHE без запуска ffprobe (None - не построен)"""
+    if virtual_input_info(input_path) is not None:
+        return None
+    try:
+        return PROBE_CACHE.get(source_fingerprint(input_path), 'keyframes')
+    except OSError as e:
+        logger.debug(f"Cannot fingerprint {input_path}: {e}")
+        return None
+
+
+def plan_seek(input_path: str, start_time=None, end_time=None, use_keyframes: bool = True) -> dict:
+    """
+    План перемотки к start_time для кодирования отрезка.
+
+    По умолчанию - одна перемотка -ss до -i: ffmpeg сам встаёт на ключевой кадр
+    не позже start_time и отбрасывает декодированные кадры до фильтров. Двухэтапная
+    (SEEK_TWO_STAGE_ENABLED): вход ровно на ключевой кадр + точная перемотка выхода.
+    Индекс берётся только из кеша (cached_keyframes) - полный проход ffprobe по файлу
+    ради перемотки не запускается; по нему же считается overhead (секунды, которые
+    ffmpeg декодирует и отбрасывает). Без индекса overhead неизвестен (None).
+
+    Returns:
+        {'start', 'end', 'duration', 'keyframe', 'input_seek', 'output_seek', 'overhead', 'keyframe_index'}
+        в секундах; end/duration - None, если отрезок до конца файла и длительность неизвестна
+    """
+    start = parse_time_value(start_time) or 0.0
+    end = parse_time_value(end_time)
+    keyframes = cached_keyframes(input_path) if start > 0 else None
+    keyframe = keyframe_at_or_before(keyframes, start) if keyframes else None
+    output_seek = 0.0
+    # Ключевой кадр в пределах 1 мс от start - перемотка выхода не нужна
+    if SEEK_TWO_STAGE_ENABLED and use_keyframes and keyframe is not None and start - keyframe > 0.001:
+        output_seek = start - keyframe
+    return {
+        'start': start,
+        'end': end,
+        'duration': expected_output_duration(input_path, start, end),
+        'keyframe': keyframe,
+        'input_seek': start - output_seek,
+        'output_seek': output_seek,
+        'overhead': round(start - keyframe, 3) if keyframe is not None else None,
+        'keyframe_index': bool(keyframes)
+    }
+
+
+def seek_trim_args(seek: dict) -> tuple[list, list]:
+    """
+    Аргументы обрезки по plan_seek: (до -i, после -i). -ss после -i и -t - опции
+    выхода: у нескольких выходов одного процесса повторяются для каждого.
+    """
+    before_input = ['-ss', format_seconds(seek['input_seek'])] if seek['input_seek'] else []
+    after_input = ['-ss', format_seconds(seek['output_seek'])] if seek['output_seek'] else []
+    if seek['end'] is not None:
+        after_input.extend(['-t', format_seconds(seek['end'] - seek['start'])])
+    return before_input, after_input
+
+
+def text_items_use_time(text_items: list) -> bool:
+    """Есть ли в text_items выражения от времени кадра (x/y/fontsize с t, текст с %{pts})"""
+    for item in text_items or []:
+        if not isinstance(item, dict):
+            continue
+        if '%{pts' in str(item.get('text', '')):
+            return True
+        if any(_TEXT_TIME_EXPRESSION_RE.search(str(item[key])) for key in _TEXT_EXPRESSION_KEYS if key in item):
+            return True
+    return False
+
+
+def seek_text_items(text_items: list, seek: dict) -> list:
+    """
+    text_items во времени фильтров при двухэтапной перемотке: фильтры видят кадры
+    с ключевого кадра, поэтому тайминги сдвигаются на остаток перемотки.
+    ValueError - нечисловые тайминги (см. shift_text_items) или выражения от t:
+    их не сдвинуть, нужна одна перемотка -ss до -i.
+    """
+    if not seek['output_seek']:
+        return text_items
+    if text_items_use_time(text_items):
+        raise ValueError("text_items expressions depend on t")
+    return shift_text_items(text_items, -seek['output_seek'], float('inf'))
+
+
+# ============================================
+# LOUDNESS NORMALIZATION (TWO-PASS, CACHED)
+# ============================================
+
+def resolve_loudnorm_target(value) -> dict | None:
+    """normalize_audio: true | {i, tp, lra} -> целевые параметры loudnorm; None - выключено"""
+    if not value:
+        return None
+    target = dict(DEFAULT_LOUDNORM_TARGET)
+    if isinstance(value, dict):
+        target.update({k: float(v) for k, v in value.items() if k in DEFAULT_LOUDNORM_TARGET})
+    return target
+
+
+def validate_normalize_audio(params: dict) -> tuple[bool, str]:
+    """Проверка параметра normalize_audio (bool или объект {i, tp, lra})"""
+    value = params.get('normalize_audio', False)
+    if isinstance(value, bool):
+        return True, ""
+    if not isinstance(value, dict):
+        return False, "normalize_audio must be a boolean or an object {i, tp, lra}"
+    ranges = {'i': (-70.0, -5.0), 'tp': (-9.0, 0.0), 'lra': (1.0, 50.0)}
+    for key, item in value.items():
+        if key not in ranges:
+            return False, f"Unknown normalize_audio field: {key}. Available: {list(ranges)}"
+        low, high = ranges[key]
+        if isinstance(item, bool) or not isinstance(item, (int, float)) or not (low <= item <= high):
+            return False, f"normalize_audio.{key} must be a number between {low} and {high}"
+    return True, ""
+
+
+def loudnorm_filter_for(input_path: str, target: dict, start_time=None, end_time=None) -> str | None:
+    """
+    Фильтр linear loudnorm для отрезка источника.
+
+    Измерение (первый проход, только аудио: -vn) выполняется один раз на источник,
+    отрезок и цель - результат хранится в PROBE_CACHE, повторные рендеры того же
+    фрагмента пропускают измерительный проход.
+
+    Returns:
+        Строка фильтра для -af или None (нет аудио / тишина / ошибка измерения)
+    """
+    cache_params = {
+        'start': parse_time_value(start_time),
+        'end': parse_time_value(end_time),
+        'target': target
+    }
+    try:
+        fingerprint = source_fingerprint(input_path)
+    except OSError as e:
+        logger.warning(f"⚠️  Loudness: cannot fingerprint {input_path}: {e}")
+        return None
+
+    measured = PROBE_CACHE.get(fingerprint, 'loudnorm', cache_params)
+    if measured is not None:
+        logger.debug(f"🔊 Loudness measurement cache HIT: {measured}")
+    else:
+        before_input, after_input = build_trim_args(start_time, end_time)
+        cmd = ['ffmpeg', *before_input, '-i', input_path, *after_input,
+               '-vn', '-sn', '-dn',
+               '-af', build_loudnorm_measure_filter(target),
+               '-f', 'null', os.devnull]
+        logger.debug(f"🔊 Loudness measurement pass: {' '.join(cmd)}")
+        result = run_ffmpeg_for_task(cmd, track_progress=False)
+        if result.returncode != 0:
+            logger.warning(f"⚠️  Loudness measurement failed, skipping normalization: {result.error_summary}")
+            return None
+        measured = parse_loudnorm_json(result.stderr)
+        if measured is None:
+            logger.warning("⚠️  Loudness measurement returned no usable values (no audio or silence), skipping normalization")
+            return None
+        PROBE_CACHE.put(fingerprint, 'loudnorm', measured, cache_params)
+        logger.debug(f"🔊 Loudness measured: {measured}")
+
+    logger.info(f"🔊 Normalizing loudness: {measured['input_i']} LUFS -> {target['i']} LUFS")
+    return build_loudnorm_apply_filter(target, measured)
+
+
+# ============================================
+# SEGMENT-PARALLEL ENCODING
+# ============================================
+
+# Настройки кодирования make_short - одинаковые для одного процесса и для сегментов
+SHORTS_VIDEO_CODEC_ARGS = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23']
+SHORTS_AUDIO_CODEC_ARGS = ['-c:a', 'aac', '-b:a', '128k']
+
+# HARDCODED for public version
+ENCODE_EXECUTORS = ('single', 'parallel')
+PARALLEL_ENCODE_MAX_SEGMENTS = 4           # Максимум одновременных процессов кодирования на операцию
+PARALLEL_ENCODE_MIN_SEGMENT_SECONDS = 20   # Короче - накладные расходы на запуск и склейку не окупаются
+MAKE_SHORT_MAX_VARIANTS = 4                # Вариантов text_items в одном кодировании (variants)
+AUDIO_CHUNK_MAX_WORKERS = 8                # Одновременных процессов нарезки чанков extract_audio
+
+
+def validate_executor(params: dict) -> tuple[bool, str]:
+    """Проверка параметров executor / parallel_segments"""
+    executor = params.get('executor', 'single')
+    if executor not in ENCODE_EXECUTORS:
+        return False, f"Invalid executor: {executor}. Available: {list(ENCODE_EXECUTORS)}"
+    segments = params.get('parallel_segments')
+    if segments is not None:
+        if isinstance(segments, bool) or not isinstance(segments, int) or not (2 <= segments <= PARALLEL_ENCODE_MAX_SEGMENTS):
+            return False, f"parallel_segments must be an integer between 2 and {PARALLEL_ENCODE_MAX_SEGMENTS}"
+    return True, ""
+
+
+def _make_combined_progress(weights: list, report):
+    """
+    Сводный прогресс нескольких одновременных ffmpeg: доля - взвешенная по длительности,
+    fps и speed - суммы, ETA - по самому медленному процессу.
+    Возвращает фабрику обработчиков по индексу процесса.
+    """
+    lock = threading.Lock()
+    snapshots = [None] * len(weights)
+    total = sum(weights) or 1.0
+
+    def hook_for(index: int):
+        def hook(snapshot: dict):
+            with lock:
+                snapshots[index] = snapshot
+                active = [s for s in snapshots if s]
+                fraction = sum((s.get('fraction') or 0.0) * w for s, w in zip(snapshots, weights) if s) / total
+                combined = {
+                    'fraction': min(1.0, fraction),
+                    'out_time': None,
+                    'fps': round(sum(s.get('fps') or 0.0 for s in active), 1) or None,
+                    'speed': round(sum(s.get('speed') or 0.0 for s in active), 2) or None,
+                    'eta_seconds': max((s['eta_seconds'] for s in active if s.get('eta_seconds') is not None), default=None),
+                    'done': False
+                }
+            report(combined)
+        return hook
+
+    return hook_for
+
+
+def run_ffmpeg_parallel(jobs: list, max_workers: int | None = None) -> list:
+    """
+    Запускает несколько ffmpeg одновременно (по рабочему потоку на процесс) от имени
+    текущей операции: лимиты полосы, логи и rusage - как у run_ffmpeg_for_task,
+    прогресс - сводный по всем процессам.
+
+    Args:
+        jobs: [(cmd, duration), ...]; duration 0 - процесс не влияет на прогресс
+        max_workers: не больше стольких процессов одновременно (None - все jobs сразу)
+
+    Returns:
+        Список FFmpegResult в порядке jobs. Первая ошибка записывается в контекст операции.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    snapshot = task_context_snapshot()
+    hook_for = None
+    if snapshot and snapshot['task_id']:
+        report = _make_progress_reporter(
+            snapshot['task_id'], snapshot['op_type'], snapshot['op_index'], snapshot['total_ops']
+        )
+        hook_for = _make_combined_progress([duration or 0.0 for _, duration in jobs], report)
+
+    def worker(index: int, cmd: list, duration: float):
+        bind_task_context(snapshot)
+        try:
+            return run_ffmpeg_for_task(
+                cmd,
+                duration=duration or None,
+                track_progress=bool(duration),
+                on_progress=hook_for(index) if hook_for and duration else None
+            )
+        finally:
+            clear_task_context()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(jobs), max_workers or len(jobs))),
+                            thread_name_prefix='ffmpeg-seg') as pool:
+        futures = [pool.submit(worker, index, cmd, duration) for index, (cmd, duration) in enumerate(jobs)]
+        results = [future.result() for future in futures]
+
+    failed = next((r for r in results if r.returncode != 0), None)
+    if failed is not None:
+        record_ffmpeg_failure(failed)
+    return results
+
+
+# ============================================
+# CONTENT-ADAPTIVE CRF (target_quality)
+# ============================================
+
+# Допустимые цели по метрикам (HARDCODED for public version)
+QUALITY_TARGET_LIMITS = {'ssim': (0.8, 0.995), 'psnr': (25.0, 55.0)}
+
+
+def resolve_quality_target(value) -> dict | None:
+    """target_quality: true | {metric, target} -> {'metric', 'target'}; None - выключено"""
+    if not value:
+        return None
+    options = value if isinstance(value, dict) else {}
+    metric = options.get('metric', 'ssim')
+    return {'metric': metric, 'target': float(options.get('target', DEFAULT_TARGETS[metric]))}
+
+
+def validate_target_quality(params: dict) -> tuple[bool, str]:
+    """Проверка параметра target_quality (bool или объект {metric, target})"""
+    value = params.get('target_quality', False)
+    if isinstance(value, bool):
+        return True, ""
+    if not isinstance(value, dict):
+        return False, "target_quality must be a boolean or an object {metric, target}"
+    unknown = set(value) - {'metric', 'target'}
+    if unknown:
+        return False, f"Unknown target_quality fields: {sorted(unknown)}. Available: ['metric', 'target']"
+    metric = value.get('metric', 'ssim')
+    if metric not in QUALITY_METRICS:
+        return False, f"Invalid target_quality.metric: {metric}. Available: {list(QUALITY_METRICS)}"
+    target = value.get('target', DEFAULT_TARGETS[metric])
+    low, high = QUALITY_TARGET_LIMITS[metric]
+    if isinstance(target, bool) or not isinstance(target, (int, float)) or not (low <= target <= high):
+        return False, f"target_quality.target for {metric} must be between {low} and {high}"
+    return True, ""
+
+
+def shorts_video_codec_args(crf: int) -> list:
+    """SHORTS_VIDEO_CODEC_ARGS с другим CRF"""
+    args = list(SHORTS_VIDEO_CODEC_ARGS)
+    args[args.index('-crf') + 1] = str(crf)
+    return args
+
+
+def select_target_crf(input_path: str, base_video_filter: str, is_complex_filter: bool,
+                      start_time, end_time, target: dict, work_dir: str) -> dict | None:
+    """
+    CRF для target_quality по пробным кодированиям отрезка (см. quality_search.py).
+
+    Пробы проходят ту же цепочку crop/scale, что и основное кодирование, и уменьшаются
+    до SAMPLE_SIZE. Измерения {CRF: оценка, битрейт} хранятся в PROBE_CACHE по источнику,
+    отрезку, цепочке и метрике: повторный рендер фрагмента не кодирует пробы, а другая
+    цель добирает только недостающие CRF.
+
+    Returns:
+        {'metric', 'target', 'crf', 'score', 'sample_kbps', 'met', 'samples', 'sample_encodes'}
+        или None (отрезок не определён / проба не удалась - CRF по умолчанию)
+    """
+    range_start = parse_time_value(start_time) if start_time is not None else 0.0
+    range_end = parse_time_value(end_time) if end_time is not None else probe_media_duration(input_path)
+    if range_start is None or range_end is None or range_end <= range_start:
+        logger.warning("⚠️  target_quality: cannot resolve the time range, using the default CRF")
+        return None
+    try:
+        fingerprint = source_fingerprint(input_path)
+    except OSError as e:
+        logger.warning(f"⚠️  target_quality: cannot fingerprint {input_path}: {e}")
+        return None
+
+    metric = target['metric']
+    samples = plan_samples(range_start, range_end)
+    cache_params = {
+        'samples': samples,
+        'filter': base_video_filter,
+        'codec': SHORTS_VIDEO_CODEC_ARGS,
+        'size': SAMPLE_SIZE,
+        'metric': metric
+    }
+    scores = PROBE_CACHE.get(fingerprint, 'quality', cache_params) or {}
+    sample_filter = f"{base_video_filter},scale={SAMPLE_SIZE[0]}:{SAMPLE_SIZE[1]}"
+    sample_dir = tempfile.mkdtemp(prefix='quality_', dir=work_dir)
+    references = []
+    encodes = 0
+    try:
+        while (crf := next_crf(scores, target['target'])) is not None:
+            if not references:
+                # Эталон пробы - без потерь (-qp 0): сравнивается только потеря от CRF
+                for index, (sample_start, length) in enumerate(samples):
+                    reference = os.path.join(sample_dir, f"ref{index}.mkv")
+                    result = run_ffmpeg_for_task([
+                        'ffmpeg', '-ss', f"{sample_start:.3f}", '-i', input_path, '-t', f"{length:.3f}",
+                        '-filter_complex' if is_complex_filter else '-vf', sample_filter,
+                        '-an', '-sn', '-dn', '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0',
+                        '-y', reference
+                    ], track_progress=False)
+                    if result.returncode != 0:
+                        logger.warning(f"⚠️  target_quality: sample extraction failed, using the default CRF: {result.error_summary}")
+                        return None
+                    references.append((reference, length))
+
+            sample_scores = []
+            bits = 0
+            for index, (reference, length) in enumerate(references):
+                encoded = os.path.join(sample_dir, f"crf{crf}_{index}.mp4")
+                result = run_ffmpeg_for_task(
+                    ['ffmpeg', '-i', reference, *shorts_video_codec_args(crf), '-y', encoded],
+                    track_progress=False
+                )
+                if result.returncode == 0:
+                    result = run_ffmpeg_for_task([
+                        'ffmpeg', '-i', encoded, '-i', reference,
+                        '-lavfi', f"[0:v][1:v]{metric}", '-f', 'null', os.devnull
+                    ], track_progress=False)
+                score = parse_quality_score(result.stderr, metric) if result.returncode == 0 else None
+                if score is None:
+                    logger.warning(f"⚠️  target_quality: sample encode at CRF {crf} was not measured, using the default CRF")
+                    return None
+                sample_scores.append(score)
+                bits += os.path.getsize(encoded) * 8
+                encodes += 1
+            scores[str(crf)] = {
+                'score': round(min(sample_scores), 5),
+                'kbps': round(bits / sum(length for _, length in references) / 1000, 1)
+            }
+            logger.debug(f"🎯 target_quality: CRF {crf} -> {metric} {scores[str(crf)]['score']} ({scores[str(crf)]['kbps']} kbps at {SAMPLE_SIZE[0]}x{SAMPLE_SIZE[1]})")
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+        if encodes:
+            # Частичные измерения тоже верны - следующий рендер продолжит с них
+            PROBE_CACHE.put(fingerprint, 'quality', scores, cache_params)
+
+    crf, entry = choose_crf(scores, target['target'])
+    selection = {
+        'metric': metric,
+        'target': target['target'],
+        'crf': crf,
+        'score': entry['score'] if entry else None,
+        'sample_kbps': entry['kbps'] if entry else None,
+        'met': bool(entry) and entry['score'] >= target['target'],
+        'samples': len(samples),
+        'sample_encodes': encodes
+    }
+    logger.info(
+        f"🎯 target_quality: CRF {crf} ({metric} {selection['score']}, target {target['target']}"
+        f"{', measurements cached' if not encodes else f', {encodes} sample encode(s)'})"
+    )
+    return selection
+
+
+# ============================================
+# TARGET FILE SIZE (max_output_mb)
+# ============================================
+
+# HARDCODED for public version
+MAX_OUTPUT_MB_LIMITS = (1, 4096)
+# Как SHORTS_VIDEO_CODEC_ARGS, но битрейт вместо CRF (двухпроходное кодирование)
+TWO_PASS_VIDEO_CODEC_ARGS = ['-c:v', 'libx264', '-preset', 'medium']
+SIZE_TARGET_AUDIO_BITRATE = 128_000  # Битрейт SHORTS_AUDIO_CODEC_ARGS
+
+
+def validate_max_output_mb(params: dict) -> tuple[bool, str]:
+    """Проверка параметра max_output_mb"""
+    value = params.get('max_output_mb')
+    if value is None:
+        return True, ""
+    low, high = MAX_OUTPUT_MB_LIMITS
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not (low <= value <= high):
+        return False, f"max_output_mb must be a number between {low} and {high}"
+    return True, ""
+
+
+def _remove_pass_logs(passlog: str):
+    """Статистика x264 двухпроходного кодирования: <passlog>-0.log, .mbtree и их .temp"""
+    directory, prefix = os.path.split(passlog)
+    for filename in os.listdir(directory or '.'):
+        if filename.startswith(prefix):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
+def encode_to_size(input_args: list, filter_args: list, audio_args: list, output_path: str,
+                   max_output_mb: float, duration: float, audio_bitrate: int,
+                   output_mode: str | None) -> tuple[bool, str, dict | None]:
+    """
+    Двухпроходное кодирование libx264 в предел max_output_mb (см. size_target.py).
+
+    Первый проход собирает статистику (без звука, выход в null), второй кодирует
+    со средним битрейтом из бюджета. Если файл всё же больше предела, второй проход
+    повторяется с битрейтом, уменьшенным пропорционально перелёту.
+
+    Args:
+        input_args: входы с обрезкой: [-ss, ..., -i, path, -t, ...]
+        filter_args: [-vf, ...] / [-filter_complex, ...] или []
+        audio_args: кодирование звука второго прохода ([-an] без звука)
+
+    Returns:
+        (ok, сообщение об ошибке, отчёт {'max_mb', 'size_mb', 'video_kbps', 'passes', 'met'} или None)
+    """
+    max_bytes = int(max_output_mb * 1024 * 1024)
+    video_bitrate = video_bitrate_for_size(max_bytes, duration, audio_bitrate)
+    if video_bitrate is None:
+        return False, f"max_output_mb={max_output_mb:g} is too small for {duration:.1f}s of video", None
+
+    passlog = os.path.splitext(output_path)[0] + '_2pass'
+    try:
+        result = run_ffmpeg_for_task([
+            'ffmpeg', *input_args, *filter_args,
+            '-an', '-sn', '-dn',
+            *TWO_PASS_VIDEO_CODEC_ARGS, '-b:v', str(video_bitrate),
+            '-pass', '1', '-passlogfile', passlog,
+            '-f', 'null', os.devnull
+        ], duration=duration)
+        if result.returncode != 0:
+            return False, f"FFmpeg error (first pass): {result.error_summary}", None
+
+        report = None
+        for attempt in range(1, MAX_SECOND_PASS_ATTEMPTS + 1):
+            result = run_ffmpeg_for_task([
+                'ffmpeg', *input_args, *filter_args,
+                *TWO_PASS_VIDEO_CODEC_ARGS, '-b:v', str(video_bitrate),
+                '-pass', '2', '-passlogfile', passlog,
+                *audio_args,
+                *mp4_movflags_args(output_mode),
+                '-y', output_path
+            ], duration=duration)
+            if result.returncode != 0:
+                return False, f"FFmpeg error: {result.error_summary}", None
+            if is_plan_recording():
+                # Dry run: размер станет известен только после кодирования
+                return True, "", None
+
+            size = os.path.getsize(output_path)
+            report = {
+                'max_mb': max_output_mb,
+                'size_mb': round(size / (1024 * 1024), 2),
+                'video_kbps': round(video_bitrate / 1000),
+                'passes': attempt + 1,
+                'met': size <= max_bytes
+            }
+            if size <= max_bytes:
+                logger.info(f"📏 Output fits max_output_mb={max_output_mb:g}: {report['size_mb']} MB at {report['video_kbps']} kbps")
+                return True, "", report
+            next_bitrate = retry_video_bitrate(video_bitrate, size, max_bytes, duration, audio_bitrate)
+            if next_bitrate is None:
+                break
+            logger.info(
+                f"📏 Output {report['size_mb']} MB exceeds max_output_mb={max_output_mb:g}, "
+                f"repeating the second pass at {next_bitrate // 1000} kbps"
+            )
+            video_bitrate = next_bitrate
+
+        remove_task_file(output_path)
+        return False, f"Output does not fit max_output_mb={max_output_mb:g} ({report['size_mb']} MB after {report['passes']} passes)", report
+    finally:
+        _remove_pass_logs(passlog)
+
+
+# ============================================
+# VIDEO OPERATIONS REGISTRY
+# ============================================
+
+class VideoOperation:
+    """Базовый класс для операций с видео"""
+    # Операция создаёт не один видеофайл (плейлисты, сегменты) - допустима только последней в pipeline
+    terminal = False
+    # Версия алгоритма операции для ключа result cache (None - не входит в ключ);
+    # повышается, когда прежние закешированные результаты больше не верны
+    result_version = None
+
+    def __init__(self, name: str, required_params: list, optional_params: dict = None):
+        self.name = name
+        self.required_params = required_params
+        self.optional_params = optional_params or {}
+
+    def validate(self, params: dict) -> tuple[bool, str]:
+        """Валидация параметров операции"""
+        for param in self.required_params:
+            if param not in params:
+                return False, f"Missing required parameter: {param}"
+        return True, ""
+    
+    def stream_output_info(self, input_path: str, params: dict) -> dict | None:
+        """
+        Выход можно отдать следующей операции потоком (pipe handoff): описание выхода
+        {'duration', 'size', 'stream_types'} или None - нужен файл
+        """
+        return None
+
+    def accepts_stream_input(self, params: dict) -> bool:
+        """Вход читается одним последовательным проходом (допустим FIFO без перемотки)"""
+        return False
+
+    def is_terminal(self, params: dict) -> bool:
+        """Допустима только последней в pipeline (по умолчанию - атрибут terminal)"""
+        return self.terminal
+
+    def expected_duration(self, input_path: str, params: dict) -> float | None:
+        """Ожидаемая длительность выхода (прогресс, оценки /plan)"""
+        return expected_output_duration(input_path, params.get('start_time'), params.get('end_time'))
+
+    def external_inputs(self, params: dict) -> list:
+        """Файлы, которые операция читает помимо input_path (входят в ключ result cache)"""
+        return []
+
+    def validate_input_file(self, input_path: str) -> tuple[bool, str]:
+        """Валидация входного файла перед FFmpeg операцией"""
+        if virtual_input_info(input_path) is not None:
+            # Поток от предыдущей операции (или вход dry run): размер заранее неизвестен
+            return True, ""
+        if not os.path.exists(input_path):
+            return False, f"Input file not found: {input_path}"
+        
+        file_size = os.path.getsize(input_path)
+        if file_size == 0:
+            return False, f"Input file is empty: {input_path}"
+        
+        if file_size < 1024:  # < 1KB
+            return False, f"Input file too small ({file_size} bytes): {input_path}"
+        
+        return True, ""
+
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str]:
+        """
+        Выполнение операции (переопределяется в подклассах)
+
+        Args:
+            input_path: Путь к входному видео
+            output_path: Путь к выходному видео
+            params: Параметры операции
+            additional_inputs: Дополнительные входные данные (аудио, изображения и т.д.)
+        """
+        raise NotImplementedError()
+
+
+# Нарезка: не больше клипов за один проход (segments)
+CUT_MAX_SEGMENTS = 100
+
+
+class CutVideoOperation(VideoOperation):
+    """Операция нарезки видео"""
+    def __init__(self):
+        super().__init__(
+            name="cut_video",
+            required_params=["start_time", "end_time"],
+            optional_params={
+                'segments': None,     # [{start_time, end_time}, ...] - все клипы за одно чтение входа
+                'output_mode': None,  # None (как есть) | faststart | fragmented
+                'max_output_mb': None  # Предел размера клипа: больший -c copy перекодируется в два прохода
+            }
+        )
+
+    def validate(self, params: dict) -> tuple[bool, str]:
+        if params.get('segments') is not None:
+            ok, msg = self._validate_segments(params)
+        else:
+            ok, msg = super().validate(params)
+        if not ok:
+            return ok, msg
+        ok, msg = validate_max_output_mb(params)
+        if not ok:
+            return ok, msg
+        if params.get('output_mode') is not None:
+            return validate_output_mode(params)
+        return True, ""
+
+    def _validate_segments(self, params: dict) -> tuple[bool, str]:
+        if params.get('start_time') is not None or params.get('end_time') is not None:
+            return False, "Use either segments or start_time/end_time, not both"
+        segments = params['segments']
+        if not isinstance(segments, list) or not segments:
+            return False, "segments must be a non-empty list"
+        if len(segments) > CUT_MAX_SEGMENTS:
+            return False, f"Too many segments: {len(segments)} (max {CUT_MAX_SEGMENTS})"
+        for index, segment in enumerate(segments, start=1):
+            if not isinstance(segment, dict) or 'start_time' not in segment or 'end_time' not in segment:
+                return False, f"Segment {index} must be an object with start_time and end_time"
+            start = parse_time_value(segment['start_time'])
+            end = parse_time_value(segment['end_time'])
+            if start is None or start < 0:
+                return False, f"Segment {index}: invalid start_time"
+            if end is None or end <= start:
+                return False, f"Segment {index}: end_time must be greater than start_time"
+        return True, ""
+
+    def is_terminal(self, params: dict) -> bool:
+        # Несколько клипов - набор файлов, а не один вход для следующей операции
+        return params.get('segments') is not None
+
+    def expected_duration(self, input_path: str, params: dict) -> float | None:
+        if params.get('segments') is None:
+            return super().expected_duration(input_path, params)
+        return sum(
+            parse_time_value(s['end_time']) - parse_time_value(s['start_time'])
+            for s in params['segments']
+        )
+
+    def stream_output_info(self, input_path: str, params: dict) -> dict | None:
+        # -c copy: потоки и размер кадра те же, что у входа; MP4-режимы выхода требуют файла,
+        # max_output_mb - проверки размера готового файла
+        if params.get('output_mode') is not None or params.get('max_output_mb') is not None or input_path in STREAM_INPUTS:
+            return None
+        return {
+            'duration': expected_output_duration(input_path, params['start_time'], params['end_time']),
+            'size': probe_video_size(input_path),
+            'stream_types': sorted(probe_stream_types(input_path))
+        }
+
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str]:
+        """Нарезка видео"""
+        logger.debug(f"📥 Starting CutVideoOperation execute: input_path={input_path}, output_path={output_path}")
+        logger.debug(f"📋 Input params: {json.dumps(params, indent=2, default=str)}")
+        
+        # Валидация входного файла
+        valid, msg = self.validate_input_file(input_path)
+        if not valid:
+            logger.error(f"❌ Input validation failed: {msg}")
+            return False, msg
+
+        if params.get('segments') is not None:
+            return self._execute_segments(input_path, output_path, params)
+
+        start_time = params['start_time']
+        end_time = params['end_time']
+        logger.debug(f"⏱️  Cut parameters: start_time={start_time}s, end_time={end_time}s, duration={(end_time - start_time)}s")
+
+        # -t (end - start): -to после -ss до -i отсчитывался бы от точки перемотки
+        before_input, after_input = build_trim_args(start_time, end_time)
+        cmd = [
+            'ffmpeg',
+            *before_input,
+            '-i', input_path,
+            *after_input,
+            '-c', 'copy',
+            *mp4_movflags_args(params.get('output_mode')),
+            '-y',
+            output_path
+        ]
+        
+        logger.debug(f"📹 ════════════════════════════════════════════════════════════")
+        logger.debug(f"📹 FFmpeg COMMAND for video cut:")
+        logger.debug(f"📹 {' '.join(cmd)}")
+
+        with growing_output(output_path, enabled=params.get('output_mode') == 'fragmented') as growing:
+            result = run_ffmpeg_for_task(cmd, duration=expected_output_duration(input_path, start_time, end_time))
+            growing['returncode'] = result.returncode
+        logger.debug(f"📊 FFmpeg return code: {result.returncode}")
+        if result.stdout:
+            logger.debug(f"📋 FFmpeg stdout: {result.stdout[:500]}")
+        if result.stderr:
+            logger.debug(f"⚠️  FFmpeg stderr: {result.stderr[:500]}")
+        
+        if result.returncode != 0:
+            logger.error(f"❌ FFmpeg error: {result.error_summary}")
+            return False, f"FFmpeg error: {result.error_summary}"
+
+        ok, message, report = self._fit_to_size(input_path, output_path, start_time, end_time, params)
+        if report:
+            record_operation_details(max_output=report)
+        if not ok:
+            return False, message
+
+        logger.info(f"✅ Video cut completed: {start_time}s to {end_time}s -> {output_path}")
+        return True, "Video cut completed"
+
+    def _fit_to_size(self, input_path: str, clip_path: str, start_time, end_time,
+                     params: dict) -> tuple[bool, str, dict | None]:
+        """
+        max_output_mb: клип -c copy больше предела перекодируется двухпроходно
+        (тот же отрезок, без фильтров). Клип в пределе остаётся копией (passes: 0).
+        Returns: (ok, сообщение об ошибке, отчёт для operation_details или None)
+        """
+        max_output_mb = params.get('max_output_mb')
+        if max_output_mb is None or is_plan_recording():
+            return True, "", None
+        size = os.path.getsize(clip_path)
+        if size <= max_output_mb * 1024 * 1024:
+            return True, "", {
+                'max_mb': max_output_mb, 'size_mb': round(size / (1024 * 1024), 2),
+                'video_kbps': None, 'passes': 0, 'met': True
+            }
+
+        logger.info(f"📏 Copied clip is {size / (1024 * 1024):.1f} MB, re-encoding to max_output_mb={max_output_mb:g}")
+        has_audio = 'audio' in probe_stream_types(input_path)
+        before_input, after_input = build_trim_args(start_time, end_time)
+        ok, message, report = encode_to_size(
+            [*before_input, '-i', input_path, *after_input], [],
+            ['-c:a', 'aac', '-b:a', str(SIZE_TARGET_AUDIO_BITRATE)] if has_audio else ['-an'],
+            clip_path, max_output_mb, expected_output_duration(input_path, start_time, end_time),
+            SIZE_TARGET_AUDIO_BITRATE if has_audio else 0, params.get('output_mode')
+        )
+        if not ok:
+            logger.error(f"❌ {message}")
+        return ok, message, report
+
+    def _execute_segments(self, input_path: str, output_path: str, params: dict) -> tuple:
+        """
+        Все клипы одним процессом ffmpeg: вход читается один раз, у каждого клипа свой
+        выход с -ss/-to (-c copy). Начало клипа сдвигается на ключевой кадр не позже
+        start_time - как у одиночной нарезки с -ss до -i.
+        Выходы - <base>_chunkNNN.<ext> (в output_files с полем chunk: i:n).
+        """
+        ranges = [
+            (parse_time_value(s['start_time']), parse_time_value(s['end_time']))
+            for s in params['segments']
+        ]
+        keyframes = probe_keyframes(input_path) if virtual_input_info(input_path) is None else None
+        if keyframes:
+            ranges = [(keyframe_at_or_before(keyframes, start), end) for start, end in ranges]
+        else:
+            # Без индекса ключевых кадров copy начнётся с первого ключевого кадра после start_time
+            logger.debug(f"✂️ Keyframes unavailable for {input_path}: clips start at the next keyframe")
+
+        # Общая перемотка входа до первого клипа; времена выходов отсчитываются от неё
+        input_seek = min(start for start, _ in ranges)
+        base, ext = os.path.splitext(output_path)
+        clip_paths = [f"{base}_chunk{index:03d}{ext}" for index in range(len(ranges))]
+
+        cmd = ['ffmpeg']
+        if input_seek > 0:
+            cmd.extend(['-ss', f"{input_seek:.3f}"])
+        cmd.extend(['-i', input_path])
+        for (start, end), clip_path in zip(ranges, clip_paths):
+            # Отступ 1 мс: ключевой кадр ровно на start не отбрасывается из-за округления времени
+            clip_start = max(0.0, start - input_seek - 0.001)
+            cmd.extend([
+                '-map', '0:v?', '-map', '0:a?',
+                '-ss', f"{clip_start:.3f}",
+                '-to', f"{end - input_seek:.3f}",
+                '-c', 'copy',
+                *mp4_movflags_args(params.get('output_mode')),
+                '-y', clip_path
+            ])
+
+        logger.debug(f"📹 FFmpeg COMMAND for {len(ranges)} cuts:")
+        logger.debug(f"📹 {' '.join(cmd)}")
+
+        result = run_ffmpeg_for_task(cmd, duration=max(end for _, end in ranges) - input_seek)
+        if result.returncode != 0:
+            logger.error(f"❌ FFmpeg error: {result.error_summary}")
+            for clip_path in clip_paths:
+                remove_task_file(clip_path)
+            return False, f"FFmpeg error: {result.error_summary}"
+
+        if params.get('max_output_mb') is not None:
+            # Предел - на каждый клип; перекодируется точный отрезок, а не сдвинутый на ключевой кадр
+            reports = []
+            for segment, clip_path in zip(params['segments'], clip_paths):
+                ok, message, report = self._fit_to_size(
+                    input_path, clip_path, parse_time_value(segment['start_time']),
+                    parse_time_value(segment['end_time']), params
+                )
+                reports.append(report)
+                if not ok:
+                    for path in clip_paths:
+                        remove_task_file(path)
+                    return False, message
+            if not is_plan_recording():
+                record_operation_details(max_output=reports)
+
+        logger.info(f"✅ Video cut into {len(clip_paths)} clips in one pass -> {os.path.basename(base)}_chunk*{ext}")
+        return True, f"Video cut into {len(clip_paths)} clips", clip_paths
+
+
+APP_FONTS_DIR = "/app/fonts"
+FONT_FACES_DIR = os.path.join(CACHE_DIR, "fonts")  # Начертания, извлечённые из .ttc
+FALLBACK_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+SUBTITLE_RENDERERS = ('drawtext', 'ass')
+
+# Реестр шрифтов строится один раз при старте (name tables, разбор .ttc, индексы поиска)
+FONT_REGISTRY = FontRegistry(APP_FONTS_DIR, FONT_FACES_DIR, fallback_font=FALLBACK_FONT)
+try:
+    FONT_REGISTRY.build()
+    logger.debug(f"Font registry: {len(FONT_REGISTRY.listing())} font file(s) indexed from {APP_FONTS_DIR}")
+except Exception as e:
+    logger.error(f"Font registry build failed: {e}")
+
+
+class MakeShortOperation(VideoOperation):
+    """Операция конвертации в Shorts формат"""
+    def __init__(self):
+        super().__init__(
+            name="make_short",
+            required_params=[],
+            optional_params={
+                'start_time': None,
+                'end_time': None,
+                'crop_mode': 'center',
+                'letterbox_config': {},
+                'text_items': [],  # Новая универсальная система текста
+                'subtitle_renderer': 'drawtext',  # drawtext | ass (один фильтр libass для всех text_items)
+                'generate_thumbnail': True,  # Автоматическая генерация превью
+                'thumbnail_timestamp': 0.5,  # Время для извлечения превью (секунды)
+                'output_mode': 'faststart',  # faststart | fragmented (fMP4, скачивание во время кодирования)
+                'normalize_audio': False,    # true | {i, tp, lra} - двухпроходный loudnorm (измерения кешируются)
+                'executor': 'single',        # single | parallel (сегменты по ключевым кадрам в K процессах)
+                'parallel_segments': None,   # K для executor=parallel (None - по числу CPU, до PARALLEL_ENCODE_MAX_SEGMENTS)
+                'variants': None,            # [text_items, ...] - несколько выходов с общим декодированием и crop/scale
+                'target_quality': False,     # true | {metric, target} - CRF по пробным кодированиям (ssim/psnr)
+                'max_output_mb': None        # Жёсткий предел размера: двухпроходное кодирование с битрейтом из бюджета
+            }
+        )
+
+    def validate(self, params: dict) -> tuple[bool, str]:
+        """Валидация параметров make_short"""
+        ok, msg = super().validate(params)
+        if not ok:
+            return ok, msg
+        renderer = params.get('subtitle_renderer', 'drawtext')
+        if renderer not in SUBTITLE_RENDERERS:
+            return False, f"Invalid subtitle_renderer: {renderer}. Available: {list(SUBTITLE_RENDERERS)}"
+        ok, msg = validate_normalize_audio(params)
+        if not ok:
+            return ok, msg
+        ok, msg = validate_executor(params)
+        if not ok:
+            return ok, msg
+        ok, msg = self._validate_variants(params)
+        if not ok:
+            return ok, msg
+        ok, msg = validate_target_quality(params)
+        if not ok:
+            return ok, msg
+        ok, msg = validate_max_output_mb(params)
+        if not ok:
+            return ok, msg
+        if params.get('max_output_mb') is not None:
+            # Битрейт задаётся бюджетом размера - CRF, варианты и сегменты с ним не сочетаются
+            if params.get('target_quality'):
+                return False, "Use either target_quality or max_output_mb, not both"
+            if params.get('variants') is not None or params.get('executor', 'single') == 'parallel':
+                return False, "max_output_mb cannot be combined with variants or executor=parallel"
+        return validate_output_mode(params)
+
+    @staticmethod
+    def _validate_variants(params: dict) -> tuple[bool, str]:
+        variants = params.get('variants')
+        if variants is None:
+            return True, ""
+        if not isinstance(variants, list) or len(variants) < 2:
+            return False, "variants must be a list of at least 2 text_items lists"
+        if len(variants) > MAKE_SHORT_MAX_VARIANTS:
+            return False, f"Too many variants: {len(variants)} (max {MAKE_SHORT_MAX_VARIANTS})"
+        if any(not isinstance(items, list) for items in variants):
+            return False, "Each variant must be a list of text_items"
+        if params.get('text_items'):
+            return False, "Use either text_items or variants, not both"
+        if params.get('executor', 'single') == 'parallel':
+            return False, "variants cannot be combined with executor=parallel"
+        return True, ""
+
+    def is_terminal(self, params: dict) -> bool:
+        # Варианты - несколько видеофайлов, а не один вход для следующей операции
+        return params.get('variants') is not None
+
+    def accepts_stream_input(self, params: dict) -> bool:
+        # Перемотка (start/end_time), замер громкости, пробы target_quality и разбиение на сегменты читают вход повторно
+        return (
+            params.get('start_time') is None
+            and params.get('end_time') is None
+            and not resolve_loudnorm_target(params.get('normalize_audio'))
+            and not params.get('target_quality')
+            and params.get('max_output_mb') is None
+            and params.get('executor', 'single') != 'parallel'
+        )
+
+    def _get_available_fonts_list(self) -> list:
+        """Получает список всех доступных шрифтов из /app/fonts/ (из реестра, построенного при старте)
+        
+        .ttc (TrueType Collection) файлы раскладываются реестром на отдельные
+        начертания, поэтому каждое начертание доступно FFmpeg как обычный файл.
+        """
+        fonts = []
+        for font in FONT_REGISTRY.listing():
+            for face in font['faces']:
+                fonts.append({"name": f"{face['family']} {face['style']}", "file": face['file']})
+        return fonts
+
+    def _resolve_font_path(self, fontfile) -> str:
+        """
+        Резолвение шрифта через FONT_REGISTRY (O(1), без обращений к диску):
+        1. Полный путь - используется как есть (если существует)
+        2. Имя файла / имя без расширения / семейство / "семейство стиль" /
+           "семейство:стиль" / PostScript имя (регистр не важен)
+        3. Если не найдено - fallback (DejaVu Sans)
+        
+        Args:
+            fontfile: Имя файла шрифта (например: "PTSans.ttc"), семейство ("PT Sans")
+                      или семейство со стилем ("PT Sans:Bold")
+        
+        Returns:
+            Полный путь к файлу шрифта
+        """
+        return FONT_REGISTRY.resolve(fontfile)
+
+    def _expand_text_items(self, text_items: list) -> list:
+        """
+        Раскрывает вложенные субтитры в плоский массив text_items.
+        
+        Если text_item содержит пустое поле 'text' и вложенный объект 'subtitles' с массивом 'items',
+        каждый элемент из subtitles.items расширяется в отдельный text_item с наследованием
+        всех параметров стиля от родительского item'а.
+        
+        Пример входящих данных:
+        [
+            { text: "Title", fontsize: 80, fontcolor: "#FFF", ... },
+            { 
+                text: "",  # пустой - используем subtitles
+                fontsize: 60, 
+                fontcolor: "#FF0",
+                subtitles: {
+                    items: [
+                        { text: "Sub 1", start: 0, end: 3 },
+                        { text: "Sub 2", start: 3, end: 6 }
+                    ]
+                }
+            }
+        ]
+        
+        На выходе: 3 элемента (title + 2 развёрнутых субтитра)
+        """
+        logger.debug(f"🔍 Expanding {len(text_items)} text items...")
+        expanded = []
+        
+        for item_idx, item in enumerate(text_items):
+            if not isinstance(item, dict):
+                logger.debug(f"  ⚠️  Item {item_idx}: Not a dict, skipping")
+                expanded.append(item)
+                continue
+            
+            # Обычный text_item с текстом
+            if item.get('text'):
+                logger.debug(f"  ✓ Item {item_idx}: Regular item with text='{item.get('text', '')[:30]}'")
+                expanded.append(item)
+                continue
+            
+            # Проверяем вложенные субтитры
+            subtitles_obj = item.get('subtitles', {})
+            if isinstance(subtitles_obj, dict) and 'items' in subtitles_obj:
+                subtitle_items = subtitles_obj['items']
+                if not isinstance(subtitle_items, list):
+                    logger.warning(f"  ⚠️  Item {item_idx}: subtitles.items is not a list")
+                    expanded.append(item)  # Некорректный формат
+                    continue
+                
+                logger.debug(f"  📂 Item {item_idx}: Container with {len(subtitle_items)} subtitles (expanding...)")
+                
+                # Развёртываем каждый субтитр в отдельный text_item
+                for sub_idx, sub in enumerate(subtitle_items):
+                    if not isinstance(sub, dict):
+                        logger.warning(f"    ⚠️  Subtitle {sub_idx}: Not a dict")
+                        continue
+                    
+                    sub_text = sub.get('text', '')
+                    if not sub_text:
+                        logger.debug(f"    ⚠️  Subtitle {sub_idx}: Empty text, skipping")
+                        continue
+                    
+                    logger.debug(f"    📝 Expanding subtitle {sub_idx}: text='{sub_text[:30]}' borderw={item.get('borderw', 0)} bordercolor={item.get('bordercolor', 'N/A')}")
+                    
+                    # Новый item с наследованными параметрами
+                    expanded_item = {
+                        'text': sub_text,
+                        'start': sub.get('start', item.get('start', 0)),
+                        'end': sub.get('end', item.get('end', 5)),
+                        
+                        # Наследуем стили от родителя
+                        'fontfile': sub.get('fontfile', item.get('fontfile')),
+                        'fontsize': sub.get('fontsize', item.get('fontsize', 60)),
+                        'fontcolor': sub.get('fontcolor', item.get('fontcolor', 'white')),
+                        'x': sub.get('x', item.get('x', '(w-text_w)/2')),
+                        'y': sub.get('y', item.get('y', 'h-200')),
+                        
+                        # Box параметры
+                        'box': sub.get('box', item.get('box', 0)),
+                        'boxcolor': sub.get('boxcolor', item.get('boxcolor', 'black@0.5')),
+                        'boxborderw': sub.get('boxborderw', item.get('boxborderw', 10)),
+                        
+                        # Дополнительные параметры
+                        'max_lines': sub.get('max_lines', item.get('max_lines', 3)),
+                        'text_align': sub.get('text_align', item.get('text_align', 'center')),
+                    }
+                    
+                    expanded.append(expanded_item)
+            else:
+                # Нет вложенных субтитров - добавляем как есть
+                expanded.append(item)
+        
+        return expanded
+
+    def _wrap_text(self, text: str, fontsize, max_lines: int) -> str:
+        """Автоматический перенос строк по ширине кадра (общий для drawtext и ASS)"""
+        max_chars_per_line = int(950 / (fontsize * 0.55))
+        if len(text) <= max_chars_per_line:
+            return text
+        
+        words = text.split(' ')
+        lines = []
+        current_line = []
+        current_length = 0
+        
+        for word in words:
+            word_len = len(word) + 1
+            if current_length + word_len > max_chars_per_line and current_line:
+                lines.append(' '.join(current_line))
+                current_line = [word]
+                current_length = word_len
+            else:
+                current_line.append(word)
+                current_length += word_len
+        
+        if current_line:
+            lines.append(' '.join(current_line))
+        
+        return '\n'.join(lines[:max_lines])
+
+    def _resolve_font_face(self, fontfile) -> tuple[str, str]:
+        """
+        (семейство, начертание) шрифта для libass: ASS ссылается на шрифты по family,
+        а не по файлу, начертание задаётся флагами Bold/Italic стиля (см. style_flags)
+        """
+        font_path = self._resolve_font_path(fontfile)
+        face = FONT_REGISTRY.face_for_path(font_path)
+        if face:
+            return face
+        if font_path == FALLBACK_FONT:
+            return 'DejaVu Sans', 'Book'
+        return os.path.basename(font_path).rsplit('.', 1)[0], 'Regular'
+
+    def _build_ass_subtitles(self, text_items: list, output_path: str) -> str | None:
+        """
+        Компилирует text_items в .ass файл рядом с output_path и возвращает фильтр ass=...
+        
+        Returns:
+            Строка фильтра или None если элементы нельзя представить в ASS (fallback на drawtext)
+        """
+        prepared = []
+        for item in text_items:
+            if not isinstance(item, dict) or not item.get('text'):
+                continue
+            prepared_item = dict(item)
+            prepared_item['text'] = self._wrap_text(
+                item['text'],
+                item.get('fontsize', 60),
+                item.get('max_lines', 3)
+            )
+            prepared.append(prepared_item)
+        
+        try:
+            script = compile_ass(prepared, resolve_font=self._resolve_font_face)
+        except AssCompileError as e:
+            logger.warning(f"⚠️  ASS renderer unavailable for these text_items ({e}), falling back to drawtext")
+            return None
         
-        fontfile = fontfile.strip()
+        ass_path = os.path.splitext(output_path)[0] + '.ass'
+        with open(ass_path, 'w', encoding='utf-8') as f:
+            f.write(script)
+        logger.debug(f"📝 ASS subtitles compiled: {len(prepared)} events -> {ass_path}")
+        return build_ass_filter(ass_path, fontsdir=APP_FONTS_DIR)
+
+    def _process_text_item(self, text_item: dict) -> str:
+        """Обрабатывает один текстовый элемент и возвращает drawtext строку для FFmpeg"""
+        try:
+            # Логируем конфигурацию параметров (БЕЗ полного текста)
+            config_str = f"fontsize={text_item.get('fontsize', 60)}, fontcolor={text_item.get('fontcolor', 'white')}, " \
+                        f"borderw={text_item.get('borderw', 0)}, box={text_item.get('box', 0)}, " \
+                        f"start={text_item.get('start', 0)}s, end={text_item.get('end', 5)}s"
+            logger.debug(f"🔨 Processing text_item: {config_str}")
+            
+            # Проверяем, что это словарь
+            if not isinstance(text_item, dict):
+                logger.warning(f"text_item is not a dict: {type(text_item)}")
+                return None
+            
+            text = text_item.get('text', '')
+            if not text:
+                return None
+            
+            # Получаем параметры с дефолтными значениями
+            fontfile = text_item.get('fontfile')
+            fontsize = text_item.get('fontsize', 60)
+            fontcolor = text_item.get('fontcolor', 'white')
+            y = text_item.get('y', 'h-200')
+            x = text_item.get('x', '(w-text_w)/2')
+            start = text_item.get('start', 0)
+            end = text_item.get('end', 5)
+            max_lines = text_item.get('max_lines', 3)
+            text_align = text_item.get('text_align', 'center')
+            
+            # Параметры обводки текста (STROKE/OUTLINE)
+            borderw = text_item.get('borderw', 0)
+            bordercolor = text_item.get('bordercolor', 'black')
+            logger.debug(f"📋 Text item: text='{text[:50]}...' borderw={borderw} bordercolor={bordercolor}")
+            
+            # Параметры плашки (опционально)
+            box = text_item.get('box', 0)
+            boxcolor = text_item.get('boxcolor', 'black@0.5')
+            boxborderw = text_item.get('boxborderw', 10)
+            
+            # Автоматический перенос строк
+            text = self._wrap_text(text, fontsize, max_lines)
+            
+            # Экранируем спецсимволы для FFmpeg
+            text_escaped = text.replace('\\', '\\\\').replace(':', '\\:').replace("'", "\\'").replace(',', '\\,')
+            
+            # Строим параметры drawtext фильтра
+            drawtext_params = [
+                f"text='{text_escaped}'",
+                "expansion=normal",
+                f"fontsize={fontsize}",
+                f"fontcolor={fontcolor}",
+                f"text_align={text_align}",
+                f"x={x}",
+                f"y={y}",
+                f"enable='between(t\\,{start}\\,{end})'"
+            ]
+            
+            # Добавляем шрифт если указан
+            if fontfile:
+                font_path = self._resolve_font_path(fontfile)
+                fontfile_escaped = font_path.replace(':', '\\:').replace("'", "\\'")
+                drawtext_params.append(f"fontfile='{fontfile_escaped}'")
+            
+            # Добавляем обводку текста (borderw и bordercolor) если указана
+            if borderw > 0:
+                drawtext_params.append(f"borderw={borderw}")
+                drawtext_params.append(f"bordercolor={bordercolor}")
+                logger.debug(f"✨ Added text stroke: borderw={borderw}, bordercolor={bordercolor}")
+            
+            # Добавляем плашку если включена
+            if box:
+                drawtext_params.append(f"box=1")
+                drawtext_params.append(f"boxcolor={boxcolor}")
+                drawtext_params.append(f"boxborderw={boxborderw}")
+            
+            # Собираем финальную строку drawtext
+            drawtext_filter = 'drawtext=' + ':'.join(drawtext_params)
+            logger.debug(f"🎨 drawtext filter: {drawtext_filter}")
+            return drawtext_filter
+            
+        except Exception as e:
+            logger.warning(f"Error processing text_item: {e}")
+            return None
+
+    def _build_text_filters(self, text_items: list, subtitle_renderer: str, output_path: str) -> tuple[str, str | None]:
+        """
+        Фильтры текста для добавления к цепочке видео.
+
+        Returns:
+            (",фильтр,..." или "", путь к .ass файлу, который нужно удалить после кодирования, или None)
+        """
+        ass_filter = None
+        if text_items and subtitle_renderer == 'ass':
+            ass_filter = self._build_ass_subtitles(text_items, output_path)
+
+        if ass_filter:
+            logger.debug(f"📊 Rendering {len(text_items)} text items with ASS: {ass_filter}")
+            return f",{ass_filter}", os.path.splitext(output_path)[0] + '.ass'
+
+        text_filters = ""
+        if text_items:
+            logger.debug(f"📊 Processing {len(text_items)} text items...")
+            for idx, text_item in enumerate(text_items):
+                drawtext_filter = self._process_text_item(text_item)
+                if drawtext_filter:
+                    # Логируем конфиг до добавления фильтра
+                    item_config = f"fontsize={text_item.get('fontsize', 60)}, fontcolor={text_item.get('fontcolor', 'white')}, " \
+                                 f"borderw={text_item.get('borderw', 0)}, box={text_item.get('box', 0)}, " \
+                                 f"start={text_item.get('start_time', 0)}s, end={text_item.get('end_time', 0)}s"
+                    logger.debug(f"  [{idx}] 🎨 Drawtext filter: {drawtext_filter}")
+                    logger.debug(f"       📋 Config: {item_config}")
+                    text_filters += f",{drawtext_filter}"
+                else:
+                    logger.warning(f"  ❌ Failed to process text_item[{idx}]")
+        else:
+            logger.debug("⚠️  No text items to process")
+        return text_filters, None
+
+    def _encode_single(self, input_path: str, output_path: str, base_video_filter: str, is_complex_filter: bool,
+                       text_items: list, subtitle_renderer: str, audio_filter: str | None,
+                       seek: dict, output_mode: str, video_args: list = SHORTS_VIDEO_CODEC_ARGS):
+        """Кодирование одним процессом ffmpeg (executor=single); seek - план plan_seek"""
+        text_filters, ass_path = self._build_text_filters(text_items, subtitle_renderer, output_path)
+        video_filter = base_video_filter + text_filters
+
+        # Выполняем FFmpeg команду
+        # Нарезка: -ss до -i на ключевой кадр, точная перемотка и длительность после
+        before_input, after_input = seek_trim_args(seek)
+        cmd = ['ffmpeg', *before_input, '-i', input_path, *after_input]
+
+        if audio_filter:
+            cmd.extend(['-af', audio_filter])
+
+        cmd.extend([
+            '-filter_complex' if is_complex_filter else '-vf', video_filter,
+            *video_args,
+            *SHORTS_AUDIO_CODEC_ARGS,
+            *mp4_movflags_args(output_mode),
+            '-y',
+            output_path
+        ])
+
+        # DEBUG: Log full FFmpeg command with all filters
+        logger.debug(f"📹 FFmpeg command: {' '.join(cmd[:5])}... (output={output_path})")
+        logger.debug(f"🎨 Video filter chain: {video_filter}")
+        if text_items:
+            logger.debug(f"📝 Text items processed: {len(text_items)} items with various configs")
+
+        logger.info(f"🚀 Executing FFmpeg for: {output_path}")
+        try:
+            with growing_output(output_path, enabled=output_mode == 'fragmented') as growing:
+                result = run_ffmpeg_for_task(cmd, duration=seek['duration'])
+                growing['returncode'] = result.returncode
+                return result
+        finally:
+            # .ass файл нужен только на время кодирования
+            if ass_path and os.path.exists(ass_path):
+                os.remove(ass_path)
+
+    def _encode_variants(self, input_path: str, variant_paths: list, base_video_filter: str, is_complex_filter: bool,
+                         variant_items: list, subtitle_renderer: str, audio_filter: str | None,
+                         seek: dict, output_mode: str, video_args: list = SHORTS_VIDEO_CODEC_ARGS):
+        """
+        Все варианты одним процессом ffmpeg: декодирование и crop/scale/blur выполняются
+        один раз, кадры делятся split=N, и на каждую ветку накладывается свой текст.
+        Каждый вариант - отдельный выход со своим кодировщиком.
+        """
+        count = len(variant_paths)
+        source = f"{base_video_filter}[base];[base]" if is_complex_filter else f"[0:v]{base_video_filter},"
+        chains = [source + 'split=' + str(count) + ''.join(f"[s{index}]" for index in range(count))]
+        ass_paths = []
+        for index, (items, path) in enumerate(zip(variant_items, variant_paths)):
+            text_filters, ass_path = self._build_text_filters(items, subtitle_renderer, path)
+            if ass_path:
+                ass_paths.append(ass_path)
+            # text_filters начинается с запятой; без текста ветка проходит через null
+            chains.append(f"[s{index}]null{text_filters}[v{index}]")
+
+        before_input, after_input = seek_trim_args(seek)
+        cmd = ['ffmpeg', *before_input, '-i', input_path, '-filter_complex', ';'.join(chains)]
+        # Опции выхода (-ss/-t, -af, кодеки) действуют на один выход - повторяются для каждого
+        for index, path in enumerate(variant_paths):
+            cmd.extend([
+                *after_input,
+                '-map', f"[v{index}]", '-map', '0:a:0?',
+                *(['-af', audio_filter] if audio_filter else []),
+                *video_args,
+                *SHORTS_AUDIO_CODEC_ARGS,
+                *mp4_movflags_args(output_mode),
+                '-y', path
+            ])
+
+        logger.debug(f"🎨 Variants filter graph: {';'.join(chains)}")
+        logger.info(f"🚀 Executing FFmpeg for {count} variants: {', '.join(os.path.basename(p) for p in variant_paths)}")
+        try:
+            return run_ffmpeg_for_task(cmd, duration=seek['duration'])
+        finally:
+            for ass_path in ass_paths:
+                if os.path.exists(ass_path):
+                    os.remove(ass_path)
+
+    def _encode_to_size(self, input_path: str, output_path: str, base_video_filter: str, is_complex_filter: bool,
+                        text_items: list, subtitle_renderer: str, audio_filter: str | None,
+                        seek: dict, output_mode: str, max_output_mb: float) -> tuple[bool, str]:
+        """Кодирование в предел max_output_mb (два прохода, см. encode_to_size); отчёт - в operation_details"""
+        duration = seek['duration']
+        if not duration:
+            return False, "max_output_mb needs a known output duration"
+        has_audio = 'audio' in probe_stream_types(input_path)
+        text_filters, ass_path = self._build_text_filters(text_items, subtitle_renderer, output_path)
+        before_input, after_input = seek_trim_args(seek)
+        audio_args = ['-an']
+        if has_audio:
+            audio_args = [*(['-af', audio_filter] if audio_filter else []), *SHORTS_AUDIO_CODEC_ARGS]
+        try:
+            ok, message, report = encode_to_size(
+                [*before_input, '-i', input_path, *after_input],
+                ['-filter_complex' if is_complex_filter else '-vf', base_video_filter + text_filters],
+                audio_args, output_path, max_output_mb, duration,
+                SIZE_TARGET_AUDIO_BITRATE if has_audio else 0, output_mode
+            )
+        finally:
+            if ass_path and os.path.exists(ass_path):
+                os.remove(ass_path)
+        if report:
+            record_operation_details(max_output=report)
+        return ok, message
+
+    def _encode_parallel(self, input_path: str, output_path: str, params: dict, base_video_filter: str,
+                         is_complex_filter: bool, text_items: list, subtitle_renderer: str, audio_filter: str | None,
+                         video_args: list = SHORTS_VIDEO_CODEC_ARGS):
+        """
+        Кодирование сегментами в K процессах (executor=parallel).
+
+        Диапазон режется по ключевым кадрам источника, видео сегментов кодируется
+        одновременно с одинаковыми настройками, аудио - одним процессом параллельно
+        с ними; затем сегменты склеиваются concat demuxer'ом без перекодирования.
+
+        Returns:
+            FFmpegResult склейки (или упавшего шага), либо None - диапазон короткий
+            или не делится, тогда кодируем одним процессом
+        """
+        start_time = params.get('start_time')
+        end_time = params.get('end_time')
+        range_start = parse_time_value(start_time) if start_time is not None else 0.0
+        range_end = parse_time_value(end_time) if end_time is not None else probe_media_duration(input_path)
+        if range_start is None or range_end is None or range_end <= range_start:
+            logger.info("⏭️  Parallel encode: cannot resolve the time range, using a single process")
+            return None
+
+        max_segments = params.get('parallel_segments') or min(PARALLEL_ENCODE_MAX_SEGMENTS, os.cpu_count() or 1)
+        segments = plan_segments(
+            range_start, range_end, probe_keyframes(input_path),
+            max_segments, PARALLEL_ENCODE_MIN_SEGMENT_SECONDS
+        )
+        if len(segments) < 2:
+            logger.info(f"⏭️  Parallel encode: {range_end - range_start:.1f}s range is not split, using a single process")
+            return None
+        try:
+            segment_items = [
+                shift_text_items(text_items, seg_start - range_start, seg_end - seg_start)
+                for seg_start, seg_end in segments
+            ]
+        except (TypeError, ValueError) as e:
+            logger.info(f"⏭️  Parallel encode: text_items timing cannot be split ({e}), using a single process")
+            return None
+
+        base = os.path.splitext(output_path)[0]
+        threads = segment_threads(len(segments))
+        segment_paths = []
+        cleanup_paths = []
+        jobs = []
+        for index, ((seg_start, seg_end), items) in enumerate(zip(segments, segment_items)):
+            segment_path = f"{base}_seg{index:03d}.mp4"
+            text_filters, ass_path = self._build_text_filters(items, subtitle_renderer, segment_path)
+            if ass_path:
+                cleanup_paths.append(ass_path)
+            segment_paths.append(segment_path)
+            # Кадр ровно на точке разреза относится к следующему сегменту
+            seg_length = seg_end - seg_start
+            if index < len(segments) - 1:
+                seg_length -= SEGMENT_END_EPSILON
+            jobs.append(([
+                'ffmpeg', '-ss', str(seg_start), '-i', input_path, '-t', f"{seg_length:.6f}",
+                '-filter_complex' if is_complex_filter else '-vf', base_video_filter + text_filters,
+                '-an', '-sn', '-dn',
+                *video_args,
+                '-threads', str(threads),
+                '-y', segment_path
+            ], seg_end - seg_start))
+        cleanup_paths.extend(segment_paths)
+
+        # Аудио целиком одним процессом: без AAC priming-пауз на стыках сегментов
+        audio_path = None
+        if 'audio' in probe_stream_types(input_path):
+            audio_path = f"{base}_audio.m4a"
+            cleanup_paths.append(audio_path)
+            before_input, after_input = build_trim_args(start_time, end_time)
+            jobs.append(([
+                'ffmpeg', *before_input, '-i', input_path, *after_input,
+                '-vn', '-sn', '-dn',
+                *(['-af', audio_filter] if audio_filter else []),
+                *SHORTS_AUDIO_CODEC_ARGS,
+                '-y', audio_path
+            ], 0.0))
+
+        concat_list_path = f"{base}_concat.txt"
+        cleanup_paths.append(concat_list_path)
+        output_mode = params.get('output_mode', 'faststart')
+        try:
+            logger.info(
+                f"🚀 Parallel encode: {len(segments)} segment(s) x {threads} thread(s) "
+                f"for {range_end - range_start:.1f}s -> {output_path}"
+            )
+            results = run_ffmpeg_parallel(jobs)
+            failed = next((r for r in results if r.returncode != 0), None)
+            if failed is not None:
+                return failed
+
+            with open(concat_list_path, 'w', encoding='utf-8') as f:
+                f.write(build_concat_list(segment_paths))
+            cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', concat_list_path]
+            if audio_path:
+                cmd.extend(['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0'])
+            cmd.extend(['-c', 'copy', *mp4_movflags_args(output_mode), '-y', output_path])
+            logger.debug(f"📹 Concat command: {' '.join(cmd)}")
+            with growing_output(output_path, enabled=output_mode == 'fragmented') as growing:
+                result = run_ffmpeg_for_task(cmd, track_progress=False)
+                growing['returncode'] = result.returncode
+                return result
+        finally:
+            for path in cleanup_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str]:
+        """Конвертация в Shorts формат (1080x1920)"""
+        # Валидация входного файла
+        logger.debug(f"📥 Starting execute: input_path={input_path}, output_path={output_path}")
+        logger.debug(f"📋 Params: {params}")
         
-        # Если это полный путь - проверяем и возвращаем как есть
-        if fontfile.startswith('/'):
-            if os.path.exists(fontfile):
-                return fontfile
-            else:
-                logger.warning(f"Font path not found: {fontfile}, using fallback")
-                return FALLBACK_FONT
+        valid, msg = self.validate_input_file(input_path)
+        if not valid:
+            return False, msg
         
-        app_fonts_dir = "/app/fonts"
+        # Применяем значения по умолчанию
+        crop_mode = params.get('crop_mode', 'center')
+        start_time = params.get('start_time')
+        end_time = params.get('end_time')
+        output_mode = params.get('output_mode', 'faststart')
+        logger.debug(f"🎬 Crop mode: {crop_mode}, start_time: {start_time}, end_time: {end_time}, output_mode: {output_mode}")
+
+        # additional_inputs может содержать аудио дорожки, изображения и т.д.
+        # Пока не используется в базовой реализации, но доступно для расширения
+        additional_inputs = additional_inputs or {}
+
+        # Конфигурация letterbox режима
+        letterbox_config_raw = params.get('letterbox_config', {})
+        letterbox_config = {
+            'blur_radius': letterbox_config_raw.get('blur_radius', 20),
+            'bg_scale': letterbox_config_raw.get('bg_scale', '1080:1920'),
+            'fg_scale': letterbox_config_raw.get('fg_scale', '-1:1080'),
+            'overlay_x': letterbox_config_raw.get('overlay_x', '(W-w)/2'),
+            'overlay_y': letterbox_config_raw.get('overlay_y', '(H-h)/2')
+        }
+        logger.debug(f"📦 Letterbox config: {letterbox_config}")
+
+        # Определяем фильтр обрезки (resolution-aware оптимизатор, см. filtergraph.py)
+        optimize_filtergraph = letterbox_config_raw.get('optimize', True)
+        source_size = probe_video_size(input_path) if crop_mode == 'letterbox' else None
+        video_filter, is_complex_filter = build_shorts_filter(
+            crop_mode,
+            letterbox_config,
+            source_size=source_size,
+            optimize=optimize_filtergraph
+        )
         
-        # Если это имя файла с расширением - ищем прямо в /app/fonts/
-        if fontfile.lower().endswith(('.ttf', '.ttc', '.otf')):
-            font_path = os.path.join(app_fonts_dir, fontfile)
-            if os.path.exists(font_path):
-                return font_path
-            else:
-                logger.warning(f"Font file not found in /app/fonts/: {fontfile}, using fallback")
-                return FALLBACK_FONT
+        logger.debug(f"🎨 Base video filter (crop): {video_filter} (source_size={source_size}, optimized={optimize_filtergraph})")
+
+        # === НОВАЯ СИСТЕМА: Универсальные текстовые элементы ===
+        # Обрабатываем text_items если они указаны
+        text_items = params.get('text_items', [])
+        logger.debug(f"📝 Input text_items count: {len(text_items)}")
+        for i, item in enumerate(text_items):
+            # Логируем только конфиг, не полный текст
+            item_config = f"fontsize={item.get('fontsize', 60)}, fontcolor={item.get('fontcolor', 'white')}, " \
+                         f"borderw={item.get('borderw', 0)}, box={item.get('box', 0)}"
+            logger.debug(f"  [{i}] {item_config}")
         
-        # Если передано только имя без расширения - ищем .ttf версию
-        font_path = os.path.join(app_fonts_dir, f"{fontfile}.ttf")
-        if os.path.exists(font_path):
-            return font_path
+        # Проверяем ограничение публичной версии ДО развёртывания
+        # (максимум 2 элемента на входе, независимо от вложенных субтитров)
+        if len(text_items) > 2:
+            return jsonify({
+                "status": "error",
+                "error": f"Public version supports max 2 text items per operation. You have {len(text_items)} items. Upgrade to Pro for unlimited text items."
+            }), 400
         
-        # Пытаемся найти файл с любым расширением
-        if os.path.exists(app_fonts_dir):
-            for filename in os.listdir(app_fonts_dir):
-                name_without_ext = filename.rsplit('.', 1)[0]
-                if name_without_ext.lower() == fontfile.lower():
-                    return os.path.join(app_fonts_dir, filename)
+        # Теперь развёртываем вложенные субтитры в каждом item'е
+        text_items = self._expand_text_items(text_items)
+        variants = params.get('variants')
+        variant_items = [self._expand_text_items(items) for items in variants] if variants else None
+        logger.debug(f"🔄 Text items after expansion: {len(text_items)} items")
+        for i, item in enumerate(text_items):
+            # Логируем только конфиг, не полный текст
+            item_config = f"fontsize={item.get('fontsize', 60)}, fontcolor={item.get('fontcolor', 'white')}, " \
+                         f"borderw={item.get('borderw', 0)}, box={item.get('box', 0)}"
+            logger.debug(f"  [{i}] {item_config}")
         
-        # Не найдено - используем fallback
-        logger.warning(f"Font '{fontfile}' not found in /app/fonts/, using DejaVu Sans fallback")
-        return FALLBACK_FONT
+        # Рендерер текста: drawtext (по фильтру на элемент) или ass (один фильтр libass)
+        subtitle_renderer = params.get('subtitle_renderer', 'drawtext')
+
+        # Нормализация громкости: измерения берутся из кеша или одним аудио-проходом
+        audio_filter = None
+        loudnorm_target = resolve_loudnorm_target(params.get('normalize_audio'))
+        if loudnorm_target:
+            audio_filter = loudnorm_filter_for(input_path, loudnorm_target, start_time, end_time)
+
+        # target_quality: CRF по пробным кодированиям отрезка (измерения кешируются)
+        video_args = SHORTS_VIDEO_CODEC_ARGS
+        quality_target = resolve_quality_target(params.get('target_quality'))
+        if quality_target:
+            selection = select_target_crf(
+                input_path, video_filter, is_complex_filter, start_time, end_time,
+                quality_target, os.path.dirname(output_path)
+            )
+            if selection:
+                video_args = shorts_video_codec_args(selection['crf'])
+                record_operation_details(target_quality=selection)
+
+        # Перемотка к start_time (plan_seek): одна -ss до -i; при двухэтапной - тайминги
+        # текста сдвигаются на остаток, выражения от t возвращают к одной перемотке
+        executor = params.get('executor', 'single')
+        seek = plan_seek(input_path, start_time, end_time)
+        try:
+            seek_items = seek_text_items(text_items, seek)
+            seek_variant_items = [seek_text_items(items, seek) for items in variant_items] if variant_items else None
+        except (TypeError, ValueError) as e:
+            logger.info(f"⏭️  Two-stage seek: text_items timing cannot be shifted ({e}), seeking the input only")
+            seek = plan_seek(input_path, start_time, end_time, use_keyframes=False)
+            seek_items, seek_variant_items = text_items, variant_items
+
+        # Варианты text_items: один процесс, выходы <base>_v1.mp4, <base>_v2.mp4, ...
+        video_paths = [output_path]
+        if variant_items:
+            base, ext = os.path.splitext(output_path)
+            video_paths = [f"{base}_v{index}{ext}" for index in range(1, len(variant_items) + 1)]
+
+        # Параллельное кодирование сегментов (executor=parallel); None - диапазон не делится
+        result = None
+        max_output_mb = params.get('max_output_mb')
+        if max_output_mb is not None:
+            ok, message = self._encode_to_size(
+                input_path, output_path, video_filter, is_complex_filter, seek_items,
+                subtitle_renderer, audio_filter, seek, output_mode, max_output_mb
+            )
+            if not ok:
+                logger.error(f"❌ {message}")
+                return False, message
+        elif variant_items:
+            result = self._encode_variants(
+                input_path, video_paths, video_filter, is_complex_filter,
+                seek_variant_items, subtitle_renderer, audio_filter, seek, output_mode,
+                video_args=video_args
+            )
+        elif executor == 'parallel':
+            result = self._encode_parallel(
+                input_path, output_path, params, video_filter, is_complex_filter,
+                text_items, subtitle_renderer, audio_filter, video_args=video_args
+            )
+        if result is None and max_output_mb is None:
+            executor = 'single'  # В том числе диапазон, который parallel не делит
+            result = self._encode_single(
+                input_path, output_path, video_filter, is_complex_filter,
+                seek_items, subtitle_renderer, audio_filter, seek, output_mode,
+                video_args=video_args
+            )
+        if executor != 'parallel' and seek['start']:
+            record_operation_details(seek={
+                'start': seek['start'],
+                'keyframe': seek['keyframe'],
+                'overhead_seconds': seek['overhead'],
+                'keyframe_index': seek['keyframe_index'],
+                'two_stage': bool(seek['output_seek'])
+            })
 
-    def _expand_text_items(self, text_items: list) -> list:
+        if result is not None:
+            logger.debug(f"📊 FFmpeg return code: {result.returncode}")
+            if result.stdout:
+                logger.debug(f"📋 FFmpeg stdout: {result.stdout[:500]}")
+            if result.stderr:
+                logger.debug(f"⚠️  FFmpeg stderr: {result.stderr[:500]}")
+
+        if result is not None and result.returncode != 0:
+            logger.error(f"❌ FFmpeg error: {result.error_summary}")
+            if variant_items:
+                for path in video_paths:
+                    remove_task_file(path)
+            return False, f"FFmpeg error: {result.error_summary}"
+
+        # Генерация превью если включено (для каждого варианта - со своим текстом)
+        output_list = []
+        thumbnails = 0
+        for video_path in video_paths:
+            output_list.append(video_path)
+            if params.get('generate_thumbnail', True):
+                thumbnail_path = self._generate_thumbnail(video_path, params.get('thumbnail_timestamp', 0.5))
+                if thumbnail_path:
+                    output_list.append(thumbnail_path)
+                    thumbnails += 1
+
+        # Возвращаем список файлов (видео + превью если создано)
+        message = "Converted to Shorts format (1080x1920)"
+        if variant_items:
+            message += f" in {len(video_paths)} variants"
+        if thumbnails:
+            message += " with thumbnail" if thumbnails == 1 else " with thumbnails"
+        return True, message, output_list
+
+    def _generate_thumbnail(self, video_path: str, thumbnail_timestamp) -> str | None:
+        """Превью из готового видео; путь к .jpg или None"""
+        # Если видео было обрезано (есть start_time), то timestamp для превью
+        # считается ОТНОСИТЕЛЬНО ОБРЕЗАННОГО видео - готовый файл уже начинается с start_time
+        thumbnail_path = video_path.replace('.mp4', '_thumbnail.jpg')
+
+        thumbnail_cmd = [
+            'ffmpeg',
+            '-ss', str(thumbnail_timestamp),
+            '-i', video_path,
+            '-vframes', '1',
+            '-q:v', '2',  # Высокое качество JPEG (2-5 диапазон)
+            '-y',
+            thumbnail_path
+        ]
+
+        thumbnail_result = run_ffmpeg_for_task(thumbnail_cmd, track_progress=False)
+        if thumbnail_result.returncode == 0 and os.path.exists(thumbnail_path):
+            return thumbnail_path  # Логирование будет в конце pipeline
+        logger.warning(f"Failed to generate thumbnail: {thumbnail_result.error_summary}")
+        return None
+
+
+class ExtractAudioOperation(VideoOperation):
+    """Операция извлечения аудио с поддержкой chunking для Whisper API"""
+    def __init__(self):
+        super().__init__(
+            name="extract_audio",
+            required_params=[],
+            optional_params={
+                'format': 'mp3',
+                'bitrate': '192k',
+                'chunk_duration_minutes': None,  # Длительность чанка в минутах (опционально)
+                'max_chunk_size_mb': 24,         # Максимальный размер чанка в МБ (для Whisper API)
+                'optimize_for_whisper': False,   # Оптимизация для Whisper (16kHz, mono, 64k bitrate)
+                'normalize_audio': False,        # true | {i, tp, lra} - двухпроходный loudnorm (измерения кешируются)
+                'peaks': False,                  # true | {pixels_per_second, format} - пики waveform для редакторов
+                'max_output_mb': None            # Предел размера: битрейт из бюджета, при перелёте - ступенью ниже
+            }
+        )
+
+    def validate(self, params: dict) -> tuple[bool, str]:
+        ok, msg = super().validate(params)
+        if not ok:
+            return ok, msg
+        ok, msg = validate_normalize_audio(params)
+        if not ok:
+            return ok, msg
+        ok, msg = validate_max_output_mb(params)
+        if not ok:
+            return ok, msg
+        return self._validate_peaks(params.get('peaks', False))
+
+    def accepts_stream_input(self, params: dict) -> bool:
+        # Чанки режутся из готового аудиофайла; повторно вход читают замер громкости
+        # и повторное извлечение при перелёте max_output_mb
+        return not resolve_loudnorm_target(params.get('normalize_audio')) and params.get('max_output_mb') is None
+
+    @staticmethod
+    def _validate_peaks(value) -> tuple[bool, str]:
+        if isinstance(value, bool):
+            return True, ""
+        if not isinstance(value, dict):
+            return False, "peaks must be a boolean or an object {pixels_per_second, format}"
+        unknown = set(value) - {'pixels_per_second', 'format'}
+        if unknown:
+            return False, f"Unknown peaks fields: {sorted(unknown)}. Available: ['pixels_per_second', 'format']"
+        fmt = value.get('format', 'json')
+        if fmt not in PEAKS_FORMATS:
+            return False, f"Invalid peaks.format: {fmt}. Available: {list(PEAKS_FORMATS)}"
+        resolutions = value.get('pixels_per_second', list(DEFAULT_PIXELS_PER_SECOND))
+        if not isinstance(resolutions, list) or not resolutions:
+            return False, "peaks.pixels_per_second must be a non-empty list of numbers"
+        for pps in resolutions:
+            if isinstance(pps, bool) or not isinstance(pps, (int, float)) or not (0 < pps <= MAX_PIXELS_PER_SECOND):
+                return False, f"peaks.pixels_per_second values must be between 0 and {MAX_PIXELS_PER_SECOND}"
+        return True, ""
+
+    @staticmethod
+    def _peaks_options(value) -> dict | None:
+        """peaks: true | {pixels_per_second, format} -> настройки или None (выключено)"""
+        if not value:
+            return None
+        options = value if isinstance(value, dict) else {}
+        return {
+            'pixels_per_second': options.get('pixels_per_second', list(DEFAULT_PIXELS_PER_SECOND)),
+            'format': options.get('format', 'json')
+        }
+
+    @staticmethod
+    def _fit_to_size(extract_cmd: list, output_audio: str, max_output_mb: float) -> tuple[bool, str]:
         """
-        Раскрывает вложенные субтитры в плоский массив text_items.
+        Файл больше max_output_mb извлекается заново на ступень битрейта ниже, пока не уложится.
+        extract_cmd изменяется на месте (итоговый -b:a - для чанков); отчёт - в operation_details.
+        """
+        max_bytes = max_output_mb * 1024 * 1024
+        bitrate_index = extract_cmd.index('-b:a') + 1
+        passes = 1
+        size = os.path.getsize(output_audio)
+        while size > max_bytes:
+            lower = lower_audio_bitrate(parse_bitrate(extract_cmd[bitrate_index]))
+            if lower is None:
+                remove_task_file(output_audio)
+                return False, f"Audio does not fit max_output_mb={max_output_mb:g} ({size / (1024 * 1024):.2f} MB at the lowest bitrate)"
+            logger.info(f"📏 Audio {size / (1024 * 1024):.2f} MB exceeds max_output_mb={max_output_mb:g}, re-extracting at {lower // 1000}k")
+            extract_cmd[bitrate_index] = f"{lower // 1000}k"
+            result = run_ffmpeg_for_task(extract_cmd, track_progress=False)
+            if result.returncode != 0:
+                return False, f"FFmpeg error: {result.error_summary}"
+            passes += 1
+            size = os.path.getsize(output_audio)
+        record_operation_details(max_output={
+            'max_mb': max_output_mb,
+            'size_mb': round(size / (1024 * 1024), 2),
+            'audio_kbps': parse_bitrate(extract_cmd[bitrate_index]) // 1000,
+            'passes': passes,
+            'met': True
+        })
+        return True, ""
+
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str, str]:
+        """Извлечение аудио из видео с опциональным chunking для Whisper API"""
+        logger.debug(f"📥 Starting ExtractAudioOperation execute: input_path={input_path}, output_path={output_path}")
+        logger.debug(f"📋 Input params: {json.dumps(params, indent=2, default=str)}")
         
-        Если text_item содержит пустое поле 'text' и вложенный объект 'subtitles' с массивом 'items',
-        каждый элемент из subtitles.items расширяется в отдельный text_item с наследованием
-        всех параметров стиля от родительского item'а.
+        # Валидация входного файла
+        valid, msg = self.validate_input_file(input_path)
+        if not valid:
+            logger.error(f"❌ Input validation failed: {msg}")
+            return False, msg, input_path
         
-        Пример входящих данных:
-        [
-            { text: "Title", fontsize: 80, fontcolor: "#FFF", ... },
-            { 
-                text: "",  # пустой - используем subtitles
-                fontsize: 60, 
-                fontcolor: "#FF0",
-                subtitles: {
-                    items: [
-                        { text: "Sub 1", start: 0, end: 3 },
-                        { text: "Sub 2", start: 3, end: 6 }
-                    ]
-                }
-            }
+        audio_format = params.get('format', 'mp3')
+        bitrate = params.get('bitrate', '192k')
+        chunk_duration_minutes = params.get('chunk_duration_minutes')
+        max_chunk_size_mb = params.get('max_chunk_size_mb', 24)
+        optimize_for_whisper = params.get('optimize_for_whisper', False)
+        whisper_bitrate = '64k'
+
+        # max_output_mb: наибольший стандартный битрейт не выше запрошенного, укладывающийся в предел
+        max_output_mb = params.get('max_output_mb')
+        if max_output_mb is not None:
+            source_duration = probe_media_duration(input_path)
+            if not source_duration:
+                return False, "max_output_mb needs a known input duration", input_path
+            requested = parse_bitrate(whisper_bitrate if optimize_for_whisper else bitrate) or 192_000
+            size_bitrate = audio_bitrate_for_size(int(max_output_mb * 1024 * 1024), source_duration, requested)
+            if size_bitrate is None:
+                return False, f"max_output_mb={max_output_mb:g} is too small for {source_duration:.1f}s of audio", input_path
+            if size_bitrate < requested:
+                logger.info(f"📏 Audio bitrate lowered to {size_bitrate // 1000}k to fit max_output_mb={max_output_mb:g}")
+            if optimize_for_whisper:
+                whisper_bitrate = f"{size_bitrate // 1000}k"
+            else:
+                bitrate = f"{size_bitrate // 1000}k"
+
+        logger.debug(f"🔊 Audio extraction config: format={audio_format}, bitrate={bitrate}, optimize_for_whisper={optimize_for_whisper}, max_chunk_size_mb={max_chunk_size_mb}MB")
+
+        # Генерируем собственное имя для аудиофайла в той же директории
+        output_dir = os.path.dirname(output_path)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        output_audio = os.path.join(output_dir, f"audio_{timestamp}.{audio_format}")
+        logger.debug(f"📁 Output audio path: {output_audio}")
+
+        # Нормализация громкости по всему источнику (измерения кешируются)
+        audio_filter = None
+        audio_filter_args = []
+        loudnorm_target = resolve_loudnorm_target(params.get('normalize_audio'))
+        if loudnorm_target:
+            audio_filter = loudnorm_filter_for(input_path, loudnorm_target)
+            if audio_filter:
+                audio_filter_args = ['-af', audio_filter]
+
+        # Копирование аудиопотока (-c:a copy), если источник уже в запрошенном виде
+        audio_stream = None
+        if audio_filter:
+            passthrough_reason = "normalize_audio re-encodes"
+        elif max_output_mb is not None:
+            passthrough_reason = "max_output_mb re-encodes"
+        else:
+            audio_stream = probe_audio_stream(input_path)
+            passthrough_reason = passthrough_mismatch(
+                audio_stream, 'mp3' if optimize_for_whisper else audio_format,
+                parse_bitrate(whisper_bitrate if optimize_for_whisper else bitrate),
+                sample_rate=16000 if optimize_for_whisper else None,
+                channels=1 if optimize_for_whisper else None
+            )
+        copy_audio = passthrough_reason is None
+        if copy_audio:
+            logger.info(f"⚡ Audio passthrough: source {audio_stream.get('codec_name')} matches the request, copying the stream")
+        else:
+            logger.debug(f"🔊 Audio passthrough not used: {passthrough_reason}")
+
+        # Извлекаем полное аудио
+        if optimize_for_whisper:
+            # Оптимизация для Whisper API
+            cmd = [
+                'ffmpeg',
+                '-i', input_path,
+                '-vn',
+                *audio_filter_args,
+                '-acodec', 'libmp3lame',
+                '-ar', '16000',  # 16kHz sample rate (оптимально для речи)
+                '-ac', '1',      # Моно
+                '-b:a', whisper_bitrate,  # Низкий битрейт
+                '-y',
+                output_audio
+            ]
+        else:
+            # Стандартное извлечение
+            cmd = [
+                'ffmpeg',
+                '-i', input_path,
+                '-vn',
+                *audio_filter_args,
+                '-acodec', 'libmp3lame' if audio_format == 'mp3' else 'aac',
+                '-b:a', bitrate,
+                '-y',
+                output_audio
+            ]
+        
+        # Команда без выхода пиков - для повторного извлечения при перелёте max_output_mb
+        extract_cmd = list(cmd)
+        attempts = [extract_cmd]
+        if copy_audio:
+            # Копия первой аудиодорожки; перекодирование - если копирование не удалось
+            attempts.insert(0, ['ffmpeg', '-i', input_path, '-map', '0:a:0', '-vn', '-sn', '-dn',
+                                '-c:a', 'copy', '-y', output_audio])
+
+        peaks_options = self._peaks_options(params.get('peaks'))
+        for attempt_cmd in attempts:
+            cmd = list(attempt_cmd)
+            # Пики waveform: второй выход того же декодирования (PCM в FIFO), без повторного чтения
+            peaks_collector = None
+            if peaks_options:
+                finest_spp = samples_per_pixel_for(max(peaks_options['pixels_per_second']))
+                fifo_path = os.path.join(output_dir, f"temp_peaks_{timestamp}.pcm")
+                peaks_collector = PeaksCollector(fifo_path, finest_spp)
+                peaks_collector.start()
+                cmd.extend(build_peaks_output_args(fifo_path, audio_filter))
+
+            logger.debug(f"📹 ════════════════════════════════════════════════════════════")
+            logger.debug(f"📹 FFmpeg COMMAND for audio extraction:")
+            logger.debug(f"📹 {' '.join(cmd)}")
+
+            try:
+                result = run_ffmpeg_for_task(cmd, duration=probe_media_duration(input_path))
+            finally:
+                peaks_levels = None
+                if peaks_collector:
+                    try:
+                        finest = peaks_collector.finish()
+                        peaks_levels = build_levels(finest, peaks_collector.samples_per_pixel, peaks_options['pixels_per_second'])
+                    except Exception as e:
+                        logger.warning(f"⚠️  Waveform peaks failed, continuing without them: {e}")
+            if result.returncode == 0 or attempt_cmd is extract_cmd:
+                break
+            logger.warning(f"⚠️  Audio stream copy failed, re-encoding: {result.error_summary}")
+            copy_audio, passthrough_reason = False, "stream copy failed"
+        logger.debug(f"📊 FFmpeg return code: {result.returncode}")
+        if result.stdout:
+            logger.debug(f"📋 FFmpeg stdout: {result.stdout[:500]}")
+        if result.stderr:
+            logger.debug(f"⚠️  FFmpeg stderr: {result.stderr[:500]}")
+        
+        if result.returncode != 0:
+            logger.error(f"❌ FFmpeg error during audio extraction: {result.error_summary}")
+            return False, f"FFmpeg error: {result.error_summary}", output_audio
+
+        if max_output_mb is not None and not is_plan_recording():
+            ok, message = self._fit_to_size(extract_cmd, output_audio, max_output_mb)
+            if not ok:
+                return False, message, output_audio
+            bitrate_arg = extract_cmd[extract_cmd.index('-b:a') + 1]
+            if optimize_for_whisper:
+                whisper_bitrate = bitrate_arg
+            else:
+                bitrate = bitrate_arg
+
+        record_operation_details(audio_passthrough={'copied': copy_audio, 'reason': passthrough_reason})
+
+        os.chmod(output_audio, 0o644)
+        file_size = os.path.getsize(output_audio)
+        file_size_mb = file_size / (1024 * 1024)
+        logger.debug(f"📊 Audio file created: {file_size_mb:.2f}MB")
+
+        # Получаем длительность аудио
+        probe_cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            output_audio
         ]
+        logger.debug(f"📊 Running ffprobe: {' '.join(probe_cmd)}")
+        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
         
-        На выходе: 3 элемента (title + 2 развёрнутых субтитра)
-        """
-        logger.debug(f"🔍 Expanding {len(text_items)} text items...")
-        expanded = []
-        
-        for item_idx, item in enumerate(text_items):
-            if not isinstance(item, dict):
-                logger.debug(f"  ⚠️  Item {item_idx}: Not a dict, skipping")
-                expanded.append(item)
-                continue
-            
-            # Обычный text_item с текстом
-            if item.get('text'):
-                logger.debug(f"  ✓ Item {item_idx}: Regular item with text='{item.get('text', '')[:30]}'")
-                expanded.append(item)
-                continue
+        if probe_result.returncode != 0:
+            logger.error(f"❌ FFprobe error: {probe_result.stderr}")
+            return False, f"FFprobe error: {probe_result.stderr}", output_audio
             
-            # Проверяем вложенные субтитры
-            subtitles_obj = item.get('subtitles', {})
-            if isinstance(subtitles_obj, dict) and 'items' in subtitles_obj:
-                subtitle_items = subtitles_obj['items']
-                if not isinstance(subtitle_items, list):
-                    logger.warning(f"  ⚠️  Item {item_idx}: subtitles.items is not a list")
-                    expanded.append(item)  # Некорректный формат
-                    continue
-                
-                logger.debug(f"  📂 Item {item_idx}: Container with {len(subtitle_items)} subtitles (expanding...)")
-                
-                # Развёртываем каждый субтитр в отдельный text_item
-                for sub_idx, sub in enumerate(subtitle_items):
-                    if not isinstance(sub, dict):
-                        logger.warning(f"    ⚠️  Subtitle {sub_idx}: Not a dict")
-                        continue
-                    
-                    sub_text = sub.get('text', '')
-                    if not sub_text:
-                        logger.debug(f"    ⚠️  Subtitle {sub_idx}: Empty text, skipping")
-                        continue
-                    
-                    logger.debug(f"    📝 Expanding subtitle {sub_idx}: text='{sub_text[:30]}' borderw={item.get('borderw', 0)} bordercolor={item.get('bordercolor', 'N/A')}")
-                    
-                    # Новый item с наследованными параметрами
-                    expanded_item = {
-                        'text': sub_text,
-                        'start': sub.get('start', item.get('start', 0)),
-                        'end': sub.get('end', item.get('end', 5)),
-                        
-                        # Наследуем стили от родителя
-                        'fontfile': sub.get('fontfile', item.get('fontfile')),
-                        'fontsize': sub.get('fontsize', item.get('fontsize', 60)),
-                        'fontcolor': sub.get('fontcolor', item.get('fontcolor', 'white')),
-                        'x': sub.get('x', item.get('x', '(w-text_w)/2')),
-                        'y': sub.get('y', item.get('y', 'h-200')),
-                        
-                        # Box параметры
-                        'box': sub.get('box', item.get('box', 0)),
-                        'boxcolor': sub.get('boxcolor', item.get('boxcolor', 'black@0.5')),
-                        'boxborderw': sub.get('boxborderw', item.get('boxborderw', 10)),
-                        
-                        # Дополнительные параметры
-                        'max_lines': sub.get('max_lines', item.get('max_lines', 3)),
-                        'text_align': sub.get('text_align', item.get('text_align', 'center')),
-                    }
-                    
-                    expanded.append(expanded_item)
+        total_duration = float(probe_result.stdout.strip())
+        logger.debug(f"⏱️  Audio duration: {total_duration:.2f}s ({total_duration/60:.2f} min)")
+
+        # Проверяем нужно ли разбивать на чанки
+        if chunk_duration_minutes or file_size_mb > max_chunk_size_mb:
+            # Определяем длительность чанка
+            if chunk_duration_minutes:
+                chunk_duration_seconds = chunk_duration_minutes * 60
             else:
-                # Нет вложенных субтитров - добавляем как есть
-                expanded.append(item)
-        
-        return expanded
+                # Автоматически вычисляем длительность чанка
+                chunk_duration_seconds = (max_chunk_size_mb / file_size_mb) * total_duration * 0.95  # 5% запас
+            if copy_audio:
+                # Копия режется по границам пакетов: длительность чанка - целое число пакетов
+                chunk_duration_seconds = align_to_packets(chunk_duration_seconds, audio_stream)
 
-    def _process_text_item(self, text_item: dict) -> str:
-        """Обрабатывает один текстовый элемент и возвращает drawtext строку для FFmpeg"""
-        try:
-            # Логируем конфигурацию параметров (БЕЗ полного текста)
-            config_str = f"fontsize={text_item.get('fontsize', 60)}, fontcolor={text_item.get('fontcolor', 'white')}, " \
-                        f"borderw={text_item.get('borderw', 0)}, box={text_item.get('box', 0)}, " \
-                        f"start={text_item.get('start', 0)}s, end={text_item.get('end', 5)}s"
-            logger.debug(f"🔨 Processing text_item: {config_str}")
-            
-            # Проверяем, что это словарь
-            if not isinstance(text_item, dict):
-                logger.warning(f"text_item is not a dict: {type(text_item)}")
-                return None
-            
-            text = text_item.get('text', '')
-            if not text:
-                return None
-            
-            # Получаем параметры с дефолтными значениями
-            fontfile = text_item.get('fontfile')
-            fontsize = text_item.get('fontsize', 60)
-            fontcolor = text_item.get('fontcolor', 'white')
-            y = text_item.get('y', 'h-200')
-            x = text_item.get('x', '(w-text_w)/2')
-            start = text_item.get('start', 0)
-            end = text_item.get('end', 5)
-            max_lines = text_item.get('max_lines', 3)
-            text_align = text_item.get('text_align', 'center')
-            
-            # Параметры обводки текста (STROKE/OUTLINE)
-            borderw = text_item.get('borderw', 0)
-            bordercolor = text_item.get('bordercolor', 'black')
-            logger.debug(f"📋 Text item: text='{text[:50]}...' borderw={borderw} bordercolor={bordercolor}")
-            
-            # Параметры плашки (опционально)
-            box = text_item.get('box', 0)
-            boxcolor = text_item.get('boxcolor', 'black@0.5')
-            boxborderw = text_item.get('boxborderw', 10)
-            
-            # Автоматический перенос строк
-            max_chars_per_line = int(950 / (fontsize * 0.55))
-            if len(text) > max_chars_per_line:
-                words = text.split(' ')
-                lines = []
-                current_line = []
-                current_length = 0
-                
-                for word in words:
-                    word_len = len(word) + 1
-                    if current_length + word_len > max_chars_per_line and current_line:
-                        lines.append(' '.join(current_line))
-                        current_line = [word]
-                        current_length = word_len
-                    else:
-                        current_line.append(word)
-                        current_length += word_len
-                
-                if current_line:
-                    lines.append(' '.join(current_line))
-                
-                text = '\n'.join(lines[:max_lines])
-            
-            # Экранируем спецсимволы для FFmpeg
-            text_escaped = text.replace('\\', '\\\\').replace(':', '\\:').replace("'", "\\'").replace(',', '\\,')
-            
-            # Строим параметры drawtext фильтра
-            drawtext_params = [
-                f"text='{text_escaped}'",
-                "expansion=normal",
-                f"fontsize={fontsize}",
-                f"fontcolor={fontcolor}",
-                f"text_align={text_align}",
-                f"x={x}",
-                f"y={y}",
-                f"enable='between(t\\,{start}\\,{end})'"
+            logger.info(f"🔊 Audio chunking enabled: {chunk_duration_seconds/60:.1f} min/chunk, file_size={file_size_mb:.2f}MB, max_chunk_size={max_chunk_size_mb}MB")
+
+            # Границы чанков
+            chunks = []  # (начало, конец, ПОЛНЫЙ путь к файлу чанка)
+            chunk_start = 0
+            while chunk_start < total_duration:
+                chunk_end = min(chunk_start + chunk_duration_seconds, total_duration)
+                chunk_filename = f"audio_{timestamp}_chunk{len(chunks):03d}.{audio_format}"
+                chunks.append((chunk_start, chunk_end, os.path.join(output_dir, chunk_filename)))
+                chunk_start = chunk_end
+
+            if optimize_for_whisper:
+                chunk_codec_args = [
+                    '-acodec', 'libmp3lame',
+                    '-ar', '16000',  # 16kHz
+                    '-ac', '1',      # Моно
+                    '-b:a', whisper_bitrate  # Низкий bitrate
+                ]
+            else:
+                chunk_codec_args = ['-acodec', 'libmp3lame' if audio_format == 'mp3' else 'aac', '-b:a', bitrate]
+            encode_cmds = [
+                ['ffmpeg', '-i', output_audio, '-ss', str(start), '-t', str(end - start),
+                 *chunk_codec_args, '-y', chunk_path]
+                for start, end, chunk_path in chunks
             ]
-            
-            # Добавляем шрифт если указан
-            if fontfile:
-                font_path = self._resolve_font_path(fontfile)
-                fontfile_escaped = font_path.replace(':', '\\:').replace("'", "\\'")
-                drawtext_params.append(f"fontfile='{fontfile_escaped}'")
-            
-            # Добавляем обводку текста (borderw и bordercolor) если указана
-            if borderw > 0:
-                drawtext_params.append(f"borderw={borderw}")
-                drawtext_params.append(f"bordercolor={bordercolor}")
-                logger.debug(f"✨ Added text stroke: borderw={borderw}, bordercolor={bordercolor}")
-            
-            # Добавляем плашку если включена
-            if box:
-                drawtext_params.append(f"box=1")
-                drawtext_params.append(f"boxcolor={boxcolor}")
-                drawtext_params.append(f"boxborderw={boxborderw}")
-            
-            # Собираем финальную строку drawtext
-            drawtext_filter = 'drawtext=' + ':'.join(drawtext_params)
-            logger.debug(f"🎨 drawtext filter: {drawtext_filter}")
-            return drawtext_filter
-            
-        except Exception as e:
-            logger.warning(f"Error processing text_item: {e}")
-            return None
+            chunk_cmds = encode_cmds
+            if copy_audio:
+                # Копия без перекодирования: границы чанков стоят на границах пакетов,
+                # соседние чанки стыкуются без пропусков и повторов
+                chunk_cmds = [
+                    ['ffmpeg', '-i', output_audio,
+                     '-ss', format_seconds(max(0.0, start - COPY_SEEK_MARGIN)),
+                     '-t', format_seconds(end - start),
+                     '-c:a', 'copy', '-y', chunk_path]
+                    for start, end, chunk_path in chunks
+                ]
+
+            # Чанки независимы - нарезаются в ограниченном пуле процессов
+            workers = min(AUDIO_CHUNK_MAX_WORKERS, os.cpu_count() or 1, len(chunks))
+            logger.debug(f"📦 Creating {len(chunks)} chunks in up to {workers} parallel process(es)")
+            results = run_ffmpeg_parallel([(cmd, 0.0) for cmd in chunk_cmds], max_workers=workers)
+
+            # Упавший чанк повторяется один раз (копия - перекодированием); повторная ошибка - ошибка операции
+            failed = [index for index, result in enumerate(results) if result.returncode != 0]
+            if failed:
+                for index in failed:
+                    logger.warning(f"⚠️  Chunk {index} failed, retrying: {results[index].error_summary}")
+                retries = run_ffmpeg_parallel([(encode_cmds[index], 0.0) for index in failed], max_workers=workers)
+                still_failed = [(index, result) for index, result in zip(failed, retries) if result.returncode != 0]
+                if still_failed:
+                    index, result = still_failed[0]
+                    logger.error(f"❌ Chunk {index} error: {result.error_summary}")
+                    for _, _, chunk_path in chunks:
+                        remove_task_file(chunk_path)
+                    return False, f"FFmpeg error (chunk {index}): {result.error_summary}", output_audio
+
+            # Результаты - в порядке индексов чанков
+            chunk_files = []  # список ПОЛНЫХ путей к файлам чанков
+            peaks_files = []
+            for chunk_index, (chunk_start, chunk_end, chunk_path) in enumerate(chunks):
+                os.chmod(chunk_path, 0o644)
+                chunk_size = os.path.getsize(chunk_path) / (1024 * 1024)
+                logger.debug(f"✅ Chunk {chunk_index} created: {chunk_start:.2f}s - {chunk_end:.2f}s, {chunk_size:.2f}MB")
+                # сохраняем полный путь, чтобы pipeline и metadata могли корректно обработать
+                chunk_files.append(chunk_path)
+                if peaks_levels:
+                    # Пики чанка - срез пиков полного файла, без повторного декодирования
+                    peaks_files.extend(write_peaks(
+                        os.path.splitext(chunk_path)[0],
+                        slice_levels(peaks_levels, chunk_start, chunk_end),
+                        peaks_options['format'],
+                        chunk_end - chunk_start,
+                        start=chunk_start
+                    ))
+
+            # Удаляем полный аудиофайл, оставляем только чанки
+            if os.path.exists(output_audio):
+                os.remove(output_audio)
+                logger.debug(f"🗑️  Deleted full audio file: {output_audio}")
+
+            logger.debug(f"✅ Split audio into {len(chunk_files)} chunks")
+
+            # Возвращаем список полных путей к чанкам
+            logger.info(f"✅ Audio extracted and split into {len(chunk_files)} chunks ({total_duration/60:.2f} min total)")
+            return True, f"Audio extracted and split into {len(chunk_files)} chunks", chunk_files + peaks_files
+
+        else:
+            # Файл не требует разбиения
+            logger.info(f"✅ Audio extracted to {audio_format}: {file_size_mb:.2f}MB, {total_duration/60:.2f} min")
+            if peaks_levels:
+                peaks_files = write_peaks(
+                    os.path.splitext(output_audio)[0], peaks_levels, peaks_options['format'], total_duration
+                )
+                logger.info(f"📈 Waveform peaks written: {', '.join(os.path.basename(p) for p in peaks_files)}")
+                return True, f"Audio extracted to {audio_format}", [output_audio, *peaks_files]
+            return True, f"Audio extracted to {audio_format}", output_audio
+
+
+# Типы для плейлистов и сегментов адаптивного стриминга (отдаются inline, а не attachment)
+STREAMING_MIME_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.mpd': 'application/dash+xml',
+    '.m4s': 'video/iso.segment',
+    '.vtt': 'text/vtt',  # Дорожка миниатюр storyboard
+}
+for _ext, _mime in STREAMING_MIME_TYPES.items():
+    mimetypes.add_type(_mime, _ext)
+
+
+class PackageHlsOperation(VideoOperation):
+    """Операция упаковки в HLS (и опционально DASH) из fMP4-сегментов без перекодирования"""
+    terminal = True
+
+    def __init__(self):
+        super().__init__(
+            name="package_hls",
+            required_params=[],
+            optional_params={
+                'segment_duration': 4,  # Целевая длительность сегмента, сек (режется по ключевым кадрам)
+                'dash': False           # Дополнительно MPD-манифест над теми же сегментами
+            }
+        )
+
+    def validate(self, params: dict) -> tuple[bool, str]:
+        ok, msg = super().validate(params)
+        if not ok:
+            return ok, msg
+        segment_duration = params.get('segment_duration', 4)
+        if isinstance(segment_duration, bool) or not isinstance(segment_duration, (int, float)) \
+                or not (1 <= segment_duration <= 60):
+            return False, "segment_duration must be a number between 1 and 60"
+        if not isinstance(params.get('dash', False), bool):
+            return False, "dash must be a boolean"
+        return True, ""
+
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str, list]:
+        """Сегментация в fMP4 HLS/DASH за один проход (-c copy)"""
+        logger.debug(f"📥 Starting PackageHlsOperation execute: input_path={input_path}, output_path={output_path}")
+        logger.debug(f"📋 Input params: {json.dumps(params, indent=2, default=str)}")
+
+        # Валидация входного файла
+        valid, msg = self.validate_input_file(input_path)
+        if not valid:
+            logger.error(f"❌ Input validation failed: {msg}")
+            return False, msg, []
+
+        segment_duration = params.get('segment_duration', 4)
+        with_dash = params.get('dash', False)
+
+        # Все файлы пакета лежат рядом с плейлистом: <name>.m3u8, <name>_init*.mp4, <name>_*.m4s
+        base = os.path.splitext(output_path)[0]
+        name = os.path.basename(base)
+        output_dir = os.path.dirname(output_path)
+
+        cmd = ['ffmpeg', '-i', input_path, '-map', '0:v?', '-map', '0:a?', '-c', 'copy']
+        if with_dash:
+            # dash muxer с hls_playlist=1 пишет MPD и HLS-плейлисты над одними и теми же сегментами
+            playlists = [f"{base}.m3u8", f"{base}.mpd"]
+            cmd.extend([
+                '-f', 'dash',
+                '-seg_duration', str(segment_duration),
+                '-use_template', '1',
+                '-use_timeline', '1',
+                '-hls_playlist', '1',
+                '-hls_master_name', f"{name}.m3u8",
+                '-init_seg_name', f"{name}_init_$RepresentationID$.mp4",
+                '-media_seg_name', f"{name}_$RepresentationID$_$Number%05d$.m4s",
+                '-y',
+                f"{base}.mpd"
+            ])
+        else:
+            playlists = [f"{base}.m3u8"]
+            cmd.extend([
+                '-f', 'hls',
+                '-hls_time', str(segment_duration),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_type', 'fmp4',
+                '-hls_flags', 'independent_segments',
+                '-hls_fmp4_init_filename', f"{name}_init.mp4",
+                '-hls_segment_filename', os.path.join(output_dir, f"{name}_%05d.m4s"),
+                '-y',
+                f"{base}.m3u8"
+            ])
+
+        logger.debug(f"📹 ════════════════════════════════════════════════════════════")
+        logger.debug(f"📹 FFmpeg COMMAND for HLS packaging:")
+        logger.debug(f"📹 {' '.join(cmd)}")
+
+        result = run_ffmpeg_for_task(cmd, duration=probe_media_duration(input_path))
+        logger.debug(f"📊 FFmpeg return code: {result.returncode}")
+        if result.stderr:
+            logger.debug(f"⚠️  FFmpeg stderr: {result.stderr[:500]}")
+
+        if result.returncode != 0:
+            logger.error(f"❌ FFmpeg error during packaging: {result.error_summary}")
+            return False, f"FFmpeg error: {result.error_summary}", []
+        if is_plan_recording():
+            # Dry run: ffmpeg не запускался - плейлистов и сегментов нет
+            return True, f"Packaged as {'HLS and DASH' if with_dash else 'HLS'}", playlists
+
+        missing = [p for p in playlists if not os.path.exists(p)]
+        if missing:
+            return False, f"Packaging produced no playlist: {', '.join(os.path.basename(p) for p in missing)}", []
+
+        segments = [f for f in os.listdir(output_dir) if f.startswith(f"{name}_") and f.endswith('.m4s')]
+        logger.info(f"✅ Packaged {'HLS+DASH' if with_dash else 'HLS'}: {len(segments)} segment(s) -> {os.path.basename(playlists[0])}")
+        return True, f"Packaged as {'HLS and DASH' if with_dash else 'HLS'} ({len(segments)} segments)", playlists
+
+
+class AnalyzeMediaOperation(VideoOperation):
+    """Операция анализа медиа: смены сцен, тишина и громкость EBU R128 за одно декодирование"""
+    terminal = True
+
+    def __init__(self):
+        super().__init__(
+            name="analyze_media",
+            required_params=[],
+            optional_params=dict(DEFAULT_ANALYSIS_PARAMS)
+        )
+
+    def validate(self, params: dict) -> tuple[bool, str]:
+        ok, msg = super().validate(params)
+        if not ok:
+            return ok, msg
+        ranges = {
+            'scene_threshold': (0.0, 1.0),
+            'silence_threshold_db': (-90.0, 0.0),
+            'silence_min_duration': (0.05, 60.0),
+        }
+        for key, (low, high) in ranges.items():
+            value = params.get(key, DEFAULT_ANALYSIS_PARAMS[key])
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not (low <= value <= high):
+                return False, f"{key} must be a number between {low} and {high}"
+        return True, ""
+
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str, str]:
+        """Анализ с кешированием timeline по отпечатку источника"""
+        logger.debug(f"📥 Starting AnalyzeMediaOperation execute: input_path={input_path}, output_path={output_path}")
 
-    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str]:
-        """Конвертация в Shorts формат (1080x1920)"""
         # Валидация входного файла
-        logger.debug(f"📥 Starting execute: input_path={input_path}, output_path={output_path}")
-        logger.debug(f"📋 Params: {params}")
-        
         valid, msg = self.validate_input_file(input_path)
         if not valid:
-            return False, msg
-        
-        # Применяем значения по умолчанию
-        crop_mode = params.get('crop_mode', 'center')
-        start_time = params.get('start_time')
-        end_time = params.get('end_time')
-        logger.debug(f"🎬 Crop mode: {crop_mode}, start_time: {start_time}, end_time: {end_time}")
+            logger.error(f"❌ Input validation failed: {msg}")
+            return False, msg, None
+
+        analysis_params = {key: params.get(key, default) for key, default in DEFAULT_ANALYSIS_PARAMS.items()}
+        output_json = os.path.splitext(output_path)[0] + '.json'
+
+        fingerprint = source_fingerprint(input_path)
+        analysis = PROBE_CACHE.get(fingerprint, 'analysis', analysis_params)
+        cached = analysis is not None
+
+        if not cached:
+            duration = probe_media_duration(input_path)
+            if not duration:
+                return False, "Cannot determine media duration", None
+            stream_types = probe_stream_types(input_path)
+            has_video = 'video' in stream_types
+            has_audio = 'audio' in stream_types
+            if not (has_video or has_audio):
+                return False, "Source has neither video nor audio streams", None
+
+            base = os.path.splitext(output_path)[0]
+            scenes_path = f"{base}_scenes.txt"
+            audio_path = f"{base}_audio.txt"
+            cmd = build_analysis_command(input_path, scenes_path, audio_path, has_video, has_audio, analysis_params)
+
+            logger.debug(f"📹 ════════════════════════════════════════════════════════════")
+            logger.debug(f"📹 FFmpeg COMMAND for media analysis:")
+            logger.debug(f"📹 {' '.join(cmd)}")
 
-        # additional_inputs может содержать аудио дорожки, изображения и т.д.
-        # Пока не используется в базовой реализации, но доступно для расширения
-        additional_inputs = additional_inputs or {}
+            try:
+                result = run_ffmpeg_for_task(cmd, duration=duration)
+                if result.returncode != 0:
+                    logger.error(f"❌ FFmpeg error during analysis: {result.error_summary}")
+                    return False, f"FFmpeg error: {result.error_summary}", None
+                analysis = build_timeline(scenes_path, audio_path, duration, analysis_params)
+            finally:
+                for path in (scenes_path, audio_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+            if result.rusage and result.rusage.get('wall_time'):
+                analysis['speed'] = round(duration / result.rusage['wall_time'], 1)
+            if not is_plan_recording():
+                # Dry run не анализировал источник - пустой timeline не должен попасть в кеш
+                PROBE_CACHE.put(fingerprint, 'analysis', analysis, analysis_params)
+
+        analysis = dict(analysis, source_fingerprint=fingerprint, cached=cached)
+        with open(output_json, 'w', encoding='utf-8') as f:
+            json.dump(analysis, f, ensure_ascii=False, separators=(',', ':'))
+
+        summary = analysis.get('summary', {})
+        logger.info(
+            f"✅ Media analyzed{' (cache hit)' if cached else ''}: {analysis.get('duration')}s, "
+            f"{summary.get('scene_changes')} scene change(s), silence {summary.get('silence_ratio')}, "
+            f"I={summary.get('integrated_lufs')} LUFS"
+        )
+        return True, f"Media analyzed{' (cached)' if cached else ''}", output_json
 
-        # Конфигурация letterbox режима
-        letterbox_config_raw = params.get('letterbox_config', {})
-        letterbox_config = {
-            'blur_radius': letterbox_config_raw.get('blur_radius', 20),
-            'bg_scale': letterbox_config_raw.get('bg_scale', '1080:1920'),
-            'fg_scale': letterbox_config_raw.get('fg_scale', '-1:1080'),
-            'overlay_x': letterbox_config_raw.get('overlay_x', '(W-w)/2'),
-            'overlay_y': letterbox_config_raw.get('overlay_y', '(H-h)/2')
+
+def link_or_copy(src: str, dst: str):
+    """Жёсткая ссылка (мгновенно, без места на диске) или копия между файловыми системами"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        import shutil
+        shutil.copy2(src, dst)
+
+
+class StoryboardOperation(VideoOperation):
+    """Операция storyboard: спрайты миниатюр + WebVTT-дорожка за одно декодирование"""
+    terminal = True
+    result_version = STORYBOARD_VERSION
+
+    def __init__(self):
+        super().__init__(
+            name="storyboard",
+            required_params=[],
+            optional_params=dict(DEFAULT_STORYBOARD_PARAMS)
+        )
+
+    def validate(self, params: dict) -> tuple[bool, str]:
+        ok, msg = super().validate(params)
+        if not ok:
+            return ok, msg
+        ranges = {
+            'interval': (0.5, 600.0),
+            'columns': (1, 20),
+            'rows': (1, 20),
+            'thumb_width': (32, 640),
         }
-        logger.debug(f"📦 Letterbox config: {letterbox_config}")
+        for key, (low, high) in ranges.items():
+            value = params.get(key, DEFAULT_STORYBOARD_PARAMS[key])
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not (low <= value <= high):
+                return False, f"{key} must be a number between {low} and {high}"
+            if key != 'interval' and value != int(value):
+                return False, f"{key} must be an integer"
+        return True, ""
 
-        # Определяем фильтр обрезки
-        if crop_mode == 'letterbox':
-            video_filter = (
-                f"[0:v]scale={letterbox_config['bg_scale']}:force_original_aspect_ratio=increase,crop=1080:1920,boxblur={letterbox_config['blur_radius']}[bg];"
-                f"[0:v]scale={letterbox_config['fg_scale']}:force_original_aspect_ratio=decrease[fg];"
-                f"[bg][fg]overlay={letterbox_config['overlay_x']}:{letterbox_config['overlay_y']}"
-            )
-        elif crop_mode == 'top':
-            video_filter = "crop=ih*9/16:ih:0:0,scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920"
-        elif crop_mode == 'bottom':
-            video_filter = "crop=ih*9/16:ih:0:ih-oh,scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920"
-        else:  # center
-            video_filter = "crop=ih*9/16:ih,scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920"
-        
-        logger.debug(f"🎨 Base video filter (crop): {video_filter}")
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str, list]:
+        """Storyboard с кешированием спрайтов по отпечатку источника"""
+        logger.debug(f"📥 Starting StoryboardOperation execute: input_path={input_path}, output_path={output_path}")
 
-        # === НОВАЯ СИСТЕМА: Универсальные текстовые элементы ===
-        # Обрабатываем text_items если они указаны
-        text_items = params.get('text_items', [])
-        logger.debug(f"📝 Input text_items count: {len(text_items)}")
-        for i, item in enumerate(text_items):
-            # Логируем только конфиг, не полный текст
-            item_config = f"fontsize={item.get('fontsize', 60)}, fontcolor={item.get('fontcolor', 'white')}, " \
-                         f"borderw={item.get('borderw', 0)}, box={item.get('box', 0)}"
-            logger.debug(f"  [{i}] {item_config}")
-        
-        # Проверяем ограничение публичной версии ДО развёртывания
-        # (максимум 2 элемента на входе, независимо от вложенных субтитров)
-        if len(text_items) > 2:
-            return jsonify({
-                "status": "error",
-                "error": f"Public version supports max 2 text items per operation. You have {len(text_items)} items. Upgrade to Pro for unlimited text items."
-            }), 400
-        
-        # Теперь развёртываем вложенные субтитры в каждом item'е
-        text_items = self._expand_text_items(text_items)
-        logger.debug(f"🔄 Text items after expansion: {len(text_items)} items")
-        for i, item in enumerate(text_items):
-            # Логируем только конфиг, не полный текст
-            item_config = f"fontsize={item.get('fontsize', 60)}, fontcolor={item.get('fontcolor', 'white')}, " \
-                         f"borderw={item.get('borderw', 0)}, box={item.get('box', 0)}"
-            logger.debug(f"  [{i}] {item_config}")
-        
-        if text_items:
-            logger.debug(f"📊 Processing {len(text_items)} text items...")
-            for idx, text_item in enumerate(text_items):
-                drawtext_filter = self._process_text_item(text_item)
-                if drawtext_filter:
-                    # Логируем конфиг до добавления фильтра
-                    item_config = f"fontsize={text_item.get('fontsize', 60)}, fontcolor={text_item.get('fontcolor', 'white')}, " \
-                                 f"borderw={text_item.get('borderw', 0)}, box={text_item.get('box', 0)}, " \
-                                 f"start={text_item.get('start_time', 0)}s, end={text_item.get('end_time', 0)}s"
-                    logger.debug(f"  [{idx}] 🎨 Drawtext filter: {drawtext_filter}")
-                    logger.debug(f"       📋 Config: {item_config}")
-                    video_filter += f",{drawtext_filter}"
-                else:
-                    logger.warning(f"  ❌ Failed to process text_item[{idx}]")
+        # Валидация входного файла
+        valid, msg = self.validate_input_file(input_path)
+        if not valid:
+            logger.error(f"❌ Input validation failed: {msg}")
+            return False, msg, None
+
+        storyboard_params = {key: params.get(key, default) for key, default in DEFAULT_STORYBOARD_PARAMS.items()}
+        base = os.path.splitext(output_path)[0]
+        output_vtt = f"{base}.vtt"
+
+        fingerprint = source_fingerprint(input_path)
+        layout = PROBE_CACHE.get(fingerprint, 'storyboard', storyboard_params)
+        # Спрайты прежней версии выборки кадров не совпадают с сеткой WebVTT - пересобираем
+        if layout and layout.get('version') != STORYBOARD_VERSION:
+            layout = None
+        cached_sprites = PROBE_CACHE.get_files(fingerprint, 'storyboard', storyboard_params) if layout else None
+        cached = cached_sprites is not None
+
+        sprite_paths = []
+        if cached:
+            # Спрайты из кеша под именами этой задачи
+            for index, cached_path in enumerate(cached_sprites, start=1):
+                sprite_path = f"{base}_{index:03d}.jpg"
+                link_or_copy(cached_path, sprite_path)
+                sprite_paths.append(sprite_path)
         else:
-            logger.debug("⚠️  No text items to process")
-
-        # Выполняем FFmpeg команду
-        cmd = ['ffmpeg']
-        
-        # Добавляем таймкоды для нарезки если указаны
-        if start_time is not None:
-            cmd.extend(['-ss', str(start_time)])
-        
-        cmd.extend(['-i', input_path])
-        
-        # Добавляем конечный таймкод или длительность
-        if end_time is not None:
-            if start_time is not None:
-                # Если есть start и end - вычисляем duration
-                if isinstance(start_time, (int, float)) and isinstance(end_time, (int, float)):
-                    duration = end_time - start_time
-                    cmd.extend(['-t', str(duration)])
-                else:
-                    # Для строковых таймкодов используем -to
-                    cmd.extend(['-to', str(end_time)])
-            else:
-                cmd.extend(['-to', str(end_time)])
-        
-        cmd.extend([
-            '-filter_complex' if crop_mode == 'letterbox' else '-vf', video_filter,
-            '-c:v', 'libx264',
-            '-preset', 'medium',
-            '-crf', '23',
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            '-movflags', '+faststart',
-            '-y',
-            output_path
-        ])
+            duration = probe_media_duration(input_path)
+            if not duration:
+                return False, "Cannot determine media duration", None
+            size = probe_video_size(input_path)
+            if not size:
+                return False, "Source has no video stream", None
+
+            layout = storyboard_layout(storyboard_params, duration, size)
+            cmd = build_storyboard_command(input_path, f"{base}_%03d.jpg", layout)
+
+            logger.debug(f"📹 ════════════════════════════════════════════════════════════")
+            logger.debug(f"📹 FFmpeg COMMAND for storyboard:")
+            logger.debug(f"📹 {' '.join(cmd)}")
+
+            result = run_ffmpeg_for_task(cmd, duration=duration)
+            if is_plan_recording():
+                # Dry run: ffmpeg не запускался - листов нет, в кеш ничего не пишется
+                return True, "Storyboard created", [output_vtt]
+            output_dir = os.path.dirname(output_path)
+            sprite_prefix = os.path.basename(base) + '_'
+            sprite_paths = sorted(
+                os.path.join(output_dir, name) for name in os.listdir(output_dir)
+                if name.startswith(sprite_prefix) and name.endswith('.jpg')
+            )
+            if result.returncode != 0:
+                logger.error(f"❌ FFmpeg error during storyboard: {result.error_summary}")
+                for path in sprite_paths:
+                    os.remove(path)
+                return False, f"FFmpeg error: {result.error_summary}", None
+            if not sprite_paths:
+                return False, "Storyboard produced no sprite sheets", None
+
+            layout['sheets'] = len(sprite_paths)
+            PROBE_CACHE.put(fingerprint, 'storyboard', layout, storyboard_params)
+            PROBE_CACHE.put_files(fingerprint, 'storyboard', sprite_paths, storyboard_params)
+
+        with open(output_vtt, 'w', encoding='utf-8') as f:
+            f.write(build_storyboard_vtt(layout, sprite_paths))
+
+        logger.info(
+            f"✅ Storyboard ready{' (cache hit)' if cached else ''}: {len(sprite_paths)} sprite sheet(s), "
+            f"{layout['thumbnails']} thumbnail(s) every {layout['interval']}s, "
+            f"{layout['thumb_width']}x{layout['thumb_height']}"
+        )
+        return True, f"Storyboard created{' (cached)' if cached else ''}", [output_vtt, *sprite_paths]
 
-        # DEBUG: Log full FFmpeg command with all filters
-        logger.debug(f"📹 FFmpeg command: {' '.join(cmd[:5])}... (output={output_path})")
-        logger.debug(f"🎨 Video filter chain: {video_filter}")
-        if text_items:
-            logger.debug(f"📝 Text items processed: {len(text_items)} items with various configs")
 
-        logger.info(f"🚀 Executing FFmpeg for: {output_path}")
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        logger.debug(f"📊 FFmpeg return code: {result.returncode}")
-        if result.stdout:
-            logger.debug(f"📋 FFmpeg stdout: {result.stdout[:500]}")
-        if result.stderr:
-            logger.debug(f"⚠️  FFmpeg stderr: {result.stderr[:500]}")
-        
-        if result.returncode != 0:
-            return False, f"FFmpeg error: {result.stderr}"
-
-        # Генерация превью если включено
-        thumbnail_path = None
-        if params.get('generate_thumbnail', True):
-            # Если видео было обрезано (есть start_time), то timestamp для превью 
-            # считается ОТНОСИТЕЛЬНО ОБРЕЗАННОГО видео
-            # Иначе используем абсолютный timestamp из параметров
-            thumbnail_timestamp = params.get('thumbnail_timestamp', 0.5)
-            
-            # Если был start_time, это значит видео уже обрезано до start_time
-            # поэтому timestamp уже правильный (относительно обрезанного видео)
-            
-            thumbnail_path = output_path.replace('.mp4', '_thumbnail.jpg')
+# Склейка: не больше отрезков в одной операции
+CONCAT_MAX_SEGMENTS = 50
+CONCAT_MODES = ('auto', 'copy', 'encode')
 
-            thumbnail_cmd = [
-                'ffmpeg',
-                '-ss', str(thumbnail_timestamp),
-                '-i', output_path,
-                '-vframes', '1',
-                '-q:v', '2',  # Высокое качество JPEG (2-5 диапазон)
-                '-y',
-                thumbnail_path
-            ]
 
-            thumbnail_result = subprocess.run(thumbnail_cmd, capture_output=True, text=True)
-            if thumbnail_result.returncode == 0 and os.path.exists(thumbnail_path):
-                pass  # Логирование будет в конце pipeline
-            else:
-                logger.warning(f"Failed to generate thumbnail: {thumbnail_result.stderr}")
-                thumbnail_path = None
+def resolve_task_file(task_id: str, filename: str) -> str | None:
+    """Путь к выходному файлу другой задачи (внутри TASKS_DIR) или None, если такого файла нет"""
+    path = os.path.join(get_task_dir(task_id), filename)
+    if not is_task_dir_name(task_id) or not os.path.abspath(path).startswith(os.path.abspath(TASKS_DIR) + os.sep):
+        return None
+    return path if os.path.isfile(path) else None
 
-        # Возвращаем список файлов (видео + превью если создано)
-        output_list = [output_path]
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            output_list.append(thumbnail_path)
-            return True, f"Converted to Shorts format (1080x1920) with thumbnail", output_list
-        else:
-            return True, "Converted to Shorts format (1080x1920)", output_list
 
+class ConcatOperation(VideoOperation):
+    """Операция склейки: отрезки источника и/или файлы готовых задач в один файл"""
 
-class ExtractAudioOperation(VideoOperation):
-    """Операция извлечения аудио с поддержкой chunking для Whisper API"""
     def __init__(self):
         super().__init__(
-            name="extract_audio",
-            required_params=[],
+            name="concat",
+            required_params=['segments'],
             optional_params={
-                'format': 'mp3',
-                'bitrate': '192k',
-                'chunk_duration_minutes': None,  # Длительность чанка в минутах (опционально)
-                'max_chunk_size_mb': 24,         # Максимальный размер чанка в МБ (для Whisper API)
-                'optimize_for_whisper': False    # Оптимизация для Whisper (16kHz, mono, 64k bitrate)
+                'mode': 'auto',  # auto: -c copy при совпадении кодеков, иначе одно кодирование
+                'output_mode': 'faststart'
             }
         )
 
-    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str, str]:
-        """Извлечение аудио из видео с опциональным chunking для Whisper API"""
-        logger.debug(f"📥 Starting ExtractAudioOperation execute: input_path={input_path}, output_path={output_path}")
+    def validate(self, params: dict) -> tuple[bool, str]:
+        ok, msg = super().validate(params)
+        if not ok:
+            return ok, msg
+        segments = params['segments']
+        if not isinstance(segments, list) or not segments:
+            return False, "segments must be a non-empty list"
+        if len(segments) > CONCAT_MAX_SEGMENTS:
+            return False, f"Too many segments: {len(segments)} (max {CONCAT_MAX_SEGMENTS})"
+        for index, segment in enumerate(segments, start=1):
+            if not isinstance(segment, dict):
+                return False, f"Segment {index} must be an object"
+            task_id = segment.get('task_id')
+            filename = segment.get('filename')
+            if (task_id is None) != (filename is None):
+                return False, f"Segment {index}: task_id and filename must be given together"
+            if task_id is not None:
+                if not isinstance(task_id, str) or not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', task_id):
+                    return False, f"Segment {index}: invalid task_id"
+                if not isinstance(filename, str) or os.path.basename(filename) != filename \
+                        or filename.startswith('.') or not filename:
+                    return False, f"Segment {index}: invalid filename"
+            start = parse_time_value(segment.get('start_time', 0))
+            end = parse_time_value(segment.get('end_time')) if segment.get('end_time') is not None else None
+            if start is None or start < 0:
+                return False, f"Segment {index}: invalid start_time"
+            if segment.get('end_time') is not None and (end is None or end <= start):
+                return False, f"Segment {index}: end_time must be greater than start_time"
+        if params.get('mode', 'auto') not in CONCAT_MODES:
+            return False, f"Invalid mode: {params.get('mode')}. Available: {list(CONCAT_MODES)}"
+        return validate_output_mode(params)
+
+    def _resolve_pieces(self, input_path: str, segments: list) -> tuple[list | None, str]:
+        """[(путь, start, end), ...] - отрезок источника pipeline или файл другой задачи"""
+        pieces = []
+        for index, segment in enumerate(segments, start=1):
+            path = input_path
+            if segment.get('task_id') is not None:
+                path = resolve_task_file(segment['task_id'], segment['filename'])
+                if path is None:
+                    return None, f"Segment {index}: file not found: {segment['task_id']}/{segment['filename']}"
+            start = parse_time_value(segment.get('start_time', 0)) or None
+            end = parse_time_value(segment.get('end_time')) if segment.get('end_time') is not None else None
+            pieces.append((path, start, end))
+        return pieces, ""
+
+    def external_inputs(self, params: dict) -> list:
+        # Ненайденный файл остаётся в списке: хеширование упадёт, и кеш не подставит старый результат
+        return list(dict.fromkeys(
+            resolve_task_file(s['task_id'], s['filename']) or f"{s['task_id']}/{s['filename']}"
+            for s in params.get('segments') or [] if s.get('task_id') is not None
+        ))
+
+    def expected_duration(self, input_path: str, params: dict) -> float | None:
+        pieces, _ = self._resolve_pieces(input_path, params.get('segments') or [])
+        if pieces is None:
+            return None
+        total = 0.0
+        for path, start, end in pieces:
+            duration = expected_output_duration(path, start, end)
+            if duration is None:
+                return None
+            total += duration
+        return total
+
+    def execute(self, input_path: str, output_path: str, params: dict, additional_inputs: dict = None) -> tuple[bool, str]:
+        """Склейка отрезков: concat demuxer с -c copy или одно кодирование через filtergraph"""
+        logger.debug(f"📥 Starting ConcatOperation execute: input_path={input_path}, output_path={output_path}")
         logger.debug(f"📋 Input params: {json.dumps(params, indent=2, default=str)}")
-        
+
         # Валидация входного файла
         valid, msg = self.validate_input_file(input_path)
         if not valid:
             logger.error(f"❌ Input validation failed: {msg}")
-            return False, msg, input_path
-        
-        audio_format = params.get('format', 'mp3')
-        bitrate = params.get('bitrate', '192k')
-        chunk_duration_minutes = params.get('chunk_duration_minutes')
-        max_chunk_size_mb = params.get('max_chunk_size_mb', 24)
-        optimize_for_whisper = params.get('optimize_for_whisper', False)
-        
-        logger.debug(f"🔊 Audio extraction config: format={audio_format}, bitrate={bitrate}, optimize_for_whisper={optimize_for_whisper}, max_chunk_size_mb={max_chunk_size_mb}MB")
+            return False, msg
+
+        pieces, msg = self._resolve_pieces(input_path, params['segments'])
+        if pieces is None:
+            return False, msg
+
+        mode = params.get('mode', 'auto')
+        output_mode = params.get('output_mode', 'faststart')
+        files = list(dict.fromkeys(path for path, _, _ in pieces))
+        signatures = [probe_stream_signature(path) for path in files]
+        if any(signature is None for signature in signatures):
+            mismatch = "codec parameters are unknown"
+        else:
+            mismatch = signature_mismatch(signatures)
+        if mode == 'copy' and mismatch:
+            return False, f"Segments cannot be joined without re-encoding: {mismatch}"
+        stream_copy = mode == 'copy' or (mode == 'auto' and mismatch is None)
+        duration = self.expected_duration(input_path, params)
+
+        base = os.path.splitext(output_path)[0]
+        script_path = f"{base}_concat.txt"
+        if stream_copy:
+            with open(script_path, 'w', encoding='utf-8') as f:
+                f.write(build_concat_script(pieces))
+            cmd = [
+                'ffmpeg', '-f', 'concat', '-safe', '0', '-i', script_path,
+                '-map', '0:v?', '-map', '0:a?',
+                '-c', 'copy',
+                *mp4_movflags_args(output_mode),
+                '-y', output_path
+            ]
+        else:
+            logger.info(f"🔁 Concat: codec parameters differ ({mismatch}), joining with one encode")
+            stream_types = [probe_stream_types(path) for path in files]
+            has_video = all('video' in types for types in stream_types)
+            has_audio = all('audio' in types for types in stream_types)
+            if not (has_video or has_audio):
+                return False, "Segments have no common video or audio stream"
+            first_video = (signatures[0] or {}).get('video') or {}
+            filter_complex = build_concat_filter(
+                len(pieces), has_video, has_audio,
+                size=probe_video_size(files[0]), frame_rate=first_video.get('r_frame_rate')
+            )
+            cmd = ['ffmpeg']
+            for path, start, end in pieces:
+                cmd.extend(trimmed_input_args(path, start, end))
+            cmd.extend(['-filter_complex', filter_complex])
+            if has_video:
+                cmd.extend(['-map', '[vout]', *SHORTS_VIDEO_CODEC_ARGS])
+            if has_audio:
+                cmd.extend(['-map', '[aout]', *SHORTS_AUDIO_CODEC_ARGS])
+            cmd.extend([*mp4_movflags_args(output_mode), '-y', output_path])
+
+        logger.debug(f"📹 ════════════════════════════════════════════════════════════")
+        logger.debug(f"📹 FFmpeg COMMAND for concat:")
+        logger.debug(f"📹 {' '.join(cmd)}")
+
+        try:
+            with growing_output(output_path, enabled=output_mode == 'fragmented') as growing:
+                result = run_ffmpeg_for_task(cmd, duration=duration)
+                growing['returncode'] = result.returncode
+        finally:
+            if os.path.exists(script_path):
+                os.remove(script_path)
+        if result.returncode != 0:
+            logger.error(f"❌ FFmpeg error during concat: {result.error_summary}")
+            return False, f"FFmpeg error: {result.error_summary}"
+
+        how = "stream copy" if stream_copy else "re-encoded"
+        logger.info(f"✅ Concatenated {len(pieces)} segment(s) ({how}) -> {output_path}")
+        return True, f"Concatenated {len(pieces)} segments ({how})"
+
+
+# Регистрация всех операций
+OPERATIONS_REGISTRY = {
+    'cut_video': CutVideoOperation(),
+    'make_short': MakeShortOperation(),
+    'extract_audio': ExtractAudioOperation(),
+    'package_hls': PackageHlsOperation(),
+    'analyze_media': AnalyzeMediaOperation(),
+    'storyboard': StoryboardOperation(),
+    'concat': ConcatOperation(),
+}
+
+# Префикс финального файла pipeline по типу последней операции
+FINAL_OUTPUT_PREFIXES = {
+    'make_short': 'short',
+    'cut_video': 'video',
+    'extract_audio': 'audio',  # хотя extract_audio сам формирует имя
+    'package_hls': 'stream',
+    'analyze_media': 'analysis',
+    'storyboard': 'storyboard',
+    'concat': 'joined',
+}
+
+
+def final_output_path(task_dir: str, op_type: str) -> str:
+    """Финальный файл pipeline: <префикс>_<timestamp>.mp4 (операции с другим форматом берут из него основу имени)"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    prefix = FINAL_OUTPUT_PREFIXES.get(op_type, 'processed')
+    return os.path.join(task_dir, f"{prefix}_{timestamp}.mp4")
+
+
+# ============================================
+# OPERATION RESULT CACHE
+# ============================================
+
+_FFMPEG_VERSION_CACHE: Dict[str, str] = {}
+
+
+def ffmpeg_version() -> str:
+    """Первая строка `ffmpeg -version` (входит в ключ result cache); '' если не удалось определить"""
+    if 'version' not in _FFMPEG_VERSION_CACHE:
+        version = ''
+        try:
+            result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=10)
+            if result.returncode == 0 and result.stdout:
+                version = result.stdout.splitlines()[0].strip()
+        except Exception as e:
+            logger.debug(f"ffmpeg -version failed: {e}")
+        _FFMPEG_VERSION_CACHE['version'] = version
+    return _FFMPEG_VERSION_CACHE['version']
+
+
+def _operation_result_paths(result: tuple, output_path: str) -> list:
+    """Выходные файлы из результата операции (2 или 3 значения)"""
+    actual_output = result[2] if len(result) == 3 else None
+    if isinstance(actual_output, list):
+        return list(actual_output)
+    return [actual_output or output_path]
+
+
+def result_cache_params(operation: VideoOperation, params: dict) -> dict:
+    """
+    Параметры для ключа result cache: с учётом значений по умолчанию, без 'type',
+    плюс result_version операции.
+    Содержимое дополнительных входов операции (external_inputs) входит в ключ хешем.
+    OSError - дополнительный вход не читается.
+    """
+    cache_params = {k: v for k, v in {**operation.optional_params, **params}.items() if k != 'type'}
+    if operation.result_version is not None:
+        cache_params['result_version'] = operation.result_version
+    external = operation.external_inputs(params)
+    if external:
+        cache_params['external_inputs'] = [file_sha256(path) for path in external]
+    return cache_params
+
+
+def operation_cache_key(operation: VideoOperation, op_type: str, input_path: str, params: dict) -> str | None:
+    """
+    Ключ result cache операции над входом; None - результат не кешируется (нет версии
+    ffmpeg или вход - поток без ключа содержимого). OSError - вход не читается.
+
+    Поток (pipe handoff) не хешируется - чтение забрало бы данные у ffmpeg. Его содержимое
+    однозначно задаёт ключ операции-источника (хеш её входа + её параметры), он и служит
+    отпечатком входа.
+    """
+    version = ffmpeg_version()
+    if not version:
+        return None
+    if input_path in STREAM_INPUTS:
+        fingerprint = STREAM_INPUTS[input_path].get('content_key')
+    else:
+        fingerprint = file_sha256(input_path)
+    if not fingerprint:
+        return None
+    return result_cache_key(fingerprint, op_type, result_cache_params(operation, params), version)
+
+
+def execute_operation_cached(operation: VideoOperation, op_type: str, input_path: str,
+                             output_path: str, params: dict) -> tuple:
+    """
+    operation.execute с кешем результатов.
+
+    Ключ - хеш содержимого входа, тип операции, канонические параметры (с учётом
+    значений по умолчанию) и версия ffmpeg. При попадании выходные файлы
+    жёстко связываются в директорию задачи, ffmpeg не запускается.
+    Одиночный файл получает имя output_path (расширение сохраняется); наборы файлов
+    (HLS, storyboard, чанки) ссылаются друг на друга по имени и сохраняют исходные имена.
+
+    Кешируются только финальные выходы: промежуточные (temp_*, RAM scratch) не сохраняются.
+    Попадание для выхода в scratch материализуется в папке задачи (tmpfs - другая
+    файловая система, жёсткой ссылки туда нет) - возвращается фактический путь.
+
+    Для входа-потока источник запускается только при промахе: при попадании
+    операция-источник не выполняется вовсе.
+    """
+    try:
+        key = operation_cache_key(operation, op_type, input_path, params)
+    except OSError as e:
+        logger.debug(f"Cannot hash {input_path} for result cache: {e}")
+        key = None
+    if key is None:
+        launch_stream_source(input_path)
+        return operation.execute(input_path, output_path, params)
+    task_id = getattr(_task_context, 'task_id', None)
+    task_label = (task_id or '')[:8]
+    in_scratch = SCRATCH.is_scratch(output_path)
+    intermediate = in_scratch or os.path.basename(output_path).startswith('temp_')
+
+    dest_path = output_path
+    if in_scratch and task_id:
+        dest_path = os.path.join(get_task_dir(task_id), os.path.basename(output_path))
+    hit = RESULT_CACHE.get(key, os.path.dirname(dest_path))
+    if hit:
+        if dest_path != output_path:
+            SCRATCH.discard(output_path)
+        paths = hit['paths']
+        if len(paths) == 1:
+            # Одиночный файл получает имя текущего output_path
+            stem = os.path.splitext(dest_path)[0]
+            renamed = stem + os.path.splitext(paths[0])[1]
+            if renamed != paths[0]:
+                os.replace(paths[0], renamed)
+            paths = [renamed]
+        logger.info(f"[{task_label}] ♻️ Result cache hit: {op_type} ({len(paths)} file(s), key {key[:12]})")
+        if hit['meta'].get('details'):
+            record_operation_details(**hit['meta']['details'])
+        return True, f"{hit['message']} (cached result)", paths[0] if len(paths) == 1 else paths
+
+    launch_stream_source(input_path)
+    result = operation.execute(input_path, output_path, params)
+    if not result[0]:
+        return result
+
+    paths = _operation_result_paths(result, output_path)
+    if intermediate or not paths or not all(os.path.isfile(path) for path in paths):
+        return result
+    # Выход, который операция сама положила в scratch или назвала temp_*, тоже промежуточный
+    if any(SCRATCH.is_scratch(path) or os.path.basename(path).startswith('temp_') for path in paths):
+        return result
+    meta = {'op': op_type, 'details': dict(getattr(_task_context, 'details', None) or {})}
+    if RESULT_CACHE.put(key, paths, result[1], meta=meta):
+        logger.debug(f"[{task_label}] 💾 Result cached: {op_type} ({len(paths)} file(s), key {key[:12]})")
+    return result
+
+
+def execute_operation_spilling(operation: VideoOperation, op_type: str, input_path: str,
+                               output_path: str, params: dict, task_id: str) -> tuple[tuple, str]:
+    """
+    execute_operation_cached с повтором на диске: выход в RAM scratch может перерасти
+    резерв (оценка по размеру источника) и оборваться с ENOSPC. Тогда частичные файлы
+    удаляются из scratch, и операция повторяется с выходом в папке задачи.
+    Вход-поток (FIFO) повторно не читается - такая ошибка возвращается как есть.
+
+    Returns:
+        (result, output_path) - output_path изменится, если операция повторялась на диске
+    """
+    try:
+        result = execute_operation_cached(operation, op_type, input_path, output_path, params)
+    except OSError as e:
+        if e.errno != errno.ENOSPC or not SCRATCH.is_scratch(output_path):
+            raise
+        result = (False, str(e))
+    if result[0] or not SCRATCH.is_scratch(output_path) or input_path in STREAM_INPUTS:
+        return result, output_path
+    if 'No space left' not in str(result[1]) and not SCRATCH.out_of_space():
+        return result, output_path
+
+    name = os.path.basename(output_path)
+    logger.warning(f"[{task_id[:8]}] 💾 Scratch full while writing {name}, retrying {op_type} on disk")
+    stem = os.path.splitext(name)[0]
+    for partial in glob.glob(os.path.join(os.path.dirname(output_path), glob.escape(stem) + '*')):
+        remove_task_file(partial)
+    SCRATCH.record_spill(output_path)
+    pop_ffmpeg_failure()
+    pop_operation_details()
+    disk_path = os.path.join(get_task_dir(task_id), name)
+    return execute_operation_cached(operation, op_type, input_path, disk_path, params), disk_path
+
+
+# ============================================
+# PIPE HANDOFF BETWEEN OPERATIONS
+# ============================================
+
+# Промежуточный поток: NUT не требует перемотки выхода и хранит любые кодеки (-c copy без потерь)
+STREAM_HANDOFF_EXTENSION = 'nut'
+STREAM_HANDOFF_ENABLED = True
+
+# FIFO -> источник, ещё не запущенный (ждёт промаха кеша у читателя)
+_PENDING_STREAM_SOURCES: Dict[str, 'StreamHandoff'] = {}
+
+
+def launch_stream_source(input_path: str):
+    """Запускает источник потока input_path, если он ещё не запущен (обычный файл - ничего)"""
+    handoff = _PENDING_STREAM_SOURCES.pop(input_path, None)
+    if handoff is not None:
+        handoff.launch()
+
+
+def _release_fifo(fifo_path: str):
+    """
+    Освобождает вторую сторону FIFO и удаляет его.
+
+    O_RDWR на FIFO не блокируется и считается и читателем, и писателем: ffmpeg,
+    ждущий в open() другой стороны, просыпается, а после close() получает EOF/EPIPE.
+    Тот, кто придёт после unlink, получит "No such file" вместо вечного ожидания.
+    """
+    try:
+        fd = os.open(fifo_path, os.O_RDWR | os.O_NONBLOCK)
+    except FileNotFoundError:
+        return
+    try:
+        os.unlink(fifo_path)
+    except FileNotFoundError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class StreamHandoff:
+    """
+    Операция-источник, которая пишет выход в FIFO в отдельном потоке, пока следующая
+    операция читает его: этапы выполняются одновременно, промежуточный файл не пишется.
+
+    Источник запускается лениво (launch_stream_source), когда читатель не нашёл свой
+    результат в кеше: при попадании источник не нужен.
+    """
+
+    def __init__(self, operation: VideoOperation, op_type: str, input_path: str, fifo_path: str,
+                 params: dict, info: dict):
+        self.operation = operation
+        self.op_type = op_type
+        self.input_path = input_path
+        self.fifo_path = fifo_path
+        self.params = params
+        self.info = info
+        self.result = None
+        self.ffmpeg_failure = None
+        self.rusage = None
+        self.finished_at = None
+        self._thread = None
+        self._run_args = None
+
+    def prepare(self, task_id: str, op_index: int, total_ops: int, lane: str):
+        """Создаёт FIFO и регистрирует поток; источник ждёт launch()"""
+        os.mkfifo(self.fifo_path)
+        STREAM_INPUTS[self.fifo_path] = self.info
+        _PENDING_STREAM_SOURCES[self.fifo_path] = self
+        self._run_args = (task_id, op_index, total_ops, lane)
+
+    def launch(self):
+        self._thread = threading.Thread(
+            target=self._run,
+            args=self._run_args,
+            name=f"handoff-{self.op_type}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, task_id: str, op_index: int, total_ops: int, lane: str):
+        set_task_context(task_id, self.op_type, op_index, total_ops, lane=lane)
+        try:
+            self.result = self.operation.execute(self.input_path, self.fifo_path, self.params)
+        except Exception as e:
+            logger.error(f"[{task_id[:8]}] ❌ Stream handoff source {self.op_type} crashed: {e}")
+            self.result = (False, str(e))
+        finally:
+            self.ffmpeg_failure = pop_ffmpeg_failure()
+            self.rusage = pop_operation_rusage()
+            clear_task_context()
+            self.finished_at = time.monotonic()
+            # Источник завершился (в т.ч. не открыв FIFO) - читатель не должен ждать вечно
+            _release_fifo(self.fifo_path)
+
+    def finish(self, result: tuple, ffmpeg_failure: dict | None) -> tuple[tuple, dict | None]:
+        """
+        Дожидается источника после завершения операции-читателя.
 
-        # Генерируем собственное имя для аудиофайла в той же директории
-        output_dir = os.path.dirname(output_path)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_audio = os.path.join(output_dir, f"audio_{timestamp}.{audio_format}")
-        logger.debug(f"📁 Output audio path: {output_audio}")
+        Ошибка источника возвращается, только если читатель успешен (выход неполный)
+        или источник упал первым (читатель получил обрыв потока). Если первым упал
+        читатель, источник лишь получил EPIPE - возвращается настоящая ошибка читателя.
 
-        # Извлекаем полное аудио
-        if optimize_for_whisper:
-            # Оптимизация для Whisper API
-            cmd = [
-                'ffmpeg',
-                '-i', input_path,
-                '-vn',
-                '-acodec', 'libmp3lame',
-                '-ar', '16000',  # 16kHz sample rate (оптимально для речи)
-                '-ac', '1',      # Моно
-                '-b:a', '64k',   # Низкий битрейт
-                '-y',
-                output_audio
-            ]
-        else:
-            # Стандартное извлечение
-            cmd = [
-                'ffmpeg',
-                '-i', input_path,
-                '-vn',
-                '-acodec', 'libmp3lame' if audio_format == 'mp3' else 'aac',
-                '-b:a', bitrate,
-                '-y',
-                output_audio
-            ]
-        
-        logger.debug(f"📹 ════════════════════════════════════════════════════════════")
-        logger.debug(f"📹 FFmpeg COMMAND for audio extraction:")
-        logger.debug(f"📹 {' '.join(cmd)}")
+        Returns:
+            (result, ffmpeg_failure)
+        """
+        reader_finished_at = time.monotonic()
+        _PENDING_STREAM_SOURCES.pop(self.fifo_path, None)
+        if self._thread is None:
+            # Источник не понадобился (результат читателя из кеша) или читатель упал до запуска
+            STREAM_INPUTS.pop(self.fifo_path, None)
+            if os.path.exists(self.fifo_path):
+                os.remove(self.fifo_path)
+            logger.debug(f"Stream handoff source {self.op_type} was not started")
+            return result, ffmpeg_failure
+        # Читатель мог упасть, не открыв FIFO - освобождаем источник, ждущий в open()
+        while self._thread.is_alive():
+            _release_fifo(self.fifo_path)
+            self._thread.join(timeout=0.5)
+        STREAM_INPUTS.pop(self.fifo_path, None)
+
+        if not self.result or self.result[0]:
+            return result, ffmpeg_failure
+        source_error = (False, f"{self.op_type} (streamed) failed: {self.result[1]}"), self.ffmpeg_failure
+        if result[0] or (self.finished_at is not None and self.finished_at <= reader_finished_at):
+            return source_error
+        logger.debug(f"Stream handoff source {self.op_type} stopped after the reader failed: {self.result[1]}")
+        return result, ffmpeg_failure
+
+
+def stream_handoff_info(operation: VideoOperation, params: dict, next_op_data: dict | None,
+                        input_path: str) -> dict | None:
+    """Описание потока, если выход операции можно отдать следующей через FIFO; None - нужен файл"""
+    if not STREAM_HANDOFF_ENABLED or not next_op_data or operation.is_terminal(params):
+        return None
+    next_operation = OPERATIONS_REGISTRY.get(next_op_data.get('type'))
+    if next_operation is None or not next_operation.accepts_stream_input(next_op_data):
+        return None
+    return operation.stream_output_info(input_path, params)
 
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        logger.debug(f"📊 FFmpeg return code: {result.returncode}")
-        if result.stdout:
-            logger.debug(f"📋 FFmpeg stdout: {result.stdout[:500]}")
-        if result.stderr:
-            logger.debug(f"⚠️  FFmpeg stderr: {result.stderr[:500]}")
-        
-        if result.returncode != 0:
-            logger.error(f"❌ FFmpeg error during audio extraction: {result.stderr}")
-            return False, f"FFmpeg error: {result.stderr}", output_audio
 
-        os.chmod(output_audio, 0o644)
-        file_size = os.path.getsize(output_audio)
-        file_size_mb = file_size / (1024 * 1024)
-        logger.debug(f"📊 Audio file created: {file_size_mb:.2f}MB")
+def start_stream_handoff(operation: VideoOperation, op_type: str, params: dict, next_op_data: dict | None,
+                         input_path: str, task_id: str, op_index: int, total_ops: int,
+                         lane: str) -> StreamHandoff | None:
+    """
+    Запускает операцию источником потока для следующей операции, если обе это допускают.
+    None - операция выполняется обычным образом с промежуточным файлом.
+    """
+    info = stream_handoff_info(operation, params, next_op_data, input_path)
+    if info is None:
+        return None
+    try:
+        content_key = operation_cache_key(operation, op_type, input_path, params)
+    except OSError as e:
+        logger.debug(f"Cannot hash {input_path} for result cache: {e}")
+        content_key = None
+    if content_key and RESULT_CACHE.lookup(content_key):
+        # Выход источника уже в кеше - файл берётся оттуда, поток ничего не ускорит
+        return None
+    # Ключ содержимого потока: по нему кешируется результат читателя
+    info = {**info, 'content_key': content_key}
 
-        # Получаем длительность аудио
-        probe_cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            output_audio
-        ]
-        logger.debug(f"📊 Running ffprobe: {' '.join(probe_cmd)}")
-        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-        
-        if probe_result.returncode != 0:
-            logger.error(f"❌ FFprobe error: {probe_result.stderr}")
-            return False, f"FFprobe error: {probe_result.stderr}", output_audio
-            
-        total_duration = float(probe_result.stdout.strip())
-        logger.debug(f"⏱️  Audio duration: {total_duration:.2f}s ({total_duration/60:.2f} min)")
+    fifo_path = os.path.join(get_task_dir(task_id), f"temp_{op_index}_{uuid.uuid4()}.{STREAM_HANDOFF_EXTENSION}")
+    handoff = StreamHandoff(operation, op_type, input_path, fifo_path, params, info)
+    try:
+        handoff.prepare(task_id, op_index, total_ops, lane)
+    except OSError as e:
+        logger.warning(f"[{task_id[:8]}] Stream handoff unavailable, using a temp file: {e}")
+        STREAM_INPUTS.pop(fifo_path, None)
+        _PENDING_STREAM_SOURCES.pop(fifo_path, None)
+        if os.path.exists(fifo_path):
+            os.remove(fifo_path)
+        return None
+    logger.info(f"[{task_id[:8]}] 🔀 Streaming {op_type} -> {next_op_data['type']} through a pipe (no temp file)")
+    return handoff
 
-        # Проверяем нужно ли разбивать на чанки
-        if chunk_duration_minutes or file_size_mb > max_chunk_size_mb:
-            # Определяем длительность чанка
-            if chunk_duration_minutes:
-                chunk_duration_seconds = chunk_duration_minutes * 60
-            else:
-                # Автоматически вычисляем длительность чанка
-                chunk_duration_seconds = (max_chunk_size_mb / file_size_mb) * total_duration * 0.95  # 5% запас
 
-            logger.info(f"🔊 Audio chunking enabled: {chunk_duration_seconds/60:.1f} min/chunk, file_size={file_size_mb:.2f}MB, max_chunk_size={max_chunk_size_mb}MB")
+# ============================================
+# DRY-RUN PLAN (POST /plan)
+# ============================================
 
-            # Разбиваем на чанки
-            chunk_start = 0
-            chunk_index = 0
-            chunk_files = []  # список ПОЛНЫХ путей к файлам чанков
+# Папка dry run в командах плана заменяется на это обозначение
+PLAN_TASK_DIR_PLACEHOLDER = '{task_dir}'
 
-            while chunk_start < total_duration:
-                chunk_end = min(chunk_start + chunk_duration_seconds, total_duration)
-                chunk_filename = f"audio_{timestamp}_chunk{chunk_index:03d}.{audio_format}"
-                chunk_path = os.path.join(output_dir, chunk_filename)
-                logger.debug(f"📦 Creating chunk {chunk_index}: {chunk_start:.2f}s - {chunk_end:.2f}s -> {chunk_path}")
-
-                # Извлекаем чанк
-                if optimize_for_whisper:
-                    chunk_cmd = [
-                        'ffmpeg',
-                        '-i', output_audio,
-                        '-ss', str(chunk_start),
-                        '-t', str(chunk_end - chunk_start),
-                        '-acodec', 'libmp3lame',
-                        '-ar', '16000',  # 16kHz
-                        '-ac', '1',      # Моно
-                        '-b:a', '64k',   # Низкий bitrate
-                        '-y',
-                        chunk_path
-                    ]
-                else:
-                    chunk_cmd = [
-                        'ffmpeg',
-                        '-i', output_audio,
-                        '-ss', str(chunk_start),
-                        '-t', str(chunk_end - chunk_start),
-                        '-acodec', 'libmp3lame' if audio_format == 'mp3' else 'aac',
-                        '-b:a', bitrate,
-                        '-y',
-                        chunk_path
-                    ]
 
-                chunk_result = subprocess.run(chunk_cmd, capture_output=True, text=True)
-                logger.debug(f"📊 Chunk {chunk_index} FFmpeg return code: {chunk_result.returncode}")
-                
-                if chunk_result.returncode != 0:
-                    logger.error(f"❌ Chunk {chunk_index} error: {chunk_result.stderr}")
-                    chunk_start = chunk_end
-                    chunk_index += 1
-                    continue
+def probe_plan_source(source: str) -> dict | None:
+    """
+    Свойства источника одним вызовом ffprobe (по URL читаются только заголовки):
+    {'duration', 'size', 'stream_types', 'bytes', 'bit_rate'}; None если ffprobe не смог
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration,size,bit_rate:stream=codec_type,width,height',
+        '-of', 'json',
+        source
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        if result.returncode != 0:
+            logger.debug(f"ffprobe failed for {source}: {result.stderr[:200]}")
+            return None
+        data = json.loads(result.stdout or '{}')
+    except Exception as e:
+        logger.debug(f"ffprobe error for {source}: {e}")
+        return None
 
-                os.chmod(chunk_path, 0o644)
-                chunk_size = os.path.getsize(chunk_path) / (1024 * 1024)
-                logger.debug(f"✅ Chunk {chunk_index} created: {chunk_size:.2f}MB")
-                # сохраняем полный путь, чтобы pipeline и metadata могли корректно обработать
-                chunk_files.append(chunk_path)
-                
-                chunk_start = chunk_end
-                chunk_index += 1
+    def positive(value):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        return number if number > 0 else None
+
+    fmt = data.get('format') or {}
+    streams = data.get('streams') or []
+    video = next((s for s in streams if s.get('codec_type') == 'video' and s.get('width')), None)
+    size = positive(fmt.get('size'))
+    bit_rate = positive(fmt.get('bit_rate'))
+    return {
+        'duration': positive(fmt.get('duration')),
+        'size': (int(video['width']), int(video['height'])) if video else None,
+        'stream_types': sorted({s['codec_type'] for s in streams if s.get('codec_type')}),
+        'bytes': int(size) if size else None,
+        'bit_rate': int(bit_rate) if bit_rate else None
+    }
 
-            # Удаляем полный аудиофайл, оставляем только чанки
-            if os.path.exists(output_audio):
-                os.remove(output_audio)
-                logger.debug(f"🗑️  Deleted full audio file: {output_audio}")
 
-            logger.debug(f"✅ Split audio into {len(chunk_files)} chunks")
+def _plan_input_dependencies(op_type: str, params: dict) -> list:
+    """Что из содержимого входа нужно операции для точных команд (без файла - недоступно)"""
+    needs = []
+    if op_type in ('analyze_media', 'storyboard'):
+        needs.append('probe cache lookup by content')
+    if resolve_loudnorm_target(params.get('normalize_audio')):
+        needs.append('loudness measurement (the loudnorm apply filter is left out)')
+    if op_type == 'make_short' and params.get('executor') == 'parallel':
+        needs.append('keyframes (parallel segment split points)')
+    if SEEK_TWO_STAGE_ENABLED and op_type == 'make_short' and params.get('start_time') is not None:
+        needs.append('keyframes (input seek point before start_time)')
+    if op_type == 'make_short' and params.get('target_quality'):
+        needs.append('sample encodes (target_quality CRF search)')
+    if op_type == 'cut_video' and params.get('segments') is not None:
+        needs.append('keyframes (clip start points)')
+    if op_type == 'concat':
+        needs.append('codec parameters (stream copy or one encode)')
+    if op_type == 'extract_audio':
+        needs.append('audio codec parameters (stream copy or encode)')
+    if params.get('max_output_mb') is not None:
+        needs.append('output size (max_output_mb re-encodes are not planned)')
+    return needs
+
+
+def build_pipeline_plan(video_url: str, operations: list, download_source: bool = False) -> tuple[bool, str, dict]:
+    """
+    Dry run pipeline: что выполнит каждая операция, ничего не выполняя.
 
-            # Возвращаем список полных путей к чанкам
-            logger.info(f"✅ Audio extracted and split into {len(chunk_files)} chunks ({total_duration/60:.2f} min total)")
-            return True, f"Audio extracted and split into {len(chunk_files)} chunks", chunk_files
+    Операции вызываются в режиме записи (start_plan_recording): ffmpeg не запускается,
+    команды попадают в план. Файлы, которых ещё нет (источник по URL, промежуточные
+    выходы), описываются в PLANNED_INPUTS - ffprobe источника и оценки предыдущих шагов.
+    file:// и download_source=True дают точный план: источник читается целиком
+    (ключевые кадры, громкость, хеш для result cache).
 
+    Returns:
+        (ok, message, plan) - при ok=False plan содержит шаги до ошибки
+    """
+    plan_dir = tempfile.mkdtemp(prefix='plan_')
+    planned_paths = []
+    steps = []
+    try:
+        input_path = os.path.join(plan_dir, f"input_{uuid.uuid4()}.mp4")
+        exact_source = True
+        if video_url.startswith('file://'):
+            local_path = video_url[len('file://'):]
+            if not os.path.isfile(local_path):
+                return False, f"Local file not found: {local_path}", {}
+            os.symlink(os.path.abspath(local_path), input_path)
+        elif download_source:
+            ok, msg = download_media_with_validation(video_url, input_path)
+            if not ok:
+                return False, msg, {}
         else:
-            # Файл не требует разбиения
-            logger.info(f"✅ Audio extracted to {audio_format}: {file_size_mb:.2f}MB, {total_duration/60:.2f} min")
-            return True, f"Audio extracted to {audio_format}", output_audio
+            exact_source = False
 
+        source = probe_plan_source(input_path if exact_source else video_url)
+        if source is None:
+            return False, "Cannot probe source media (ffprobe failed)", {}
+        if not exact_source:
+            PLANNED_INPUTS[input_path] = source
+            planned_paths.append(input_path)
 
-# Регистрация всех операций
-OPERATIONS_REGISTRY = {
-    'cut_video': CutVideoOperation(),
-    'make_short': MakeShortOperation(),
-    'extract_audio': ExtractAudioOperation(),
-}
+        def display(value):
+            return value.replace(plan_dir, PLAN_TASK_DIR_PLACEHOLDER) if isinstance(value, str) else value
+
+        version = ffmpeg_version()
+        current_hash = file_sha256(input_path) if exact_source and version else None
+        current_input = input_path
+        current_info = source
+        streamed_input = False
+        temp_live = []  # размеры промежуточных файлов на диске/в scratch по шагам
+
+        for idx, op_data in enumerate(operations):
+            op_type = op_data['type']
+            operation = OPERATIONS_REGISTRY[op_type]
+            params = {**operation.optional_params, **op_data}
+            next_op_data = operations[idx + 1] if idx + 1 < len(operations) else None
+            is_last = next_op_data is None
+
+            # Result cache - те же ключи, что в execute_operation_cached (вход-поток - ключ источника)
+            key, cached_entry, key_error = None, None, False
+            if version and current_hash is not None:
+                try:
+                    key = result_cache_key(current_hash, op_type, result_cache_params(operation, op_data), version)
+                    cached_entry = RESULT_CACHE.lookup(key)
+                except OSError:
+                    key_error = True
+
+            # Pipe handoff - те же условия, что в pipeline (читатель потока сам источником не бывает,
+            # выход из кеша не стримится)
+            stream_info = None
+            if not streamed_input and not cached_entry:
+                stream_info = stream_handoff_info(operation, op_data, next_op_data, current_input)
+            if stream_info is not None:
+                output_path = os.path.join(plan_dir, f"temp_{idx}_{uuid.uuid4()}.{STREAM_HANDOFF_EXTENSION}")
+            elif is_last:
+                output_path = final_output_path(plan_dir, op_type)
+            else:
+                output_path = os.path.join(plan_dir, f"temp_{idx}_{uuid.uuid4()}.mp4")
+
+            if not version:
+                cache_status = 'disabled'
+            elif key is None or key_error:
+                cache_status = 'unknown'  # содержимое входа неизвестно до выполнения
+            elif stream_info is not None:
+                cache_status = 'bypassed'  # выход уходит потоком и не сохраняется
+            else:
+                cache_status = 'hit' if cached_entry else 'miss'
+
+            duration = operation.expected_duration(current_input, op_data)
+            estimate = estimate_output(op_type, params, current_info, duration)
+            notes = []
+
+            start_plan_recording()
+            result, failure = None, None
+            try:
+                result = operation.execute(current_input, output_path, op_data)
+            except Exception as e:
+                failure = display(str(e))
+            finally:
+                commands = stop_plan_recording()
+            if failure and commands:
+                # Дальше операция читает собственный выход (ffprobe, чанки, проверка файлов)
+                notes.append(f"Planning stopped after the encode: the remaining steps read its output ({failure})")
+            elif failure:
+                notes.append(f"Commands cannot be compiled before the input exists ({failure})")
+
+            if result is not None and not result[0]:
+                steps.append({'index': idx, 'type': op_type, 'error': result[1]})
+                return False, f"Operation '{op_type}' would fail: {result[1]}", {'steps': steps}
+
+            dependencies = _plan_input_dependencies(op_type, op_data)
+            if dependencies and virtual_input_info(current_input) is not None:
+                notes.append(f"Commands are approximate until the input exists: {'; '.join(dependencies)}")
+            if cache_status == 'hit':
+                notes.append("Result cache hit: these commands are skipped, the cached output is linked")
+                if streamed_input:
+                    # Источник потока запускается только при промахе читателя
+                    steps[-1]['estimate']['cpu_seconds'] = 0.0
+                    steps[-1]['notes'].append("Not started: the next step's result is cached")
+
+            media_seconds = duration or current_info.get('duration')
+            cpu_seconds = 0.0 if cache_status == 'hit' else COST_MODEL.cpu_seconds(op_type, media_seconds)
+            temp_live.append((estimate['bytes'] or 0) if not is_last and stream_info is None else 0)
+            steps.append({
+                'index': idx,
+                'type': op_type,
+                'input': display(current_input),
+                'output': display(output_path),
+                'streamed_input': streamed_input,
+                'streamed_to_next': stream_info is not None,
+                'result_cache': cache_status,
+                'complete': failure is None,
+                'commands': [
+                    {
+                        'command': display(shlex.join(call['cmd'])),
+                        'args': [display(arg) for arg in call['cmd']],
+                        'media_seconds': call['duration']
+                    }
+                    for call in commands
+                ],
+                'estimate': {
+                    'cpu_seconds': cpu_seconds,
+                    'output_duration': round(duration, 3) if duration else None,
+                    'output_bytes': estimate['bytes'],
+                    'output_files': estimate['files'],
+                    'output_size': estimate['size']
+                },
+                'notes': notes
+            })
+
+            # Вход следующего шага: поток, файл из кеша или оценка выхода
+            if result is not None and len(result) == 3 and result[2]:
+                produced = result[2]
+                output_path = produced[0] if isinstance(produced, list) else produced
+            if stream_info is not None:
+                current_hash = key
+            else:
+                current_hash = cached_entry['files'][0]['object'] if cached_entry else None
+            current_info = stream_info if stream_info is not None else {
+                field: estimate[field] for field in ('duration', 'size', 'stream_types', 'bytes')
+            }
+            PLANNED_INPUTS[output_path] = current_info
+            planned_paths.append(output_path)
+            current_input = output_path
+            streamed_input = stream_info is not None
+
+        # Scratch: источник + одновременно живущие промежуточные файлы (текущий вход и выход)
+        source_bytes = source.get('bytes') or 0
+        peak_temp = max((a + b for a, b in zip([0] + temp_live, temp_live)), default=0)
+        temp_count = max((bool(a) + bool(b) for a, b in zip([0] + temp_live, temp_live)), default=0)
+        # Резерв в RAM scratch считается так же, как при выполнении (scratch_temp_path)
+        ram_reservation = int(source_bytes * (1 + temp_count * SCRATCH_TEMP_SIZE_FACTOR))
+        scratch_stats = SCRATCH.usage()
+        ram_free = max(0, SCRATCH.budget_bytes - scratch_stats['reserved_bytes']) if SCRATCH.enabled else 0
+
+        final_step = steps[-1]
+        cpu_values = [step['estimate']['cpu_seconds'] for step in steps]
+        return True, "Plan built", {
+            'video_url': video_url,
+            'source': {
+                'exact': exact_source,
+                'duration': source.get('duration'),
+                'size': source.get('size'),
+                'stream_types': source.get('stream_types'),
+                'bytes': source.get('bytes'),
+                'bit_rate': source.get('bit_rate')
+            },
+            'ffmpeg_version': version or None,
+            'steps': steps,
+            'estimates': {
+                'cpu_seconds': round(sum(cpu_values), 1) if all(v is not None for v in cpu_values) else None,
+                'output_bytes': final_step['estimate']['output_bytes'],
+                'output_files': final_step['estimate']['output_files'],
+                'scratch': {
+                    'source_bytes': source_bytes,
+                    'peak_intermediate_bytes': peak_temp,
+                    'peak_bytes': source_bytes + peak_temp,
+                    'ram_enabled': SCRATCH.enabled,
+                    'ram_reservation_bytes': ram_reservation,
+                    'ram_free_bytes': ram_free,
+                    'fits_ram': SCRATCH.enabled and ram_reservation <= ram_free
+                },
+                'cost_model': COST_MODEL.snapshot()
+            }
+        }
+    finally:
+        stop_plan_recording()
+        for path in planned_paths:
+            PLANNED_INPUTS.pop(path, None)
+        shutil.rmtree(plan_dir, ignore_errors=True)
 
 # Вызов логирования после определения всех параметров — выводим один раз на контейнер
 _log_startup_once()
@@ -1957,7 +5265,12 @@ def health_check():
             },
             "cleanup": {
                 "interval_seconds": CLEANUP_INTERVAL_SECONDS
-            }
+            },
+            "cache": {
+                "probe": {"hits": PROBE_CACHE.hits, "misses": PROBE_CACHE.misses},
+                "results": {"max_bytes": RESULT_CACHE_MAX_BYTES, **RESULT_CACHE.stats()}
+            },
+            "scratch": SCRATCH.usage()
         },
         
         "pro_features": {
@@ -1976,37 +5289,43 @@ def health_check():
         }
     })
 
+# Ответ /fonts неизменен в рамках процесса - сериализуем один раз
+_FONTS_RESPONSE_CACHE: Dict[str, Any] = {}
+
+
+def _get_fonts_response_cache() -> dict:
+    """Возвращает {'body': bytes, 'etag': str} для /fonts (строится при первом запросе)"""
+    if not _FONTS_RESPONSE_CACHE:
+        fonts = FONT_REGISTRY.listing()
+        payload = {
+            "status": "success",
+            "total_fonts": len(fonts),
+            "total_faces": sum(len(f['faces']) for f in fonts),
+            "fonts": fonts,
+            "note": "These are the custom fonts available for video generation in /app/fonts/. "
+                    "Use a filename, family, 'family style' or 'family:style' as text_items[].fontfile"
+        }
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        _FONTS_RESPONSE_CACHE['etag'] = hashlib.sha1(body).hexdigest()
+        _FONTS_RESPONSE_CACHE['body'] = body
+    return _FONTS_RESPONSE_CACHE
+
+
 @app.route('/fonts', methods=['GET'])
 @require_api_key
 def list_fonts():
     """
     Получить список доступных шрифтов из /app/fonts/
-    Возвращает только шрифты, которые зашиты в контейнер для использования при генерации шорцев
+    Возвращает только шрифты, которые зашиты в контейнер для использования при генерации шорцев.
+    Ответ кешируется (реестр строится при старте) и отдаётся с ETag (If-None-Match -> 304).
     """
     try:
-        available_fonts = []
-        
-        # Только шрифты из /app/fonts/
-        app_fonts_dir = "/app/fonts"
-        if os.path.exists(app_fonts_dir):
-            for filename in sorted(os.listdir(app_fonts_dir)):
-                if filename.lower().endswith(('.ttf', '.ttc', '.otf')):
-                    font_path = os.path.join(app_fonts_dir, filename)
-                    # Название шрифта = имя файла без расширения
-                    font_name = filename.rsplit('.', 1)[0]
-                    available_fonts.append({
-                        "name": font_name,
-                        "filename": filename,
-                        "file": font_path,
-                        "type": filename.lower().split('.')[-1]
-                    })
-
-        return jsonify({
-            "status": "success",
-            "total_fonts": len(available_fonts),
-            "fonts": available_fonts,
-            "note": "These are the custom fonts available for video generation in /app/fonts/"
-        })
+        cached = _get_fonts_response_cache()
+        response = app.response_class(cached['body'], mimetype='application/json')
+        response.set_etag(cached['etag'])
+        # private: ответ за API-ключом - общие прокси/CDN не должны его хранить
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response.make_conditional(request)
 
     except Exception as e:
         logger.error(f"Error listing fonts: {e}")
@@ -2023,16 +5342,30 @@ def download_file(file_path):
     try:
         full_path = os.path.join(TASKS_DIR, file_path)
         
-        # Проверка безопасности - файл должен быть внутри TASKS_DIR
-        if not os.path.abspath(full_path).startswith(os.path.abspath(TASKS_DIR)):
+        # Проверка безопасности - файл должен быть внутри TASKS_DIR и не в служебном каталоге
+        if (not os.path.abspath(full_path).startswith(os.path.abspath(TASKS_DIR))
+                or not is_task_dir_name(os.path.normpath(file_path))):
             return jsonify(create_simple_error(
                 "Invalid file path",
                 ERROR_INVALID_PATH
             )), 403
 
         if os.path.exists(full_path) and os.path.isfile(full_path):
+            # Файл ещё кодируется (output_mode=fragmented) - отдаём потоком по мере записи
+            marker = full_path + GROWING_FILE_SUFFIX
+            if os.path.exists(marker):
+                return Response(
+                    stream_with_context(_stream_growing_file(full_path, marker)),
+                    mimetype=mimetypes.guess_type(full_path)[0] or 'application/octet-stream',
+                    headers={
+                        'Content-Disposition': f'attachment; filename="{os.path.basename(full_path)}"',
+                        'Cache-Control': 'no-store'
+                    }
+                )
             # conditional=True позволяет поддерживать диапазоны (Range) и эффективное кеширование
-            return send_file(full_path, as_attachment=True, conditional=True)
+            # Плейлисты и сегменты HLS/DASH отдаём inline - их читает плеер, а не браузер
+            is_streaming = os.path.splitext(full_path)[1].lower() in STREAMING_MIME_TYPES
+            return send_file(full_path, as_attachment=not is_streaming, conditional=True)
         else:
             return jsonify(create_simple_error(
                 "File not found",
@@ -2077,12 +5410,21 @@ def get_task_status(task_id):
             # Для всех статусов возвращаем данные из Redis
             if status in ['queued', 'processing']:
                 # Задачи в процессе - минимальный статус
-                return jsonify({
+                response = {
                     "task_id": task_id,
                     "status": status,
                     "created_at": task.get('created_at'),
                     "progress": task.get('progress', 0)
-                })
+                }
+                if task.get('current_operation'):
+                    response["current_operation"] = task['current_operation']
+                if task.get('encode'):
+                    # Живой прогресс ffmpeg: fps, speed (x realtime), ETA текущей операции
+                    response["encode"] = task['encode']
+                if task.get('streaming_output'):
+                    # Финальный файл пишется как fMP4 - его можно скачивать уже сейчас
+                    response["streaming_output"] = task['streaming_output']
+                return jsonify(response)
             
             if status == 'completed':
                 # Завершённые задачи - полная структура из Redis
@@ -2155,6 +5497,144 @@ def list_all_tasks():
         logger.error(f"List tasks error: {e}")
         return jsonify(create_simple_error(str(e), ERROR_INTERNAL_SERVER)), 500
 
+def parse_process_request(data: dict) -> tuple[dict | None, tuple | None]:
+    """
+    Разбор и валидация тела /process_video (общая для /plan).
+
+    Returns:
+        (поля запроса, None) или (None, (ответ, HTTP-статус)) при ошибке
+    """
+    # Базовые параметры
+    video_url = data.get('video_url')
+    execution = data.get('execution', 'sync')  # sync или async
+    operations = data.get('operations', [])
+
+    # Webhook - только новый формат (объект с url и headers)
+    webhook = data.get('webhook')
+    webhook_url = None
+    webhook_headers = None
+
+    if webhook is not None:
+        # Принимаем только объект формата: {"url": "...", "headers": {...}}
+        if not isinstance(webhook, dict):
+            return None, (jsonify({"error": "Invalid webhook (must be an object with 'url' and optional 'headers')"}), 400)
+
+        webhook_url = webhook.get('url')
+        webhook_headers = webhook.get('headers')
+
+        # Валидация webhook.url
+        if webhook_url is not None:
+            if not isinstance(webhook_url, str) or not webhook_url.lower().startswith(("http://", "https://")):
+                return None, (jsonify({"error": "Invalid webhook.url (must start with http(s)://)"}), 400)
+            if len(webhook_url) > 2048:
+                return None, (jsonify({"error": "Invalid webhook.url (too long)"}), 400)
+
+        # Валидация webhook.headers
+        if webhook_headers is not None:
+            if not isinstance(webhook_headers, dict):
+                return None, (jsonify({"error": "Invalid webhook.headers (must be an object)"}), 400)
+            for key, value in webhook_headers.items():
+                if not isinstance(key, str) or not isinstance(value, str):
+                    return None, (jsonify({"error": "Invalid webhook.headers (keys and values must be strings)"}), 400)
+                if len(key) > 256 or len(value) > 2048:
+                    return None, (jsonify({"error": "Invalid webhook.headers (header name or value too long)"}), 400)
+
+    # Fallback на DEFAULT_WEBHOOK_URL если webhook не указан
+    if webhook_url is None and DEFAULT_WEBHOOK_URL:
+        webhook_url = DEFAULT_WEBHOOK_URL
+
+    # Произвольные метаданные клиента для сквозного возврата в ответах/вебхуках
+    client_meta = data.get('client_meta')
+    if client_meta is None and 'meta' in data:
+        # Поддержка алиаса 'meta' для совместимости
+        client_meta = data.get('meta')
+
+    # Если client_meta пришёл строкой, пытаемся распарсить как JSON-объект
+    if isinstance(client_meta, str):
+        try:
+            # Сначала проверим грубый лимит размера строки до парсинга
+            if len(client_meta.encode('utf-8')) > MAX_CLIENT_META_BYTES:
+                return None, (jsonify({
+                    "status": "error",
+                    "error": f"Invalid client_meta: exceeds {MAX_CLIENT_META_BYTES} bytes"
+                }), 400)
+            parsed = json.loads(client_meta)
+            if not isinstance(parsed, dict):
+                return None, (jsonify({
+                    "status": "error",
+                    "error": "Invalid client_meta: must be an object or JSON stringified object"
+                }), 400)
+            client_meta = parsed
+        except json.JSONDecodeError as e:
+            return None, (jsonify({
+                "status": "error",
+                "error": f"Invalid client_meta: JSON parse error ({str(e)})"
+            }), 400)
+
+    # Пытаемся распарсить вложенные JSON-строки (вроде {{ $json.metadata.toJsonString() }})
+    if isinstance(client_meta, (dict, list)):
+        client_meta = normalize_client_meta(client_meta)
+
+    # Валидация client_meta с ограничениями
+    ok, err = validate_client_meta(client_meta)
+    if not ok:
+        return None, (jsonify({
+            "status": "error",
+            "error": f"Invalid client_meta: {err}"
+        }), 400)
+
+    if not video_url:
+        return None, (jsonify(create_simple_error("video_url is required", ERROR_MISSING_REQUIRED_FIELD)), 400)
+
+    if not operations:
+        return None, (jsonify(create_simple_error("operations list is required", ERROR_MISSING_REQUIRED_FIELD)), 400)
+
+    # Валидация операций
+    error_msg = validate_pipeline_operations(operations)
+    if error_msg:
+        return None, (jsonify({
+            "status": "error",
+            "error": error_msg
+        }), 400)
+
+    return {
+        'video_url': video_url,
+        'execution': execution,
+        'operations': operations,
+        'webhook': webhook,
+        'webhook_url': webhook_url,
+        'webhook_headers': webhook_headers,
+        'client_meta': client_meta,
+    }, None
+
+
+def validate_pipeline_operations(operations: list) -> str | None:
+    """Проверка списка операций pipeline (типы, параметры, порядок); текст ошибки или None"""
+    for op_index, op in enumerate(operations):
+        op_type = op.get('type')
+        if not op_type:
+            return "Each operation must have 'type' field"
+
+        if op_type not in OPERATIONS_REGISTRY:
+            return f"Unknown operation type: {op_type}. Available: {list(OPERATIONS_REGISTRY.keys())}"
+
+        # Валидация параметров операции
+        operation_handler = OPERATIONS_REGISTRY[op_type]
+        is_valid, error_msg = operation_handler.validate(op)
+        if not is_valid:
+            return f"Operation '{op_type}' validation failed: {error_msg}"
+
+        if operation_handler.is_terminal(op) and op_index != len(operations) - 1:
+            return f"Operation '{op_type}' must be the last operation in the pipeline"
+
+        # PUBLIC VERSION: Ограничение на количество text_items (max 2)
+        if op_type == 'make_short':
+            for text_items in [op.get('text_items', []), *(op.get('variants') or [])]:
+                if len(text_items) > 2:
+                    return f"Public version supports max 2 text items per operation. You have {len(text_items)} items. Upgrade to Pro for up to 10 text items."
+    return None
+
+
 @app.route('/process_video', methods=['POST'])
 @require_api_key
 def process_video():
@@ -2192,123 +5672,14 @@ def process_video():
         if not data:
             return jsonify(create_simple_error("JSON data required", ERROR_INVALID_JSON)), 400
 
-        # Базовые параметры
-        video_url = data.get('video_url')
-        execution = data.get('execution', 'sync')  # sync или async
-        operations = data.get('operations', [])
-
-        # Webhook - только новый формат (объект с url и headers)
-        webhook = data.get('webhook')
-        webhook_url = None
-        webhook_headers = None
-
-        if webhook is not None:
-            # Принимаем только объект формата: {"url": "...", "headers": {...}}
-            if not isinstance(webhook, dict):
-                return jsonify({"error": "Invalid webhook (must be an object with 'url' and optional 'headers')"}), 400
-
-            webhook_url = webhook.get('url')
-            webhook_headers = webhook.get('headers')
-
-            # Валидация webhook.url
-            if webhook_url is not None:
-                if not isinstance(webhook_url, str) or not webhook_url.lower().startswith(("http://", "https://")):
-                    return jsonify({"error": "Invalid webhook.url (must start with http(s)://)"}), 400
-                if len(webhook_url) > 2048:
-                    return jsonify({"error": "Invalid webhook.url (too long)"}), 400
-
-            # Валидация webhook.headers
-            if webhook_headers is not None:
-                if not isinstance(webhook_headers, dict):
-                    return jsonify({"error": "Invalid webhook.headers (must be an object)"}), 400
-                for key, value in webhook_headers.items():
-                    if not isinstance(key, str) or not isinstance(value, str):
-                        return jsonify({"error": "Invalid webhook.headers (keys and values must be strings)"}), 400
-                    if len(key) > 256 or len(value) > 2048:
-                        return jsonify({"error": "Invalid webhook.headers (header name or value too long)"}), 400
-
-        # Fallback на DEFAULT_WEBHOOK_URL если webhook не указан
-        if webhook_url is None and DEFAULT_WEBHOOK_URL:
-            webhook_url = DEFAULT_WEBHOOK_URL
-
-        # Произвольные метаданные клиента для сквозного возврата в ответах/вебхуках
-        client_meta = data.get('client_meta')
-        if client_meta is None and 'meta' in data:
-            # Поддержка алиаса 'meta' для совместимости
-            client_meta = data.get('meta')
-
-        # Если client_meta пришёл строкой, пытаемся распарсить как JSON-объект
-        if isinstance(client_meta, str):
-            try:
-                # Сначала проверим грубый лимит размера строки до парсинга
-                if len(client_meta.encode('utf-8')) > MAX_CLIENT_META_BYTES:
-                    return jsonify({
-                        "status": "error",
-                        "error": f"Invalid client_meta: exceeds {MAX_CLIENT_META_BYTES} bytes"
-                    }), 400
-                parsed = json.loads(client_meta)
-                if not isinstance(parsed, dict):
-                    return jsonify({
-                        "status": "error",
-                        "error": "Invalid client_meta: must be an object or JSON stringified object"
-                    }), 400
-                client_meta = parsed
-            except json.JSONDecodeError as e:
-                return jsonify({
-                    "status": "error",
-                    "error": f"Invalid client_meta: JSON parse error ({str(e)})"
-                }), 400
-
-        # Пытаемся распарсить вложенные JSON-строки (вроде {{ $json.metadata.toJsonString() }})
-        if isinstance(client_meta, (dict, list)):
-            client_meta = normalize_client_meta(client_meta)
-
-        # Валидация client_meta с ограничениями
-        ok, err = validate_client_meta(client_meta)
-        if not ok:
-            return jsonify({
-                "status": "error",
-                "error": f"Invalid client_meta: {err}"
-            }), 400
-
-        if not video_url:
-            return jsonify(create_simple_error("video_url is required", ERROR_MISSING_REQUIRED_FIELD)), 400
-
-        if not operations:
-            return jsonify(create_simple_error("operations list is required", ERROR_MISSING_REQUIRED_FIELD)), 400
-
-        # Валидация операций
-        for op in operations:
-            op_type = op.get('type')
-            if not op_type:
-                return jsonify({
-                    "status": "error",
-                    "error": "Each operation must have 'type' field"
-                }), 400
-
-            if op_type not in OPERATIONS_REGISTRY:
-                return jsonify({
-                    "status": "error",
-                    "error": f"Unknown operation type: {op_type}. Available: {list(OPERATIONS_REGISTRY.keys())}"
-                }), 400
-
-            # Валидация параметров операции
-            operation_handler = OPERATIONS_REGISTRY[op_type]
-            is_valid, error_msg = operation_handler.validate(op)
-            if not is_valid:
-                return jsonify({
-                    "status": "error",
-                    "error": f"Operation '{op_type}' validation failed: {error_msg}"
-                }), 400
-
-            # PUBLIC VERSION: Ограничение на количество text_items (max 2)
-            if op_type == 'make_short':
-                text_items = op.get('text_items', [])
-                if len(text_items) > 2:
-                    return jsonify({
-                        "status": "error",
-                        "error": f"Public version supports max 2 text items per operation. You have {len(text_items)} items. Upgrade to Pro for up to 10 text items."
-                    }), 400
+        parsed, error_response = parse_process_request(data)
+        if error_response:
+            return error_response
+        video_url = parsed['video_url']
+        execution = parsed['execution']
+        operations = parsed['operations']
+        webhook = parsed['webhook']
+        client_meta = parsed['client_meta']
 
         # Выполнение операций
         if execution == 'async':
@@ -2414,6 +5785,44 @@ def process_video():
         return jsonify(create_simple_error(str(e), ERROR_INTERNAL_SERVER)), 500
 
 
+@app.route('/plan', methods=['POST'])
+@require_api_key
+def plan_video():
+    """
+    Dry run pipeline: тело как у /process_video (плюс download_source), ничего не выполняется.
+
+    Возвращает по каждой операции ffmpeg-команды, которые она запустит, pipe handoff
+    (streamed_to_next), result cache (hit/miss/bypassed/unknown) и оценки: CPU-секунды,
+    размеры выходов, место под временные файлы (scratch).
+    """
+    try:
+        data = request.json
+        if not data:
+            return jsonify(create_simple_error("JSON data required", ERROR_INVALID_JSON)), 400
+
+        parsed, error_response = parse_process_request(data)
+        if error_response:
+            return error_response
+
+        # download_source: скачать источник для точного плана (ключевые кадры, громкость, result cache)
+        download_source = data.get('download_source', False)
+        if not isinstance(download_source, bool):
+            return jsonify({
+                "status": "error",
+                "error": "download_source must be a boolean"
+            }), 400
+
+        logger.info(f"🧭 Plan requested: {len(parsed['operations'])} operation(s) | URL: {parsed['video_url']}")
+        ok, message, plan = build_pipeline_plan(parsed['video_url'], parsed['operations'], download_source)
+        if not ok:
+            return jsonify({"status": "error", "error": message, **plan}), 400
+        return jsonify({"status": "success", "execution": parsed['execution'], **plan})
+
+    except Exception as e:
+        logger.error(f"Plan error: {e}")
+        return jsonify(create_simple_error(str(e), ERROR_INTERNAL_SERVER)), 500
+
+
 def process_video_pipeline_sync(task_id: str, video_url: str, operations: list, webhook: dict = None, client_meta: dict | None = None) -> dict:
     """Синхронное выполнение pipeline операций"""
 
@@ -2434,12 +5843,10 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
         webhook_url = webhook.get('url')
         webhook_headers = webhook.get('headers')
 
-    # Скачиваем исходное видео в input/ с валидацией
-    input_filename = f"{uuid.uuid4()}.mp4"
-    input_path = os.path.join(get_task_dir(task_id), f"input_{input_filename}")
-
-    ok, msg = download_media_with_validation(video_url, input_path)
+    # Скачиваем исходное видео (RAM scratch или папка задачи) с валидацией
+    ok, msg, input_path = download_task_input(task_id, video_url)
     if not ok:
+        release_task_scratch(task_id)
         logger.error(f"Task {task_id}: download validation failed — {msg}")
         return jsonify({
             "status": "error",
@@ -2449,6 +5856,9 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
 
     current_input = input_path
     output_files = []  # Список всех созданных output файлов
+    resource_usage = []  # rusage ffmpeg по операциям
+    operation_details = []  # решения операций по содержимому (record_operation_details)
+    handoff = None  # Операция-источник, отдающая поток текущей операции через FIFO
 
     # Логируем создание задачи
     logger.info(f"✨ Task created: [{task_id}] | SYNC | URL: {video_url} | Operations: {len(operations)}")
@@ -2458,25 +5868,22 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
         op_type = op_data['type']
         operation = OPERATIONS_REGISTRY[op_type]
 
+        # Pipe handoff: операция пишет поток в FIFO, следующая читает его одновременно с ней
+        next_op_data = operations[idx + 1] if idx + 1 < len(operations) else None
+        if handoff is None:
+            handoff = start_stream_handoff(operation, op_type, op_data, next_op_data, current_input,
+                                           task_id, idx, len(operations), lane='interactive')
+            if handoff:
+                current_input = handoff.fifo_path
+                continue
+
         # Генерируем временный выходной файл
         if idx == len(operations) - 1:
             # Последняя операция - финальный файл с семантическим префиксом
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            # Определяем префикс в зависимости от типа операции
-            if op_type == 'make_short':
-                prefix = 'short'
-            elif op_type == 'cut_video':
-                prefix = 'video'
-            elif op_type == 'extract_audio':
-                prefix = 'audio'  # хотя extract_audio сам формирует имя
-            else:
-                prefix = 'processed'
-            
-            output_filename = f"{prefix}_{timestamp}.mp4"
-            output_path = os.path.join(get_task_dir(task_id), output_filename)
+            output_path = final_output_path(get_task_dir(task_id), op_type)
         else:
             # Промежуточный файл
-            output_path = os.path.join(get_task_dir(task_id), f"temp_{idx}_{uuid.uuid4()}.mp4")
+            output_path = scratch_temp_path(task_id, idx, input_path)
 
         # Логируем начало операции
         input_filename = os.path.basename(current_input)
@@ -2484,7 +5891,30 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
         op_start_time = datetime.now()
 
         # Выполняем операцию
-        result = operation.execute(current_input, output_path, op_data)
+        set_task_context(task_id, op_type, idx, len(operations), lane='interactive')
+        result, ffmpeg_failure = None, None
+        try:
+            result, output_path = execute_operation_spilling(operation, op_type, current_input, output_path,
+                                                             op_data, task_id)
+            ffmpeg_failure = pop_ffmpeg_failure()
+            op_rusage = pop_operation_rusage()
+            op_details = pop_operation_details()
+        finally:
+            clear_task_context()
+            if handoff:
+                # Источник дожидаемся и при исключении - иначе его ffmpeg повиснет на FIFO
+                result, ffmpeg_failure = handoff.finish(result, ffmpeg_failure)
+        if handoff:
+            if handoff.rusage:
+                resource_usage.append(handoff.rusage)
+            # Вход источника больше не нужен (если это промежуточный файл)
+            if handoff.input_path != input_path:
+                remove_task_file(handoff.input_path)
+            handoff = None
+        if op_rusage:
+            resource_usage.append(op_rusage)
+        if op_details:
+            operation_details.append(op_details)
         
         # Вычисляем время выполнения операции
         op_duration = (datetime.now() - op_start_time).total_seconds()
@@ -2504,6 +5934,7 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
             success, message = result
 
         if not success:
+            scratch_usage = release_task_scratch(task_id)
             # Create error metadata with full structure
             now = datetime.now()
             error_metadata = build_structured_metadata(
@@ -2528,10 +5959,14 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
                 total_size=0,
                 total_size_mb=0.0,
                 ttl_seconds=TASK_TTL_HOURS * 3600,
-                ttl_human=format_ttl_human(TASK_TTL_HOURS)
+                ttl_human=format_ttl_human(TASK_TTL_HOURS),
+                resource_usage=resource_usage,
+                scratch_usage=scratch_usage,
+                operation_details=operation_details
             )
             error_metadata["error"] = message
             error_metadata["failed_at"] = now.isoformat()
+            error_metadata.update(build_operation_error_details(task_id, op_type, message, ffmpeg_failure))
             
             # Save error metadata
             save_task_metadata(task_id, error_metadata)
@@ -2555,8 +5990,8 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
                 output_files.append(output_path)
 
         # Удаляем предыдущий временный файл
-        if current_input != input_path and os.path.exists(current_input):
-            os.remove(current_input)
+        if current_input != input_path:
+            remove_task_file(current_input)
 
         # Следующая операция будет использовать этот файл как вход
         current_input = output_path
@@ -2575,6 +6010,8 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
                     cleaned_count += 1
                 except Exception as e:
                     logger.warning(f"Failed to delete {filename}: {e}")
+    # input_*/temp_* в RAM scratch
+    scratch_usage = release_task_scratch(task_id)
 
     # Логируем очистку один раз в конце
     if cleaned_count > 0:
@@ -2664,7 +6101,10 @@ def process_video_pipeline_sync(task_id: str, video_url: str, operations: list,
         total_size=total_size,
         total_size_mb=round(total_size / (1024 * 1024), 2),
         ttl_seconds=TASK_TTL_HOURS * 3600,
-        ttl_human=format_ttl_human(TASK_TTL_HOURS)
+        ttl_human=format_ttl_human(TASK_TTL_HOURS),
+        resource_usage=resource_usage,
+        scratch_usage=scratch_usage,
+        operation_details=operation_details
     )
     
     # Save metadata.json (source of truth)
@@ -2759,7 +6199,8 @@ def _recover_interrupted_tasks_once():
 
     # Сканируем все задачи в TASKS_DIR
     try:
-        task_ids = [d for d in os.listdir(TASKS_DIR) if os.path.isdir(os.path.join(TASKS_DIR, d))]
+        task_ids = [d for d in os.listdir(TASKS_DIR)
+                    if is_task_dir_name(d) and os.path.isdir(os.path.join(TASKS_DIR, d))]
     except Exception as e:
         logger.error(f"❌ Recovery: failed to scan tasks directory: {e}")
         RECOVERY_IN_PROGRESS = False
@@ -2877,6 +6318,7 @@ def _recover_interrupted_tasks_once():
             thread = threading.Thread(
                 target=process_video_pipeline_background,
                 args=(task_id, video_url, operations, webhook),
+                kwargs={'priority_lane': 'recovery'},
                 daemon=True,
                 name=f'recovery-{task_id[:8]}'
             )
@@ -2906,8 +6348,12 @@ def _recover_interrupted_tasks_once():
     logger.info("✅ Recovery: API endpoint accepting requests now.")
 
 
-def process_video_pipeline_background(task_id: str, video_url: str, operations: list, webhook: dict = None):
-    """Фоновое выполнение pipeline операций с использованием task-based архитектуры"""
+def process_video_pipeline_background(task_id: str, video_url: str, operations: list, webhook: dict = None,
+                                      priority_lane: str = DEFAULT_RESOURCE_LANE):
+    """Фоновое выполнение pipeline операций с использованием task-based архитектуры
+
+    priority_lane - полоса лимитов ресурсов ffmpeg (FFMPEG_RESOURCE_LANES)
+    """
 
     # Извлекаем webhook_url, webhook_headers и client_meta из webhook объекта
     webhook_url = None
@@ -2918,6 +6364,10 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
         webhook_headers = webhook.get('headers')
         client_meta = webhook.get('client_meta')
 
+    failure_details = None  # error_code/error_details упавшей операции (см. build_operation_error_details)
+    resource_usage = []  # rusage ffmpeg по операциям
+    operation_details = []  # решения операций по содержимому (record_operation_details)
+
     try:
         # Создаем директории для задачи
         create_task_dirs(task_id)
@@ -2929,11 +6379,8 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
         logger.info(f"✨ Task created: [{task_id}] | ASYNC | URL: {video_url} | Operations: {len(operations)}")
 
         # Скачиваем исходное видео
-        input_filename = f"{uuid.uuid4()}.mp4"
-        input_path = os.path.join(get_task_dir(task_id), f"input_{input_filename}")
-
         logger.debug(f"Downloading video: {video_url}")
-        ok, msg = download_media_with_validation(video_url, input_path)
+        ok, msg, input_path = download_task_input(task_id, video_url)
         if not ok:
             raise Exception(msg)
 
@@ -2941,6 +6388,7 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
 
         current_input = input_path
         final_outputs = []  # Может быть несколько выходных файлов (например при chunking)
+        handoff = None  # Операция-источник, отдающая поток текущей операции через FIFO
 
         # Выполняем операции последовательно
         total_ops = len(operations)
@@ -2948,35 +6396,55 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
             op_type = op_data['type']
             operation = OPERATIONS_REGISTRY[op_type]
 
+            # Pipe handoff: операция пишет поток в FIFO, следующая читает его одновременно с ней
+            next_op_data = operations[idx + 1] if idx + 1 < total_ops else None
+            if handoff is None:
+                handoff = start_stream_handoff(operation, op_type, op_data, next_op_data, current_input,
+                                               task_id, idx, total_ops, lane=priority_lane)
+                if handoff:
+                    current_input = handoff.fifo_path
+                    continue
+
             # Прогресс: 20% + (idx / total_ops) * 70%
             progress = 20 + int((idx / total_ops) * 70)
-            update_task(task_id, {'progress': progress, 'current_operation': op_type})
+            update_task(task_id, {'progress': progress, 'current_operation': op_type, 'encode': None})
 
             # Генерируем выходной файл
             if idx == total_ops - 1:
                 # Последняя операция - финальный файл с семантическим префиксом
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                # Определяем префикс в зависимости от типа операции
-                if op_type == 'make_short':
-                    prefix = 'short'
-                elif op_type == 'cut_video':
-                    prefix = 'video'
-                elif op_type == 'extract_audio':
-                    prefix = 'audio'
-                else:
-                    prefix = 'processed'
-                
-                output_filename = f"{prefix}_{timestamp}.mp4"
-                output_path = os.path.join(get_task_dir(task_id), output_filename)
+                output_path = final_output_path(get_task_dir(task_id), op_type)
             else:
                 # Промежуточный файл
-                output_path = os.path.join(get_task_dir(task_id), f"temp_{idx}_{uuid.uuid4()}.mp4")
+                output_path = scratch_temp_path(task_id, idx, input_path)
 
             input_filename = os.path.basename(current_input)
             logger.info(f"[{task_id[:8]}] 🚀 Processing: {op_type} [{idx+1}/{total_ops}] | Input: {input_filename}")
 
-            # Выполняем операцию
-            result = operation.execute(current_input, output_path, op_data)
+            # Выполняем операцию (ffmpeg внутри неё пишет живой прогресс в task record)
+            set_task_context(task_id, op_type, idx, total_ops, lane=priority_lane)
+            result, ffmpeg_failure = None, None
+            try:
+                result, output_path = execute_operation_spilling(operation, op_type, current_input, output_path,
+                                                                 op_data, task_id)
+                ffmpeg_failure = pop_ffmpeg_failure()
+                op_rusage = pop_operation_rusage()
+                op_details = pop_operation_details()
+            finally:
+                clear_task_context()
+                if handoff:
+                    # Источник дожидаемся и при исключении - иначе его ffmpeg повиснет на FIFO
+                    result, ffmpeg_failure = handoff.finish(result, ffmpeg_failure)
+            if handoff:
+                if handoff.rusage:
+                    resource_usage.append(handoff.rusage)
+                # Вход источника больше не нужен (если это промежуточный файл)
+                if handoff.input_path != input_path:
+                    remove_task_file(handoff.input_path)
+                handoff = None
+            if op_rusage:
+                resource_usage.append(op_rusage)
+            if op_details:
+                operation_details.append(op_details)
             
             # Обрабатываем результат (может быть 2 или 3 значения)
             if len(result) == 3:
@@ -2994,6 +6462,7 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
                 output_paths = [output_path]
 
             if not success:
+                failure_details = build_operation_error_details(task_id, op_type, message, ffmpeg_failure)
                 raise Exception(f"Operation '{op_type}' failed: {message}")
 
             # Если это последняя операция - сохраняем все выходные файлы
@@ -3001,15 +6470,15 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
                 final_outputs = output_paths
             
             # Удаляем предыдущий временный файл
-            if current_input != input_path and os.path.exists(current_input):
-                os.remove(current_input)
+            if current_input != input_path:
+                remove_task_file(current_input)
 
             # Следующая операция будет использовать первый файл как вход
             current_input = output_paths[0] if output_paths else output_path
 
-        # Удаляем исходный файл
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        # Удаляем исходный файл и RAM scratch задачи
+        remove_task_file(input_path)
+        scratch_usage = release_task_scratch(task_id)
 
         # Финальный результат
         if not final_outputs:
@@ -3020,7 +6489,7 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
             if os.path.exists(output_file):
                 os.chmod(output_file, 0o644)
 
-        update_task(task_id, {'progress': 95})
+        update_task(task_id, {'progress': 95, 'encode': None})
 
         # Собираем информацию о выходных файлах
         output_files_info = []
@@ -3125,7 +6594,10 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
             total_size=total_size,
             total_size_mb=round(total_size / (1024 * 1024), 2),
             ttl_seconds=TASK_TTL_HOURS * 3600,
-            ttl_human=format_ttl_human(TASK_TTL_HOURS)
+            ttl_human=format_ttl_human(TASK_TTL_HOURS),
+            resource_usage=resource_usage,
+            scratch_usage=scratch_usage,
+            operation_details=operation_details
         )
         
         # CRITICAL: Save metadata.json first (source of truth) with verification
@@ -3182,6 +6654,7 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
 
     except Exception as e:
         logger.error(f"Task {task_id}: Error - {e}")
+        scratch_usage = release_task_scratch(task_id)
         
         # Get task snapshot from Redis or use defaults
         task_snapshot = get_task(task_id) or {}
@@ -3210,10 +6683,15 @@ def process_video_pipeline_background(task_id: str, video_url: str, operations:
             total_size=0,
             total_size_mb=0.0,
             ttl_seconds=TASK_TTL_HOURS * 3600,
-            ttl_human=format_ttl_human(TASK_TTL_HOURS)
+            ttl_human=format_ttl_human(TASK_TTL_HOURS),
+            resource_usage=resource_usage,
+            scratch_usage=scratch_usage,
+            operation_details=operation_details
         )
         error_metadata["error"] = str(e)
         error_metadata["failed_at"] = now.isoformat()
+        if failure_details:
+            error_metadata.update(failure_details)
         
         # Save error metadata
         save_task_metadata(task_id, error_metadata)
@@ -3311,6 +6789,8 @@ def _recover_task_by_id(task_id: str, force: bool = False) -> tuple[bool, str, d
     
     if temp_deleted_count > 0:
         logger.debug(f"Task {task_id}: Cleanup removed {temp_deleted_count} temp file(s)")
+    # Промежуточные файлы прерванной попытки в RAM scratch
+    release_task_scratch(task_id)
 
     # Prepare retry counters
     retry_count = int(metadata.get('retry_count', 0)) + 1
@@ -3336,6 +6816,7 @@ def _recover_task_by_id(task_id: str, force: bool = False) -> tuple[bool, str, d
     thread = threading.Thread(
         target=process_video_pipeline_background,
         args=(task_id, video_url, operations, webhook),
+        kwargs={'priority_lane': 'recovery'},
         daemon=True
     )
     thread.start()
@@ -3398,7 +6879,7 @@ def _webhook_resender_loop():
 
             for task_id in os.listdir(TASKS_DIR):
                 task_path = os.path.join(TASKS_DIR, task_id)
-                if not os.path.isdir(task_path):
+                if not is_task_dir_name(task_id) or not os.path.isdir(task_path):
                     continue
 
                 scanned += 1
@@ -0,0 +1,406 @@
+"""
+ASS Renderer - compiles make_short text_items into an ASS subtitle script
+
+The drawtext renderer turns every text item (and every expanded word-level
+subtitle) into its own drawtext filter with an enable='between(t,...)'
+expression, and FFmpeg evaluates all of them on every frame. This module
+compiles the same text_items into a single Advanced SubStation Alpha script
+that is burned in by one `ass` filter (libass), which only rasterizes the
+events active at the current timestamp.
+
+Semantics preserved from drawtext:
+- font (family and face style resolved by the caller; the style becomes the
+  Bold weight and Italic flags), fontsize, fontcolor (names, #RRGGBB,
+  0xRRGGBB and @alpha suffix)
+- borderw/bordercolor -> outline
+- box/boxcolor/boxborderw -> opaque box (separate layer below the text so a box
+  and an outline can be combined, as with drawtext)
+- x/y expressions that are linear in text_w/text_h (e.g. "(w-text_w)/2",
+  "h-200", "h-text_h-100", numbers) -> \\an alignment + \\pos
+
+Items that cannot be represented (time-dependent expressions, unknown
+variables, faces like "Condensed" that are not a weight plus italic) raise
+AssCompileError so the caller can fall back to drawtext.
+
+Usage:
+    from ass_renderer import compile_ass, build_ass_filter, AssCompileError
+
+    script = compile_ass(text_items, resolve_font=lambda f: ("PT Sans", "Bold"))
+"""
+
+import ast
+import re
+from typing import Callable, Optional, Tuple, Union
+
+
+class AssCompileError(ValueError):
+    """text_item не может быть представлен в ASS без потери семантики."""
+
+
+DEFAULT_PLAY_RES = (1080, 1920)
+
+# Базовые именованные цвета FFmpeg (подмножество, используемое в шаблонах)
+_NAMED_COLORS = {
+    'white': (255, 255, 255),
+    'black': (0, 0, 0),
+    'red': (255, 0, 0),
+    'green': (0, 128, 0),
+    'lime': (0, 255, 0),
+    'blue': (0, 0, 255),
+    'yellow': (255, 255, 0),
+    'cyan': (0, 255, 255),
+    'aqua': (0, 255, 255),
+    'magenta': (255, 0, 255),
+    'fuchsia': (255, 0, 255),
+    'orange': (255, 165, 0),
+    'gold': (255, 215, 0),
+    'pink': (255, 192, 203),
+    'purple': (128, 0, 128),
+    'violet': (238, 130, 238),
+    'gray': (128, 128, 128),
+    'grey': (128, 128, 128),
+    'silver': (192, 192, 192),
+    'navy': (0, 0, 128),
+    'teal': (0, 128, 128),
+    'maroon': (128, 0, 0),
+    'olive': (128, 128, 0),
+    'brown': (165, 42, 42),
+    'transparent': (0, 0, 0),
+}
+
+# Слова в имени начертания -> вес (OpenType usWeightClass)
+_STYLE_WEIGHTS = {
+    'thin': 100, 'hairline': 100,
+    'extralight': 200, 'ultralight': 200,
+    'light': 300,
+    'regular': 400, 'normal': 400, 'book': 400, 'roman': 400,
+    'medium': 500,
+    'semibold': 600, 'demibold': 600,
+    'bold': 700,
+    'extrabold': 800, 'ultrabold': 800,
+    'black': 900, 'heavy': 900,
+}
+_ITALIC_WORDS = ('italic', 'oblique')
+# Длинные слова первыми: "semibold" не должен разбиваться на "semi" + "bold"
+_STYLE_WORD_RE = re.compile('|'.join(sorted((*_STYLE_WEIGHTS, *_ITALIC_WORDS), key=len, reverse=True)))
+_STYLE_RE = re.compile(f"(?:{_STYLE_WORD_RE.pattern})+")
+
+
+def parse_color(value, default: str = 'white') -> Tuple[int, int, int, float]:
+    """
+    Парсит цвет в формате FFmpeg: имя, #RRGGBB[AA], 0xRRGGBB[AA], с опциональным @alpha.
+
+    Returns:
+        (r, g, b, opacity) где opacity в диапазоне 0..1
+    """
+    if value is None:
+        value = default
+    text = str(value).strip()
+    opacity = 1.0
+
+    if '@' in text:
+        text, alpha_part = text.split('@', 1)
+        try:
+            opacity = float(alpha_part)
+        except ValueError:
+            raise AssCompileError(f"Unsupported color alpha: {value}")
+        opacity = min(1.0, max(0.0, opacity))
+
+    lowered = text.lower()
+    if lowered.startswith('#') or lowered.startswith('0x'):
+        hex_part = lowered[1:] if lowered.startswith('#') else lowered[2:]
+        if not re.fullmatch(r'[0-9a-f]{6}([0-9a-f]{2})?', hex_part):
+            raise AssCompileError(f"Unsupported color: {value}")
+        r, g, b = int(hex_part[0:2], 16), int(hex_part[2:4], 16), int(hex_part[4:6], 16)
+        if len(hex_part) == 8:
+            opacity *= int(hex_part[6:8], 16) / 255.0
+        return r, g, b, opacity
+
+    if lowered in _NAMED_COLORS:
+        if lowered == 'transparent':
+            opacity = 0.0
+        r, g, b = _NAMED_COLORS[lowered]
+        return r, g, b, opacity
+
+    raise AssCompileError(f"Unsupported color: {value}")
+
+
+def ass_color(value, default: str = 'white') -> str:
+    """Конвертирует цвет FFmpeg в ASS формат &HAABBGGR (alpha: 00 - непрозрачный)."""
+    r, g, b, opacity = parse_color(value, default)
+    alpha = int(round((1.0 - opacity) * 255))
+    return f"&H{alpha:02X}{b:02X}{g:02X}{r:02X}"
+
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd,
+)
+
+# Синонимы переменных drawtext
+_FRAME_W = ('w', 'W', 'main_w')
+_FRAME_H = ('h', 'H', 'main_h')
+_TEXT_W = ('text_w', 'tw')
+_TEXT_H = ('text_h', 'th')
+
+
+def _eval_linear(expr, frame: Tuple[int, int], text_size: Tuple[float, float]) -> float:
+    """Вычисляет арифметическое выражение drawtext с подстановкой размеров кадра и текста."""
+    if isinstance(expr, (int, float)):
+        return float(expr)
+    source = str(expr).strip()
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError:
+        raise AssCompileError(f"Unsupported position expression: {expr}")
+
+    variables = {}
+    for name in _FRAME_W:
+        variables[name] = frame[0]
+    for name in _FRAME_H:
+        variables[name] = frame[1]
+    for name in _TEXT_W:
+        variables[name] = text_size[0]
+    for name in _TEXT_H:
+        variables[name] = text_size[1]
+
+    def _eval(node):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise AssCompileError(f"Unsupported position expression: {expr}")
+        if isinstance(node, ast.Expression):
+            return _eval(node.body)
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)):
+                raise AssCompileError(f"Unsupported position expression: {expr}")
+            return float(node.value)
+        if isinstance(node, ast.Name):
+            if node.id not in variables:
+                raise AssCompileError(f"Unsupported variable '{node.id}' in: {expr}")
+            return float(variables[node.id])
+        if isinstance(node, ast.UnaryOp):
+            value = _eval(node.operand)
+            return -value if isinstance(node.op, ast.USub) else value
+        left, right = _eval(node.left), _eval(node.right)
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        if right == 0:
+            raise AssCompileError(f"Division by zero in: {expr}")
+        return left / right
+
+    return _eval(tree)
+
+
+def resolve_anchor(expr, frame: Tuple[int, int], axis: str) -> Tuple[float, int]:
+    """
+    Раскладывает выражение позиции drawtext как pos = a + b * text_size.
+
+    Returns:
+        (координата якоря, якорь) где якорь: 0 - начало, 1 - центр, 2 - конец
+    """
+    if axis == 'x':
+        at0 = _eval_linear(expr, frame, (0.0, 0.0))
+        at1 = _eval_linear(expr, frame, (1.0, 0.0))
+        other = _eval_linear(expr, frame, (0.0, 1.0))
+    else:
+        at0 = _eval_linear(expr, frame, (0.0, 0.0))
+        at1 = _eval_linear(expr, frame, (0.0, 1.0))
+        other = _eval_linear(expr, frame, (1.0, 0.0))
+    if abs(other - at0) > 1e-9:
+        raise AssCompileError(f"Position depends on the other text dimension: {expr}")
+
+    slope = at1 - at0
+    # Проверка линейности (например text_w*text_w недопустимо)
+    probe = _eval_linear(expr, frame, (2.0, 0.0) if axis == 'x' else (0.0, 2.0))
+    if abs((probe - at0) - 2 * slope) > 1e-6:
+        raise AssCompileError(f"Non-linear position expression: {expr}")
+
+    anchors = {0.0: 0, -0.5: 1, -1.0: 2}
+    for coeff, anchor in anchors.items():
+        if abs(slope - coeff) < 1e-9:
+            return at0, anchor
+    raise AssCompileError(f"Unsupported text anchor in: {expr}")
+
+
+# \an: numpad раскладка - строки по y (top/middle/bottom), столбцы по x (left/center/right)
+_ALIGNMENT = {
+    (0, 0): 7, (1, 0): 8, (2, 0): 9,
+    (0, 1): 4, (1, 1): 5, (2, 1): 6,
+    (0, 2): 1, (1, 2): 2, (2, 2): 3,
+}
+
+
+def format_timestamp(seconds) -> str:
+    """Секунды -> H:MM:SS.cc (формат ASS)."""
+    try:
+        total_cs = int(round(float(seconds) * 100))
+    except (TypeError, ValueError):
+        raise AssCompileError(f"Unsupported time value: {seconds}")
+    total_cs = max(0, total_cs)
+    hours, rem = divmod(total_cs, 360000)
+    minutes, rem = divmod(rem, 6000)
+    secs, cs = divmod(rem, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{cs:02d}"
+
+
+def escape_text(text: str) -> str:
+    """Экранирует текст для поля Text события ASS (переносы строк -> \\N)."""
+    escaped = str(text).replace('\\', '\\\u200b')
+    escaped = escaped.replace('{', '\\{').replace('}', '\\}')
+    return escaped.replace('\r\n', '\n').replace('\n', '\\N')
+
+
+def _number(value, name: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise AssCompileError(f"Unsupported {name}: {value}")
+
+
+def style_flags(style: Optional[str]) -> Tuple[int, int]:
+    """
+    Имя начертания ("Bold", "SemiBold Italic") -> (Bold, Italic) для строки Style.
+
+    Bold: 0 - обычный, -1 - жирный, иначе вес 100..900 (libass подбирает начертание по весу).
+    Italic: 0 или -1. Начертание, которое не сводится к весу и наклону
+    ("Condensed", "Caption"), даёт AssCompileError - семейство с флагами выбрало бы другой файл.
+    """
+    key = re.sub(r'[\s_-]+', '', (style or '').lower()) or 'regular'
+    if not _STYLE_RE.fullmatch(key):
+        raise AssCompileError(f"Font style cannot be expressed as weight and italic: {style}")
+    words = _STYLE_WORD_RE.findall(key)
+    weight = max((_STYLE_WEIGHTS[w] for w in words if w in _STYLE_WEIGHTS), default=400)
+    italic = -1 if any(w in _ITALIC_WORDS for w in words) else 0
+    if weight == 400:
+        return 0, italic
+    return (-1 if weight == 700 else weight), italic
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.2f}"
+
+
+def compile_ass(text_items: list,
+                resolve_font: Callable[[Optional[str]], Union[str, Tuple[str, str]]],
+                play_res: Tuple[int, int] = DEFAULT_PLAY_RES) -> str:
+    """
+    Компилирует развёрнутые text_items в ASS скрипт.
+
+    Args:
+        text_items: Плоский список text_items (после раскрытия subtitles.items),
+                    поле 'text' уже содержит итоговые переносы строк
+        resolve_font: Функция fontfile -> (семейство, начертание) для libass;
+                      строка - только семейство (Regular)
+        play_res: Разрешение кадра (координаты ASS совпадают с пикселями)
+
+    Returns:
+        Содержимое .ass файла
+
+    Raises:
+        AssCompileError: если какой-то элемент нельзя представить в ASS
+    """
+    width, height = play_res
+    styles = {}
+    events = []
+
+    for item in text_items:
+        if not isinstance(item, dict) or not item.get('text'):
+            continue
+
+        face = resolve_font(item.get('fontfile'))
+        family, style = face if isinstance(face, tuple) else (face, None)
+        family = family or 'DejaVu Sans'
+        bold, italic = style_flags(style)
+        fontsize = _number(item.get('fontsize', 60), 'fontsize')
+        primary = ass_color(item.get('fontcolor', 'white'))
+        borderw = _number(item.get('borderw', 0), 'borderw')
+        outline_color = ass_color(item.get('bordercolor', 'black'), 'black')
+
+        x_pos, x_anchor = resolve_anchor(item.get('x', '(w-text_w)/2'), play_res, 'x')
+        y_pos, y_anchor = resolve_anchor(item.get('y', 'h-200'), play_res, 'y')
+        alignment = _ALIGNMENT[(x_anchor, y_anchor)]
+
+        start = format_timestamp(item.get('start', 0))
+        end = format_timestamp(item.get('end', 5))
+        text = escape_text(item['text'])
+        override = f"{{\\an{alignment}\\pos({_fmt(x_pos)},{_fmt(y_pos)})}}"
+
+        # Стиль текста (layer 1)
+        text_style_key = ('text', family, bold, italic, fontsize, primary, borderw, outline_color)
+        if text_style_key not in styles:
+            styles[text_style_key] = (
+                f"T{len(styles)}", family, bold, italic, fontsize, primary, outline_color,
+                '&H00000000', 1, borderw
+            )
+        text_style = styles[text_style_key][0]
+
+        if item.get('box'):
+            # Плашка отдельным слоем под текстом: BorderStyle=3, цвет плашки - OutlineColour,
+            # отступ - Outline. Сам текст в этом слое полностью прозрачный.
+            box_color = ass_color(item.get('boxcolor', 'black@0.5'), 'black')
+            box_padding = _number(item.get('boxborderw', 10), 'boxborderw')
+            box_style_key = ('box', family, bold, italic, fontsize, box_color, box_padding)
+            if box_style_key not in styles:
+                styles[box_style_key] = (
+                    f"B{len(styles)}", family, bold, italic, fontsize, '&HFF000000', box_color,
+                    box_color, 3, box_padding
+                )
+            box_style = styles[box_style_key][0]
+            events.append(f"Dialogue: 0,{start},{end},{box_style},,0,0,0,,{override}{text}")
+
+        events.append(f"Dialogue: 1,{start},{end},{text_style},,0,0,0,,{override}{text}")
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+    ]
+    for name, family, bold, italic, fontsize, primary, outline, back, border_style, outline_w in styles.values():
+        lines.append(
+            f"Style: {name},{family},{_fmt(fontsize)},{primary},{primary},{outline},{back},"
+            f"{bold},{italic},0,0,100,100,0,0,{border_style},{_fmt(outline_w)},0,7,0,0,0,1"
+        )
+    lines += [
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    lines += events
+    return '\n'.join(lines) + '\n'
+
+
+def _escape_filter_path(path: str) -> str:
+    """Экранирует путь для аргумента фильтра внутри filtergraph."""
+    return path.replace('\\', '\\\\').replace(':', '\\:').replace("'", "\\'")
+
+
+def build_ass_filter(ass_path: str, fontsdir: Optional[str] = None) -> str:
+    """Строит фильтр ass=... для прожига скрипта."""
+    parts = [f"ass=filename='{_escape_filter_path(ass_path)}'"]
+    if fontsdir:
+        parts.append(f"fontsdir='{_escape_filter_path(fontsdir)}'")
+    return ':'.join(parts)
+
+
+__all__ = [
+    "AssCompileError",
+    "parse_color",
+    "ass_color",
+    "resolve_anchor",
+    "format_timestamp",
+    "escape_text",
+    "style_flags",
+    "compile_ass",
+    "build_ass_filter",
+]
@@ -0,0 +1,112 @@
+"""
+Audio Passthrough - when extract_audio can copy the source audio stream
+
+Re-encoding audio costs a full decode and encode of the track; copying it
+(-c:a copy) only remuxes packets and is orders of magnitude faster. The copy
+is only taken when the result is what the request asked for:
+- the source codec is the one the output format uses (AAC for aac/m4a,
+  MP3 for mp3)
+- sample rate and channel count meet the request (whisper: 16 kHz mono)
+- the source bitrate is not noticeably above the requested bitrate, so the
+  file is not larger than an encode would be; an unknown bitrate re-encodes
+
+Copied audio is split into chunks on packet boundaries: every AAC or MP3
+packet holds a fixed number of samples, so chunk lengths that are whole
+numbers of packets let -c copy cuts meet without gaps or overlaps.
+
+This module only makes decisions. It has no side effects: no ffmpeg, no
+Redis, no Flask.
+
+Usage:
+    from audio_passthrough import passthrough_mismatch, align_to_packets
+
+    reason = passthrough_mismatch(stream, 'aac', 192_000)
+    if reason is None:
+        ... ffmpeg -i input -vn -c:a copy output.aac ...
+        chunk_seconds = align_to_packets(600.0, stream)
+"""
+
+import math
+from typing import Optional
+
+# Кодек потока, который формат выхода получает без перекодирования
+FORMAT_CODECS = {'aac': 'aac', 'm4a': 'aac', 'mp3': 'mp3'}
+
+# Допустимое превышение запрошенного битрейта источником (VBR, округление ffprobe)
+BITRATE_TOLERANCE = 1.1
+
+# Отсчётов на пакет: AAC-LC - 1024, MP3 (MPEG-1) - 1152, MP3 MPEG-2/2.5 (< 32 кГц) - 576
+AAC_PACKET_SAMPLES = 1024
+MP3_PACKET_SAMPLES = 1152
+MP3_LSF_PACKET_SAMPLES = 576
+
+# Отступ -ss копии назад от границы пакета (много меньше пакета): округление
+# таймкода до микросекунд не отбрасывает первый пакет чанка
+COPY_SEEK_MARGIN = 0.0001
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def passthrough_mismatch(stream: Optional[dict], audio_format: str, bitrate: Optional[int],
+                         sample_rate: Optional[int] = None, channels: Optional[int] = None) -> Optional[str]:
+    """
+    Почему аудиопоток нельзя скопировать ('source codec opus, aac needs aac') или None - можно.
+
+    Args:
+        stream: первый аудиопоток из ffprobe {'codec_name', 'sample_rate', 'channels', 'bit_rate'}
+        bitrate: запрошенный битрейт (бит/с)
+        sample_rate, channels: требования запроса (None - любые)
+    """
+    if not stream:
+        return "audio stream parameters unknown"
+    codec = FORMAT_CODECS.get(audio_format)
+    if codec is None:
+        return f"no passthrough for format {audio_format}"
+    if stream.get('codec_name') != codec:
+        return f"source codec {stream.get('codec_name')}, {audio_format} needs {codec}"
+    if sample_rate is not None and _int_or_none(stream.get('sample_rate')) != sample_rate:
+        return f"source sample rate {stream.get('sample_rate')}, requested {sample_rate}"
+    if channels is not None and _int_or_none(stream.get('channels')) != channels:
+        return f"source has {stream.get('channels')} channel(s), requested {channels}"
+    source_bitrate = _int_or_none(stream.get('bit_rate'))
+    if source_bitrate is None:
+        return "source bitrate unknown"
+    if bitrate and source_bitrate > bitrate * BITRATE_TOLERANCE:
+        return f"source bitrate {source_bitrate // 1000}k above requested {bitrate // 1000}k"
+    return None
+
+
+def packet_duration(stream: dict) -> Optional[float]:
+    """Длительность пакета (секунды) для AAC/MP3; None - неизвестна"""
+    sample_rate = _int_or_none(stream.get('sample_rate'))
+    if not sample_rate:
+        return None
+    if stream.get('codec_name') == 'aac':
+        samples = AAC_PACKET_SAMPLES
+    elif stream.get('codec_name') == 'mp3':
+        samples = MP3_PACKET_SAMPLES if sample_rate >= 32000 else MP3_LSF_PACKET_SAMPLES
+    else:
+        return None
+    return samples / sample_rate
+
+
+def align_to_packets(seconds: float, stream: dict) -> float:
+    """Длительность чанка, кратная длительности пакета (не меньше одного пакета)"""
+    duration = packet_duration(stream)
+    if not duration:
+        return seconds
+    return max(1, math.floor(seconds / duration)) * duration
+
+
+__all__ = [
+    "FORMAT_CODECS",
+    "COPY_SEEK_MARGIN",
+    "passthrough_mismatch",
+    "packet_duration",
+    "align_to_packets",
+]
@@ -0,0 +1,263 @@
+"""
+Audio Peaks - waveform min/max peaks for editor UIs
+
+Peaks are computed from the same ffmpeg decode that produces the audio file:
+the command gets a second output that writes mono s16le PCM into a named pipe
+(FIFO), and PeaksCollector folds that stream into min/max bins in a background
+thread. Nothing is written to disk except the final peaks files, and the audio
+is never decoded twice.
+
+Coarser resolutions are derived from the finest one, and peaks for a time range
+(e.g. a Whisper chunk) are sliced from the full-file bins, so chunks do not need
+their own decode either. The module has no side effects (no Redis, no Flask).
+
+Output formats:
+    json - one file with all resolutions:
+        {"version": 1, "channels": 1, "sample_rate": 16000, "bits": 8,
+         "duration": 12.5, "start": 0.0,
+         "levels": [{"samples_per_pixel": 80, "pixels_per_second": 200.0,
+                     "length": 1000, "data": [min0, max0, min1, max1, ...]}]}
+    dat  - audiowaveform binary format v2 (8-bit), one file per resolution,
+           readable by peaks.js and other audiowaveform consumers
+
+Usage:
+    from audio_peaks import PeaksCollector, build_peaks_output_args, build_levels, write_peaks
+
+    collector = PeaksCollector(fifo_path, samples_per_pixel=80)
+    collector.start()
+    cmd = [..., '-y', output_audio, *build_peaks_output_args(fifo_path)]
+    ... run cmd ...
+    finest = collector.finish()
+    files = write_peaks(base_path, build_levels(finest, 80, [10, 50, 200]), 'json', duration)
+"""
+
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import Optional
+
+PEAKS_SAMPLE_RATE = 16000
+DEFAULT_PIXELS_PER_SECOND = (10, 50, 200)
+MAX_PIXELS_PER_SECOND = 1000
+PEAKS_FORMATS = ('json', 'dat')
+
+PEAKS_JSON_VERSION = 1
+DAT_VERSION = 2
+DAT_FLAG_8BIT = 0x1
+
+# Размер чтения из FIFO (чётный - сэмплы s16 по 2 байта)
+_READ_SIZE = 64 * 1024
+
+
+def build_peaks_output_args(fifo_path: str, audio_filter: Optional[str] = None) -> list:
+    """
+    Дополнительный выход ffmpeg: моно PCM s16le в FIFO.
+
+    audio_filter (например loudnorm) применяется и здесь, чтобы пики
+    соответствовали итоговому аудиофайлу.
+    """
+    args = ['-map', '0:a:0']
+    if audio_filter:
+        args += ['-af', audio_filter]
+    args += ['-ac', '1', '-ar', str(PEAKS_SAMPLE_RATE), '-f', 's16le', '-y', fifo_path]
+    return args
+
+
+def samples_per_pixel_for(pixels_per_second: float) -> int:
+    """Число сэмплов (при PEAKS_SAMPLE_RATE) на один бин заданного разрешения."""
+    return max(1, int(round(PEAKS_SAMPLE_RATE / float(pixels_per_second))))
+
+
+class PeaksCollector:
+    """Читает PCM из FIFO в фоновом потоке и сворачивает его в min/max бины (int8)."""
+
+    def __init__(self, fifo_path: str, samples_per_pixel: int):
+        self.fifo_path = fifo_path
+        self.samples_per_pixel = samples_per_pixel
+        self.peaks = array('b')
+        self.error = None
+        self._pending = array('h')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        os.mkfifo(self.fifo_path)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            # open() блокируется, пока ffmpeg не откроет FIFO на запись
+            with open(self.fifo_path, 'rb') as f:
+                leftover = b''
+                while True:
+                    data = f.read(_READ_SIZE)
+                    if not data:
+                        break
+                    data = leftover + data
+                    usable = len(data) - (len(data) % 2)
+                    leftover = data[usable:]
+                    self._feed(data[:usable])
+            self._flush()
+        except Exception as e:
+            self.error = e
+
+    def _feed(self, data: bytes):
+        samples = array('h')
+        samples.frombytes(data)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        if self._pending:
+            samples = self._pending + samples
+        spp = self.samples_per_pixel
+        full = len(samples) - (len(samples) % spp)
+        peaks = self.peaks
+        for offset in range(0, full, spp):
+            block = samples[offset:offset + spp]
+            peaks.append(min(block) >> 8)
+            peaks.append(max(block) >> 8)
+        self._pending = samples[full:]
+
+    def _flush(self):
+        # Неполный последний бин тоже попадает в результат
+        if self._pending:
+            self.peaks.append(min(self._pending) >> 8)
+            self.peaks.append(max(self._pending) >> 8)
+            self._pending = array('h')
+
+    def finish(self, timeout: float = 30.0) -> array:
+        """
+        Дожидается конца потока и удаляет FIFO.
+
+        Если ffmpeg завершился, не открыв FIFO (ошибка до начала кодирования),
+        читатель разблокируется открытием FIFO на запись с немедленным закрытием.
+        """
+        if self._thread.is_alive():
+            try:
+                fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:
+                pass
+            self._thread.join(timeout)
+        try:
+            os.remove(self.fifo_path)
+        except OSError:
+            pass
+        if self.error is not None:
+            raise self.error
+        return self.peaks
+
+
+def downsample_peaks(peaks: array, factor: int) -> array:
+    """Свёртка min/max пар по factor бинов (для более грубых разрешений)."""
+    if factor <= 1:
+        return array('b', peaks)
+    result = array('b')
+    step = factor * 2
+    for offset in range(0, len(peaks), step):
+        block = peaks[offset:offset + step]
+        result.append(min(block[0::2]))
+        result.append(max(block[1::2]))
+    return result
+
+
+def build_levels(finest: array, finest_spp: int, pixels_per_second) -> list:
+    """
+    Уровни детализации из самого подробного.
+
+    Returns:
+        [{'samples_per_pixel': int, 'pixels_per_second': float, 'peaks': array}, ...]
+        от самого подробного к самому грубому
+    """
+    finest_pps = PEAKS_SAMPLE_RATE / finest_spp
+    factors = sorted({max(1, int(round(finest_pps / float(pps)))) for pps in pixels_per_second})
+    levels = []
+    for factor in factors:
+        spp = finest_spp * factor
+        levels.append({
+            'samples_per_pixel': spp,
+            'pixels_per_second': round(PEAKS_SAMPLE_RATE / spp, 3),
+            'peaks': downsample_peaks(finest, factor),
+        })
+    return levels
+
+
+def slice_levels(levels: list, start: float, end: float) -> list:
+    """Пики отрезка [start, end) секунд - для чанков без повторного декодирования."""
+    sliced = []
+    for level in levels:
+        spp = level['samples_per_pixel']
+        first = int(start * PEAKS_SAMPLE_RATE // spp)
+        last = int(-(-end * PEAKS_SAMPLE_RATE // spp))  # ceil
+        sliced.append(dict(level, peaks=level['peaks'][first * 2:last * 2]))
+    return sliced
+
+
+def _dat_bytes(level: dict) -> bytes:
+    peaks = level['peaks']
+    header = struct.pack(
+        '<iIiiIi',
+        DAT_VERSION, DAT_FLAG_8BIT, PEAKS_SAMPLE_RATE,
+        level['samples_per_pixel'], len(peaks) // 2, 1
+    )
+    return header + peaks.tobytes()
+
+
+def write_peaks(base_path: str, levels: list, fmt: str, duration: float, start: float = 0.0) -> list:
+    """
+    Записывает файлы пиков рядом с аудио.
+
+    Args:
+        base_path: Путь без расширения (audio_<ts> или audio_<ts>_chunk000)
+        fmt: json | dat
+        duration / start: Длительность и начало отрезка в секундах
+
+    Returns:
+        Список путей созданных файлов
+    """
+    if fmt == 'dat':
+        paths = []
+        for level in levels:
+            path = f"{base_path}.peaks.{level['samples_per_pixel']}.dat"
+            with open(path, 'wb') as f:
+                f.write(_dat_bytes(level))
+            paths.append(path)
+        return paths
+
+    path = f"{base_path}.peaks.json"
+    document = {
+        'version': PEAKS_JSON_VERSION,
+        'channels': 1,
+        'sample_rate': PEAKS_SAMPLE_RATE,
+        'bits': 8,
+        'duration': round(duration, 3),
+        'start': round(start, 3),
+        'levels': [
+            {
+                'samples_per_pixel': level['samples_per_pixel'],
+                'pixels_per_second': level['pixels_per_second'],
+                'length': len(level['peaks']) // 2,
+                'data': level['peaks'].tolist(),
+            }
+            for level in levels
+        ],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, separators=(',', ':'))
+    return [path]
+
+
+__all__ = [
+    "PEAKS_SAMPLE_RATE",
+    "DEFAULT_PIXELS_PER_SECOND",
+    "MAX_PIXELS_PER_SECOND",
+    "PEAKS_FORMATS",
+    "build_peaks_output_args",
+    "samples_per_pixel_for",
+    "PeaksCollector",
+    "downsample_peaks",
+    "build_levels",
+    "slice_levels",
+    "write_peaks",
+]
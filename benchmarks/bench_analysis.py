@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: one-pass media analysis vs three separate naive passes.
+
+Generates a synthetic 1080p source with audio (testsrc2 + sine with gaps) and
+measures:
+  - naive: three ffmpeg runs over the full-resolution source
+    (scene detection, silencedetect, ebur128 on 48 kHz stereo)
+  - one-pass: the single command from media_analysis.build_analysis_command
+Reports wall time and the speed as a multiple of realtime.
+
+Usage:
+    python benchmarks/bench_analysis.py [--duration 120]
+
+Requires ffmpeg in PATH. Run from the repository root.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from media_analysis import build_analysis_command, build_timeline  # noqa: E402
+
+
+def make_source(path: str, duration: float):
+    # Тон с паузами: каждые 10 секунд 2 секунды тишины
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        '-af', "volume='if(lt(mod(t,10),2),0,1)':eval=frame",
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '23',
+        '-c:a', 'aac', '-ac', '2',
+        '-y', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def timed(cmd: list) -> float:
+    started = time.monotonic()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=120.0, help='Synthetic source duration, seconds')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_analysis_') as tmp:
+        src = os.path.join(tmp, 'source.mp4')
+        make_source(src, args.duration)
+
+        naive = [
+            ['ffmpeg', '-i', src, '-vf', "select='gt(scene,0.3)',metadata=print", '-an', '-f', 'null', '-'],
+            ['ffmpeg', '-i', src, '-af', 'silencedetect=noise=-35dB:d=0.5', '-vn', '-f', 'null', '-'],
+            ['ffmpeg', '-i', src, '-af', 'ebur128', '-vn', '-f', 'null', '-'],
+        ]
+        naive_time = sum(timed(cmd) for cmd in naive)
+
+        scenes = os.path.join(tmp, 'scenes.txt')
+        audio = os.path.join(tmp, 'audio.txt')
+        one_pass_time = timed(build_analysis_command(src, scenes, audio, has_video=True, has_audio=True))
+        timeline = build_timeline(scenes, audio, args.duration)
+
+        print(f"{args.duration:.0f}s 1080p source with audio")
+        print(f"{'mode':<10} {'time,s':>8} {'x realtime':>11}")
+        print(f"{'naive':<10} {naive_time:>8.2f} {args.duration / naive_time:>10.1f}x")
+        print(f"{'one-pass':<10} {one_pass_time:>8.2f} {args.duration / one_pass_time:>10.1f}x")
+        print(f"silences found: {len(timeline['silences'])}, "
+              f"integrated loudness: {timeline['summary']['integrated_lufs']} LUFS")
+
+
+if __name__ == '__main__':
+    main()
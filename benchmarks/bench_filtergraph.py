@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark: legacy vs optimized letterbox filtergraph.
+
+Generates synthetic 1080p and 4K inputs (testsrc2, lavfi) and encodes each with
+the legacy and the optimized letterbox filtergraph from filtergraph.py,
+reporting encode fps for both.
+
+Usage:
+    python benchmarks/bench_filtergraph.py [--duration 10] [--preset medium]
+
+Requires ffmpeg in PATH. Run from the repository root.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from filtergraph import (  # noqa: E402
+    LEGACY_LETTERBOX_CONFIG,
+    build_legacy_letterbox_filter,
+    build_letterbox_filter,
+)
+
+SOURCES = {
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+
+def make_source(path: str, size: tuple, duration: float):
+    """Создаёт синтетическое видео (testsrc2 + шум, чтобы кодеку было что делать)."""
+    w, h = size
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={w}x{h}:rate=30:duration={duration}',
+        '-vf', 'noise=alls=12:allf=t',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18',
+        '-y', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def run_encode(input_path: str, video_filter: str, preset: str) -> tuple:
+    """Кодирует в /dev/null и возвращает (frames, seconds, fps)."""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-stats',
+        '-i', input_path,
+        '-filter_complex', video_filter,
+        '-c:v', 'libx264', '-preset', preset, '-crf', '23',
+        '-an', '-f', 'null', '-'
+    ]
+    started = time.monotonic()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    elapsed = time.monotonic() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    frames = 0
+    for m in re.finditer(r'frame=\s*(\d+)', result.stderr):
+        frames = int(m.group(1))
+    return frames, elapsed, (frames / elapsed if elapsed > 0 else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10.0, help='Synthetic source duration, seconds')
+    parser.add_argument('--preset', default='medium', help='x264 preset used for both runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_filtergraph_') as tmp:
+        print(f"{'source':<8} {'graph':<10} {'frames':>7} {'time,s':>8} {'fps':>8}")
+        for label, size in SOURCES.items():
+            src = os.path.join(tmp, f'{label}.mp4')
+            make_source(src, size, args.duration)
+
+            graphs = {
+                'legacy': build_legacy_letterbox_filter(LEGACY_LETTERBOX_CONFIG),
+                'optimized': build_letterbox_filter(LEGACY_LETTERBOX_CONFIG, source_size=size),
+            }
+            results = {}
+            for name, graph in graphs.items():
+                frames, elapsed, fps = run_encode(src, graph, args.preset)
+                results[name] = fps
+                print(f"{label:<8} {name:<10} {frames:>7} {elapsed:>8.2f} {fps:>8.1f}")
+            if results.get('legacy'):
+                print(f"{label:<8} {'speedup':<10} {'':>7} {'':>8} {results['optimized'] / results['legacy']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single-process vs segment-parallel make_short encode.
+
+Generates a synthetic 1080p source with audio (testsrc2 + sine, keyframe every
+2 seconds) and measures the make_short encode (center crop to 1080x1920,
+libx264 -preset medium -crf 23):
+  - single:   one ffmpeg process for the whole range
+  - parallel: K video segments cut at keyframes (parallel_encode.plan_segments)
+              encoded concurrently, audio encoded once alongside them, then a
+              lossless concat (-c copy)
+Reports wall time, speed as a multiple of realtime, and output frame counts
+(they must match: the segment split neither drops nor duplicates frames).
+
+Usage:
+    python benchmarks/bench_parallel_encode.py [--duration 120] [--segments 4]
+
+Requires ffmpeg/ffprobe in PATH. Run from the repository root.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parallel_encode import (  # noqa: E402
+    SEGMENT_END_EPSILON,
+    build_concat_list,
+    plan_segments,
+    segment_threads,
+)
+
+VIDEO_FILTER = 'crop=ih*9/16:ih,scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920'
+VIDEO_ARGS = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23']
+AUDIO_ARGS = ['-c:a', 'aac', '-b:a', '128k']
+
+
+def make_source(path: str, duration: float):
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-crf', '23',
+        '-c:a', 'aac', '-ac', '2',
+        '-y', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def keyframes(path: str) -> list:
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags:format=start_time', '-of', 'json', path
+    ], capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout)
+    offset = float(data['format'].get('start_time') or 0.0)
+    return sorted(float(p['pts_time']) - offset for p in data['packets'] if 'K' in p.get('flags', ''))
+
+
+def frame_count(path: str) -> int:
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+        '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', path
+    ], capture_output=True, text=True, check=True)
+    return int(result.stdout.strip())
+
+
+def run(cmd: list):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+
+
+def encode_single(src: str, out: str, duration: float):
+    run(['ffmpeg', '-i', src, '-t', str(duration), '-vf', VIDEO_FILTER, *VIDEO_ARGS, *AUDIO_ARGS,
+         '-movflags', '+faststart', '-y', out])
+
+
+def encode_parallel(src: str, out: str, duration: float, segments_max: int, tmp: str) -> int:
+    segments = plan_segments(0.0, duration, keyframes(src), segments_max, 20)
+    threads = segment_threads(len(segments))
+    jobs = []
+    paths = []
+    for index, (seg_start, seg_end) in enumerate(segments):
+        path = os.path.join(tmp, f'seg{index:03d}.mp4')
+        length = seg_end - seg_start - (SEGMENT_END_EPSILON if index < len(segments) - 1 else 0)
+        paths.append(path)
+        jobs.append(['ffmpeg', '-ss', str(seg_start), '-i', src, '-t', f'{length:.6f}', '-vf', VIDEO_FILTER,
+                     '-an', *VIDEO_ARGS, '-threads', str(threads), '-y', path])
+    audio = os.path.join(tmp, 'audio.m4a')
+    jobs.append(['ffmpeg', '-i', src, '-t', str(duration), '-vn', *AUDIO_ARGS, '-y', audio])
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        list(pool.map(run, jobs))
+
+    concat_list = os.path.join(tmp, 'concat.txt')
+    with open(concat_list, 'w') as f:
+        f.write(build_concat_list(paths))
+    run(['ffmpeg', '-f', 'concat', '-safe', '0', '-i', concat_list, '-i', audio,
+         '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-movflags', '+faststart', '-y', out])
+    return len(segments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=120.0, help='Synthetic source duration, seconds')
+    parser.add_argument('--segments', type=int, default=4, help='Maximum parallel segments (K)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_parallel_') as tmp:
+        src = os.path.join(tmp, 'source.mp4')
+        make_source(src, args.duration)
+
+        single_out = os.path.join(tmp, 'single.mp4')
+        started = time.monotonic()
+        encode_single(src, single_out, args.duration)
+        single_time = time.monotonic() - started
+
+        parallel_out = os.path.join(tmp, 'parallel.mp4')
+        started = time.monotonic()
+        used = encode_parallel(src, parallel_out, args.duration, args.segments, tmp)
+        parallel_time = time.monotonic() - started
+
+        print(f"{args.duration:.0f}s 1080p source -> 1080x1920, {os.cpu_count()} CPU(s)")
+        print(f"{'mode':<14} {'time,s':>8} {'x realtime':>11} {'frames':>8}")
+        print(f"{'single':<14} {single_time:>8.2f} {args.duration / single_time:>10.1f}x {frame_count(single_out):>8}")
+        print(f"{f'parallel x{used}':<14} {parallel_time:>8.2f} {args.duration / parallel_time:>10.1f}x "
+              f"{frame_count(parallel_out):>8}")
+
+
+if __name__ == '__main__':
+    main()
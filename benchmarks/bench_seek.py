@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single input seek vs two-stage seek for a make_short range encode.
+
+Generates a synthetic long-GOP 1080p source with audio (testsrc2 + sine,
+keyframe every 10 seconds) and encodes a range that starts mid-GOP with the
+make_short filter (center crop to 1080x1920, libx264 -preset medium -crf 23):
+  - single:    -ss start before -i (ffmpeg seeks to the preceding keyframe and
+               drops the decoded frames before the filtergraph)
+  - two-stage: -ss keyframe before -i plus -ss (start - keyframe) after -i
+               (the frames up to start pass through the filtergraph first)
+  - probe:     the cold keyframe index scan two-stage needs (ffprobe packets)
+Reports wall time per mode and output frame counts (they must match).
+
+app.SEEK_TWO_STAGE_ENABLED should only be switched on where two-stage is
+measurably faster than single, including the probe on an uncached source.
+
+Usage:
+    python benchmarks/bench_seek.py [--duration 600] [--length 30] [--gop 10]
+
+Requires ffmpeg/ffprobe in PATH. Run from the repository root.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+VIDEO_FILTER = 'crop=ih*9/16:ih,scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920'
+VIDEO_ARGS = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23']
+AUDIO_ARGS = ['-c:a', 'aac', '-b:a', '128k']
+
+
+def make_source(path: str, duration: float, gop_seconds: float):
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(int(gop_seconds * 30)),
+        '-keyint_min', str(int(gop_seconds * 30)), '-sc_threshold', '0', '-crf', '23',
+        '-c:a', 'aac', '-ac', '2',
+        '-y', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def keyframes(path: str) -> list:
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags:format=start_time', '-of', 'json', path
+    ], capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout)
+    offset = float(data['format'].get('start_time') or 0.0)
+    return sorted(float(p['pts_time']) - offset for p in data['packets'] if 'K' in p.get('flags', ''))
+
+
+def frame_count(path: str) -> int:
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+        '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', path
+    ], capture_output=True, text=True, check=True)
+    return int(result.stdout.strip())
+
+
+def timed(cmd: list) -> float:
+    started = time.monotonic()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    return time.monotonic() - started
+
+
+def encode(src: str, out: str, before_input: list, after_input: list) -> float:
+    return timed(['ffmpeg', *before_input, '-i', src, *after_input, '-vf', VIDEO_FILTER,
+                  *VIDEO_ARGS, *AUDIO_ARGS, '-movflags', '+faststart', '-y', out])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=600.0, help='Synthetic source duration, seconds')
+    parser.add_argument('--length', type=float, default=30.0, help='Encoded range length, seconds')
+    parser.add_argument('--gop', type=float, default=10.0, help='Keyframe interval, seconds')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_seek_') as tmp:
+        src = os.path.join(tmp, 'source.mp4')
+        make_source(src, args.duration, args.gop)
+
+        started = time.monotonic()
+        index = keyframes(src)
+        probe_time = time.monotonic() - started
+
+        print(f"{args.duration:.0f}s 1080p source, keyframe every {args.gop:g}s, {args.length:g}s range -> 1080x1920")
+        print(f"keyframe index probe (cold): {probe_time:.2f}s")
+        print(f"{'start':>8} {'overhead':>9} {'single,s':>9} {'two-stage,s':>12} {'frames':>13}")
+        # Старты в конце GOP - максимальный остаток от ключевого кадра
+        for start in (args.duration * 0.25 + args.gop * 0.9, args.duration * 0.5 + args.gop * 0.5,
+                      args.duration * 0.75 + args.gop * 0.1):
+            keyframe = max(k for k in index if k <= start)
+            single_out = os.path.join(tmp, 'single.mp4')
+            single_time = encode(src, single_out, ['-ss', f'{start:.6f}'], ['-t', f'{args.length:.6f}'])
+            two_stage_out = os.path.join(tmp, 'two_stage.mp4')
+            two_stage_time = encode(src, two_stage_out, ['-ss', f'{keyframe:.6f}'],
+                                    ['-ss', f'{start - keyframe:.6f}', '-t', f'{args.length:.6f}'])
+            frames = f"{frame_count(single_out)}/{frame_count(two_stage_out)}"
+            print(f"{start:>8.1f} {start - keyframe:>8.1f}s {single_time:>9.2f} {two_stage_time:>12.2f} {frames:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark: drawtext chain vs single ASS filter for word-level captions.
+
+Builds a one-minute synthetic 1080p source and N word-level subtitle items
+(the shape n8n templates send in text_items[].subtitles.items), then encodes
+the Shorts crop chain with:
+  - drawtext: one drawtext filter per word with enable='between(t,...)'
+    (same parameter layout as MakeShortOperation._process_text_item)
+  - ass: one ass filter burning a script compiled by ass_renderer.compile_ass
+
+Usage:
+    python benchmarks/bench_subtitles.py [--words 180] [--duration 60] [--font /path/font.ttf]
+
+Requires ffmpeg built with libass in PATH. Run from the repository root.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ass_renderer import build_ass_filter, compile_ass  # noqa: E402
+from filtergraph import build_crop_filter  # noqa: E402
+
+STYLE = {
+    'fontsize': 60,
+    'fontcolor': 'yellow',
+    'borderw': 3,
+    'bordercolor': 'black',
+    'box': 1,
+    'boxcolor': 'black@0.7',
+    'boxborderw': 8,
+    'x': '(w-text_w)/2',
+    'y': 'h-200',
+}
+
+
+def make_source(path: str, duration: float):
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=30:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18',
+        '-y', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def make_items(words: int, duration: float) -> list:
+    step = duration / words
+    return [
+        dict(STYLE, text=f"word{i}", start=round(i * step, 3), end=round((i + 1) * step, 3))
+        for i in range(words)
+    ]
+
+
+def drawtext_chain(items: list, fontfile: str) -> str:
+    filters = []
+    font_escaped = fontfile.replace(':', '\\:').replace("'", "\\'")
+    for item in items:
+        filters.append('drawtext=' + ':'.join([
+            f"text='{item['text']}'",
+            "expansion=normal",
+            f"fontsize={item['fontsize']}",
+            f"fontcolor={item['fontcolor']}",
+            "text_align=center",
+            f"x={item['x']}",
+            f"y={item['y']}",
+            f"enable='between(t\\,{item['start']}\\,{item['end']})'",
+            f"fontfile='{font_escaped}'",
+            f"borderw={item['borderw']}",
+            f"bordercolor={item['bordercolor']}",
+            "box=1",
+            f"boxcolor={item['boxcolor']}",
+            f"boxborderw={item['boxborderw']}",
+        ]))
+    return ','.join(filters)
+
+
+def run_encode(input_path: str, video_filter: str, script_dir: str) -> tuple:
+    # Длинные цепочки drawtext не помещаются в аргументы командной строки - через файл
+    script = os.path.join(script_dir, 'filter.txt')
+    with open(script, 'w', encoding='utf-8') as f:
+        f.write(video_filter)
+    cmd = [
+        'ffmpeg', '-v', 'error', '-stats',
+        '-i', input_path,
+        '-filter_script:v', script,
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23',
+        '-an', '-f', 'null', '-'
+    ]
+    started = time.monotonic()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    elapsed = time.monotonic() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    frames = 0
+    for m in re.finditer(r'frame=\s*(\d+)', result.stderr):
+        frames = int(m.group(1))
+    return frames, elapsed, (frames / elapsed if elapsed > 0 else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=180, help='Number of word-level subtitle items')
+    parser.add_argument('--duration', type=float, default=60.0, help='Source duration, seconds')
+    parser.add_argument('--font', default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+    args = parser.parse_args()
+
+    base = build_crop_filter('center')
+    items = make_items(args.words, args.duration)
+
+    with tempfile.TemporaryDirectory(prefix='bench_subtitles_') as tmp:
+        src = os.path.join(tmp, 'source.mp4')
+        make_source(src, args.duration)
+
+        ass_path = os.path.join(tmp, 'captions.ass')
+        with open(ass_path, 'w', encoding='utf-8') as f:
+            f.write(compile_ass(items, resolve_font=lambda _: 'DejaVu Sans'))
+
+        graphs = {
+            'drawtext': f"{base},{drawtext_chain(items, args.font)}",
+            'ass': f"{base},{build_ass_filter(ass_path, os.path.dirname(args.font))}",
+        }
+
+        print(f"{args.words} word-level items, {args.duration:.0f}s source")
+        print(f"{'renderer':<10} {'frames':>7} {'time,s':>8} {'fps':>8}")
+        results = {}
+        for name, graph in graphs.items():
+            frames, elapsed, fps = run_encode(src, graph, tmp)
+            results[name] = fps
+            print(f"{name:<10} {frames:>7} {elapsed:>8.2f} {fps:>8.1f}")
+        if results.get('drawtext'):
+            print(f"{'speedup':<10} {'':>7} {'':>8} {results['ass'] / results['drawtext']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
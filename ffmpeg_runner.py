@@ -0,0 +1,500 @@
+"""
+FFmpeg Runner - subprocess wrapper with live progress reporting
+
+This module launches ffmpeg with `-progress pipe:1` and parses the key=value
+progress blocks while the encode is running. It has no side effects (no Redis,
+no Flask), so the API decides what to do with the progress snapshots
+(throttling, writing them to the task record).
+
+Responsibilities:
+- Injecting `-progress pipe:1 -nostats` into an ffmpeg command
+- Draining stdout (progress) and stderr (log) in reader threads, so neither
+  pipe can fill up and stall ffmpeg
+- Converting out_time into fractional progress, fps, speed multiple and ETA
+- Bounded stderr capture: only the last N lines are kept in memory; the full
+  log is streamed to a spool file next to log_path and kept only on failure
+- Extracting a concise error summary from the stderr tail
+- Per-job resource limits for the child, applied as exec'ing command prefixes
+  (prlimit, taskset, nice, ionice): an RLIMIT_CPU scaled by media duration and
+  cores (a fixed per-core budget when the duration is unknown), CPU affinity,
+  nice and ionice class, plus the child's rusage (max RSS, user/sys time)
+- A resident memory cap: a watchdog thread reads VmRSS from /proc/<pid>/status
+  and kills ffmpeg above the limit (virtual reservations are not counted)
+
+Usage:
+    from ffmpeg_runner import run_ffmpeg
+
+    result = run_ffmpeg(cmd, duration=62.5, on_progress=lambda p: print(p),
+                        log_path='/app/tasks/<id>/ffmpeg_make_short.log')
+    if result.returncode != 0:
+        print(result.error_summary, result.log_path)
+
+    limits = {'nice': 10, 'ionice_class': 2, 'ionice_level': 7,
+              'cpu_time_factor': 20, 'cpu_time_fallback': 3600,
+              'max_rss_mb': 6144, 'cpu_affinity': [0, 1]}
+    result = run_ffmpeg(cmd, duration=62.5, limits=limits)
+    print(result.rusage)  # {'max_rss_mb': ..., 'user_time': ..., 'sys_time': ..., 'wall_time': ...}
+"""
+
+import logging
+import os
+import math
+import re
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Выходы, при которых stdout ffmpeg занят данными и progress туда писать нельзя
+_STDOUT_OUTPUTS = ('-', 'pipe:', 'pipe:1')
+
+# Сколько последних строк stderr держать в памяти
+STDERR_TAIL_LINES = 200
+
+# Ограничения для краткого описания ошибки
+ERROR_SUMMARY_MAX_LINES = 5
+ERROR_SUMMARY_MAX_CHARS = 500
+
+_ERROR_LINE_RE = re.compile(
+    r'error|invalid|failed|no such file|not found|unable|cannot|could not|unknown|'
+    r'unrecognized|does not|permission denied|out of memory|killed',
+    re.IGNORECASE
+)
+_CONTEXT_ADDR_RE = re.compile(r' @ 0x[0-9a-fA-F]+')
+
+# Пояснения для сигналов, которыми ядро завершает процесс при превышении лимитов
+_SIGNAL_HINTS = {
+    signal.SIGXCPU: 'CPU time limit exceeded',
+    signal.SIGKILL: 'killed (timeout, hard CPU limit, memory limit or OOM killer)',
+    signal.SIGSEGV: 'segmentation fault',
+}
+
+# Запас между мягким (SIGXCPU) и жёстким (SIGKILL) лимитом CPU, секунды
+_CPU_HARD_LIMIT_GRACE = 10
+
+# Нижняя граница мягкого лимита CPU: короткие клипы тратят заметное время на старт и фильтры
+_CPU_LIMIT_FLOOR = 300
+
+# Период опроса VmRSS для лимита max_rss_mb, секунды
+_RSS_POLL_SECONDS = 1.0
+
+_IONICE_BIN = shutil.which('ionice')
+_PRLIMIT_BIN = shutil.which('prlimit')
+_TASKSET_BIN = shutil.which('taskset')
+_NICE_BIN = shutil.which('nice')
+
+
+class FFmpegResult(subprocess.CompletedProcess):
+    """
+    Результат run_ffmpeg, совместимый с subprocess.CompletedProcess.
+
+    stderr содержит только последние строки лога (кольцевой буфер).
+    Дополнительно:
+        error_summary: краткое описание ошибки ('' при успехе)
+        log_path: путь к полному логу (только при ошибке и заданном log_path)
+        stderr_lines_total: сколько строк stderr выдал ffmpeg всего
+        rusage: max_rss_mb, user_time, sys_time, wall_time процесса ffmpeg (или None)
+    """
+    def __init__(self, args, returncode, stdout='', stderr='', error_summary='',
+                 log_path=None, stderr_lines_total=0, rusage=None):
+        super().__init__(args, returncode, stdout=stdout, stderr=stderr)
+        self.error_summary = error_summary
+        self.log_path = log_path
+        self.stderr_lines_total = stderr_lines_total
+        self.rusage = rusage
+
+
+def summarize_ffmpeg_error(lines, returncode: Optional[int] = None,
+                           max_lines: int = ERROR_SUMMARY_MAX_LINES,
+                           max_chars: int = ERROR_SUMMARY_MAX_CHARS) -> str:
+    """
+    Извлекает краткое описание ошибки из хвоста stderr.
+
+    Берутся последние строки, похожие на ошибку (без повторов); если таких нет -
+    последние непустые строки. Адреса контекстов ('[libx264 @ 0x5581...]') убираются.
+    """
+    cleaned = []
+    for line in lines:
+        line = _CONTEXT_ADDR_RE.sub('', line.strip())
+        if line:
+            cleaned.append(line)
+
+    picked = []
+    for line in reversed(cleaned):
+        if _ERROR_LINE_RE.search(line) and line not in picked:
+            picked.append(line)
+            if len(picked) >= max_lines:
+                break
+    if not picked:
+        picked = list(reversed(cleaned[-3:]))
+    picked.reverse()
+
+    if returncode is not None and returncode < 0:
+        # Завершён сигналом - чаще всего сработал лимит ресурсов
+        try:
+            sig = signal.Signals(-returncode)
+            hint = _SIGNAL_HINTS.get(sig)
+            picked.append(f"ffmpeg terminated by {sig.name}" + (f" ({hint})" if hint else ''))
+        except ValueError:
+            picked.append(f"ffmpeg terminated by signal {-returncode}")
+
+    summary = '; '.join(picked)
+    if not summary:
+        summary = f"ffmpeg exited with code {returncode}" if returncode is not None else "ffmpeg failed"
+    if len(summary) > max_chars:
+        summary = summary[:max_chars - 3] + '...'
+    return summary
+
+
+def _parse_float(value) -> Optional[float]:
+    """'1.23x' / '29.97' / 'N/A' -> float или None."""
+    if value is None:
+        return None
+    value = str(value).strip().rstrip('x')
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_progress_block(block: dict, duration: Optional[float], started_at: float) -> dict:
+    """
+    Превращает один блок -progress (frame=, fps=, out_time_us=, speed=, progress=)
+    в снимок прогресса.
+
+    Args:
+        block: Пары key=value одного блока, завершённого строкой progress=...
+        duration: Ожидаемая длительность выхода в секундах (None - неизвестна)
+        started_at: time.monotonic() момента запуска ffmpeg
+
+    Returns:
+        dict с ключами out_time, fraction, fps, speed, eta_seconds, frame, done
+    """
+    # out_time_ms в ffmpeg исторически тоже в микросекундах - берём out_time_us, если есть
+    raw_us = block.get('out_time_us', block.get('out_time_ms'))
+    out_time = None
+    try:
+        if raw_us not in (None, '', 'N/A'):
+            out_time = max(0.0, int(raw_us) / 1_000_000)
+    except ValueError:
+        out_time = None
+
+    done = block.get('progress') == 'end'
+    fraction = None
+    if done:
+        fraction = 1.0
+    elif duration and duration > 0 and out_time is not None:
+        fraction = min(1.0, out_time / duration)
+
+    fps = _parse_float(block.get('fps'))
+    speed = _parse_float(block.get('speed'))
+
+    eta = None
+    if done:
+        eta = 0.0
+    elif fraction and fraction > 0:
+        # Оценка по реальному времени учитывает и разгон кодека, и паузы на I/O
+        elapsed = time.monotonic() - started_at
+        eta = elapsed * (1.0 - fraction) / fraction
+    elif duration and out_time is not None and speed:
+        eta = max(0.0, (duration - out_time) / speed)
+
+    frame = None
+    try:
+        frame = int(block['frame']) if block.get('frame') else None
+    except ValueError:
+        frame = None
+
+    return {
+        'out_time': round(out_time, 2) if out_time is not None else None,
+        'fraction': round(fraction, 4) if fraction is not None else None,
+        'fps': fps,
+        'speed': speed,
+        'eta_seconds': round(eta, 1) if eta is not None else None,
+        'frame': frame,
+        'done': done,
+    }
+
+
+def with_progress_args(cmd: list) -> Optional[list]:
+    """
+    Добавляет `-progress pipe:1 -nostats` сразу после бинаря ffmpeg.
+
+    Returns:
+        Новую команду или None, если stdout уже используется как выход.
+    """
+    if not cmd or cmd[-1] in _STDOUT_OUTPUTS or '-progress' in cmd:
+        return None
+    return [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+
+
+def with_ionice(cmd: list, limits: Optional[dict]) -> list:
+    """
+    Оборачивает команду в `ionice -c <class> [-n <level>]`, если класс задан и утилита есть.
+    ionice делает exec, поэтому pid и rusage остаются от самого ffmpeg.
+    """
+    if not limits or not limits.get('ionice_class') or not _IONICE_BIN:
+        return cmd
+    prefix = [_IONICE_BIN, '-c', str(limits['ionice_class'])]
+    # Для класса idle (3) уровень не задаётся
+    if limits.get('ionice_level') is not None and int(limits['ionice_class']) in (1, 2):
+        prefix += ['-n', str(limits['ionice_level'])]
+    return prefix + list(cmd)
+
+
+def _cpu_time_limit(limits: dict, duration: Optional[float]) -> Optional[int]:
+    """
+    Мягкий RLIMIT_CPU из ожидаемой длительности медиа: duration × ядра × cpu_time_factor.
+    RLIMIT_CPU считает время всех потоков процесса, поэтому лимит растёт с числом ядер.
+    Без длительности - запасной бюджет полосы: cpu_time_fallback × ядра (щедрый, чтобы
+    не убивать длинные кодирования, но зависший ffmpeg всё равно будет остановлен).
+    """
+    cores = len(limits['cpu_affinity']) if limits.get('cpu_affinity') else (os.cpu_count() or 1)
+    factor = limits.get('cpu_time_factor')
+    if factor and duration and duration > 0:
+        return max(_CPU_LIMIT_FLOOR, int(math.ceil(duration * cores * float(factor))))
+    fallback = limits.get('cpu_time_fallback')
+    if fallback:
+        return max(_CPU_LIMIT_FLOOR, int(math.ceil(cores * float(fallback))))
+    return None
+
+
+def with_limits(cmd: list, limits: Optional[dict], duration: Optional[float] = None) -> list:
+    """
+    Оборачивает команду в префиксы `prlimit --cpu`, `taskset -c`, `nice -n` и `ionice`.
+
+    Все утилиты делают exec, поэтому pid и rusage остаются от самого ffmpeg. Лимиты
+    применяются префиксами, а не через Popen(preexec_fn=...): preexec_fn небезопасен,
+    когда у родителя есть потоки (fork в многопоточном процессе может зависнуть).
+    Отсутствующая утилита просто пропускается.
+
+    Ключи limits (все опциональны):
+        nice: прибавка к nice
+        ionice_class / ionice_level: см. with_ionice
+        cpu_time_factor: CPU-секунд на секунду медиа и ядро (см. _cpu_time_limit)
+        cpu_time_fallback: CPU-секунд на ядро, когда длительность неизвестна
+        cpu_affinity: список номеров CPU
+        max_rss_mb: не префикс - лимит RSS проверяет run_ffmpeg (см. _watch_rss)
+    """
+    if not limits:
+        return cmd
+    prefix = []
+    cpu_seconds = _cpu_time_limit(limits, duration)
+    if cpu_seconds and _PRLIMIT_BIN:
+        prefix += [_PRLIMIT_BIN, f"--cpu={cpu_seconds}:{cpu_seconds + _CPU_HARD_LIMIT_GRACE}"]
+    if limits.get('cpu_affinity') and _TASKSET_BIN:
+        prefix += [_TASKSET_BIN, '-c', ','.join(str(cpu) for cpu in limits['cpu_affinity'])]
+    if limits.get('nice') and _NICE_BIN:
+        prefix += [_NICE_BIN, '-n', str(int(limits['nice']))]
+    return prefix + with_ionice(cmd, limits)
+
+
+def _rusage_to_dict(ru, wall_time: float) -> dict:
+    """struct_rusage из os.wait4 -> dict (ru_maxrss в Linux в килобайтах)."""
+    return {
+        'max_rss_mb': round(ru.ru_maxrss / 1024, 1),
+        'user_time': round(ru.ru_utime, 2),
+        'sys_time': round(ru.ru_stime, 2),
+        'wall_time': round(wall_time, 2),
+    }
+
+
+def _read_rss_mb(pid: int) -> Optional[float]:
+    """Текущий VmRSS процесса в МБ (None - процесс уже завершился или /proc недоступен)."""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _watch_rss(proc: subprocess.Popen, max_rss_mb: float, stop: threading.Event, exceeded: list):
+    """
+    Сторож памяти (выполняется в отдельном потоке): убивает процесс, когда VmRSS
+    превышает max_rss_mb. В отличие от RLIMIT_AS учитывает только реально занятую
+    память, а не адресное пространство, зарезервированное под потоки и кодеки.
+    """
+    while not stop.wait(_RSS_POLL_SECONDS):
+        rss = _read_rss_mb(proc.pid)
+        if rss is None:
+            return
+        if rss > max_rss_mb:
+            exceeded.append(rss)
+            proc.kill()
+            return
+
+
+def _drain(stream, sink: Callable[[str], None]):
+    """Читает поток построчно до EOF (выполняется в отдельном потоке)."""
+    try:
+        for line in iter(stream.readline, ''):
+            sink(line)
+    except (ValueError, OSError):
+        pass
+    finally:
+        try:
+            stream.close()
+        except Exception:
+            pass
+
+
+def run_ffmpeg(cmd: list, duration: Optional[float] = None,
+               on_progress: Optional[Callable[[dict], None]] = None,
+               timeout: Optional[float] = None,
+               log_path: Optional[str] = None,
+               tail_lines: int = STDERR_TAIL_LINES,
+               limits: Optional[dict] = None) -> FFmpegResult:
+    """
+    Запускает ffmpeg и, если задан on_progress, вызывает его для каждого блока -progress.
+
+    Результат совместим с subprocess.run(cmd, capture_output=True, text=True):
+    returncode, stdout и stderr (stderr - только последние tail_lines строк).
+
+    Args:
+        cmd: Команда ffmpeg (cmd[0] - бинарь)
+        duration: Ожидаемая длительность выхода в секундах, для fraction/ETA
+        on_progress: Callback(snapshot) - вызывается из потока-читателя stdout
+        timeout: Максимальное время выполнения в секундах (None - без ограничения)
+        log_path: Куда сохранить полный stderr при ошибке (None - не сохранять)
+        tail_lines: Размер кольцевого буфера stderr в строках
+        limits: Лимиты ресурсов дочернего процесса (см. with_limits)
+    """
+    progress_cmd = with_progress_args(cmd) if on_progress else None
+    run_cmd = with_limits(progress_cmd or cmd, limits, duration)
+
+    stdout_lines = []
+    stderr_tail = deque(maxlen=max(1, tail_lines))
+    stderr_count = [0]
+    started_at = time.monotonic()
+    block = {}
+
+    # Полный лог пишется на диск по мере поступления, в памяти - только хвост
+    spool = None
+    spool_path = f"{log_path}.part" if log_path else None
+    if spool_path:
+        try:
+            spool = open(spool_path, 'w', encoding='utf-8', errors='replace')
+        except OSError as e:
+            logger.debug(f"Cannot open ffmpeg log spool {spool_path}: {e}")
+            spool = None
+
+    def on_stdout_line(line: str):
+        if not progress_cmd:
+            stdout_lines.append(line)
+            return
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return
+        block[key] = value
+        if key == 'progress':
+            snapshot = parse_progress_block(block, duration, started_at)
+            block.clear()
+            try:
+                on_progress(snapshot)
+            except Exception as e:
+                logger.debug(f"Progress callback failed: {e}")
+
+    def on_stderr_line(line: str):
+        stderr_tail.append(line)
+        stderr_count[0] += 1
+        if spool:
+            spool.write(line)
+
+    proc = subprocess.Popen(
+        run_cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace',
+        bufsize=1
+    )
+    readers = [
+        threading.Thread(target=_drain, args=(proc.stdout, on_stdout_line), daemon=True),
+        threading.Thread(target=_drain, args=(proc.stderr, on_stderr_line), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, on_timeout) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+
+    # Лимит памяти по RSS: сторож работает до завершения процесса
+    max_rss_mb = (limits or {}).get('max_rss_mb')
+    rss_stop = threading.Event()
+    rss_exceeded = []
+    if max_rss_mb:
+        threading.Thread(target=_watch_rss, args=(proc, float(max_rss_mb), rss_stop, rss_exceeded),
+                         daemon=True).start()
+
+    rusage = None
+    try:
+        # wait4 вместо wait - чтобы получить rusage именно этого процесса
+        _, status, ru = os.wait4(proc.pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+        proc.returncode = returncode
+        rusage = _rusage_to_dict(ru, time.monotonic() - started_at)
+    except ChildProcessError:
+        returncode = proc.wait()
+    finally:
+        rss_stop.set()
+        if timer:
+            timer.cancel()
+        for reader in readers:
+            reader.join(timeout=5)
+
+    if timed_out.is_set():
+        on_stderr_line(f"ffmpeg killed after {timeout}s timeout\n")
+    if rss_exceeded:
+        on_stderr_line(f"ffmpeg killed: resident memory {rss_exceeded[0]:.0f} MB exceeded {max_rss_mb} MB limit\n")
+
+    kept_log = None
+    if spool:
+        spool.close()
+        try:
+            if returncode != 0:
+                os.replace(spool_path, log_path)
+                kept_log = log_path
+            else:
+                os.remove(spool_path)
+        except OSError as e:
+            logger.debug(f"ffmpeg log spool cleanup failed for {spool_path}: {e}")
+
+    tail = list(stderr_tail)
+    return FFmpegResult(
+        run_cmd, returncode,
+        stdout=''.join(stdout_lines),
+        stderr=''.join(tail),
+        error_summary=summarize_ffmpeg_error(tail, returncode) if returncode != 0 else '',
+        log_path=kept_log,
+        stderr_lines_total=stderr_count[0],
+        rusage=rusage
+    )
+
+
+__all__ = [
+    "STDERR_TAIL_LINES",
+    "FFmpegResult",
+    "summarize_ffmpeg_error",
+    "parse_progress_block",
+    "with_progress_args",
+    "with_ionice",
+    "with_limits",
+    "run_ffmpeg",
+]
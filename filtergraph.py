@@ -0,0 +1,211 @@
+"""
+Filtergraph - FFmpeg filter chain builders for Shorts conversion
+
+This module builds the video filter chains used by the make_short operation.
+It has no side effects (no Redis, no Flask), so it can be imported by the API
+and by the benchmark scripts in benchmarks/ alike.
+
+Responsibilities:
+- Crop/scale chains for center, top and bottom crop modes
+- Letterbox filtergraph (blurred background + scaled foreground)
+- Resolution-aware optimization of the letterbox graph:
+    * the source is decoded once and split explicitly between branches
+    * the background is cropped to its visible region BEFORE scaling, so no
+      pixels are scaled only to be thrown away by the following crop
+    * the background blur runs at a fraction of the output resolution and is
+      upscaled afterwards (a box blur of a downscaled frame is visually
+      indistinguishable from a full-resolution blur at the same radius)
+
+Usage:
+    from filtergraph import build_shorts_filter
+
+    video_filter, is_complex = build_shorts_filter('letterbox', letterbox_config,
+                                                   source_size=(3840, 2160))
+"""
+
+import re
+from typing import Optional, Tuple
+
+
+# Целевой формат Shorts
+SHORTS_WIDTH = 1080
+SHORTS_HEIGHT = 1920
+
+# Размер фона, при котором выполняется размытие (1/4 от 1080x1920)
+BLUR_WORK_WIDTH = 270
+BLUR_WORK_HEIGHT = 480
+
+# Радиус размытия ниже которого понижать разрешение фона нет смысла
+MIN_RADIUS_FOR_DOWNSCALE = 4
+
+LEGACY_LETTERBOX_CONFIG = {
+    'blur_radius': 20,
+    'bg_scale': f'{SHORTS_WIDTH}:{SHORTS_HEIGHT}',
+    'fg_scale': f'-1:{SHORTS_WIDTH}',
+    'overlay_x': '(W-w)/2',
+    'overlay_y': '(H-h)/2'
+}
+
+_SIZE_RE = re.compile(r'^\s*(\d+)\s*[:x]\s*(\d+)\s*$')
+
+
+def _parse_fixed_size(value) -> Optional[Tuple[int, int]]:
+    """Парсит 'W:H' (или 'WxH') с положительными целыми числами, иначе None."""
+    if not isinstance(value, str):
+        return None
+    m = _SIZE_RE.match(value)
+    if not m:
+        return None
+    w, h = int(m.group(1)), int(m.group(2))
+    if w <= 0 or h <= 0:
+        return None
+    return w, h
+
+
+def _even(value: float) -> int:
+    """Округляет размер до ближайшего чётного (требование yuv420p)."""
+    return max(2, int(round(value / 2.0)) * 2)
+
+
+def choose_blur_downscale(blur_radius, source_size: Optional[Tuple[int, int]] = None) -> int:
+    """
+    Выбирает во сколько раз уменьшить фон перед размытием.
+
+    Args:
+        blur_radius: Радиус boxblur из letterbox_config
+        source_size: (width, height) исходного видео, если известен
+
+    Returns:
+        Делитель разрешения фона (1 - без уменьшения, 2 или 4)
+    """
+    try:
+        radius = float(blur_radius)
+    except (TypeError, ValueError):
+        # Выражение вместо числа - не трогаем
+        return 1
+
+    if radius < MIN_RADIUS_FOR_DOWNSCALE:
+        return 1
+
+    factor = 4 if radius >= 2 * MIN_RADIUS_FOR_DOWNSCALE else 2
+
+    # Для источников ниже рабочего разрешения уменьшение почти ничего не даёт
+    if source_size:
+        src_w, src_h = source_size
+        if src_w and src_h and min(src_w, src_h) < BLUR_WORK_HEIGHT:
+            factor = min(factor, 2)
+
+    return factor
+
+
+def build_crop_filter(crop_mode: str) -> str:
+    """Строит цепочку crop/scale для режимов center, top и bottom.
+
+    Обрезка выполняется ДО масштабирования: crop в FFmpeg не копирует пиксели,
+    поэтому масштабируется только видимая область кадра.
+    """
+    tail = f"scale={SHORTS_WIDTH}:{SHORTS_HEIGHT}:force_original_aspect_ratio=increase,crop={SHORTS_WIDTH}:{SHORTS_HEIGHT}"
+    if crop_mode == 'top':
+        return f"crop=ih*9/16:ih:0:0,{tail}"
+    if crop_mode == 'bottom':
+        return f"crop=ih*9/16:ih:0:ih-oh,{tail}"
+    return f"crop=ih*9/16:ih,{tail}"
+
+
+def build_legacy_letterbox_filter(letterbox_config: dict) -> str:
+    """Исходный (неоптимизированный) letterbox filtergraph.
+
+    Оставлен для сравнения в бенчмарках и как fallback (letterbox_config.optimize=false).
+    """
+    return (
+        f"[0:v]scale={letterbox_config['bg_scale']}:force_original_aspect_ratio=increase,crop={SHORTS_WIDTH}:{SHORTS_HEIGHT},boxblur={letterbox_config['blur_radius']}[bg];"
+        f"[0:v]scale={letterbox_config['fg_scale']}:force_original_aspect_ratio=decrease[fg];"
+        f"[bg][fg]overlay={letterbox_config['overlay_x']}:{letterbox_config['overlay_y']}"
+    )
+
+
+def build_letterbox_filter(letterbox_config: dict, source_size: Optional[Tuple[int, int]] = None) -> str:
+    """
+    Строит оптимизированный letterbox filtergraph.
+
+    Результат визуально эквивалентен build_legacy_letterbox_filter():
+    - [0:v] декодируется один раз и явно делится split=2
+    - фон: сначала crop видимой области (в координатах источника), затем один scale
+      сразу в рабочее разрешение размытия, boxblur с пропорционально уменьшенным
+      радиусом и upscale до 1080x1920
+    - передний план масштабируется как раньше
+
+    Args:
+        letterbox_config: Нормализованный letterbox_config (все ключи заданы)
+        source_size: (width, height) источника, если известен (через ffprobe)
+
+    Returns:
+        Строка для -filter_complex
+    """
+    blur_radius = letterbox_config['blur_radius']
+    bg_size = _parse_fixed_size(letterbox_config['bg_scale'])
+    factor = choose_blur_downscale(blur_radius, source_size)
+
+    work_w = _even(SHORTS_WIDTH / factor)
+    work_h = _even(SHORTS_HEIGHT / factor)
+
+    if bg_size:
+        # Область источника, которая после scale(increase)+crop(1080:1920) попадает в кадр:
+        # s = max(W/iw, H/ih); видимая часть = 1080/s x 1920/s по центру
+        bg_w, bg_h = bg_size
+        cover = f"max({bg_w}/iw,{bg_h}/ih)"
+        bg_chain = f"crop='min(iw,{SHORTS_WIDTH}/{cover})':'min(ih,{SHORTS_HEIGHT}/{cover})',"
+        if factor > 1:
+            # Фон всё равно будет размыт - достаточно самого быстрого ресэмплинга
+            bg_chain += f"scale={work_w}:{work_h}:flags=fast_bilinear"
+        else:
+            bg_chain += f"scale={SHORTS_WIDTH}:{SHORTS_HEIGHT}"
+    else:
+        # Нестандартный bg_scale (выражения, -1) - сохраняем исходную семантику
+        bg_chain = (
+            f"scale={letterbox_config['bg_scale']}:force_original_aspect_ratio=increase,"
+            f"crop={SHORTS_WIDTH}:{SHORTS_HEIGHT}"
+        )
+        if factor > 1:
+            bg_chain += f",scale={work_w}:{work_h}:flags=fast_bilinear"
+
+    if factor > 1:
+        scaled_radius = max(1, int(round(float(blur_radius) / factor)))
+        bg_chain += f",boxblur={scaled_radius},scale={SHORTS_WIDTH}:{SHORTS_HEIGHT}:flags=bilinear"
+    else:
+        bg_chain += f",boxblur={blur_radius}"
+
+    return (
+        f"[0:v]split=2[bgsrc][fgsrc];"
+        f"[bgsrc]{bg_chain}[bg];"
+        f"[fgsrc]scale={letterbox_config['fg_scale']}:force_original_aspect_ratio=decrease[fg];"
+        f"[bg][fg]overlay={letterbox_config['overlay_x']}:{letterbox_config['overlay_y']}"
+    )
+
+
+def build_shorts_filter(crop_mode: str, letterbox_config: dict,
+                        source_size: Optional[Tuple[int, int]] = None,
+                        optimize: bool = True) -> Tuple[str, bool]:
+    """
+    Возвращает (video_filter, is_complex) для make_short.
+
+    is_complex=True означает что фильтр нужно передавать через -filter_complex,
+    иначе через -vf.
+    """
+    if crop_mode == 'letterbox':
+        if optimize:
+            return build_letterbox_filter(letterbox_config, source_size), True
+        return build_legacy_letterbox_filter(letterbox_config), True
+    return build_crop_filter(crop_mode), False
+
+
+__all__ = [
+    "SHORTS_WIDTH",
+    "SHORTS_HEIGHT",
+    "LEGACY_LETTERBOX_CONFIG",
+    "choose_blur_downscale",
+    "build_crop_filter",
+    "build_legacy_letterbox_filter",
+    "build_letterbox_filter",
+    "build_shorts_filter",
+]
@@ -0,0 +1,355 @@
+"""
+Font Registry - indexed font lookup with TrueType Collection face extraction
+
+The registry scans the fonts directory once (at startup), parses every font's
+`name` table and builds in-memory indexes, so resolving a `fontfile` from a
+text item is a dictionary lookup instead of os.path.exists/os.listdir calls
+on every request.
+
+Responsibilities:
+- Parse sfnt (.ttf/.otf) and TrueType Collection (.ttc) files without external
+  dependencies: family, style (subfamily), full name and PostScript name
+- Split .ttc collections into standalone per-face files (cached on disk and
+  re-extracted only when the collection changes), so every face can be passed
+  to FFmpeg drawtext by path
+- O(1) case-insensitive lookup by file name, file stem, family, "family style",
+  "family:style", full name and PostScript name
+- A precomputed listing for the /fonts endpoint
+
+Usage:
+    from font_registry import FontRegistry
+
+    registry = FontRegistry("/app/fonts", "/app/cache/fonts").build()
+    path = registry.resolve("PT Sans:Bold")
+    family, style = registry.face_for_path(path)  # ("PT Sans", "Bold")
+"""
+
+import logging
+import os
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# Name IDs из спецификации OpenType 'name' table
+NAME_FAMILY = 1
+NAME_SUBFAMILY = 2
+NAME_FULL = 4
+NAME_POSTSCRIPT = 6
+NAME_TYPO_FAMILY = 16
+NAME_TYPO_SUBFAMILY = 17
+
+_KEY_STRIP_RE = re.compile(r'[\s_\-]+')
+
+logger = logging.getLogger(__name__)
+
+
+class FontParseError(ValueError):
+    """Файл не является корректным sfnt/TTC шрифтом."""
+
+
+def normalize_key(value: str) -> str:
+    """Ключ поиска: нижний регистр, без пробелов, '_' и '-' ("PT Sans" == "ptsans")."""
+    return _KEY_STRIP_RE.sub('', str(value).strip().lower())
+
+
+def _read_table_records(data: bytes, offset: int) -> tuple:
+    """Читает offset table sfnt: возвращает (sfnt_version, {tag: (checksum, offset, length)})."""
+    if offset + 12 > len(data):
+        raise FontParseError("Truncated offset table")
+    sfnt_version, num_tables = struct.unpack_from('>4sH', data, offset)
+    if sfnt_version not in (b'\x00\x01\x00\x00', b'OTTO', b'true', b'typ1'):
+        raise FontParseError(f"Unknown sfnt version: {sfnt_version!r}")
+    records = {}
+    pos = offset + 12
+    for _ in range(num_tables):
+        if pos + 16 > len(data):
+            raise FontParseError("Truncated table directory")
+        tag, checksum, table_offset, length = struct.unpack_from('>4sIII', data, pos)
+        records[tag] = (checksum, table_offset, length)
+        pos += 16
+    return sfnt_version, records
+
+
+def _decode_name(raw: bytes, platform_id: int) -> str:
+    if platform_id in (0, 3):
+        return raw.decode('utf-16-be', errors='replace')
+    return raw.decode('mac_roman', errors='replace')
+
+
+def _parse_name_table(data: bytes, table_offset: int, length: int) -> Dict[int, str]:
+    """Извлекает записи name table, предпочитая Windows/English, затем Mac, затем Unicode."""
+    if table_offset + 6 > len(data):
+        raise FontParseError("Truncated name table")
+    _, count, string_offset = struct.unpack_from('>HHH', data, table_offset)
+    storage = table_offset + string_offset
+
+    # Чем меньше ранг - тем предпочтительнее запись
+    best: Dict[int, tuple] = {}
+    for i in range(count):
+        rec = table_offset + 6 + i * 12
+        if rec + 12 > table_offset + length:
+            break
+        platform_id, encoding_id, language_id, name_id, str_len, str_off = struct.unpack_from('>HHHHHH', data, rec)
+        if name_id not in (NAME_FAMILY, NAME_SUBFAMILY, NAME_FULL, NAME_POSTSCRIPT,
+                           NAME_TYPO_FAMILY, NAME_TYPO_SUBFAMILY):
+            continue
+        if platform_id == 3 and language_id == 0x409:
+            rank = 0
+        elif platform_id == 1 and language_id == 0:
+            rank = 1
+        elif platform_id == 3:
+            rank = 2
+        elif platform_id == 0:
+            rank = 3
+        else:
+            continue
+        if name_id in best and best[name_id][0] <= rank:
+            continue
+        raw = data[storage + str_off:storage + str_off + str_len]
+        value = _decode_name(raw, platform_id).strip('\x00').strip()
+        if value:
+            best[name_id] = (rank, value)
+
+    return {name_id: value for name_id, (_, value) in best.items()}
+
+
+def _face_offsets(data: bytes) -> List[int]:
+    """Смещения offset table всех начертаний (одно для .ttf/.otf, несколько для .ttc)."""
+    if data[:4] == b'ttcf':
+        if len(data) < 12:
+            raise FontParseError("Truncated TTC header")
+        num_fonts = struct.unpack_from('>I', data, 8)[0]
+        if 12 + num_fonts * 4 > len(data):
+            raise FontParseError("Truncated TTC offsets")
+        return list(struct.unpack_from(f'>{num_fonts}I', data, 12))
+    return [0]
+
+
+def parse_font_file(path: str) -> List[dict]:
+    """
+    Парсит шрифт и возвращает описание всех его начертаний.
+
+    Returns:
+        Список словарей: index, family, style, full_name, postscript_name, sfnt_version
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    faces = []
+    for index, offset in enumerate(_face_offsets(data)):
+        sfnt_version, records = _read_table_records(data, offset)
+        names = {}
+        if b'name' in records:
+            _, name_offset, name_length = records[b'name']
+            names = _parse_name_table(data, name_offset, name_length)
+        stem = os.path.basename(path).rsplit('.', 1)[0]
+        family = names.get(NAME_TYPO_FAMILY) or names.get(NAME_FAMILY) or stem
+        style = names.get(NAME_TYPO_SUBFAMILY) or names.get(NAME_SUBFAMILY) or 'Regular'
+        faces.append({
+            'index': index,
+            'family': family,
+            'style': style,
+            'full_name': names.get(NAME_FULL) or f"{family} {style}",
+            'postscript_name': names.get(NAME_POSTSCRIPT),
+            'sfnt_version': sfnt_version,
+        })
+    return faces
+
+
+def extract_face(data: bytes, face_index: int) -> bytes:
+    """Собирает самостоятельный sfnt файл из одного начертания TrueType Collection."""
+    offsets = _face_offsets(data)
+    if face_index >= len(offsets):
+        raise FontParseError(f"Face index {face_index} out of range ({len(offsets)} faces)")
+    sfnt_version, records = _read_table_records(data, offsets[face_index])
+
+    tags = sorted(records)
+    num_tables = len(tags)
+    entry_selector = max(0, num_tables.bit_length() - 1)
+    search_range = (1 << entry_selector) * 16
+    range_shift = num_tables * 16 - search_range
+
+    header = struct.pack('>4sHHHH', sfnt_version, num_tables, search_range, entry_selector, range_shift)
+    directory = b''
+    body = b''
+    table_offset = 12 + num_tables * 16
+    for tag in tags:
+        checksum, src_offset, length = records[tag]
+        table = data[src_offset:src_offset + length]
+        directory += struct.pack('>4sIII', tag, checksum, table_offset + len(body), length)
+        body += table + b'\x00' * ((4 - length % 4) % 4)
+    return header + directory + body
+
+
+class FontRegistry:
+    """Индекс шрифтов, построенный один раз при старте приложения."""
+
+    def __init__(self, fonts_dir: str, faces_dir: str, fallback_font: Optional[str] = None):
+        self.fonts_dir = fonts_dir
+        self.faces_dir = faces_dir
+        self.fallback_font = fallback_font
+        self.files: List[dict] = []
+        self._by_key: Dict[str, str] = {}
+        self._face_by_path: Dict[str, Tuple[str, str]] = {}
+
+    def _face_path(self, filename: str, face: dict) -> str:
+        stem = filename.rsplit('.', 1)[0]
+        ext = 'otf' if face['sfnt_version'] == b'OTTO' else 'ttf'
+        return os.path.join(self.faces_dir, f"{stem}-{face['index']}.{ext}")
+
+    def _extract_faces(self, path: str, filename: str, faces: List[dict]):
+        """Раскладывает .ttc на отдельные файлы (пропуская уже актуальные)."""
+        os.makedirs(self.faces_dir, exist_ok=True)
+        source_mtime = os.path.getmtime(path)
+        data = None
+        for face in faces:
+            face_path = self._face_path(filename, face)
+            face['file'] = face_path
+            if os.path.exists(face_path) and os.path.getmtime(face_path) >= source_mtime:
+                continue
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            tmp_path = face_path + '.part'
+            with open(tmp_path, 'wb') as f:
+                f.write(extract_face(data, face['index']))
+            os.replace(tmp_path, face_path)
+            os.chmod(face_path, 0o644)
+
+    def _index(self, key: str, path: str):
+        normalized = normalize_key(key)
+        if normalized and normalized not in self._by_key:
+            self._by_key[normalized] = path
+
+    def build(self) -> 'FontRegistry':
+        """Сканирует fonts_dir, парсит name tables и строит индексы."""
+        files = []
+        by_key: Dict[str, str] = {}
+        self._by_key = by_key
+        self._face_by_path = {}
+
+        if not os.path.isdir(self.fonts_dir):
+            self.files = files
+            return self
+
+        for filename in sorted(os.listdir(self.fonts_dir)):
+            if not filename.lower().endswith(FONT_EXTENSIONS):
+                continue
+            path = os.path.join(self.fonts_dir, filename)
+            try:
+                faces = parse_font_file(path)
+            except (OSError, FontParseError, struct.error) as e:
+                logger.warning(f"Font registry: skipping {filename}: {e}")
+                continue
+
+            is_collection = filename.lower().endswith('.ttc')
+            if is_collection:
+                try:
+                    self._extract_faces(path, filename, faces)
+                except (OSError, FontParseError, struct.error) as e:
+                    logger.warning(f"Font registry: failed to split {filename}: {e}")
+                    for face in faces:
+                        face['file'] = path
+            else:
+                for face in faces:
+                    face['file'] = path
+
+            # Имя файла и stem указывают на исходный файл (drawtext берёт face 0 из .ttc)
+            stem = filename.rsplit('.', 1)[0]
+            self._index(filename, path)
+            self._index(stem, path)
+            self._face_by_path[path] = (faces[0]['family'], faces[0]['style'])
+
+            for face in faces:
+                face_path = face['file']
+                self._face_by_path.setdefault(face_path, (face['family'], face['style']))
+                self._index(f"{face['family']} {face['style']}", face_path)
+                self._index(f"{face['family']}:{face['style']}", face_path)
+                self._index(face['full_name'], face_path)
+                if face['postscript_name']:
+                    self._index(face['postscript_name'], face_path)
+
+            # Алиасы по имени файла - после имён из name table, чтобы не перекрывать их
+            if is_collection:
+                for face in faces:
+                    self._index(os.path.basename(face['file']), face['file'])
+                    self._index(f"{stem}:{face['style']}", face['file'])
+
+            # Семейство без стиля -> Regular начертание (или первое)
+            regular = next((f for f in faces if f['style'].lower() in ('regular', 'roman', 'book')), faces[0])
+            self._index(regular['family'], regular['file'])
+
+            files.append({
+                'name': stem,
+                'filename': filename,
+                'file': path,
+                'type': filename.lower().rsplit('.', 1)[-1],
+                'faces': [
+                    {
+                        'index': face['index'],
+                        'family': face['family'],
+                        'style': face['style'],
+                        'full_name': face['full_name'],
+                        'postscript_name': face['postscript_name'],
+                        'file': face['file'],
+                    }
+                    for face in faces
+                ],
+            })
+
+        self.files = files
+        return self
+
+    def lookup(self, name: str) -> Optional[str]:
+        """O(1) поиск пути к шрифту по имени файла/семейства/стиля (регистр не важен)."""
+        if not name:
+            return None
+        return self._by_key.get(normalize_key(name))
+
+    def resolve(self, fontfile) -> Optional[str]:
+        """
+        Резолвит fontfile из text_item в путь к файлу.
+
+        Поддерживает: абсолютный путь, "PTSans.ttc", "PTSans", "PT Sans",
+        "PT Sans Bold", "PT Sans:Bold", "PTSans-Bold" (PostScript).
+        Возвращает fallback_font если ничего не найдено.
+        """
+        if not fontfile:
+            return self.fallback_font
+        fontfile = str(fontfile).strip()
+        if fontfile.startswith('/'):
+            if os.path.exists(fontfile):
+                return fontfile
+            logger.warning(f"Font path not found: {fontfile}, using fallback")
+            return self.fallback_font
+        path = self.lookup(fontfile)
+        if path:
+            return path
+        logger.warning(f"Font '{fontfile}' not found in {self.fonts_dir}/, using fallback")
+        return self.fallback_font
+
+    def family_for_path(self, path: str) -> Optional[str]:
+        """Имя семейства для пути, полученного из resolve()."""
+        face = self._face_by_path.get(path)
+        return face[0] if face else None
+
+    def face_for_path(self, path: str) -> Optional[Tuple[str, str]]:
+        """(семейство, начертание) для пути, полученного из resolve()."""
+        return self._face_by_path.get(path)
+
+    def listing(self) -> List[dict]:
+        """Список файлов с начертаниями для /fonts."""
+        return self.files
+
+
+__all__ = [
+    "FONT_EXTENSIONS",
+    "FontParseError",
+    "FontRegistry",
+    "normalize_key",
+    "parse_font_file",
+    "extract_face",
+]
@@ -0,0 +1,305 @@
+"""
+Media Analysis - one-pass scene, silence and loudness analysis
+
+Builds a single ffmpeg command that decodes the source once and runs:
+- scene-change detection on a downscaled video stream (select + scene score)
+- silence detection on a low-rate mono audio stream (silencedetect)
+- EBU R128 loudness (ebur128, short-term loudness sampled once per second)
+
+Per-frame results are written by metadata/ametadata print filters into two
+small text files, which are then folded into a compact per-second timeline.
+The module has no side effects (no Redis, no Flask), so it can be used by the
+API and by benchmark scripts alike.
+
+Speed-ups over a naive analysis:
+- the H.264/HEVC loop filter is skipped while decoding (not needed for scene scores)
+- video is scaled to ANALYSIS_WIDTH pixels before scene scoring
+- audio is downmixed to mono 16 kHz for silencedetect; ebur128 (48 kHz only by
+  specification) receives one-second frames, so metadata is emitted once per second
+
+The module also builds the two loudnorm passes used by normalize_audio:
+a measurement pass (print_format=json) and a linear apply pass that reuses
+the measured values.
+
+Usage:
+    from media_analysis import build_analysis_command, build_timeline
+
+    cmd = build_analysis_command(src, scenes_txt, audio_txt, has_video=True, has_audio=True)
+    ... run cmd ...
+    timeline = build_timeline(scenes_txt, audio_txt, duration)
+"""
+
+import json
+import math
+import os
+from typing import Optional
+
+ANALYSIS_WIDTH = 320
+ANALYSIS_SAMPLE_RATE = 16000
+EBUR128_SAMPLE_RATE = 48000
+
+DEFAULT_ANALYSIS_PARAMS = {
+    'scene_threshold': 0.3,        # Порог scene score (0..1) для смены сцены
+    'silence_threshold_db': -35,   # Уровень тишины, dBFS
+    'silence_min_duration': 0.5,   # Минимальная длительность тишины, сек
+}
+
+# Значение ebur128 для тишины (ниже абсолютного гейта)
+LOUDNESS_FLOOR = -70.0
+
+TIMELINE_VERSION = 1
+
+
+def _escape_filter_path(path: str) -> str:
+    """Экранирует путь для аргумента фильтра внутри filtergraph."""
+    return path.replace('\\', '\\\\').replace(':', '\\:').replace("'", "\\'")
+
+
+def build_analysis_command(input_path: str, scenes_path: str, audio_path: str,
+                           has_video: bool, has_audio: bool,
+                           params: Optional[dict] = None) -> list:
+    """
+    Команда ffmpeg для анализа за один проход декодирования.
+
+    Args:
+        input_path: Источник
+        scenes_path: Файл для метаданных смены сцен (metadata=print)
+        audio_path: Файл для метаданных тишины и громкости (ametadata=print)
+        has_video / has_audio: Какие потоки есть в источнике (по ffprobe)
+        params: scene_threshold, silence_threshold_db, silence_min_duration
+    """
+    p = dict(DEFAULT_ANALYSIS_PARAMS, **(params or {}))
+    graphs = []
+    maps = []
+    if has_video:
+        graphs.append(
+            f"[0:v]scale={ANALYSIS_WIDTH}:-2:flags=fast_bilinear,"
+            f"select='gt(scene,{float(p['scene_threshold'])})',"
+            f"metadata=mode=print:file='{_escape_filter_path(scenes_path)}'[vout]"
+        )
+        maps += ['-map', '[vout]']
+    if has_audio:
+        graphs.append(
+            f"[0:a]aformat=channel_layouts=mono,aresample={ANALYSIS_SAMPLE_RATE},"
+            f"silencedetect=noise={float(p['silence_threshold_db'])}dB:d={float(p['silence_min_duration'])},"
+            f"aresample={EBUR128_SAMPLE_RATE},asetnsamples=n={EBUR128_SAMPLE_RATE}:p=0,"
+            f"ebur128=metadata=1,"
+            f"ametadata=mode=print:file='{_escape_filter_path(audio_path)}'[aout]"
+        )
+        maps += ['-map', '[aout]']
+    if not graphs:
+        raise ValueError("Source has neither video nor audio streams")
+
+    cmd = ['ffmpeg', '-hide_banner']
+    if has_video:
+        # Деблокинг не влияет на scene score, но заметно ускоряет декодирование
+        cmd += ['-skip_loop_filter', 'all']
+    cmd += ['-i', input_path, '-filter_complex', ';'.join(graphs)]
+    cmd += maps
+    cmd += ['-sn', '-dn', '-f', 'null', os.devnull]
+    return cmd
+
+
+def parse_metadata_print(path: str) -> list:
+    """
+    Разбирает вывод metadata/ametadata mode=print:
+        frame:12   pts:576000  pts_time:12
+        lavfi.r128.S=-23.1
+    Returns:
+        [(pts_time, {key: value}), ...]
+    """
+    frames = []
+    if not path or not os.path.exists(path):
+        return frames
+    current = None
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('frame:'):
+                pts_time = None
+                for token in line.split():
+                    if token.startswith('pts_time:'):
+                        try:
+                            pts_time = float(token.split(':', 1)[1])
+                        except ValueError:
+                            pts_time = None
+                current = (pts_time, {})
+                frames.append(current)
+            elif current is not None and '=' in line:
+                key, value = line.split('=', 1)
+                current[1][key] = value
+    return frames
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(result):
+        return None
+    return result
+
+
+def build_timeline(scenes_path: str, audio_path: str, duration: float,
+                   params: Optional[dict] = None) -> dict:
+    """
+    Сводит метаданные анализа в компактный посекундный timeline.
+
+    timeline - колонки одинаковой длины (индекс = секунда):
+        loudness: short-term громкость LUFS (None без аудио)
+        silence: доля секунды в тишине (0..1)
+        scene: максимальный scene score смены сцены в этой секунде (0 - нет смены)
+    """
+    p = dict(DEFAULT_ANALYSIS_PARAMS, **(params or {}))
+    seconds = max(1, int(math.ceil(duration or 0)))
+
+    # Смены сцен
+    scene = [0.0] * seconds
+    scene_changes = []
+    for pts_time, meta in parse_metadata_print(scenes_path):
+        score = _to_float(meta.get('lavfi.scene_score'))
+        if pts_time is None or score is None:
+            continue
+        scene_changes.append(round(pts_time, 3))
+        idx = min(seconds - 1, max(0, int(pts_time)))
+        scene[idx] = max(scene[idx], round(score, 3))
+
+    # Громкость и тишина
+    audio_frames = parse_metadata_print(audio_path)
+    has_audio = bool(audio_frames)
+    loudness = [None] * seconds
+    silences = []
+    silence_start = None
+    integrated = None
+    loudness_range = None
+    for pts_time, meta in audio_frames:
+        short_term = meta.get('lavfi.r128.S')
+        if short_term is not None and pts_time is not None:
+            value = _to_float(short_term)
+            value = LOUDNESS_FLOOR if value is None or value < LOUDNESS_FLOOR else value
+            idx = min(seconds - 1, max(0, int(pts_time)))
+            loudness[idx] = round(value, 1)
+        if 'lavfi.r128.I' in meta:
+            integrated = _to_float(meta['lavfi.r128.I'])
+        if 'lavfi.r128.LRA' in meta:
+            loudness_range = _to_float(meta['lavfi.r128.LRA'])
+        if 'lavfi.silence_start' in meta:
+            silence_start = _to_float(meta['lavfi.silence_start'])
+        if 'lavfi.silence_end' in meta and silence_start is not None:
+            end = _to_float(meta['lavfi.silence_end'])
+            if end is not None:
+                silences.append([round(max(0.0, silence_start), 3), round(end, 3)])
+            silence_start = None
+    if silence_start is not None:
+        # Тишина до конца файла
+        silences.append([round(max(0.0, silence_start), 3), round(duration, 3)])
+
+    silence = [0.0] * seconds
+    for start, end in silences:
+        for idx in range(int(start), min(seconds, int(math.ceil(end)))):
+            overlap = min(end, idx + 1) - max(start, idx)
+            if overlap > 0:
+                silence[idx] = round(min(1.0, silence[idx] + overlap), 2)
+
+    silent_total = sum(end - start for start, end in silences)
+    return {
+        'version': TIMELINE_VERSION,
+        'duration': round(duration, 3),
+        'params': p,
+        'summary': {
+            'integrated_lufs': round(integrated, 1) if integrated is not None else None,
+            'loudness_range_lu': round(loudness_range, 1) if loudness_range is not None else None,
+            'scene_changes': len(scene_changes),
+            'silence_ratio': round(silent_total / duration, 3) if duration else None,
+            'has_audio': has_audio,
+        },
+        'scene_changes': scene_changes,
+        'silences': silences,
+        'timeline': {
+            'step': 1,
+            'loudness': loudness if has_audio else None,
+            'silence': silence,
+            'scene': scene,
+        },
+    }
+
+
+# ============================================
+# LOUDNESS NORMALIZATION (loudnorm, two-pass)
+# ============================================
+
+DEFAULT_LOUDNORM_TARGET = {
+    'i': -14.0,    # Целевая интегральная громкость, LUFS (уровень Shorts/Reels)
+    'tp': -1.5,    # Максимальный true peak, dBTP
+    'lra': 11.0,   # Целевой диапазон громкости, LU
+}
+
+# Поля первого прохода loudnorm, которые передаются во второй
+_LOUDNORM_MEASURED_KEYS = ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')
+
+
+def build_loudnorm_measure_filter(target: dict) -> str:
+    """Фильтр первого (измерительного) прохода loudnorm."""
+    return (
+        f"loudnorm=I={float(target['i'])}:TP={float(target['tp'])}:LRA={float(target['lra'])}"
+        f":print_format=json"
+    )
+
+
+def parse_loudnorm_json(stderr: str) -> Optional[dict]:
+    """
+    Достаёт JSON-блок, который loudnorm печатает в stderr в конце первого прохода.
+
+    Returns:
+        {input_i, input_tp, input_lra, input_thresh, target_offset} как float или None
+    """
+    if not stderr:
+        return None
+    end = stderr.rfind('}')
+    start = stderr.rfind('{', 0, end)
+    if start < 0 or end < 0:
+        return None
+    try:
+        data = json.loads(stderr[start:end + 1])
+    except ValueError:
+        return None
+    measured = {}
+    for key in _LOUDNORM_MEASURED_KEYS:
+        value = _to_float(data.get(key))
+        if value is None or math.isinf(value):
+            # -inf у input_i - тишина, нормализовать нечего
+            return None
+        measured[key] = value
+    return measured
+
+
+def build_loudnorm_apply_filter(target: dict, measured: dict, sample_rate: int = 48000) -> str:
+    """
+    Фильтр второго прохода: linear loudnorm по измеренным значениям.
+
+    loudnorm внутри работает на 192 kHz - на выходе возвращаем обычную частоту.
+    """
+    return (
+        f"loudnorm=I={float(target['i'])}:TP={float(target['tp'])}:LRA={float(target['lra'])}"
+        f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+        f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+        f":offset={measured['target_offset']}:linear=true:print_format=none,"
+        f"aresample={sample_rate}"
+    )
+
+
+__all__ = [
+    "ANALYSIS_WIDTH",
+    "ANALYSIS_SAMPLE_RATE",
+    "DEFAULT_ANALYSIS_PARAMS",
+    "build_analysis_command",
+    "parse_metadata_print",
+    "build_timeline",
+    "DEFAULT_LOUDNORM_TARGET",
+    "build_loudnorm_measure_filter",
+    "parse_loudnorm_json",
+    "build_loudnorm_apply_filter",
+]
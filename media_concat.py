@@ -0,0 +1,138 @@
+"""
+Media Concat - joining clips into one file without intermediate files
+
+A concat job is a list of pieces (path, start, end): whole files or time
+ranges of them. There are two ways to join the pieces:
+- stream copy: every distinct file has the same codec parameters. The concat
+  demuxer reads the pieces in place (inpoint/outpoint directives) and the
+  result is remuxed with -c copy. With inter-frame codecs a piece starts at
+  the keyframe at or before its inpoint, the same as a -c copy cut.
+- one encode: the parameters differ. Every piece is opened as a trimmed input
+  (-ss/-t before -i) and a single filtergraph normalizes frame size, frame
+  rate, pixel format and audio layout before the concat filter. This is one
+  ffmpeg process with no per-piece files.
+
+This module only builds arguments and text. It has no side effects: no
+Redis, no Flask, no subprocesses.
+
+Usage:
+    from media_concat import stream_signature, signature_mismatch, build_concat_script
+
+    signatures = [stream_signature(ffprobe_streams(path)) for path in files]
+    if signature_mismatch(signatures) is None:
+        script = build_concat_script([(path, 10.0, 25.0), (path, 40.0, None)])
+"""
+
+import os
+from typing import Optional
+
+# Параметры, которые должны совпадать у всех файлов для склейки без перекодирования
+VIDEO_SIGNATURE_FIELDS = ('codec_name', 'profile', 'width', 'height', 'pix_fmt',
+                          'sample_aspect_ratio', 'r_frame_rate', 'time_base')
+AUDIO_SIGNATURE_FIELDS = ('codec_name', 'profile', 'sample_rate', 'channels', 'channel_layout')
+
+# Формат звука после нормализации в режиме перекодирования
+CONCAT_AUDIO_SAMPLE_RATE = 48000
+CONCAT_AUDIO_LAYOUT = 'stereo'
+DEFAULT_FRAME_RATE = '30'
+
+
+def stream_signature(streams: list) -> dict:
+    """
+    Сигнатура файла из streams ffprobe: параметры первого видео- и аудиопотока
+    и число потоков каждого типа.
+    """
+    video = [s for s in streams if s.get('codec_type') == 'video']
+    audio = [s for s in streams if s.get('codec_type') == 'audio']
+    return {
+        'video_streams': len(video),
+        'audio_streams': len(audio),
+        'video': {field: video[0].get(field) for field in VIDEO_SIGNATURE_FIELDS} if video else None,
+        'audio': {field: audio[0].get(field) for field in AUDIO_SIGNATURE_FIELDS} if audio else None,
+    }
+
+
+def signature_mismatch(signatures: list) -> Optional[str]:
+    """Первое расхождение с сигнатурой первого файла ('video width: 1920 != 1280 (file 2)') или None"""
+    if not signatures:
+        return None
+    first = signatures[0]
+    for index, signature in enumerate(signatures[1:], start=2):
+        for count in ('video_streams', 'audio_streams'):
+            if signature[count] != first[count]:
+                return f"{count.replace('_', ' ')}: {first[count]} != {signature[count]} (file {index})"
+        for kind in ('video', 'audio'):
+            if not first[kind]:
+                continue
+            for field, value in first[kind].items():
+                if signature[kind].get(field) != value:
+                    return f"{kind} {field}: {value} != {signature[kind].get(field)} (file {index})"
+    return None
+
+
+def _format_time(seconds: float) -> str:
+    return f"{seconds:.6f}".rstrip('0').rstrip('.')
+
+
+def build_concat_script(pieces: list) -> str:
+    """Список для concat demuxer (-f concat -safe 0): file + inpoint/outpoint для отрезков"""
+    lines = []
+    for path, start, end in pieces:
+        escaped = os.path.abspath(path).replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+        if start:
+            lines.append(f"inpoint {_format_time(start)}")
+        if end is not None:
+            lines.append(f"outpoint {_format_time(end)}")
+    return '\n'.join(lines) + '\n'
+
+
+def trimmed_input_args(path: str, start: Optional[float], end: Optional[float]) -> list:
+    """Вход отрезка для режима перекодирования: -ss/-t до -i (быстрый поиск, точная обрезка)"""
+    args = []
+    if start:
+        args.extend(['-ss', _format_time(start)])
+    if end is not None:
+        args.extend(['-t', _format_time(end - (start or 0.0))])
+    return [*args, '-i', path]
+
+
+def build_concat_filter(count: int, has_video: bool, has_audio: bool,
+                        size: Optional[tuple] = None, frame_rate: Optional[str] = None) -> str:
+    """
+    filter_complex склейки count входов одним кодированием: кадры приводятся к size
+    (вписываются с полями), частоте frame_rate и yuv420p, звук - к 48 кГц стерео.
+    Выходы: [vout] и/или [aout].
+    """
+    width, height = size or (1920, 1080)
+    width, height = width - width % 2, height - height % 2
+    rate = frame_rate if frame_rate and not frame_rate.startswith('0') else DEFAULT_FRAME_RATE
+    chains = []
+    labels = ''
+    for index in range(count):
+        if has_video:
+            chains.append(
+                f"[{index}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={rate},format=yuv420p[v{index}]"
+            )
+            labels += f"[v{index}]"
+        if has_audio:
+            chains.append(
+                f"[{index}:a:0]aresample={CONCAT_AUDIO_SAMPLE_RATE},"
+                f"aformat=sample_fmts=fltp:channel_layouts={CONCAT_AUDIO_LAYOUT}[a{index}]"
+            )
+            labels += f"[a{index}]"
+    outputs = ('[vout]' if has_video else '') + ('[aout]' if has_audio else '')
+    chains.append(f"{labels}concat=n={count}:v={int(has_video)}:a={int(has_audio)}{outputs}")
+    return ';'.join(chains)
+
+
+__all__ = [
+    "VIDEO_SIGNATURE_FIELDS",
+    "AUDIO_SIGNATURE_FIELDS",
+    "stream_signature",
+    "signature_mismatch",
+    "build_concat_script",
+    "trimmed_input_args",
+    "build_concat_filter",
+]
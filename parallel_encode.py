@@ -0,0 +1,130 @@
+"""
+Parallel Encode - planning for segment-parallel video encoding
+
+A long encode is split into K segments that are encoded concurrently by K
+ffmpeg processes with identical settings and then joined losslessly with the
+concat demuxer (-c copy). This module only plans the work; it has no side
+effects (no Redis, no Flask, no subprocesses).
+
+Planning rules:
+- cut points are snapped to source keyframes (encoders place keyframes on
+  scene cuts, so segments usually start on a cut and seeking is free: no
+  frames before the cut point need to be decoded and thrown away)
+- every segment is at least min_segment_seconds long; short ranges stay in
+  one segment
+- time-based overlays (drawtext enable=between(t,...), ASS events) are
+  shifted into each segment's local time, and items outside a segment are
+  dropped from that segment's filtergraph
+
+Audio is not split: it is encoded once for the whole range and muxed with the
+concatenated video, so there are no AAC priming gaps at segment boundaries.
+
+Usage:
+    from parallel_encode import plan_segments, shift_text_items, build_concat_list
+
+    segments = plan_segments(0.0, 600.0, keyframes, max_segments=4, min_segment_seconds=20)
+    for seg_start, seg_end in segments:
+        items = shift_text_items(text_items, seg_start - 0.0, seg_end - seg_start)
+"""
+
+import os
+from typing import Optional
+
+# Отступ от конца сегмента: кадр ровно на точке разреза относится к следующему сегменту
+SEGMENT_END_EPSILON = 0.001
+
+# Значения start/end text_item по умолчанию (как в drawtext/ASS рендерерах)
+TEXT_ITEM_DEFAULT_START = 0.0
+TEXT_ITEM_DEFAULT_END = 5.0
+
+
+def plan_segments(start: float, end: float, keyframes: Optional[list],
+                  max_segments: int, min_segment_seconds: float) -> list:
+    """
+    Делит [start, end) на сегменты с разрезами по ключевым кадрам.
+
+    Args:
+        start / end: Границы диапазона в секундах источника
+        keyframes: Времена ключевых кадров источника (секунды от начала файла)
+        max_segments: Максимум сегментов (K)
+        min_segment_seconds: Минимальная длина сегмента
+
+    Returns:
+        [(seg_start, seg_end), ...] - один элемент, если делить не имеет смысла
+    """
+    total = end - start
+    count = min(int(max_segments), int(total // min_segment_seconds)) if min_segment_seconds > 0 else int(max_segments)
+    if count < 2 or not keyframes:
+        return [(start, end)]
+
+    candidates = sorted(
+        k for k in keyframes
+        if start + min_segment_seconds <= k <= end - min_segment_seconds
+    )
+    cuts = []
+    previous = start
+    for index in range(1, count):
+        target = start + total * index / count
+        best = None
+        for k in candidates:
+            if k - previous < min_segment_seconds:
+                continue
+            if best is None or abs(k - target) < abs(best - target):
+                best = k
+            elif k > target:
+                break
+        if best is None or end - best < min_segment_seconds:
+            break
+        cuts.append(best)
+        previous = best
+
+    bounds = [start, *cuts, end]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def shift_text_items(text_items: list, offset: float, length: float) -> list:
+    """
+    text_items в локальном времени сегмента [offset, offset + length).
+
+    Элементы вне сегмента отбрасываются. Нечисловые start/end - ValueError
+    (такой набор нельзя корректно разделить, кодирование идёт одним процессом).
+    """
+    shifted = []
+    for item in text_items:
+        if not isinstance(item, dict):
+            shifted.append(item)
+            continue
+        item_start = float(item.get('start', TEXT_ITEM_DEFAULT_START))
+        item_end = float(item.get('end', TEXT_ITEM_DEFAULT_END))
+        if item_end <= offset or item_start >= offset + length:
+            continue
+        shifted.append(dict(
+            item,
+            start=round(max(0.0, item_start - offset), 3),
+            end=round(item_end - offset, 3)
+        ))
+    return shifted
+
+
+def segment_threads(segment_count: int, cpu_count: Optional[int] = None) -> int:
+    """Потоки кодировщика на сегмент, чтобы K процессов не делили CPU с переподпиской"""
+    cpus = cpu_count or os.cpu_count() or 1
+    return max(1, cpus // max(1, segment_count))
+
+
+def build_concat_list(paths: list) -> str:
+    """Содержимое списка для concat demuxer (-f concat -safe 0)"""
+    lines = []
+    for path in paths:
+        escaped = os.path.abspath(path).replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+    return '\n'.join(lines) + '\n'
+
+
+__all__ = [
+    "SEGMENT_END_EPSILON",
+    "plan_segments",
+    "shift_text_items",
+    "segment_threads",
+    "build_concat_list",
+]
@@ -0,0 +1,212 @@
+"""
+Plan Estimates - cost and size model for dry-run pipeline plans (POST /plan)
+
+Answers "what would this pipeline cost" before anything runs:
+- CPU-seconds of an operation: CPU-seconds per second of processed media.
+  Starts from built-in defaults and follows an exponential moving average of
+  the ffmpeg rusage (user + sys) this process actually observed per operation
+- the output of every step (duration, frame size, stream types, bytes),
+  derived from the step's input description and its parameters, so the
+  estimate of one step is the input of the next
+
+All numbers are estimates for capacity planning. The module has no side
+effects (no ffmpeg, no Redis, no Flask).
+
+Usage:
+    from plan_estimates import CostModel, estimate_output
+
+    model = CostModel()
+    model.observe('make_short', cpu_seconds=95.0, media_seconds=30.0)
+    cpu = model.cpu_seconds('make_short', 60.0)
+    out = estimate_output('make_short', params, {'duration': 600, 'bytes': 2e8}, duration=60.0)
+"""
+
+import math
+import threading
+from typing import Optional
+
+# CPU-секунд на секунду медиа (1080p-источник) до первых наблюдений
+DEFAULT_CPU_SECONDS_PER_MEDIA_SECOND = {
+    'cut_video': 0.01,       # -c copy: только демультиплексирование
+    'make_short': 3.0,       # декодирование + фильтры + libx264 medium 1080x1920
+    'extract_audio': 0.05,   # декодирование и кодирование одной аудиодорожки
+    'package_hls': 0.01,     # -c copy в сегменты
+    'analyze_media': 0.5,    # декодирование видео для scdet + ebur128
+    'storyboard': 0.3,       # декодирование видео, кадры раз в interval
+    'concat': 1.0,           # -c copy почти бесплатен, перекодирование ~3: среднее до наблюдений
+}
+FALLBACK_CPU_SECONDS_PER_MEDIA_SECOND = 1.0
+
+# Вес нового наблюдения в скользящем среднем
+OBSERVATION_WEIGHT = 0.2
+
+# Битрейты выходов (бит/с), если операция не задаёт свой
+SHORTS_VIDEO_BITRATE = 4_000_000  # libx264 -crf 23 -preset medium, 1080x1920, типичный контент
+SHORTS_AUDIO_BITRATE = 128_000
+SHORTS_SIZE = (1080, 1920)
+DEFAULT_AUDIO_BITRATE = 192_000
+WHISPER_AUDIO_BITRATE = 64_000
+THUMBNAIL_BYTES = 150 * 1024
+STORYBOARD_SHEET_BYTES = 60 * 1024
+ANALYSIS_BYTES_PER_SECOND = 40
+
+
+def parse_bitrate(value) -> Optional[int]:
+    """Бит/с из 192000, '192k', '1.5M'; None если не распознано"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if value > 0 else None
+    text = str(value or '').strip().lower()
+    multiplier = 1
+    if text.endswith('k'):
+        multiplier, text = 1000, text[:-1]
+    elif text.endswith('m'):
+        multiplier, text = 1000 * 1000, text[:-1]
+    try:
+        bits = float(text) * multiplier
+    except ValueError:
+        return None
+    return int(bits) if bits > 0 else None
+
+
+def _bytes_for(bitrate: Optional[float], duration: Optional[float]) -> Optional[int]:
+    if not bitrate or not duration:
+        return None
+    return int(bitrate * duration / 8)
+
+
+def source_bitrate(source: dict) -> Optional[float]:
+    """Средний битрейт входа: из ffprobe или размер / длительность"""
+    if source.get('bit_rate'):
+        return float(source['bit_rate'])
+    if source.get('bytes') and source.get('duration'):
+        return source['bytes'] * 8 / source['duration']
+    return None
+
+
+class CostModel:
+    """CPU-секунды на секунду медиа по типам операций: значения по умолчанию + наблюдения процесса."""
+
+    def __init__(self, defaults: Optional[dict] = None, weight: float = OBSERVATION_WEIGHT):
+        self.defaults = dict(defaults or DEFAULT_CPU_SECONDS_PER_MEDIA_SECOND)
+        self.weight = weight
+        self._lock = threading.Lock()
+        self._rates = {}  # op_type -> (скользящее среднее, число наблюдений)
+
+    def observe(self, op_type: str, cpu_seconds: float, media_seconds: float):
+        """Учитывает выполненный ffmpeg-вызов операции (user + sys) над media_seconds медиа"""
+        if not media_seconds or media_seconds <= 0 or cpu_seconds is None or cpu_seconds < 0:
+            return
+        rate = cpu_seconds / media_seconds
+        with self._lock:
+            current, samples = self._rates.get(op_type, (None, 0))
+            if current is None:
+                current = rate
+            else:
+                current += (rate - current) * self.weight
+            self._rates[op_type] = (current, samples + 1)
+
+    def rate(self, op_type: str) -> float:
+        with self._lock:
+            observed = self._rates.get(op_type)
+        if observed:
+            return observed[0]
+        return self.defaults.get(op_type, FALLBACK_CPU_SECONDS_PER_MEDIA_SECOND)
+
+    def cpu_seconds(self, op_type: str, media_seconds: Optional[float]) -> Optional[float]:
+        if not media_seconds:
+            return None
+        return round(self.rate(op_type) * media_seconds, 1)
+
+    def snapshot(self) -> dict:
+        """Текущие коэффициенты: {op_type: {'cpu_per_media_second', 'observations'}}"""
+        with self._lock:
+            observed = dict(self._rates)
+        result = {}
+        for op_type in sorted(set(self.defaults) | set(observed)):
+            rate, samples = observed.get(op_type, (self.defaults.get(op_type), 0))
+            result[op_type] = {'cpu_per_media_second': round(rate, 3), 'observations': samples}
+        return result
+
+
+def estimate_output(op_type: str, params: dict, source: dict, duration: Optional[float]) -> dict:
+    """
+    Оценка выхода шага pipeline.
+
+    Args:
+        source: вход шага {'duration', 'size', 'stream_types', 'bytes', 'bit_rate'}
+        duration: длительность выхода с учётом start_time/end_time (None - неизвестна)
+
+    Returns:
+        {'duration', 'size', 'stream_types', 'bytes', 'files'}; bytes - все файлы шага
+    """
+    stream_types = list(source.get('stream_types') or [])
+    has_audio = 'audio' in stream_types
+    out = {
+        'duration': duration,
+        'size': source.get('size'),
+        'stream_types': stream_types,
+        'bytes': None,
+        'files': 1,
+    }
+
+    if op_type in ('cut_video', 'package_hls', 'concat'):
+        # -c copy: размер пропорционален длительности (склейка с перекодированием - того же порядка)
+        out['bytes'] = _bytes_for(source_bitrate(source), duration)
+        if op_type == 'package_hls' and duration:
+            out['files'] = 2 + math.ceil(duration / params.get('segment_duration', 4))
+        elif op_type == 'cut_video' and params.get('segments'):
+            out['files'] = len(params['segments'])
+    elif op_type == 'make_short':
+        bitrate = SHORTS_VIDEO_BITRATE + (SHORTS_AUDIO_BITRATE if has_audio else 0)
+        out['size'] = SHORTS_SIZE
+        out['stream_types'] = ['video', 'audio'] if has_audio else ['video']
+        out['bytes'] = _bytes_for(bitrate, duration)
+        if params.get('generate_thumbnail', True):
+            out['files'] = 2
+            out['bytes'] = out['bytes'] + THUMBNAIL_BYTES if out['bytes'] is not None else None
+        # variants: тот же отрезок с разным текстом - каждый вариант отдельным файлом
+        copies = len(params.get('variants') or []) or 1
+        out['files'] *= copies
+        out['bytes'] = out['bytes'] * copies if out['bytes'] is not None else None
+    elif op_type == 'extract_audio':
+        if params.get('optimize_for_whisper'):
+            bitrate = WHISPER_AUDIO_BITRATE
+        else:
+            bitrate = parse_bitrate(params.get('bitrate', '192k')) or DEFAULT_AUDIO_BITRATE
+        out['size'] = None
+        out['stream_types'] = ['audio']
+        out['bytes'] = _bytes_for(bitrate, duration)
+        max_chunk_bytes = params.get('max_chunk_size_mb', 24) * 1024 * 1024
+        if params.get('chunk_duration_minutes') and duration:
+            out['files'] = math.ceil(duration / (params['chunk_duration_minutes'] * 60))
+        elif out['bytes'] and out['bytes'] > max_chunk_bytes:
+            out['files'] = math.ceil(out['bytes'] / (max_chunk_bytes * 0.95))
+    elif op_type == 'analyze_media':
+        out['size'] = None
+        out['stream_types'] = []
+        out['bytes'] = int(ANALYSIS_BYTES_PER_SECOND * duration) if duration else None
+    elif op_type == 'storyboard':
+        out['size'] = None
+        out['stream_types'] = []
+        if duration:
+            per_sheet = params.get('columns', 5) * params.get('rows', 5)
+            thumbnails = max(1, math.ceil(duration / params.get('interval', 5.0)))
+            sheets = math.ceil(thumbnails / per_sheet)
+            out['files'] = sheets + 1
+            out['bytes'] = sheets * STORYBOARD_SHEET_BYTES
+    if params.get('max_output_mb') and out['bytes'] is not None:
+        # Предел размера: на каждый клип у cut_video segments, на весь выход у остальных
+        clips = len(params['segments']) if op_type == 'cut_video' and params.get('segments') else 1
+        out['bytes'] = min(out['bytes'], int(params['max_output_mb'] * 1024 * 1024) * clips)
+    return out
+
+
+__all__ = [
+    "DEFAULT_CPU_SECONDS_PER_MEDIA_SECOND",
+    "parse_bitrate",
+    "source_bitrate",
+    "CostModel",
+    "estimate_output",
+]
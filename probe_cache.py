@@ -0,0 +1,187 @@
+"""
+Probe Cache - persistent per-source cache for probe and analysis results
+
+Results that depend only on the source media (ffprobe data, media analysis
+timelines, loudness measurements) are stored as small JSON files keyed by a
+content fingerprint of the source. The fingerprint does not depend on the file
+name or URL, so re-downloading the same video into a new task still hits the
+cache. The module has no side effects (no Redis, no Flask).
+
+Layout:
+    <cache_dir>/<fp[:2]>/<fp>/<kind>[-<params hash>].json
+    <cache_dir>/<fp[:2]>/<fp>/<kind>[-<params hash>].files/   (file sets, e.g. sprites)
+
+Fingerprint:
+    sha256 over the file size and three 1 MB samples (start, middle, end).
+    Cheap to compute for multi-GB files and stable across re-downloads.
+
+Usage:
+    from probe_cache import ProbeCache, source_fingerprint
+
+    cache = ProbeCache('/app/cache/probe')
+    fp = source_fingerprint('/app/tasks/<id>/input_x.mp4')
+    timeline = cache.get(fp, 'analysis', {'scene_threshold': 0.3})
+    if timeline is None:
+        timeline = analyze(...)
+        cache.put(fp, 'analysis', timeline, {'scene_threshold': 0.3})
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_SAMPLE_BYTES = 1024 * 1024
+
+
+def source_fingerprint(path: str, sample_bytes: int = FINGERPRINT_SAMPLE_BYTES) -> str:
+    """Отпечаток содержимого файла: размер + выборки из начала, середины и конца."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode('ascii'))
+    offsets = sorted({0, max(0, size // 2 - sample_bytes // 2), max(0, size - sample_bytes)})
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            digest.update(f.read(sample_bytes))
+    return digest.hexdigest()[:32]
+
+
+def params_key(params: Optional[dict]) -> str:
+    """Короткий стабильный хеш параметров ('' если параметров нет)."""
+    if not params:
+        return ''
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class ProbeCache:
+    """Файловый JSON-кеш результатов, привязанных к отпечатку источника."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, fingerprint: str, kind: str, params: Optional[dict] = None) -> str:
+        key = params_key(params)
+        filename = f"{kind}-{key}.json" if key else f"{kind}.json"
+        return os.path.join(self.cache_dir, fingerprint[:2], fingerprint, filename)
+
+    def get(self, fingerprint: str, kind: str, params: Optional[dict] = None) -> Optional[Any]:
+        """Значение из кеша или None. Обращение обновляет mtime (для prune по давности)."""
+        path = self._path(fingerprint, kind, params)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, fingerprint: str, kind: str, value: Any, params: Optional[dict] = None):
+        """Атомарная запись (tmp + rename) - безопасно при нескольких worker'ах."""
+        path = self._path(fingerprint, kind, params)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Probe cache write failed for {path}: {e}")
+
+    def _files_dir(self, fingerprint: str, kind: str, params: Optional[dict] = None) -> str:
+        return os.path.splitext(self._path(fingerprint, kind, params))[0] + '.files'
+
+    def get_files(self, fingerprint: str, kind: str, params: Optional[dict] = None) -> Optional[list]:
+        """
+        Пути закешированного набора файлов (по имени, отсортированы) или None.
+
+        Файлы обновляют mtime, чтобы prune не удалил набор, которым пользуются.
+        """
+        directory = self._files_dir(fingerprint, kind, params)
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            return None
+        if not names:
+            return None
+        paths = [os.path.join(directory, name) for name in names]
+        for path in paths:
+            try:
+                os.utime(path, None)
+            except OSError:
+                return None
+        return paths
+
+    def put_files(self, fingerprint: str, kind: str, paths: list, params: Optional[dict] = None):
+        """
+        Сохраняет набор файлов (под их basename). Сборка во временной директории
+        и rename - параллельный worker видит либо весь набор, либо ничего.
+        """
+        directory = self._files_dir(fingerprint, kind, params)
+        parent = os.path.dirname(directory)
+        tmp_dir = None
+        try:
+            os.makedirs(parent, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+            for path in paths:
+                target = os.path.join(tmp_dir, os.path.basename(path))
+                try:
+                    os.link(path, target)
+                except OSError:
+                    shutil.copy2(path, target)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+            os.rename(tmp_dir, directory)
+            tmp_dir = None
+        except OSError as e:
+            logger.warning(f"Probe cache file set write failed for {directory}: {e}")
+        finally:
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Удаляет записи, к которым не обращались дольше max_age_seconds. Возвращает их число."""
+        removed = 0
+        cutoff = time.time() - max_age_seconds
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir, topdown=False):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+            if dirpath != self.cache_dir:
+                try:
+                    os.rmdir(dirpath)  # Удаляется только если пуста
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self) -> dict:
+        """Счётчики попаданий этого процесса."""
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+__all__ = [
+    "FINGERPRINT_SAMPLE_BYTES",
+    "source_fingerprint",
+    "params_key",
+    "ProbeCache",
+]
@@ -0,0 +1,119 @@
+"""
+Quality Search - content-adaptive x264 CRF from sampled test encodes
+
+A fixed CRF spends too many bits on static content (talking heads, slides)
+and too few on high-motion clips. target_quality picks the CRF per segment:
+- a few short samples are taken evenly across the segment, run through the
+  same crop/scale chain as the real encode and downscaled to SAMPLE_SIZE
+- every sample is encoded at a candidate CRF and compared with its lossless
+  reference by ffmpeg's ssim or psnr filter; the score of a CRF is the worst
+  sample score, so every sampled part of the segment meets the target
+- a binary search over [CRF_MIN, CRF_MAX] (quality falls as CRF grows) finds
+  the highest CRF - the lowest bitrate - that still meets the target
+
+This module only plans the search and parses filter output. It has no side
+effects: no ffmpeg, no Redis, no Flask.
+
+Usage:
+    from quality_search import plan_samples, next_crf, choose_crf, parse_quality_score
+
+    samples = plan_samples(30.0, 90.0)
+    while (crf := next_crf(scores, 0.97)) is not None:
+        scores[crf] = {'score': measure(crf), 'kbps': ...}
+    crf, entry = choose_crf(scores, 0.97)
+"""
+
+import re
+from typing import Optional
+
+QUALITY_METRICS = ('ssim', 'psnr')
+DEFAULT_TARGETS = {'ssim': 0.97, 'psnr': 40.0}
+
+# Диапазон поиска CRF (libx264): ниже 18 разница на глаз не видна, выше 32 - заметные артефакты
+CRF_MIN = 18
+CRF_MAX = 32
+
+# Пробы: число, длительность и размер кадра (1/3 от 1080x1920)
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 2.0
+SAMPLE_SIZE = (360, 640)
+
+# psnr=inf (кадры совпали) заменяется конечным значением - JSON и сравнения
+PSNR_IDENTICAL = 100.0
+
+_SSIM_RE = re.compile(r"SSIM .*?All:\s*([0-9.]+)")
+_PSNR_RE = re.compile(r"PSNR .*?average:\s*([0-9.]+|inf)")
+
+
+def plan_samples(start: float, end: float, count: int = SAMPLE_COUNT,
+                 seconds: float = SAMPLE_SECONDS) -> list:
+    """
+    [(начало, длительность), ...] проб, равномерно по [start, end).
+    Короткий отрезок (меньше count проб) - одна проба на весь отрезок.
+    """
+    total = end - start
+    if total <= 0:
+        return []
+    if total <= count * seconds:
+        return [(start, total)]
+    step = total / count
+    # Проба - в середине своей части отрезка
+    return [(start + step * index + (step - seconds) / 2, seconds) for index in range(count)]
+
+
+def parse_quality_score(stderr: str, metric: str) -> Optional[float]:
+    """Итоговое значение из вывода ffmpeg: ssim All:... или psnr average:...; None если нет"""
+    pattern = _SSIM_RE if metric == 'ssim' else _PSNR_RE
+    matches = pattern.findall(stderr or '')
+    if not matches:
+        return None
+    value = matches[-1]
+    return PSNR_IDENTICAL if value == 'inf' else float(value)
+
+
+def _bounds(scores: dict, target: float) -> tuple[int, int]:
+    """(лучший проходящий CRF, худший непроходящий) среди измеренных - границы поиска"""
+    passing, failing = CRF_MIN - 1, CRF_MAX + 1
+    for crf, entry in scores.items():
+        crf = int(crf)
+        if entry['score'] >= target:
+            passing = max(passing, crf)
+        else:
+            failing = min(failing, crf)
+    return passing, failing
+
+
+def next_crf(scores: dict, target: float) -> Optional[int]:
+    """
+    Следующий CRF для пробного кодирования или None - поиск окончен.
+
+    scores: {crf: {'score', 'kbps'}} уже измеренных CRF (ключи могут быть строками из JSON)
+    """
+    passing, failing = _bounds(scores, target)
+    if failing - passing <= 1:
+        return None
+    return (passing + failing) // 2
+
+
+def choose_crf(scores: dict, target: float) -> tuple[int, Optional[dict]]:
+    """
+    Итог поиска: (CRF, его измерения). Если цель недостижима и в CRF_MIN -
+    CRF_MIN с его измерениями (лучшее из возможного в диапазоне).
+    """
+    passing, _ = _bounds(scores, target)
+    crf = max(passing, CRF_MIN)
+    entry = scores.get(crf, scores.get(str(crf)))
+    return crf, entry
+
+
+__all__ = [
+    "QUALITY_METRICS",
+    "DEFAULT_TARGETS",
+    "CRF_MIN",
+    "CRF_MAX",
+    "SAMPLE_SIZE",
+    "plan_samples",
+    "parse_quality_score",
+    "next_crf",
+    "choose_crf",
+]
@@ -0,0 +1,335 @@
+"""
+Result Cache - content-addressed store for completed operation outputs
+
+An operation run is identified by a deterministic key:
+    sha256(source fingerprint, operation type, canonical params, ffmpeg version)
+Its output files are stored once in a content-addressed object store (by the
+sha256 of the file content) and referenced from a small JSON entry. A cache hit
+hardlinks the objects into the new task directory, so it costs no copying and
+no extra disk space. The cache must live on the same filesystem as the task
+outputs: there is no copy fallback, a cross-device file is simply not stored.
+The module has no side effects (no Redis, no Flask).
+
+Layout:
+    <cache_dir>/entries/<key[:2]>/<key>.json   {"files": [{"name", "object", "size"}], "message", ...}
+    <cache_dir>/objects/<sha[:2]>/<sha>        output file contents
+
+Eviction is size-based LRU: entries are ordered by mtime (touched on every hit),
+the least recently used entries are dropped until the objects fit into
+max_bytes, and objects no entry references are deleted. It runs as soon as a
+put pushes the running byte count over max_bytes.
+
+Usage:
+    from result_cache import ResultCache, result_cache_key
+
+    cache = ResultCache('/app/cache/results', max_bytes=20 * 1024**3)
+    key = result_cache_key(fp, 'make_short', params, ffmpeg_version)
+    hit = cache.get(key, task_dir)
+    if hit is None:
+        ... run operation ...
+        cache.put(key, output_paths, message)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_VERSION = 1
+
+# После вытеснения кеш занимает не больше этой доли max_bytes (запас до следующего вытеснения)
+EVICTION_TARGET_RATIO = 0.9
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Сколько хешей файлов помнить в процессе (LRU)
+HASH_MEMO_MAX_ENTRIES = 4096
+_hash_memo = OrderedDict()  # (st_dev, st_ino, size, mtime_ns) -> sha256
+_hash_memo_lock = threading.Lock()
+
+
+def canonical_params(params: dict) -> str:
+    """Параметры в каноническом JSON (порядок ключей и пробелы не влияют на ключ)."""
+    return json.dumps(params, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def result_cache_key(source_fingerprint: str, op_type: str, params: dict, ffmpeg_version: str) -> str:
+    """Детерминированный ключ результата операции."""
+    payload = '\n'.join([
+        f"v{RESULT_CACHE_VERSION}",
+        source_fingerprint,
+        op_type,
+        canonical_params(params),
+        ffmpeg_version or '',
+    ])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _stat_key(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def file_sha256(path: str) -> str:
+    """
+    sha256 содержимого файла. Хеш запоминается в процессе по (st_dev, st_ino, размер,
+    mtime_ns): выход операции хешируется при put, и тот же файл на входе следующей
+    операции (или источник, повторно читаемый шагами) не читается заново.
+    """
+    memo_key = _stat_key(path)
+    with _hash_memo_lock:
+        sha = _hash_memo.get(memo_key)
+        if sha is not None:
+            _hash_memo.move_to_end(memo_key)
+            return sha
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    sha = digest.hexdigest()
+
+    # Файл менялся во время чтения - хеш не запоминаем
+    if _stat_key(path) == memo_key:
+        with _hash_memo_lock:
+            _hash_memo[memo_key] = sha
+            while len(_hash_memo) > HASH_MEMO_MAX_ENTRIES:
+                _hash_memo.popitem(last=False)
+    return sha
+
+
+class ResultCache:
+    """Кеш результатов операций: записи (LRU по mtime) + объекты по хешу содержимого."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._bytes = None  # байты объектов на диске (None - ещё не подсчитаны)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.entries_dir, key[:2], f"{key}.json")
+
+    def _object_path(self, sha: str) -> str:
+        return os.path.join(self.objects_dir, sha[:2], sha)
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key: str, dest_dir: str) -> Optional[dict]:
+        """
+        Материализует результат в dest_dir (жёсткие ссылки на объекты, исходные имена файлов).
+
+        Returns:
+            {'paths': [...], 'message': str, 'meta': dict} или None (промах / объект уже вытеснен);
+            meta - поля, переданные в put(meta=...)
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count('misses')
+            return None
+
+        created = []
+        try:
+            for item in entry['files']:
+                dest = os.path.join(dest_dir, item['name'])
+                if os.path.exists(dest):
+                    os.remove(dest)
+                os.link(self._object_path(item['object']), dest)
+                created.append(dest)
+        except (OSError, KeyError) as e:
+            logger.warning(f"Result cache entry {key[:12]} is incomplete, treating as miss: {e}")
+            for path in created:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._count('misses')
+            return None
+
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        self._count('hits')
+        meta = {k: v for k, v in entry.items() if k not in ('version', 'files', 'message', 'created_at')}
+        return {'paths': created, 'message': entry.get('message', ''), 'meta': meta}
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """
+        Запись без материализации (dry run): её JSON, если все объекты на месте, иначе None.
+        Не влияет на счётчики и на порядок LRU.
+        """
+        try:
+            with open(self._entry_path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if all(os.path.exists(self._object_path(item['object'])) for item in entry['files']):
+                return entry
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def put(self, key: str, paths: list, message: str = '', meta: Optional[dict] = None) -> bool:
+        """
+        Сохраняет выходные файлы операции. Содержимое одинаковых файлов хранится один раз.
+        Запись появляется атомарно (tmp + rename) после того, как все объекты на месте.
+        Объекты - жёсткие ссылки: файл на другой файловой системе (EXDEV) не сохраняется,
+        копирования нет. Сверх max_bytes сразу выполняется вытеснение.
+        """
+        files = []
+        added = 0
+        try:
+            for path in paths:
+                sha = file_sha256(path)
+                object_path = self._object_path(sha)
+                if not os.path.exists(object_path):
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    tmp_path = f"{object_path}.tmp{os.getpid()}_{threading.get_ident()}"
+                    os.link(path, tmp_path)
+                    added += os.path.getsize(path)
+                    os.replace(tmp_path, object_path)
+                files.append({'name': os.path.basename(path), 'object': sha, 'size': os.path.getsize(path)})
+
+            entry_path = self._entry_path(key)
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            entry = {
+                'version': RESULT_CACHE_VERSION,
+                'files': files,
+                'message': message,
+                'created_at': time.time(),
+                **(meta or {})
+            }
+            fd, tmp_entry = tempfile.mkstemp(dir=os.path.dirname(entry_path), prefix='.tmp_', suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_entry, entry_path)
+        except OSError as e:
+            logger.warning(f"Result cache store failed for {key[:12]}: {e}")
+            return False
+        self._count('stores')
+        self._account(added)
+        return True
+
+    def _account(self, added: int):
+        """Счётчик байт объектов: при превышении max_bytes (или пока размер неизвестен) - evict()"""
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += added
+            over = self._bytes is None or self._bytes > self.max_bytes
+        # Вытеснение уже идёт в другом потоке - оно учтёт и этот объект
+        if over and self._evict_lock.acquire(blocking=False):
+            try:
+                evicted = self.evict()
+            finally:
+                self._evict_lock.release()
+            if evicted['entries'] or evicted['freed_bytes']:
+                logger.info(f"Result cache: evicted {evicted['entries']} entr{'y' if evicted['entries'] == 1 else 'ies'}, "
+                            f"{evicted['freed_bytes'] / 1024 / 1024:.1f} MB freed")
+
+    def _scan(self) -> tuple[list, dict]:
+        """(записи [(mtime, path, [sha...])], объекты {sha: size})"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.entries_dir):
+            for filename in filenames:
+                if not filename.endswith('.json') or filename.startswith('.tmp_'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    mtime = os.path.getmtime(path)
+                    with open(path, 'r', encoding='utf-8') as f:
+                        shas = [item['object'] for item in json.load(f).get('files', [])]
+                except (OSError, ValueError, KeyError):
+                    continue
+                entries.append((mtime, path, shas))
+        objects = {}
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                if '.tmp' in filename:
+                    continue
+                try:
+                    objects[filename] = os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass
+        return entries, objects
+
+    def evict(self) -> dict:
+        """
+        LRU-вытеснение по размеру: удаляет самые давно использованные записи, пока
+        объекты не уложатся в EVICTION_TARGET_RATIO * max_bytes, затем объекты без ссылок.
+        """
+        entries, objects = self._scan()
+        refs = {}
+        for _, _, shas in entries:
+            for sha in shas:
+                refs[sha] = refs.get(sha, 0) + 1
+
+        total = sum(objects.values())
+        removed_entries = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICTION_TARGET_RATIO
+            live = sum(size for sha, size in objects.items() if refs.get(sha))
+            for _, path, shas in sorted(entries):
+                if live <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed_entries += 1
+                for sha in shas:
+                    refs[sha] -= 1
+                    if refs[sha] == 0:
+                        live -= objects.get(sha, 0)
+
+        freed = 0
+        for sha, size in objects.items():
+            if refs.get(sha):
+                continue
+            try:
+                os.remove(self._object_path(sha))
+                freed += size
+            except OSError:
+                pass
+        with self._lock:
+            self.evicted += removed_entries
+            self._bytes = sum(size for sha, size in objects.items() if refs.get(sha))
+        return {'entries': removed_entries, 'freed_bytes': freed}
+
+    def usage(self) -> dict:
+        """Размер кеша на диске (обход директорий)"""
+        entries, objects = self._scan()
+        return {'entries': len(entries), 'objects': len(objects), 'bytes': sum(objects.values())}
+
+    def stats(self) -> dict:
+        """Счётчики этого процесса"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'evicted': self.evicted}
+
+
+__all__ = [
+    "RESULT_CACHE_VERSION",
+    "canonical_params",
+    "result_cache_key",
+    "file_sha256",
+    "ResultCache",
+]
@@ -0,0 +1,327 @@
+"""
+Scratch Space - RAM-backed (tmpfs) storage for short-lived task files
+
+Downloaded sources (input_*, *.part) and intermediate pipeline outputs (temp_*)
+live only while a task runs. Writing them to the persistent task volume costs
+disk bandwidth and fsync pressure for data that is deleted minutes later. This
+module places them on a tmpfs within a byte budget:
+
+- allocate() reserves the expected size and returns a path on tmpfs, or a
+  path in the task directory when the budget (or the tmpfs itself) is full
+- SpillWriter streams a file of unknown size (a download) into tmpfs and
+  moves it to disk when the budget runs out mid-write
+- release_task() removes the task's scratch directory and its reservations
+
+Final outputs are never placed here: they are written into the task directory.
+The RAM tier is enabled only when ram_dir is on tmpfs/ramfs (per /proc/mounts).
+Accounting is per process; the tmpfs size (free space is checked on every
+reservation) is the hard limit shared by all workers.
+
+Usage:
+    from scratch_space import ScratchSpace, SpillWriter
+
+    scratch = ScratchSpace('/app/scratch', budget_bytes=2 * 1024**3)
+    path = scratch.allocate(task_id, 'temp_0_x.mp4', task_dir, expected_bytes=size)
+    ...
+    scratch.release_task(task_id)
+"""
+
+import os
+import shutil
+import threading
+import time
+from typing import Optional
+
+RAM_FILESYSTEMS = ('tmpfs', 'ramfs')
+
+# Шаг резервирования для файлов неизвестного размера (скачивание)
+SPILL_RESERVE_STEP = 64 * 1024 * 1024
+
+# Сколько места на tmpfs всегда оставлять свободным (чужие процессы, метаданные)
+DEFAULT_MIN_FREE_BYTES = 64 * 1024 * 1024
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Тип файловой системы, на которой лежит path (самая длинная точка монтирования из /proc/mounts)"""
+    real = os.path.realpath(path)
+    best_mount, best_type = '', None
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount = parts[1].replace('\\040', ' ')
+                if real == mount or real.startswith(mount.rstrip('/') + '/'):
+                    if len(mount) >= len(best_mount):
+                        best_mount, best_type = mount, parts[2]
+    except OSError:
+        return None
+    return best_type
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchSpace:
+    """Бюджет RAM-хранилища для временных файлов задач с переходом на диск при нехватке."""
+
+    def __init__(self, ram_dir: Optional[str], budget_bytes: int, min_free_bytes: int = DEFAULT_MIN_FREE_BYTES):
+        self.ram_dir = os.path.realpath(ram_dir) if ram_dir else None
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.enabled = False
+        if self.ram_dir and budget_bytes > 0:
+            try:
+                os.makedirs(self.ram_dir, exist_ok=True)
+                self.enabled = filesystem_type(self.ram_dir) in RAM_FILESYSTEMS
+            except OSError:
+                self.enabled = False
+        self._lock = threading.Lock()
+        self._reserved = {}  # path -> зарезервированные байты
+        self._task_spills = {}  # task_id -> число файлов, ушедших на диск
+        self._task_peak = {}  # task_id -> максимум одновременно зарезервированных байт
+        self.allocations = 0
+        self.spills = 0
+
+    def _task_ram_dir(self, task_id: str) -> str:
+        return os.path.join(self.ram_dir, task_id)
+
+    def _task_of(self, path: str) -> Optional[str]:
+        """task_id для пути внутри ram_dir (<ram_dir>/<task_id>/...), иначе None"""
+        if not self.enabled:
+            return None
+        rel = os.path.relpath(os.path.realpath(path), self.ram_dir)
+        if rel.startswith('..') or os.sep not in rel:
+            return None
+        return rel.split(os.sep, 1)[0]
+
+    def is_scratch(self, path: str) -> bool:
+        return self._task_of(path) is not None
+
+    def ram_path(self, task_id: str, name: str) -> str:
+        return os.path.join(self._task_ram_dir(task_id), name)
+
+    def _used_locked(self) -> int:
+        # Файл мог вырасти сверх оценки - учитываем фактический размер
+        used = 0
+        for path, reserved in self._reserved.items():
+            try:
+                used += max(reserved, os.path.getsize(path))
+            except OSError:
+                used += reserved
+        return used
+
+    def reserve(self, path: str, nbytes: int) -> bool:
+        """Резервирует (или увеличивает резерв) nbytes для пути в ram_dir; False - не помещается"""
+        task_id = self._task_of(path)
+        if task_id is None:
+            return False
+        with self._lock:
+            extra = nbytes - self._reserved.get(path, 0)
+            if extra <= 0:
+                return True
+            if self._used_locked() + extra > self.budget_bytes:
+                return False
+            try:
+                if shutil.disk_usage(self.ram_dir).free - extra < self.min_free_bytes:
+                    return False
+            except OSError:
+                return False
+            self._reserved[path] = nbytes
+            prefix = self._task_ram_dir(task_id) + os.sep
+            task_reserved = sum(b for p, b in self._reserved.items() if p.startswith(prefix))
+            self._task_peak[task_id] = max(self._task_peak.get(task_id, 0), task_reserved)
+            return True
+
+    def out_of_space(self) -> bool:
+        """В ram_dir свободно меньше min_free_bytes: запись туда могла оборваться с ENOSPC"""
+        if not self.enabled:
+            return False
+        try:
+            return shutil.disk_usage(self.ram_dir).free < self.min_free_bytes
+        except OSError:
+            return False
+
+    def record_spill(self, path: str):
+        """Учитывает файл, который пришлось писать на диск вместо path в ram_dir"""
+        task_id = self._task_of(path)
+        if task_id is None:
+            return
+        with self._lock:
+            self.spills += 1
+            self._task_spills[task_id] = self._task_spills.get(task_id, 0) + 1
+
+    def allocate(self, task_id: str, name: str, disk_dir: str, expected_bytes: int) -> str:
+        """
+        Путь для временного файла: на tmpfs, если expected_bytes помещается в бюджет,
+        иначе в disk_dir (spill).
+        """
+        if self.enabled:
+            path = self.ram_path(task_id, name)
+            if expected_bytes > 0 and self.reserve(path, expected_bytes):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with self._lock:
+                    self.allocations += 1
+                return path
+            self.record_spill(path)
+        return os.path.join(disk_dir, name)
+
+    def move(self, src: str, dst: str):
+        """Переносит резерв при переименовании файла внутри ram_dir (.part -> итоговое имя)"""
+        with self._lock:
+            reserved = self._reserved.pop(src, None)
+            if reserved is not None and self._task_of(dst) is not None:
+                self._reserved[dst] = reserved
+
+    def discard(self, path: str):
+        """Снимает резерв (файл удалён или перенесён на диск)"""
+        with self._lock:
+            self._reserved.pop(path, None)
+
+    def release_task(self, task_id: str) -> int:
+        """Удаляет scratch-директорию задачи и её резервы; возвращает освобождённые байты"""
+        if not self.enabled:
+            return 0
+        task_dir = self._task_ram_dir(task_id)
+        freed = _tree_size(task_dir) if os.path.isdir(task_dir) else 0
+        shutil.rmtree(task_dir, ignore_errors=True)
+        prefix = task_dir + os.sep
+        with self._lock:
+            for path in [p for p in self._reserved if p.startswith(prefix)]:
+                del self._reserved[path]
+            self._task_spills.pop(task_id, None)
+            self._task_peak.pop(task_id, None)
+        return freed
+
+    def prune_orphans(self, max_age_seconds: float) -> int:
+        """
+        Удаляет scratch-директории без изменений дольше max_age_seconds
+        (задачи упавших процессов). Возвращает число удалённых директорий.
+        """
+        if not self.enabled:
+            return 0
+        removed = 0
+        now = time.time()
+        for task_id in os.listdir(self.ram_dir):
+            task_dir = self._task_ram_dir(task_id)
+            if not os.path.isdir(task_dir):
+                continue
+            try:
+                newest = max(
+                    [os.path.getmtime(task_dir)] +
+                    [os.path.getmtime(os.path.join(task_dir, name)) for name in os.listdir(task_dir)]
+                )
+            except OSError:
+                continue
+            if now - newest > max_age_seconds:
+                self.release_task(task_id)
+                removed += 1
+        return removed
+
+    def usage(self, task_id: Optional[str] = None) -> dict:
+        """Использование RAM-хранилища: по задаче или общее"""
+        if task_id is not None:
+            prefix = self._task_ram_dir(task_id) + os.sep if self.enabled else None
+            with self._lock:
+                reserved = sum(b for p, b in self._reserved.items() if prefix and p.startswith(prefix))
+                spills = self._task_spills.get(task_id, 0)
+                peak = self._task_peak.get(task_id, 0)
+            task_dir = self._task_ram_dir(task_id) if self.enabled else None
+            return {
+                'ram_bytes': _tree_size(task_dir) if task_dir and os.path.isdir(task_dir) else 0,
+                'reserved_bytes': reserved,
+                'peak_reserved_bytes': peak,
+                'spills': spills,
+            }
+        with self._lock:
+            used = self._used_locked() if self.enabled else 0
+            stats = {
+                'enabled': self.enabled,
+                'ram_dir': self.ram_dir,
+                'budget_bytes': self.budget_bytes,
+                'reserved_bytes': used,
+                'active_files': len(self._reserved),
+                'allocations': self.allocations,
+                'spills': self.spills,
+            }
+        if self.enabled:
+            try:
+                stats['tmpfs_free_bytes'] = shutil.disk_usage(self.ram_dir).free
+            except OSError:
+                pass
+        return stats
+
+
+class SpillWriter:
+    """
+    Запись файла неизвестного размера: в RAM, пока бюджет позволяет, затем
+    написанное переносится на диск и запись продолжается там.
+    Итоговое расположение - атрибут path.
+    """
+
+    def __init__(self, scratch: ScratchSpace, ram_path: str, disk_path: str,
+                 reserve_step: int = SPILL_RESERVE_STEP):
+        self.scratch = scratch
+        self.ram_path = ram_path
+        self.disk_path = disk_path
+        self.reserve_step = reserve_step
+        self.written = 0
+        self._reserved = 0
+        if scratch.enabled and scratch.reserve(ram_path, reserve_step):
+            os.makedirs(os.path.dirname(ram_path), exist_ok=True)
+            self._reserved = reserve_step
+            self.path = ram_path
+        else:
+            scratch.record_spill(ram_path)
+            self.path = disk_path
+        self._file = open(self.path, 'wb')
+
+    @property
+    def spilled(self) -> bool:
+        return self.path == self.disk_path
+
+    def _spill(self):
+        self._file.close()
+        shutil.move(self.ram_path, self.disk_path)
+        self.scratch.discard(self.ram_path)
+        self.scratch.record_spill(self.ram_path)
+        self.path = self.disk_path
+        self._file = open(self.path, 'ab')
+
+    def write(self, data: bytes):
+        if not self.spilled and self.written + len(data) > self._reserved:
+            grow = max(self.reserve_step, len(data))
+            if self.scratch.reserve(self.ram_path, self._reserved + grow):
+                self._reserved += grow
+            else:
+                self._spill()
+        self._file.write(data)
+        self.written += len(data)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+__all__ = [
+    "RAM_FILESYSTEMS",
+    "SPILL_RESERVE_STEP",
+    "filesystem_type",
+    "ScratchSpace",
+    "SpillWriter",
+]
@@ -0,0 +1,98 @@
+"""
+Size Target - bitrates for outputs with a hard file size cap (max_output_mb)
+
+Video is encoded in two passes at an average bitrate derived from the size
+budget: the first pass only collects rate-control statistics (x264 runs it
+with fast analysis settings), the second pass distributes the bits over the
+segment. Two-pass rate control lands close to the requested average, but not
+exactly, so the caller checks the result and repeats the second pass with a
+bitrate scaled by the overshoot until the file fits.
+
+Audio has no second pass: the bitrate is the highest standard bitrate that
+fits the budget, stepped down if the encoded file is still too large.
+
+This module only does the arithmetic. It has no side effects: no ffmpeg, no
+Redis, no Flask.
+
+Usage:
+    from size_target import video_bitrate_for_size, retry_video_bitrate
+
+    bitrate = video_bitrate_for_size(50 * 1024 * 1024, 60.0, audio_bitrate=128_000)
+    ... pass 1, pass 2 at bitrate ...
+    if achieved > limit:
+        bitrate = retry_video_bitrate(bitrate, achieved, limit, 60.0, 128_000)
+"""
+
+from typing import Optional
+
+# Доля размера на контейнер (заголовки MP4, индексы) - не отдаётся битрейту
+MUXING_OVERHEAD_RATIO = 0.02
+
+# Ниже этого видеобитрейта 1080x1920 распадается на блоки - лучше отказать
+MIN_VIDEO_BITRATE = 150_000
+
+# Запас при повторе второго прохода (перелёт редко повторяется точно)
+RETRY_MARGIN = 0.97
+
+# Попыток второго прохода до отказа
+MAX_SECOND_PASS_ATTEMPTS = 3
+
+# Стандартные битрейты аудио (бит/с) по убыванию
+AUDIO_BITRATE_STEPS = (320_000, 256_000, 192_000, 160_000, 128_000, 96_000, 64_000, 48_000, 32_000)
+
+
+def _payload_bytes(max_bytes: int) -> float:
+    return max_bytes * (1.0 - MUXING_OVERHEAD_RATIO)
+
+
+def video_bitrate_for_size(max_bytes: int, duration: float, audio_bitrate: int = 0) -> Optional[int]:
+    """
+    Средний видеобитрейт (бит/с), при котором видео + аудио укладываются в max_bytes.
+    None - бюджета не хватает даже на MIN_VIDEO_BITRATE.
+    """
+    if not duration or duration <= 0:
+        return None
+    bitrate = int(_payload_bytes(max_bytes) * 8 / duration - audio_bitrate)
+    return bitrate if bitrate >= MIN_VIDEO_BITRATE else None
+
+
+def retry_video_bitrate(bitrate: int, achieved_bytes: int, max_bytes: int,
+                        duration: float, audio_bitrate: int = 0) -> Optional[int]:
+    """
+    Видеобитрейт следующей попытки второго прохода после перелёта: видеочасть
+    уменьшается пропорционально превышению (с запасом RETRY_MARGIN).
+    None - ниже MIN_VIDEO_BITRATE.
+    """
+    audio_bytes = audio_bitrate * duration / 8
+    video_bytes = achieved_bytes - audio_bytes
+    if video_bytes <= 0:
+        return None
+    factor = (_payload_bytes(max_bytes) - audio_bytes) / video_bytes
+    new_bitrate = int(bitrate * min(factor, 1.0) * RETRY_MARGIN)
+    return new_bitrate if new_bitrate >= MIN_VIDEO_BITRATE else None
+
+
+def audio_bitrate_for_size(max_bytes: int, duration: float, requested: int) -> Optional[int]:
+    """Наибольший стандартный битрейт не выше requested, укладывающийся в max_bytes; None - не укладывается"""
+    if not duration or duration <= 0:
+        return None
+    budget = _payload_bytes(max_bytes) * 8 / duration
+    for step in AUDIO_BITRATE_STEPS:
+        if step <= requested and step <= budget:
+            return step
+    return None
+
+
+def lower_audio_bitrate(bitrate: int) -> Optional[int]:
+    """Следующий стандартный битрейт ниже bitrate (None - ниже некуда)"""
+    return next((step for step in AUDIO_BITRATE_STEPS if step < bitrate), None)
+
+
+__all__ = [
+    "MIN_VIDEO_BITRATE",
+    "MAX_SECOND_PASS_ATTEMPTS",
+    "video_bitrate_for_size",
+    "retry_video_bitrate",
+    "audio_bitrate_for_size",
+    "lower_audio_bitrate",
+]
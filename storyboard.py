@@ -0,0 +1,148 @@
+"""
+Storyboard - sprite-sheet thumbnails and a WebVTT thumbnail track
+
+Builds a single ffmpeg command that decodes the source once and:
+- selects the first frame of every interval [i*interval, (i+1)*interval) on a
+  fixed grid (select filter on timestamps, so only the needed frames are
+  scaled), which is exactly the range the WebVTT cue of thumbnail i covers
+- scales them down to a small thumbnail size
+- packs them into sprite sheets with the tile filter (columns x rows per JPEG)
+
+The WebVTT track maps each interval of the timeline to a region of a sprite
+sheet (#xywh media fragment), which players and review UIs use for scrubbing
+previews. The module has no side effects (no Redis, no Flask).
+
+Usage:
+    from storyboard import build_storyboard_command, build_storyboard_vtt, storyboard_layout
+
+    layout = storyboard_layout(params, duration, (1920, 1080))
+    cmd = build_storyboard_command(src, 'storyboard_%03d.jpg', layout)
+    ... run cmd ...
+    vtt = build_storyboard_vtt(layout, ['storyboard_001.jpg', ...])
+"""
+
+import math
+import os
+from typing import Optional
+
+DEFAULT_STORYBOARD_PARAMS = {
+    'interval': 5.0,       # Секунд между кадрами
+    'columns': 5,          # Кадров в строке спрайта
+    'rows': 5,             # Строк в спрайте
+    'thumb_width': 160,    # Ширина кадра, px (высота - по пропорциям источника)
+}
+
+# Качество JPEG (-q:v, 2 - лучшее, 31 - худшее)
+STORYBOARD_JPEG_QUALITY = 5
+
+STORYBOARD_VERSION = 2
+
+
+def storyboard_layout(params: Optional[dict], duration: float, source_size: Optional[tuple]) -> dict:
+    """
+    Геометрия storyboard: размер кадра, число кадров и спрайтов.
+
+    Высота кадра вычисляется здесь (а не scale=W:-2), чтобы координаты в WebVTT
+    точно совпадали с тем, что сделает ffmpeg.
+    """
+    p = dict(DEFAULT_STORYBOARD_PARAMS, **(params or {}))
+    width = int(p['thumb_width']) // 2 * 2
+    if source_size:
+        src_w, src_h = source_size
+        height = max(2, int(round(width * src_h / src_w / 2)) * 2)
+    else:
+        height = width * 9 // 16 // 2 * 2
+    interval = float(p['interval'])
+    per_sheet = int(p['columns']) * int(p['rows'])
+    thumbnails = max(1, int(math.ceil(duration / interval)))
+    return {
+        'version': STORYBOARD_VERSION,
+        'duration': round(duration, 3),
+        'interval': interval,
+        'columns': int(p['columns']),
+        'rows': int(p['rows']),
+        'thumb_width': width,
+        'thumb_height': height,
+        'thumbnails': thumbnails,
+        'sheets': int(math.ceil(thumbnails / per_sheet)),
+    }
+
+
+def build_storyboard_command(input_path: str, sprite_pattern: str, layout: dict) -> list:
+    """
+    Команда ffmpeg для всех спрайтов за одно декодирование.
+
+    Args:
+        input_path: Источник
+        sprite_pattern: Шаблон имён спрайтов для image2 (например storyboard_%03d.jpg)
+        layout: Результат storyboard_layout
+    """
+    interval = layout['interval']
+    # Сетка от 0, а не от предыдущего выбранного кадра: иначе выборка дрейфует на длительность
+    # кадра за шаг и сдвигается на start_time потока, а WebVTT считает index * interval.
+    # max(t,0): кадры с отрицательным t (edit list) относятся к первой ячейке
+    video_filter = (
+        f"select='isnan(prev_selected_t)"
+        f"+gt(floor(max(t,0)/{interval}),floor(max(prev_selected_t,0)/{interval}))',"
+        f"scale={layout['thumb_width']}:{layout['thumb_height']}:flags=fast_bilinear,"
+        f"setsar=1,"
+        f"tile={layout['columns']}x{layout['rows']}"
+    )
+    return [
+        'ffmpeg', '-hide_banner',
+        # Деблокинг не нужен для миниатюр, но заметно ускоряет декодирование
+        '-skip_loop_filter', 'all',
+        '-i', input_path,
+        '-map', '0:v:0', '-an', '-sn', '-dn',
+        '-vf', video_filter,
+        '-fps_mode', 'vfr',
+        '-q:v', str(STORYBOARD_JPEG_QUALITY),
+        '-start_number', '1',
+        '-f', 'image2',
+        '-y', sprite_pattern,
+    ]
+
+
+def _vtt_timestamp(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+
+def build_storyboard_vtt(layout: dict, sprite_names: list) -> str:
+    """
+    WebVTT-дорожка миниатюр: каждый интервал -> область спрайта (#xywh).
+
+    sprite_names - имена файлов спрайтов по порядку (ссылки относительные,
+    файлы лежат рядом с .vtt).
+    """
+    per_sheet = layout['columns'] * layout['rows']
+    width = layout['thumb_width']
+    height = layout['thumb_height']
+    duration = layout['duration']
+    lines = ['WEBVTT', '']
+    for index in range(layout['thumbnails']):
+        sheet = index // per_sheet
+        if sheet >= len(sprite_names):
+            break
+        cell = index % per_sheet
+        x = (cell % layout['columns']) * width
+        y = (cell // layout['columns']) * height
+        start = index * layout['interval']
+        end = min(duration, start + layout['interval'])
+        lines.append(f"{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}")
+        lines.append(f"{os.path.basename(sprite_names[sheet])}#xywh={x},{y},{width},{height}")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+__all__ = [
+    "DEFAULT_STORYBOARD_PARAMS",
+    "STORYBOARD_JPEG_QUALITY",
+    "STORYBOARD_VERSION",
+    "storyboard_layout",
+    "build_storyboard_command",
+    "build_storyboard_vtt",
+]